@@ -0,0 +1,50 @@
+"""Compare two reports written by run_benchmarks.py.
+
+Usage:
+    python benchmarks/compare.py BASELINE.json CURRENT.json [--threshold 0.1]
+
+Exits non-zero when any benchmark got slower than the threshold.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pypcie import bench  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="allowed slowdown as a fraction (default: 0.10)",
+    )
+    args = parser.parse_args(argv)
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    with open(args.current) as handle:
+        current = json.load(handle)
+    regressions = 0
+    for shape in sorted(current):
+        if shape not in baseline:
+            continue
+        rows = bench.compare_results(baseline[shape], current[shape])
+        print("== %s" % shape)
+        for line in bench.format_comparison(rows):
+            print(line)
+        regressions += sum(1 for row in rows if row[3] < -args.threshold)
+    if regressions:
+        print("%d benchmark(s) regressed" % regressions, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
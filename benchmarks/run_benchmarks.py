@@ -0,0 +1,60 @@
+"""Run the pypcie benchmark suite over several synthetic fabric sizes.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--output results.json] [--quick]
+
+The report maps each fabric size to a ``pypcie.bench.run_suite`` result so two
+reports from different versions can be compared with ``compare.py``.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pypcie import bench  # noqa: E402
+
+SHAPES = {
+    "small": {"root_ports": 2, "switch_depth": 1, "switch_ports": 2, "functions": 1},
+    "medium": {"root_ports": 4, "switch_depth": 1, "switch_ports": 8, "functions": 4},
+    "large": {"root_ports": 8, "switch_depth": 2, "switch_ports": 3, "functions": 8},
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument(
+        "--quick", action="store_true", help="fewer iterations, for smoke runs"
+    )
+    parser.add_argument(
+        "--shape",
+        action="append",
+        choices=sorted(SHAPES),
+        help="run only the named fabric size (repeatable)",
+    )
+    args = parser.parse_args(argv)
+    iterations = 200 if args.quick else 5000
+    scan_iterations = 3 if args.quick else 30
+    report = {}
+    for name in args.shape or sorted(SHAPES):
+        result = bench.run_suite(
+            iterations=iterations, scan_iterations=scan_iterations, **SHAPES[name]
+        )
+        report[name] = result
+        print("== %s" % name, file=sys.stderr)
+        for line in bench.format_results(result):
+            print(line, file=sys.stderr)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
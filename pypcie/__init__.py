@@ -13,6 +13,7 @@ from .link import (
     link_disable,
     link_enable,
     link_hot_reset,
+    read_link_capabilities,
     read_link_status,
     retrain_link,
     set_link_control_bits,
@@ -21,7 +22,15 @@ from .link import (
 )
 from .config import read as read_config, write as write_config
 from .device import Device, PciDevice
-from .discover import find_devices, list_devices
+from .discover import find_devices, iter_devices, list_devices
+from .instrument import (
+    disable as disable_stats,
+    enable as enable_stats,
+    reset as reset_stats,
+    snapshot as stats,
+)
+from .handles import HandlePool
+from .monitor import LinkMonitor
 from .errors import (
     AlignmentError,
     BarError,
@@ -40,7 +49,7 @@ from .errors import (
     ValidationError,
     ValueRangeError,
 )
-from .types import PciAddress
+from .types import PciAddress, PciAddressSet
 
 __all__ = [
     "__version__",
@@ -48,11 +57,14 @@ __all__ = [
     "ConfigError",
     "Device",
     "DeviceNotFoundError",
+    "HandlePool",
+    "LinkMonitor",
     "PciDevice",
     "AlignmentError",
     "MultipleDevicesFoundError",
     "OutOfRangeError",
     "PciAddress",
+    "PciAddressSet",
     "PciAddressError",
     "PciError",
     "PciSpaceError",
@@ -63,7 +75,10 @@ __all__ = [
     "SysfsFormatError",
     "ValidationError",
     "ValueRangeError",
+    "disable_stats",
+    "enable_stats",
     "find_devices",
+    "iter_devices",
     "find_ext_capability",
     "find_pci_capability",
     "find_pcie_capability",
@@ -72,12 +87,15 @@ __all__ = [
     "link_enable",
     "link_hot_reset",
     "list_devices",
+    "read_link_capabilities",
     "read_link_status",
     "read_bar",
     "read_config",
+    "reset_stats",
     "retrain_link",
     "set_link_control_bits",
     "set_target_link_speed",
+    "stats",
     "wait_for_link_training",
     "write_bar",
     "write_config",
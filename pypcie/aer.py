@@ -0,0 +1,361 @@
+"""Advanced Error Reporting (AER) status and counters across the fabric."""
+
+import collections
+import struct
+import time
+
+from . import config as config_access
+from .capability import find_ext_capability
+from .discover import list_devices
+from .errors import (
+    OutOfRangeError,
+    PciError,
+    PermissionDeniedError,
+    ResourceNotFoundError,
+    SysfsFormatError,
+)
+from .sysfs import DeviceDir, Sysfs
+from .types import PciAddress
+
+PCI_EXT_CAP_ID_ERR = 0x0001
+PCI_ERR_UNCOR_STATUS = 0x04
+PCI_ERR_UNCOR_MASK = 0x08
+PCI_ERR_UNCOR_SEVER = 0x0C
+PCI_ERR_COR_STATUS = 0x10
+PCI_ERR_COR_MASK = 0x14
+PCI_ERR_CAP = 0x18
+PCI_ERR_HEADER_LOG = 0x1C
+
+# Status through the end of the header log, read with one pread per device.
+_AER_BLOCK = struct.Struct("<IIIIIIIIII")
+
+UNCORRECTABLE_ERRORS = {
+    4: "DLP",
+    5: "SDES",
+    12: "PoisonedTLP",
+    13: "FCP",
+    14: "CompletionTimeout",
+    15: "CompleterAbort",
+    16: "UnexpectedCompletion",
+    17: "ReceiverOverflow",
+    18: "MalformedTLP",
+    19: "ECRC",
+    20: "UnsupportedRequest",
+    21: "ACSViolation",
+    22: "UncorrectableInternal",
+    23: "MCBlockedTLP",
+    24: "AtomicOpEgressBlocked",
+    25: "TLPPrefixBlocked",
+    26: "PoisonedTLPEgressBlocked",
+}
+
+CORRECTABLE_ERRORS = {
+    0: "RxErr",
+    6: "BadTLP",
+    7: "BadDLLP",
+    8: "Rollover",
+    12: "Timeout",
+    13: "NonFatalErr",
+    14: "CorrIntErr",
+    15: "HeaderOF",
+}
+
+KERNEL_COUNTER_FILES = ("aer_dev_correctable", "aer_dev_fatal", "aer_dev_nonfatal")
+
+
+def error_names(status, table):
+    """Return the names of the error bits set in ``status``."""
+    return [name for bit, name in sorted(table.items()) if status & (1 << bit)]
+
+
+class AerStatus(object):
+    """One reading of a device's AER registers."""
+
+    __slots__ = (
+        "address",
+        "timestamp",
+        "uncor_status",
+        "uncor_mask",
+        "uncor_severity",
+        "cor_status",
+        "cor_mask",
+        "cap_control",
+        "header_log",
+    )
+
+    def __init__(self, address, timestamp, block):
+        values = _AER_BLOCK.unpack(block)
+        self.address = address
+        self.timestamp = timestamp
+        self.uncor_status = values[0]
+        self.uncor_mask = values[1]
+        self.uncor_severity = values[2]
+        self.cor_status = values[3]
+        self.cor_mask = values[4]
+        self.cap_control = values[5]
+        self.header_log = values[6:10]
+
+    @property
+    def uncorrectable(self):
+        return error_names(self.uncor_status, UNCORRECTABLE_ERRORS)
+
+    @property
+    def correctable(self):
+        return error_names(self.cor_status, CORRECTABLE_ERRORS)
+
+    @property
+    def fatal(self):
+        """Uncorrectable errors whose severity bit marks them fatal."""
+        return error_names(
+            self.uncor_status & self.uncor_severity, UNCORRECTABLE_ERRORS
+        )
+
+    def as_dict(self):
+        return {
+            "bdf": self.address.bdf,
+            "uncor_status": self.uncor_status,
+            "uncor_mask": self.uncor_mask,
+            "uncor_severity": self.uncor_severity,
+            "cor_status": self.cor_status,
+            "cor_mask": self.cor_mask,
+            "cap_control": self.cap_control,
+            "header_log": list(self.header_log),
+            "uncorrectable": self.uncorrectable,
+            "correctable": self.correctable,
+        }
+
+    def __repr__(self):
+        return "AerStatus(%s, uncor=0x%08x, cor=0x%08x)" % (
+            self.address.bdf,
+            self.uncor_status,
+            self.cor_status,
+        )
+
+
+def parse_kernel_counters(text):
+    """Parse an ``aer_dev_*`` file ("RxErr 3" per line) into a dict."""
+    counters = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) != 2:
+            continue
+        try:
+            counters[parts[0]] = int(parts[1])
+        except ValueError:
+            raise SysfsFormatError("invalid AER counter line: %r" % line)
+    return counters
+
+
+def read_kernel_counters(addr, sysfs=None):
+    """Return {file: {counter: value}} for the ``aer_dev_*`` files present."""
+    if sysfs is None:
+        sysfs = Sysfs()
+    with DeviceDir(addr, root=sysfs.root) as device:
+        return _read_kernel_counters(device)
+
+
+def _read_kernel_counters(device):
+    result = {}
+    for name in KERNEL_COUNTER_FILES:
+        try:
+            result[name] = parse_kernel_counters(device.read_text(name))
+        except (ResourceNotFoundError, PermissionDeniedError):
+            continue
+    return result
+
+
+def read_aer(addr, sysfs_root=None):
+    """Read the AER registers of one device, or None without an AER capability."""
+    address = PciAddress.parse(addr)
+    offset = find_ext_capability(address, PCI_EXT_CAP_ID_ERR, sysfs_root=sysfs_root)
+    if not offset:
+        return None
+    with config_access.ConfigHandle(address, sysfs_root=sysfs_root) as handle:
+        block = handle.read_block(offset + PCI_ERR_UNCOR_STATUS, _AER_BLOCK.size)
+    return AerStatus(address, time.time(), block)
+
+
+class _Device(object):
+    __slots__ = (
+        "address",
+        "offset",
+        "handle",
+        "sysfs_dir",
+        "last",
+        "counters",
+        "kernel",
+    )
+
+    def __init__(self, address, offset, handle, sysfs_dir):
+        self.address = address
+        self.offset = offset
+        self.handle = handle
+        self.sysfs_dir = sysfs_dir
+        self.last = None
+        self.counters = collections.Counter()
+        self.kernel = {}
+
+
+class AerCollector(object):
+    """Collect AER status and cumulative error counters for many devices.
+
+    AER capability offsets are resolved once and every config file stays
+    open, so a pass costs one pread per device. Status bits are sticky, so
+    an error is counted when its bit goes from clear to set; with
+    ``clear=True`` the observed bits are written back (RW1C) after each
+    pass and every set bit counts as a new occurrence. The kernel's
+    ``aer_dev_*`` counters are read as well when ``kernel_counters`` is set,
+    through a sysfs directory handle that also stays open between passes.
+    """
+
+    def __init__(self, addresses=None, sysfs=None, clear=False, kernel_counters=True):
+        self.sysfs = sysfs if sysfs is not None else Sysfs()
+        self.clear = bool(clear)
+        self.kernel_counters = bool(kernel_counters)
+        if addresses is None:
+            addresses = list_devices(sysfs=self.sysfs)
+        self._addresses = sorted(set(PciAddress.parse(addr) for addr in addresses))
+        self._devices = None
+        self.passes = 0
+        self.started = None
+        self.last_pass = None
+
+    def open(self):
+        if self._devices is not None:
+            return self
+        devices = []
+        root = self.sysfs.root
+        for address in self._addresses:
+            try:
+                offset = find_ext_capability(address, PCI_EXT_CAP_ID_ERR, sysfs_root=root)
+            except (ResourceNotFoundError, PermissionDeniedError, OutOfRangeError):
+                continue
+            if not offset:
+                continue
+            handle = config_access.ConfigHandle(address, sysfs_root=root)
+            sysfs_dir = None
+            if self.kernel_counters:
+                sysfs_dir = DeviceDir(address, root=root)
+            devices.append(_Device(address, offset, handle, sysfs_dir))
+        self._devices = devices
+        return self
+
+    def close(self):
+        if self._devices is None:
+            return
+        for device in self._devices:
+            device.handle.close()
+            if device.sysfs_dir is not None:
+                device.sysfs_dir.close()
+        self._devices = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    @property
+    def addresses(self):
+        """Devices with an AER capability."""
+        self.open()
+        return [device.address for device in self._devices]
+
+    def sample(self):
+        """Read every device once; returns {address: AerStatus}."""
+        self.open()
+        now = time.time()
+        if self.started is None:
+            self.started = now
+        results = {}
+        for device in self._devices:
+            try:
+                block = device.handle.read_block(
+                    device.offset + PCI_ERR_UNCOR_STATUS, _AER_BLOCK.size
+                )
+            except (PciError, OSError):
+                # Skip a device that vanished or stopped answering; the
+                # others are still sampled.
+                continue
+            status = AerStatus(device.address, now, block)
+            self._count(device, status)
+            if self.clear:
+                self._clear(device, status)
+            if self.kernel_counters:
+                try:
+                    device.kernel = _read_kernel_counters(device.sysfs_dir)
+                except (ResourceNotFoundError, PermissionDeniedError, SysfsFormatError):
+                    device.kernel = {}
+            device.last = status
+            results[device.address] = status
+        self.passes += 1
+        self.last_pass = now
+        return results
+
+    def _count(self, device, status):
+        if self.clear or device.last is None:
+            new_uncor, new_cor = status.uncor_status, status.cor_status
+        else:
+            new_uncor = status.uncor_status & ~device.last.uncor_status
+            new_cor = status.cor_status & ~device.last.cor_status
+        for name in error_names(new_uncor, UNCORRECTABLE_ERRORS):
+            device.counters["uncorrectable." + name] += 1
+        for name in error_names(new_cor, CORRECTABLE_ERRORS):
+            device.counters["correctable." + name] += 1
+
+    def _clear(self, device, status):
+        base = device.offset
+        if status.uncor_status:
+            device.handle.write(base + PCI_ERR_UNCOR_STATUS, 4, status.uncor_status)
+        if status.cor_status:
+            device.handle.write(base + PCI_ERR_COR_STATUS, 4, status.cor_status)
+
+    def counters(self):
+        """Return {address: {"correctable": n, "uncorrectable": n, ...}}.
+
+        Each entry holds the totals, the per-error counts and the kernel's
+        ``TOTAL_ERR_*`` counters when those files exist.
+        """
+        self.open()
+        result = {}
+        for device in self._devices:
+            totals = {"correctable": 0, "uncorrectable": 0}
+            for key, count in device.counters.items():
+                totals[key.split(".", 1)[0]] += count
+            entry = {"errors": dict(device.counters)}
+            entry.update(totals)
+            for name, values in device.kernel.items():
+                for counter, value in values.items():
+                    if counter.startswith("TOTAL_ERR_"):
+                        entry["kernel_" + counter[len("TOTAL_ERR_") :].lower()] = value
+            result[device.address] = entry
+        return result
+
+
+def counter_rates(before, after, elapsed):
+    """Per-second rates of the numeric counters between two counters() results."""
+    rates = {}
+    for address, entry in after.items():
+        previous = before.get(address, {})
+        rates[address] = {
+            key: (value - previous.get(key, 0)) / elapsed if elapsed > 0 else 0.0
+            for key, value in entry.items()
+            if isinstance(value, int)
+        }
+    return rates
+
+
+__all__ = [
+    "AerCollector",
+    "AerStatus",
+    "CORRECTABLE_ERRORS",
+    "KERNEL_COUNTER_FILES",
+    "PCI_EXT_CAP_ID_ERR",
+    "UNCORRECTABLE_ERRORS",
+    "counter_rates",
+    "error_names",
+    "parse_kernel_counters",
+    "read_aer",
+    "read_kernel_counters",
+]
@@ -0,0 +1,412 @@
+"""ASPM and L1 PM Substates along a device's upstream path."""
+
+import struct
+
+from . import config as config_access
+from .capability import find_ext_capability_in
+from .discover import _extract_bdfs_from_path, list_devices
+from .errors import ResourceNotFoundError, ValueRangeError
+from .link import (
+    ASPM_STATES,
+    DOWNSTREAM_PORT_TYPES,
+    PCI_EXP_LNKCAP,
+    PCI_EXP_LNKCTL,
+    PCI_EXP_LNKCTL_ASPM_L0S,
+    PCI_EXP_LNKCTL_ASPM_L1,
+    PCI_EXP_LNKCTL_ASPMC,
+    PCI_EXT_CAP_ID_L1SS,
+    PCI_L1SS_CAP,
+    PCI_L1SS_CAP_L1_PM_SS,
+    PCI_L1SS_CTL1,
+    PCI_L1SS_CTL1_ASPM_L1_1,
+    PCI_L1SS_CTL1_ASPM_L1_2,
+    PCI_L1SS_CTL2,
+    decode_aspm_control,
+    decode_l1ss,
+    decode_link_capabilities,
+    read_pcie_caps,
+)
+from .sysfs import Sysfs
+from .types import PciAddress
+
+_LNKCTL_BITS = {"l0s": PCI_EXP_LNKCTL_ASPM_L0S, "l1": PCI_EXP_LNKCTL_ASPM_L1}
+_L1SS_BITS = {"l1.1": PCI_L1SS_CTL1_ASPM_L1_1, "l1.2": PCI_L1SS_CTL1_ASPM_L1_2}
+_L1SS_ASPM_MASK = PCI_L1SS_CTL1_ASPM_L1_1 | PCI_L1SS_CTL1_ASPM_L1_2
+_ASPM_SUPPORT_BITS = {"l0s": 0x1, "l1": 0x2}
+
+# Each switch between a link and the root port adds up to 1us to the L1
+# exit latency seen by the device (PCIe r6.0, sec 5.4.1.3).
+_L1_SWITCH_LATENCY_NS = 1000
+
+
+class AspmEnd(object):
+    """ASPM registers of one function at either end of a link."""
+
+    __slots__ = (
+        "address",
+        "port_type",
+        "cap_offset",
+        "l1ss_offset",
+        "lnkcap",
+        "lnkctl",
+        "l1ss_cap",
+        "l1ss_ctl1",
+        "l1ss_ctl2",
+    )
+
+    def __init__(self, address, port_type, cap_offset, lnkcap, lnkctl):
+        self.address = address
+        self.port_type = port_type
+        self.cap_offset = cap_offset
+        self.lnkcap = lnkcap
+        self.lnkctl = lnkctl
+        self.l1ss_offset = 0
+        self.l1ss_cap = 0
+        self.l1ss_ctl1 = 0
+        self.l1ss_ctl2 = 0
+
+    @property
+    def supported(self):
+        """ASPM states this function supports, L1 substates included."""
+        support = (self.lnkcap >> 10) & 0x3
+        states = [
+            state for state in ("l0s", "l1") if support & _ASPM_SUPPORT_BITS[state]
+        ]
+        if self.l1ss_cap & PCI_L1SS_CAP_L1_PM_SS:
+            states.extend(decode_l1ss(self.l1ss_cap)["supported"])
+        return states
+
+    @property
+    def enabled(self):
+        states = decode_aspm_control(self.lnkctl)
+        if self.l1ss_offset:
+            states.extend(decode_l1ss(self.l1ss_cap, self.l1ss_ctl1)["enabled"])
+        return states
+
+    def as_dict(self):
+        caps = decode_link_capabilities(self.lnkcap)
+        entry = {
+            "bdf": self.address.bdf,
+            "supported": self.supported,
+            "enabled": self.enabled,
+            "l0s_exit_latency_ns": caps["l0s_exit_latency_ns"],
+            "l1_exit_latency_ns": caps["l1_exit_latency_ns"],
+        }
+        if self.l1ss_offset:
+            entry["l1ss"] = decode_l1ss(self.l1ss_cap, self.l1ss_ctl1, self.l1ss_ctl2)
+        return entry
+
+
+def read_end(address, sysfs_root=None):
+    """Read the ASPM state of one function with a single config read."""
+    sysfs = Sysfs(root=sysfs_root) if sysfs_root else Sysfs()
+    caps = read_pcie_caps(address, sysfs=sysfs, length=None)
+    lnkcap = caps.u32(PCI_EXP_LNKCAP)
+    lnkctl = caps.u16(PCI_EXP_LNKCTL)
+    if lnkcap is None or lnkctl is None:
+        raise ResourceNotFoundError("PCIe capability not found")
+    end = AspmEnd(caps.address, caps.port_type, caps.base, lnkcap, lnkctl)
+    data = caps.data
+    l1ss = find_ext_capability_in(data, PCI_EXT_CAP_ID_L1SS)
+    if l1ss and l1ss + PCI_L1SS_CTL2 + 4 <= len(data):
+        end.l1ss_offset = l1ss
+        end.l1ss_cap, end.l1ss_ctl1, end.l1ss_ctl2 = struct.unpack_from(
+            "<III", data, l1ss + PCI_L1SS_CAP
+        )
+    return end
+
+
+class AspmLink(object):
+    """One link: the port above it and every function of the device below.
+
+    ``switches`` is the number of switches between this link and the root
+    port; each adds to the L1 exit latency seen below the link.
+    """
+
+    __slots__ = ("port", "functions", "switches")
+
+    def __init__(self, port, functions, switches=0):
+        self.port = port
+        self.functions = functions
+        self.switches = switches
+
+    @property
+    def ends(self):
+        return [self.port] + self.functions
+
+    @property
+    def supported(self):
+        """States every end of the link supports."""
+        return [
+            state
+            for state in ASPM_STATES
+            if all(state in end.supported for end in self.ends)
+        ]
+
+    @property
+    def enabled(self):
+        """States in effect: L0s if any transmitter uses it, the rest on all ends."""
+        states = []
+        if any("l0s" in end.enabled for end in self.ends):
+            states.append("l0s")
+        for state in ASPM_STATES[1:]:
+            if all(state in end.enabled for end in self.ends):
+                states.append(state)
+        return states
+
+    @property
+    def l0s_exit_ns(self):
+        if "l0s" not in self.enabled:
+            return 0
+        return max(
+            decode_link_capabilities(end.lnkcap)["l0s_exit_latency_ns"]
+            for end in self.ends
+        )
+
+    @property
+    def l1_exit_ns(self):
+        enabled = self.enabled
+        if "l1" not in enabled:
+            return 0
+        latency = max(
+            decode_link_capabilities(end.lnkcap)["l1_exit_latency_ns"]
+            for end in self.ends
+        )
+        if "l1.2" in enabled:
+            # Leaving L1.2 first powers the link up, then restores common mode.
+            decoded = [
+                decode_l1ss(end.l1ss_cap, end.l1ss_ctl1, end.l1ss_ctl2)
+                for end in self.ends
+            ]
+            t_power_on = max(entry["t_power_on_us"] or 0 for entry in decoded)
+            latency += (t_power_on + decoded[0]["common_mode_restore_us"]) * 1000
+        return latency
+
+    def as_dict(self):
+        return {
+            "port": self.port.as_dict(),
+            "functions": [end.as_dict() for end in self.functions],
+            "switches": self.switches,
+            "supported": self.supported,
+            "enabled": self.enabled,
+            "l0s_exit_ns": self.l0s_exit_ns,
+            "l1_exit_ns": self.l1_exit_ns,
+        }
+
+    def __repr__(self):
+        return "AspmLink(%s -> %s, enabled=%s)" % (
+            self.port.address.bdf,
+            self.functions[0].address.bdf,
+            ",".join(self.enabled) or "none",
+        )
+
+
+def path_links(address, sysfs=None):
+    """Return the AspmLinks from the root port down to ``address``.
+
+    Links are paired like ``audit_links``: each root or downstream port with
+    the device below it. Every function of that device shares the link and
+    is included.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    address = PciAddress.parse(address)
+    chain = _extract_bdfs_from_path(sysfs.device_dir(address))
+    if not chain or chain[-1] != address:
+        raise ResourceNotFoundError("device %s not found in sysfs" % address.bdf)
+    ends = {}
+
+    def end(addr):
+        if addr not in ends:
+            ends[addr] = read_end(addr, sysfs_root=sysfs.root)
+        return ends[addr]
+
+    devices = None
+    links = []
+    for port_addr, child in zip(chain, chain[1:]):
+        port = end(port_addr)
+        if port.port_type not in DOWNSTREAM_PORT_TYPES:
+            continue
+        if devices is None:
+            devices = list_devices(sysfs=sysfs)
+        functions = [
+            end(addr)
+            for addr in devices
+            if (addr.domain, addr.bus, addr.device)
+            == (child.domain, child.bus, child.device)
+        ]
+        links.append(AspmLink(port, functions, switches=len(links)))
+    if not links:
+        raise ResourceNotFoundError("%s is not below a PCIe port" % address.bdf)
+    return links
+
+
+def path_exit_latency(links):
+    """Return the worst-case exit latencies (ns) seen by the device at the end.
+
+    L0s exits are independent per link and add up. L1 exits propagate along
+    the path in parallel, so the total is the slowest link plus 1us for each
+    switch between it and the device.
+    """
+    depth = len(links) - 1
+    l1 = 0
+    for link in links:
+        if link.l1_exit_ns:
+            l1 = max(
+                l1, link.l1_exit_ns + (depth - link.switches) * _L1_SWITCH_LATENCY_NS
+            )
+    return {"l0s_ns": sum(link.l0s_exit_ns for link in links), "l1_ns": l1}
+
+
+def _normalize_states(states, enable):
+    if states is None:
+        states = ASPM_STATES
+    states = set(states)
+    unknown = states - set(ASPM_STATES)
+    if unknown:
+        raise ValueRangeError(
+            "unknown ASPM state %s (expected %s)"
+            % (", ".join(sorted(unknown)), ", ".join(ASPM_STATES))
+        )
+    # Substates only exist inside L1: enabling one needs L1 and turning L1
+    # off leaves them meaningless.
+    if enable and states & set(_L1SS_BITS):
+        states.add("l1")
+    if not enable and "l1" in states:
+        states.update(_L1SS_BITS)
+    return states
+
+
+def _configure_link(link, states, enable, handles):
+    """Change one link, returning the number of registers written.
+
+    LNKCTL is cleared on the child functions before the port and set on the
+    port before the child functions. L1 stays off on both ends while the
+    substate enables change.
+    """
+    supported = link.supported
+    lnkctl_bits = 0
+    l1ss_bits = 0
+    for state in states:
+        if enable and state not in supported:
+            continue
+        lnkctl_bits |= _LNKCTL_BITS.get(state, 0)
+        l1ss_bits |= _L1SS_BITS.get(state, 0)
+    down_first = link.functions + [link.port]
+    up_first = [link.port] + link.functions
+
+    targets = {}
+    for end in link.ends:
+        lnkctl = end.lnkctl & PCI_EXP_LNKCTL_ASPMC
+        ctl1 = end.l1ss_ctl1 & _L1SS_ASPM_MASK
+        if enable:
+            targets[end.address] = (lnkctl | lnkctl_bits, ctl1 | l1ss_bits)
+        else:
+            targets[end.address] = (lnkctl & ~lnkctl_bits, ctl1 & ~l1ss_bits)
+    l1ss_change = any(
+        end.l1ss_offset
+        and targets[end.address][1] != end.l1ss_ctl1 & _L1SS_ASPM_MASK
+        for end in link.ends
+    )
+
+    writes = 0
+    current = {}
+    for end in down_first:
+        value = end.lnkctl & PCI_EXP_LNKCTL_ASPMC
+        interim = value & targets[end.address][0]
+        if l1ss_change:
+            interim &= ~PCI_EXP_LNKCTL_ASPM_L1
+        if interim != value:
+            handles(end.address).modify(
+                end.cap_offset + PCI_EXP_LNKCTL, 2, PCI_EXP_LNKCTL_ASPMC, interim
+            )
+            writes += 1
+        current[end.address] = interim
+    if l1ss_change:
+        for end in up_first if enable else down_first:
+            target = targets[end.address][1]
+            if end.l1ss_offset and target != end.l1ss_ctl1 & _L1SS_ASPM_MASK:
+                handles(end.address).modify(
+                    end.l1ss_offset + PCI_L1SS_CTL1, 4, _L1SS_ASPM_MASK, target
+                )
+                writes += 1
+    for end in up_first:
+        target = targets[end.address][0]
+        if target != current[end.address]:
+            handles(end.address).modify(
+                end.cap_offset + PCI_EXP_LNKCTL, 2, PCI_EXP_LNKCTL_ASPMC, target
+            )
+            writes += 1
+    return writes
+
+
+def set_path_aspm(address, states=None, enable=True, sysfs=None):
+    """Enable or disable ASPM states on every link from the root port to ``address``.
+
+    ``states`` is a subset of ASPM_STATES (default: all of them). Enabling
+    walks the path from the root port down and only turns on states both
+    ends of a link support; disabling walks up from the device. L1.1/L1.2
+    timing parameters are left as firmware programmed them. Returns the
+    number of registers written.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    states = _normalize_states(states, enable)
+    links = path_links(address, sysfs=sysfs)
+    if not enable:
+        links.reverse()
+    open_handles = {}
+
+    def handles(addr):
+        handle = open_handles.get(addr)
+        if handle is None:
+            handle = config_access.ConfigHandle(addr, sysfs_root=sysfs.root)
+            open_handles[addr] = handle
+        return handle
+
+    try:
+        return sum(_configure_link(link, states, enable, handles) for link in links)
+    finally:
+        for handle in open_handles.values():
+            handle.close()
+
+
+def _states_text(states):
+    return ",".join(states) or "-"
+
+
+def format_path(links):
+    """Return table lines for a path plus its total exit latency."""
+    lines = [
+        "%-12s  %-12s  %-16s  %-16s  %8s  %8s"
+        % ("PORT", "DEVICE", "SUPPORTED", "ENABLED", "L0S ns", "L1 ns")
+    ]
+    for link in links:
+        lines.append(
+            "%-12s  %-12s  %-16s  %-16s  %8d  %8d"
+            % (
+                link.port.address.bdf,
+                link.functions[0].address.bdf,
+                _states_text(link.supported),
+                _states_text(link.enabled),
+                link.l0s_exit_ns,
+                link.l1_exit_ns,
+            )
+        )
+    total = path_exit_latency(links)
+    lines.append(
+        "worst-case exit latency: L0s %d ns, L1 %d ns"
+        % (total["l0s_ns"], total["l1_ns"])
+    )
+    return lines
+
+
+__all__ = [
+    "AspmEnd",
+    "AspmLink",
+    "format_path",
+    "path_exit_latency",
+    "path_links",
+    "read_end",
+    "set_path_aspm",
+]
@@ -0,0 +1,280 @@
+"""Fabric-wide link audit: links trained below what both ends support."""
+
+import concurrent.futures
+
+from .discover import _extract_bdfs_from_path, list_devices
+from .errors import PermissionDeniedError, ResourceNotFoundError
+from .link import (
+    DOWNSTREAM_PORT_TYPES,
+    PCI_EXP_LNKCAP,
+    PCI_EXP_LNKCAP2,
+    PCI_EXP_LNKSTA,
+    PCI_EXP_LNKSTA2,
+    PCI_EXP_LNKSTA2_FLIT,
+    PCI_EXP_TYPE_ENDPOINT,
+    PCI_EXP_TYPE_LEG_END,
+    PCI_EXP_TYPE_PCI_BRIDGE,
+    PCI_EXP_TYPE_UPSTREAM,
+    decode_link_capabilities,
+    decode_link_status,
+    link_bandwidth,
+    link_text,
+    read_pcie_caps,
+    read_sysfs_link_attrs,
+)
+from .sysfs import Sysfs
+from .types import PciAddress, validate_workers
+
+# Functions that can sit on the upstream end of a physical link.
+_UPSTREAM_COMPONENTS = (
+    PCI_EXP_TYPE_ENDPOINT,
+    PCI_EXP_TYPE_LEG_END,
+    PCI_EXP_TYPE_UPSTREAM,
+    PCI_EXP_TYPE_PCI_BRIDGE,
+)
+
+
+class _LinkEnd(object):
+    __slots__ = ("address", "port_type", "caps", "status", "flit")
+
+    def __init__(self, address, port_type, lnkcap, lnksta, lnkcap2=None, lnksta2=None):
+        self.address = address
+        self.port_type = port_type
+        self.caps = decode_link_capabilities(lnkcap, lnkcap2)
+        self.status = decode_link_status(lnksta)
+        self.flit = bool((lnksta2 or 0) & PCI_EXP_LNKSTA2_FLIT)
+
+    @classmethod
+    def from_caps(cls, caps):
+        """Decode the link registers of a PcieCaps (None without them)."""
+        lnkcap = caps.u32(PCI_EXP_LNKCAP)
+        lnksta = caps.u16(PCI_EXP_LNKSTA)
+        if lnkcap is None or lnksta is None:
+            return None
+        return cls(
+            caps.address,
+            caps.port_type,
+            lnkcap,
+            lnksta,
+            caps.u32(PCI_EXP_LNKCAP2),
+            caps.u16(PCI_EXP_LNKSTA2),
+        )
+
+
+def _read_end(address, sysfs):
+    try:
+        caps = read_pcie_caps(address, sysfs=sysfs)
+    except (PermissionDeniedError, ResourceNotFoundError):
+        return None
+    return _LinkEnd.from_caps(caps)
+
+
+class LinkAudit(object):
+    """One physical link: the port above, the device below and their state.
+
+    ``capable_*`` is the best both ends support; ``degraded`` is set when
+    the link runs below it and ``lost_gbps`` is the bandwidth given up, in
+    GB/s per direction. ``limited_by`` names the end ("port" or "device")
+    whose capability caps the link below the other end's maximum.
+    """
+
+    __slots__ = (
+        "port",
+        "device",
+        "speed_gtps",
+        "width",
+        "capable_speed_gtps",
+        "capable_width",
+        "device_max_speed_gtps",
+        "device_max_width",
+        "limited_by",
+        "sysfs",
+        "sysfs_mismatch",
+    )
+
+    def __init__(self, port, device):
+        self.port = port.address
+        self.device = device.address
+        self.speed_gtps = device.status["speed_gtps"]
+        self.width = device.status["width"]
+        port_speed = port.caps["max_speed_gtps"] or 0
+        device_speed = device.caps["max_speed_gtps"] or 0
+        port_width = port.caps["max_width"]
+        device_width = device.caps["max_width"]
+        self.capable_speed_gtps = min(port_speed, device_speed) or None
+        self.capable_width = min(port_width, device_width)
+        self.device_max_speed_gtps = device.caps["max_speed_gtps"]
+        self.device_max_width = device_width
+        self.limited_by = None
+        if port_speed < device_speed or port_width < device_width:
+            self.limited_by = "port"
+        elif device_speed < port_speed or device_width < port_width:
+            self.limited_by = "device"
+        self.sysfs = None
+        self.sysfs_mismatch = []
+
+    @property
+    def degraded(self):
+        return (self.speed_gtps or 0) < (self.capable_speed_gtps or 0) or (
+            self.width < self.capable_width
+        )
+
+    @property
+    def bandwidth_gbps(self):
+        return link_bandwidth(self.speed_gtps, self.width)
+
+    @property
+    def capable_gbps(self):
+        return link_bandwidth(self.capable_speed_gtps, self.capable_width)
+
+    @property
+    def lost_gbps(self):
+        return max(0.0, self.capable_gbps - self.bandwidth_gbps)
+
+    def compare_sysfs(self, attrs):
+        """Record the kernel's view and list fields that disagree with config."""
+        self.sysfs = attrs
+        expected = (
+            ("current_speed_gtps", self.speed_gtps),
+            ("current_width", self.width),
+            ("max_speed_gtps", self.device_max_speed_gtps),
+            ("max_width", self.device_max_width),
+        )
+        self.sysfs_mismatch = [
+            key
+            for key, value in expected
+            if attrs.get(key) is not None and attrs[key] != value
+        ]
+
+    def as_dict(self):
+        entry = {
+            "port": self.port.bdf,
+            "device": self.device.bdf,
+            "speed_gtps": self.speed_gtps,
+            "width": self.width,
+            "capable_speed_gtps": self.capable_speed_gtps,
+            "capable_width": self.capable_width,
+            "device_max_speed_gtps": self.device_max_speed_gtps,
+            "device_max_width": self.device_max_width,
+            "limited_by": self.limited_by,
+            "degraded": self.degraded,
+            "bandwidth_gbps": round(self.bandwidth_gbps, 3),
+            "capable_gbps": round(self.capable_gbps, 3),
+            "lost_gbps": round(self.lost_gbps, 3),
+        }
+        if self.sysfs is not None:
+            entry["sysfs"] = self.sysfs
+            entry["sysfs_mismatch"] = self.sysfs_mismatch
+        return entry
+
+    def __repr__(self):
+        return "LinkAudit(%s -> %s, %sGT/s x%d of %sGT/s x%d)" % (
+            self.port.bdf,
+            self.device.bdf,
+            self.speed_gtps,
+            self.width,
+            self.capable_speed_gtps,
+            self.capable_width,
+        )
+
+
+def _parent(address, sysfs):
+    try:
+        chain = _extract_bdfs_from_path(sysfs.device_dir(address))
+    except ResourceNotFoundError:
+        return None
+    if len(chain) < 2 or chain[-1] != address:
+        return None
+    return chain[-2]
+
+
+def audit_links(addresses=None, sysfs=None, workers=8, compare_sysfs=False):
+    """Audit every PCIe link once, reading all devices in parallel.
+
+    Each link is reported once, from the lowest-numbered function below a
+    root or downstream port; switch-internal port pairs are skipped. With
+    ``compare_sysfs`` the kernel's ``current_link_*``/``max_link_*``
+    attributes are read for the device as well.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    workers = validate_workers(workers)
+    if addresses is None:
+        addresses = list_devices(sysfs=sysfs)
+    else:
+        addresses = sorted(set(PciAddress.parse(addr) for addr in addresses))
+
+    def one(address):
+        end = _read_end(address, sysfs)
+        if end is None or end.port_type not in _UPSTREAM_COMPONENTS:
+            return end, None
+        return end, _parent(address, sysfs)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(one, addresses))
+    ends = {end.address: end for end, _ in results if end is not None}
+    parents = {end.address: parent for end, parent in results if parent is not None}
+    missing = sorted(set(parents.values()) - set(ends))
+    if missing:
+        # Ports outside the requested set still bound the link.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            for end in pool.map(lambda addr: _read_end(addr, sysfs), missing):
+                if end is not None:
+                    ends[end.address] = end
+
+    audits = []
+    seen = set()
+    for address in sorted(parents):
+        port = ends.get(parents[address])
+        if port is None or port.port_type not in DOWNSTREAM_PORT_TYPES:
+            continue
+        # All functions of a device share one link.
+        key = (port.address, address.domain, address.bus, address.device)
+        if key in seen:
+            continue
+        seen.add(key)
+        audit = LinkAudit(port, ends[address])
+        if compare_sysfs:
+            try:
+                audit.compare_sysfs(read_sysfs_link_attrs(address, sysfs=sysfs))
+            except (ResourceNotFoundError, PermissionDeniedError):
+                pass
+        audits.append(audit)
+    return audits
+
+
+def format_audit(audits, show_all=False):
+    """Return table lines for degraded links (every link with ``show_all``)."""
+    lines = [
+        "%-12s  %-12s  %-13s  %-13s  %-13s  %9s  %s"
+        % ("PORT", "DEVICE", "CURRENT", "CAPABLE", "DEVICE MAX", "LOST GB/s", "STATUS")
+    ]
+    for audit in audits:
+        if not (show_all or audit.degraded or audit.sysfs_mismatch):
+            continue
+        status = ["degraded" if audit.degraded else "ok"]
+        if audit.limited_by:
+            status.append("limited-by-%s" % audit.limited_by)
+        if audit.sysfs_mismatch:
+            status.append("sysfs-mismatch(%s)" % ",".join(audit.sysfs_mismatch))
+        lines.append(
+            "%-12s  %-12s  %-13s  %-13s  %-13s  %9.2f  %s"
+            % (
+                audit.port.bdf,
+                audit.device.bdf,
+                link_text(audit.speed_gtps, audit.width),
+                link_text(audit.capable_speed_gtps, audit.capable_width),
+                link_text(audit.device_max_speed_gtps, audit.device_max_width),
+                audit.lost_gbps,
+                " ".join(status),
+            )
+        )
+    degraded = [audit for audit in audits if audit.degraded]
+    lines.append(
+        "%d links audited, %d degraded, %.2f GB/s lost"
+        % (len(audits), len(degraded), sum(audit.lost_gbps for audit in degraded))
+    )
+    return lines
+
+
+__all__ = ["LinkAudit", "audit_links", "format_audit"]
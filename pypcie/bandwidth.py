@@ -0,0 +1,310 @@
+"""Usable bandwidth along the path from an endpoint up to its root port."""
+
+import concurrent.futures
+import struct
+
+from . import config as config_access
+from .audit import LinkAudit, _LinkEnd
+from .discover import _extract_bdfs_from_path, list_devices
+from .errors import (
+    OutOfRangeError,
+    PermissionDeniedError,
+    ResourceNotFoundError,
+)
+from .link import (
+    DOWNSTREAM_PORT_TYPES,
+    PCI_EXP_LNKCAP,
+    PCI_EXP_LNKCAP2,
+    PCI_EXP_LNKSTA,
+    PCI_EXP_LNKSTA2,
+    PCI_EXP_TYPE_ENDPOINT,
+    PCI_EXP_TYPE_LEG_END,
+    link_bandwidth,
+    link_encoding,
+    link_text,
+    read_pcie_caps,
+)
+from .sysfs import Sysfs
+from .types import PciAddress, validate_workers
+
+# LNKCAP through LNKSTA (version 1) or LNKSTA2 (version 2), in one read.
+_LINK_BLOCK_V1 = PCI_EXP_LNKSTA + 2 - PCI_EXP_LNKCAP
+_LINK_BLOCK_V2 = PCI_EXP_LNKSTA2 + 2 - PCI_EXP_LNKCAP
+
+_ENDPOINTS = (PCI_EXP_TYPE_ENDPOINT, PCI_EXP_TYPE_LEG_END)
+
+
+def _decode_block(address, port_type, block, version):
+    (lnkcap,) = struct.unpack_from("<I", block, 0)
+    (lnksta,) = struct.unpack_from("<H", block, PCI_EXP_LNKSTA - PCI_EXP_LNKCAP)
+    lnkcap2 = lnksta2 = None
+    if version >= 2 and len(block) >= _LINK_BLOCK_V2:
+        (lnkcap2,) = struct.unpack_from("<I", block, PCI_EXP_LNKCAP2 - PCI_EXP_LNKCAP)
+        (lnksta2,) = struct.unpack_from("<H", block, PCI_EXP_LNKSTA2 - PCI_EXP_LNKCAP)
+    return _LinkEnd(address, port_type, lnkcap, lnksta, lnkcap2, lnksta2)
+
+
+class PathHop(LinkAudit):
+    """One link on the path: the port above, the device below and its rate.
+
+    ``max_*`` (``capable_*``) is the best both ends support. Bandwidths are in GB/s per
+    direction after line encoding, including flit overhead in flit mode.
+    """
+
+    __slots__ = ("flit",)
+
+    def __init__(self, port, device):
+        LinkAudit.__init__(self, port, device)
+        self.flit = port.flit or device.flit
+
+    @property
+    def max_speed_gtps(self):
+        return self.capable_speed_gtps
+
+    @property
+    def max_width(self):
+        return self.capable_width
+
+    @property
+    def encoding(self):
+        return link_encoding(self.speed_gtps, self.flit)[0]
+
+    @property
+    def bandwidth_gbps(self):
+        return link_bandwidth(self.speed_gtps, self.width, self.flit)
+
+    @property
+    def capable_gbps(self):
+        return link_bandwidth(self.capable_speed_gtps, self.capable_width, self.flit)
+
+    def as_dict(self):
+        return {
+            "port": self.port.bdf,
+            "device": self.device.bdf,
+            "speed_gtps": self.speed_gtps,
+            "width": self.width,
+            "max_speed_gtps": self.max_speed_gtps,
+            "max_width": self.max_width,
+            "encoding": self.encoding,
+            "degraded": self.degraded,
+            "bandwidth_gbps": round(self.bandwidth_gbps, 3),
+            "capable_gbps": round(self.capable_gbps, 3),
+        }
+
+    def __repr__(self):
+        return "PathHop(%s -> %s, %s)" % (
+            self.port.bdf,
+            self.device.bdf,
+            link_text(self.speed_gtps, self.width),
+        )
+
+
+class PathBandwidth(object):
+    """Every hop from the root port down to ``endpoint``, root first.
+
+    The usable bandwidth is that of the ``bottleneck`` hop; among equally
+    slow hops the one nearest the root is named, since it is shared by the
+    most devices.
+    """
+
+    __slots__ = ("endpoint", "hops")
+
+    def __init__(self, endpoint, hops):
+        self.endpoint = endpoint
+        self.hops = hops
+
+    @property
+    def bottleneck(self):
+        return min(self.hops, key=lambda hop: hop.bandwidth_gbps)
+
+    @property
+    def bandwidth_gbps(self):
+        return self.bottleneck.bandwidth_gbps
+
+    @property
+    def capable_gbps(self):
+        return min(hop.capable_gbps for hop in self.hops)
+
+    @property
+    def limited(self):
+        """Whether the path runs below what its slowest capable hop allows."""
+        return self.bandwidth_gbps < self.capable_gbps
+
+    def as_dict(self):
+        bottleneck = self.bottleneck
+        return {
+            "endpoint": self.endpoint.bdf,
+            "bandwidth_gbps": round(self.bandwidth_gbps, 3),
+            "capable_gbps": round(self.capable_gbps, 3),
+            "limited": self.limited,
+            "bottleneck": {
+                "port": bottleneck.port.bdf,
+                "device": bottleneck.device.bdf,
+            },
+            "hops": [hop.as_dict() for hop in self.hops],
+        }
+
+    def __repr__(self):
+        return "PathBandwidth(%s, %.2f GB/s at %s)" % (
+            self.endpoint.bdf,
+            self.bandwidth_gbps,
+            self.bottleneck.device.bdf,
+        )
+
+
+class BandwidthReader(object):
+    """Read path bandwidth repeatedly, keeping topology and offsets.
+
+    The first pass walks each device's capability list in a 256-byte read
+    and remembers the PCIe capability offset and the device's chain of
+    upstream bridges. Later passes read only the LNKCAP..LNKSTA2 block of
+    each device. Every device is read once per pass, however many paths
+    share it.
+    """
+
+    def __init__(self, sysfs=None, workers=8):
+        workers = validate_workers(workers)
+        self.sysfs = sysfs if sysfs is not None else Sysfs()
+        self.workers = workers
+        self._offsets = {}
+        self._chains = {}
+
+    def _read_end(self, address):
+        offset = self._offsets.get(address)
+        try:
+            if offset is None:
+                caps = read_pcie_caps(address, sysfs=self.sysfs)
+                offset = (caps.base, caps.port_type, caps.version)
+                return address, offset, _LinkEnd.from_caps(caps)
+            base, port_type, version = offset
+            if not base:
+                return address, offset, None
+            length = _LINK_BLOCK_V2 if version >= 2 else _LINK_BLOCK_V1
+            with config_access.ConfigHandle(
+                address, sysfs_root=self.sysfs.root
+            ) as handle:
+                block = handle.read_block(base + PCI_EXP_LNKCAP, length)
+        except (OutOfRangeError, PermissionDeniedError, ResourceNotFoundError):
+            return address, None, None
+        return address, offset, _decode_block(address, port_type, block, version)
+
+    def _chain(self, address):
+        chain = self._chains.get(address)
+        if chain is None:
+            try:
+                chain = _extract_bdfs_from_path(self.sysfs.device_dir(address))
+            except ResourceNotFoundError:
+                chain = []
+            if not chain or chain[-1] != address:
+                chain = []
+            self._chains[address] = chain
+        return chain
+
+    def _read_ends(self, addresses):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(self._read_end, sorted(addresses)))
+        ends = {}
+        for address, offset, end in results:
+            if offset is not None:
+                self._offsets[address] = offset
+            if end is not None:
+                ends[address] = end
+        return ends
+
+    def read(self, addresses=None):
+        """Return a PathBandwidth per endpoint below a PCIe port.
+
+        Without ``addresses`` every PCIe endpoint is reported; given
+        addresses are reported whatever their type.
+        """
+        if addresses is None:
+            candidates = sorted(list_devices(sysfs=self.sysfs))
+        else:
+            candidates = sorted(set(PciAddress.parse(addr) for addr in addresses))
+        wanted = set(candidates)
+        for address in candidates:
+            wanted.update(self._chain(address))
+        ends = self._read_ends(wanted)
+        paths = []
+        for address in candidates:
+            end = ends.get(address)
+            if addresses is None and (end is None or end.port_type not in _ENDPOINTS):
+                continue
+            chain = self._chain(address)
+            hops = []
+            for port, device in zip(chain, chain[1:]):
+                port_end, device_end = ends.get(port), ends.get(device)
+                if port_end is None or device_end is None:
+                    continue
+                if port_end.port_type in DOWNSTREAM_PORT_TYPES:
+                    hops.append(PathHop(port_end, device_end))
+            if hops:
+                paths.append(PathBandwidth(address, hops))
+        return paths
+
+
+def path_bandwidth(address, sysfs=None):
+    """Return the PathBandwidth of one device."""
+    address = PciAddress.parse(address)
+    paths = BandwidthReader(sysfs=sysfs, workers=1).read([address])
+    if not paths:
+        raise ResourceNotFoundError("%s is not below a PCIe port" % address.bdf)
+    return paths[0]
+
+
+def path_bandwidths(addresses=None, sysfs=None, workers=8):
+    """Return a PathBandwidth per endpoint (or per address), read in parallel."""
+    return BandwidthReader(sysfs=sysfs, workers=workers).read(addresses)
+
+
+def _hop_text(hop):
+    return "%s %s" % (link_text(hop.speed_gtps, hop.width), hop.encoding)
+
+
+def format_paths(paths, hops=False):
+    """Return one line per endpoint, with its hops listed below on request."""
+    lines = [
+        "%-12s  %9s  %9s  %-28s  %s"
+        % ("ENDPOINT", "GB/s", "CAPABLE", "BOTTLENECK", "LINK")
+    ]
+    for path in paths:
+        bottleneck = path.bottleneck
+        lines.append(
+            "%-12s  %9.2f  %9.2f  %-28s  %s"
+            % (
+                path.endpoint.bdf,
+                path.bandwidth_gbps,
+                path.capable_gbps,
+                "%s -> %s" % (bottleneck.port.bdf, bottleneck.device.bdf),
+                _hop_text(bottleneck),
+            )
+        )
+        if not hops:
+            continue
+        for hop in path.hops:
+            lines.append(
+                "  %s -> %s  %-23s  of %-13s  %8.2f GB/s%s"
+                % (
+                    hop.port.bdf,
+                    hop.device.bdf,
+                    _hop_text(hop),
+                    link_text(hop.max_speed_gtps, hop.max_width),
+                    hop.bandwidth_gbps,
+                    "  bottleneck" if hop is bottleneck else "",
+                )
+            )
+    limited = sum(1 for path in paths if path.limited)
+    lines.append(
+        "%d endpoints, %d below their capable bandwidth" % (len(paths), limited)
+    )
+    return lines
+
+
+__all__ = [
+    "BandwidthReader",
+    "PathBandwidth",
+    "PathHop",
+    "format_paths",
+    "path_bandwidth",
+    "path_bandwidths",
+]
@@ -3,12 +3,18 @@
 import mmap
 import os
 import struct
+import threading
+import weakref
 
+from . import instrument
 from .errors import AlignmentError, OutOfRangeError, PermissionDeniedError, ValueRangeError
 from .sysfs import Sysfs, parse_resource_file
-from .types import PciAddress
+from .types import AccessGuard, PciAddress
 
 IORESOURCE_IO = 0x00000100
+IORESOURCE_MEM = 0x00000200
+IORESOURCE_PREFETCH = 0x00002000
+IORESOURCE_MEM_64 = 0x00100000
 
 
 def _validate_offset(offset):
@@ -35,34 +41,178 @@ def _validate_value(value, width):
         raise ValueRangeError("value out of range")
 
 
+class BarInfo(object):
+    """Decoded entry of a device's ``resource`` file."""
+
+    __slots__ = ("address", "index", "start", "end", "flags", "size", "has_wc", "has_file")
+
+    def __init__(self, address, index, start, end, flags, has_wc=False, has_file=True):
+        self.address = address
+        self.index = index
+        self.start = start
+        self.end = end
+        self.flags = flags
+        if (start == 0 and end == 0) or end < start:
+            self.size = 0
+        else:
+            self.size = end - start + 1
+        self.has_wc = has_wc
+        self.has_file = has_file
+
+    @property
+    def is_io(self):
+        return bool(self.flags & IORESOURCE_IO)
+
+    @property
+    def is_mem(self):
+        return bool(self.flags & IORESOURCE_MEM)
+
+    @property
+    def is_64bit(self):
+        return bool(self.flags & IORESOURCE_MEM_64)
+
+    @property
+    def prefetchable(self):
+        return bool(self.flags & IORESOURCE_PREFETCH)
+
+    @property
+    def mmappable(self):
+        """True for a sized memory BAR that has a ``resourceN`` file."""
+        return self.size > 0 and self.is_mem and self.has_file
+
+    def as_dict(self):
+        return {
+            "index": self.index,
+            "start": self.start,
+            "end": self.end,
+            "size": self.size,
+            "flags": self.flags,
+            "io": self.is_io,
+            "mem": self.is_mem,
+            "mem_64bit": self.is_64bit,
+            "prefetchable": self.prefetchable,
+            "write_combining": self.has_wc,
+            "mmappable": self.mmappable,
+        }
+
+    def __repr__(self):
+        kind = "io" if self.is_io else "mem" if self.is_mem else "none"
+        return "BarInfo(%s, %d, %s, 0x%x, size=0x%x)" % (
+            self.address.bdf,
+            self.index,
+            kind,
+            self.start,
+            self.size,
+        )
+
+
+def read_bar_table(addr, sysfs_root=None):
+    """Return a tuple of BarInfo, one per ``resource`` line, indexed by BAR.
+
+    Costs one read of ``resource`` and one directory listing; callers that
+    keep the table (``PciDevice.bars``, ``HandlePool``) never re-read it.
+    """
+    sysfs = _get_sysfs(sysfs_root)
+    address = PciAddress.parse(addr)
+    entries = parse_resource_file(address, root=sysfs.root)
+    try:
+        names = frozenset(os.listdir(sysfs.device_dir(address)))
+    except OSError:
+        names = frozenset()
+    return tuple(
+        BarInfo(
+            address,
+            index,
+            start,
+            end,
+            flags,
+            has_wc="resource%d_wc" % index in names,
+            has_file="resource%d" % index in names,
+        )
+        for index, (start, end, flags) in enumerate(entries)
+    )
+
+
+# Open PciBars and the objects caching BAR tables (PciDevice, HandlePool),
+# so a BAR resize reaches every mapping of the device it moves.
+_open_bars = weakref.WeakSet()
+_bar_caches = weakref.WeakSet()
+_registry_lock = threading.Lock()
+
+
+def register_bar_cache(cache):
+    """Have ``invalidate_bars()`` call ``cache.invalidate_bars(address)``."""
+    with _registry_lock:
+        _bar_caches.add(cache)
+
+
+def invalidate_bars(addr):
+    """Drop the BAR mappings and tables every registered cache holds for a device."""
+    address = PciAddress.parse(addr)
+    with _registry_lock:
+        caches = list(_bar_caches)
+    for cache in caches:
+        cache.invalidate_bars(address)
+
+
+def open_bars(addr):
+    """Return the PciBars of a device that currently hold a mapping."""
+    address = PciAddress.parse(addr)
+    with _registry_lock:
+        return [pci_bar for pci_bar in _open_bars if pci_bar.address == address]
+
+
 class PciBar(object):
-    """Access a PCI BAR resource."""
+    """Access a PCI BAR resource.
 
-    def __init__(self, sysfs, addr, index):
+    A PciBar may be shared between threads: reads run concurrently on one
+    mapping and a read-only mapping is upgraded to read-write in place.
+    ``close()`` waits for accesses in flight before unmapping.
+    """
+
+    def __init__(self, sysfs, addr, index, info=None):
         self.sysfs = sysfs or Sysfs()
         self.address = PciAddress.parse(addr)
         if not isinstance(index, int) or isinstance(index, bool) or index < 0:
             raise OutOfRangeError("bar index must be a non-negative integer")
+        if info is not None and (info.index != index or info.address != self.address):
+            raise ValueRangeError("BarInfo does not describe this BAR")
         self.index = index
         self._fd = None
         self._mmap = None
         self._readonly = False
         self._length = None
-        self._start, self._end, self._flags, self._size = self._resource_entry()
-        self._io_port = bool(self._flags & IORESOURCE_IO)
+        self._retired = []
+        self._lock = threading.Lock()
+        self._guard = AccessGuard()
+        self._rmw_locks = {}
+        if info is None:
+            info = self._resource_entry()
+        self.info = info
+        self._start, self._end, self._flags, self._size = (
+            info.start,
+            info.end,
+            info.flags,
+            info.size,
+        )
+        self._io_port = info.is_io
+
+    @classmethod
+    def from_table(cls, sysfs, table, index):
+        """Build a PciBar from a read_bar_table() result without touching sysfs."""
+        if not isinstance(index, int) or isinstance(index, bool) or index < 0:
+            raise OutOfRangeError("bar index must be a non-negative integer")
+        if index >= len(table):
+            raise OutOfRangeError("BAR index out of range")
+        info = table[index]
+        return cls(sysfs, info.address, index, info=info)
 
     def _resource_entry(self):
         entries = parse_resource_file(self.address, root=self.sysfs.root)
         if self.index >= len(entries):
             raise OutOfRangeError("BAR index out of range")
         start, end, flags = entries[self.index]
-        if start == 0 and end == 0:
-            size = 0
-        elif end < start:
-            size = 0
-        else:
-            size = end - start + 1
-        return start, end, flags, size
+        return BarInfo(self.address, self.index, start, end, flags)
 
     @property
     def is_io(self):
@@ -75,39 +225,73 @@ class PciBar(object):
         return self._size or 4096
 
     def open(self, readonly=False, length=None):
-        if self._fd is not None or self._mmap is not None:
-            return self
+        with self._lock:
+            if self._fd is None:
+                self._open_locked(readonly, length)
+        return self
+
+    def _open_locked(self, readonly, length=None):
         if length is None:
             length = self._size or 4096
         if length <= 0:
             raise OutOfRangeError("length must be positive")
+        fd, mapping = self._map(readonly, length)
         self._length = length
         self._readonly = bool(readonly)
+        self._mmap = mapping
+        self._fd = fd
+        with _registry_lock:
+            _open_bars.add(self)
+
+    def _map(self, readonly, length):
         path = self.sysfs.resource_path(self.address, self.index)
         flags = os.O_RDONLY if readonly else os.O_RDWR
+        if instrument.state.enabled:
+            instrument.count_syscall("open")
         try:
-            self._fd = os.open(path, flags)
+            fd = os.open(path, flags)
         except PermissionError as exc:
             raise PermissionDeniedError(str(exc))
         except OSError as exc:
             raise OutOfRangeError(str(exc))
-        if not self._io_port:
-            access = mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE
-            try:
-                self._mmap = mmap.mmap(self._fd, length, access=access)
-            except (OSError, ValueError) as exc:
-                os.close(self._fd)
-                self._fd = None
-                raise OutOfRangeError(str(exc))
-        return self
+        if self._io_port:
+            return fd, None
+        access = mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE
+        if instrument.state.enabled:
+            instrument.count_syscall("mmap")
+        try:
+            return fd, mmap.mmap(fd, length, access=access)
+        except (OSError, ValueError) as exc:
+            os.close(fd)
+            raise OutOfRangeError(str(exc))
+
+    def _upgrade_locked(self):
+        # Readers snapshot the fd and mapping without the lock and may still
+        # be using the read-only pair, so the read-write pair is swapped in
+        # (mapping before fd) and the old one is retired until close().
+        fd, mapping = self._map(False, self._length)
+        self._retired.append((self._fd, self._mmap))
+        self._mmap = mapping
+        self._fd = fd
+        self._readonly = False
 
     def close(self):
-        if self._mmap is not None:
-            self._mmap.close()
-            self._mmap = None
-        if self._fd is not None:
-            os.close(self._fd)
-            self._fd = None
+        self._guard.drain()
+        try:
+            with self._lock:
+                handles = self._retired + [(self._fd, self._mmap)]
+                self._retired = []
+                self._fd = None
+                self._mmap = None
+            with _registry_lock:
+                _open_bars.discard(self)
+            for fd, mapping in handles:
+                if mapping is not None:
+                    mapping.close()
+                if fd is not None:
+                    os.close(fd)
+        finally:
+            self._guard.release()
 
     def __enter__(self):
         return self.open()
@@ -116,12 +300,28 @@ class PciBar(object):
         self.close()
         return False
 
-    def _ensure_open(self, readonly=False):
-        if self._fd is None and self._mmap is None:
-            self.open(readonly=readonly)
-        elif readonly is False and self._readonly:
-            self.close()
-            self.open(readonly=False)
+    def _ensure_open_locked(self, readonly):
+        if self._fd is None:
+            self._open_locked(readonly)
+        elif not readonly and self._readonly:
+            self._upgrade_locked()
+
+    def _handles(self, readonly):
+        # Only opening and upgrading take the lock; the caller holds the
+        # guard, so the fd and mapping returned stay valid until it exits.
+        if self._fd is None or (self._readonly and not readonly):
+            with self._lock:
+                self._ensure_open_locked(readonly)
+        return self._fd, self._mmap
+
+    def _register_lock(self, offset):
+        # Keyed on the dword so that overlapping accesses of different
+        # widths (a u8 at 0x1 and a u32 at 0x0) share one lock.
+        key = offset & ~0x3
+        lock = self._rmw_locks.get(key)
+        if lock is None:
+            lock = self._rmw_locks.setdefault(key, threading.Lock())
+        return lock
 
     def _check_bounds(self, offset, length):
         if offset + length > self.length:
@@ -131,12 +331,17 @@ class PciBar(object):
         _validate_offset(offset)
         if not isinstance(length, int) or isinstance(length, bool) or length < 0:
             raise OutOfRangeError("length must be non-negative")
-        self._ensure_open(readonly=True)
-        self._check_bounds(offset, length)
-        if self._io_port:
-            data = os.pread(self._fd, length, offset)
-        else:
-            data = self._mmap[offset : offset + length]
+        with self._guard:
+            fd, mapping = self._handles(True)
+            self._check_bounds(offset, length)
+            if self._io_port:
+                data = os.pread(fd, length, offset)
+                if instrument.state.enabled:
+                    instrument.count_syscall("pread", len(data))
+            else:
+                data = mapping[offset : offset + length]
+                if instrument.state.enabled:
+                    instrument.count_bytes(len(data))
         if len(data) != length:
             raise OutOfRangeError("short read from BAR")
         return data
@@ -145,28 +350,48 @@ class PciBar(object):
         _validate_offset(offset)
         if not isinstance(data, (bytes, bytearray)):
             raise ValueRangeError("data must be bytes")
-        self._ensure_open(readonly=False)
-        self._check_bounds(offset, len(data))
-        if self._io_port:
-            written = os.pwrite(self._fd, data, offset)
-            if written != len(data):
-                raise OutOfRangeError("short write to BAR")
-        else:
-            self._mmap[offset : offset + len(data)] = data
+        with self._guard:
+            fd, mapping = self._handles(False)
+            self._check_bounds(offset, len(data))
+            if self._io_port:
+                written = os.pwrite(fd, data, offset)
+                if instrument.state.enabled:
+                    instrument.count_syscall("pwrite", written, write=True)
+            else:
+                mapping[offset : offset + len(data)] = data
+                written = len(data)
+                if instrument.state.enabled:
+                    instrument.count_bytes(written, write=True)
+        if written != len(data):
+            raise OutOfRangeError("short write to BAR")
+
+    def _trace(self, offset, width, value, write):
+        instrument.notify_access(
+            "bar", self.address, self.index, offset, width, value, write
+        )
 
     def read_u8(self, offset):
         data = self.read_bytes(offset, 1)
-        return struct.unpack("<B", data)[0]
+        value = struct.unpack("<B", data)[0]
+        if instrument.state.tracing:
+            self._trace(offset, 1, value, False)
+        return value
 
     def read_u16(self, offset):
         _validate_alignment(offset, 2)
         data = self.read_bytes(offset, 2)
-        return struct.unpack("<H", data)[0]
+        value = struct.unpack("<H", data)[0]
+        if instrument.state.tracing:
+            self._trace(offset, 2, value, False)
+        return value
 
     def read_u32(self, offset):
         _validate_alignment(offset, 4)
         data = self.read_bytes(offset, 4)
-        return struct.unpack("<I", data)[0]
+        value = struct.unpack("<I", data)[0]
+        if instrument.state.tracing:
+            self._trace(offset, 4, value, False)
+        return value
 
     def read_u64(self, offset):
         _validate_alignment(offset, 8)
@@ -178,16 +403,47 @@ class PciBar(object):
     def write_u8(self, offset, value):
         _validate_value(value, 1)
         self.write_bytes(offset, struct.pack("<B", value))
+        if instrument.state.tracing:
+            self._trace(offset, 1, value, True)
 
     def write_u16(self, offset, value):
         _validate_alignment(offset, 2)
         _validate_value(value, 2)
         self.write_bytes(offset, struct.pack("<H", value))
+        if instrument.state.tracing:
+            self._trace(offset, 2, value, True)
 
     def write_u32(self, offset, value):
         _validate_alignment(offset, 4)
         _validate_value(value, 4)
         self.write_bytes(offset, struct.pack("<I", value))
+        if instrument.state.tracing:
+            self._trace(offset, 4, value, True)
+
+    def modify_u8(self, offset, clear_bits=0, set_bits=0):
+        """Atomically clear then set bits in a u8 register; returns the new value."""
+        with self._register_lock(offset):
+            value = (self.read_u8(offset) & ~clear_bits) | set_bits
+            self.write_u8(offset, value)
+        return value
+
+    def modify_u16(self, offset, clear_bits=0, set_bits=0):
+        """Atomically clear then set bits in a u16 register; returns the new value."""
+        with self._register_lock(offset):
+            value = (self.read_u16(offset) & ~clear_bits) | set_bits
+            self.write_u16(offset, value)
+        return value
+
+    def modify_u32(self, offset, clear_bits=0, set_bits=0):
+        """Atomically clear then set bits in a u32 register; returns the new value.
+
+        Read-modify-write sequences on the same register are serialized
+        across threads sharing this PciBar; plain writes are not.
+        """
+        with self._register_lock(offset):
+            value = (self.read_u32(offset) & ~clear_bits) | set_bits
+            self.write_u32(offset, value)
+        return value
 
     def write_u64(self, offset, value):
         _validate_alignment(offset, 8)
@@ -206,6 +462,7 @@ def _get_sysfs(sysfs_root):
     return Sysfs(root=sysfs_root) if sysfs_root else Sysfs()
 
 
+@instrument.timed("bar")
 def read(address, bar, offset, width, sysfs_root=None):
     if width not in (1, 2, 4, 8):
         raise ValueRangeError("width must be 1, 2, 4, or 8")
@@ -220,6 +477,7 @@ def read(address, bar, offset, width, sysfs_root=None):
         return pci_bar.read_u64(offset)
 
 
+@instrument.timed("bar")
 def write(address, bar, offset, width, value, sysfs_root=None):
     if width not in (1, 2, 4, 8):
         raise ValueRangeError("width must be 1, 2, 4, or 8")
@@ -268,12 +526,21 @@ def write_u64(address, bar, offset, value, sysfs_root=None):
 
 
 __all__ = [
+    "BarInfo",
+    "IORESOURCE_IO",
+    "IORESOURCE_MEM",
+    "IORESOURCE_MEM_64",
+    "IORESOURCE_PREFETCH",
     "PciBar",
+    "invalidate_bars",
+    "open_bars",
+    "read_bar_table",
     "read",
     "read_u8",
     "read_u16",
     "read_u32",
     "read_u64",
+    "register_bar_cache",
     "write",
     "write_u8",
     "write_u16",
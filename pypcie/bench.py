@@ -0,0 +1,301 @@
+"""Micro-benchmarks for pypcie's own overhead on a synthetic sysfs tree."""
+
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+from . import __version__
+from . import bar as bar_access
+from . import capability
+from . import config as config_access
+from . import discover
+from .errors import ValueRangeError
+from .synthetic import create_fabric
+from .sysfs import Sysfs
+
+PCI_EXT_CAP_ID_ERR = 0x0001
+
+BENCHMARKS = (
+    "config.read_u32",
+    "bar.read_u32",
+    "bar.write_u32",
+    "bar.mapped_read_u32",
+    "bar.mapped_write_u32",
+    "capability.find_pcie",
+    "capability.find_ext",
+    "discover.list_devices",
+    "discover.find_by_id",
+    "discover.build_device_tree",
+    "cli.render_tree",
+)
+
+DEFAULT_SHAPE = {
+    "root_ports": 4,
+    "switch_depth": 1,
+    "switch_ports": 4,
+    "functions": 2,
+    "bar_size": 4096,
+}
+
+
+# Smallest value of each fabric parameter the benchmarks can run on.
+_MIN_SHAPE = {
+    "root_ports": 1,
+    "switch_depth": 0,
+    "switch_ports": 1,
+    "functions": 1,
+    "bar_size": 4,
+}
+
+
+def check_shape(name, value):
+    """Validate one fabric parameter and return it."""
+    if name not in DEFAULT_SHAPE:
+        raise ValueRangeError("unknown fabric parameter: %s" % name)
+    if value < _MIN_SHAPE[name]:
+        raise ValueRangeError(
+            "%s must be at least %d" % (name.replace("_", " "), _MIN_SHAPE[name])
+        )
+    if name == "bar_size" and value % 4:
+        raise ValueRangeError("bar size must be a multiple of 4")
+    return value
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def _measure(op, iterations, warmup):
+    for index in range(warmup):
+        op(index)
+    clock = time.perf_counter
+    samples = []
+    append = samples.append
+    started = clock()
+    for index in range(iterations):
+        t0 = clock()
+        op(index)
+        append(clock() - t0)
+    wall = clock() - started
+    samples.sort()
+    return {
+        "ops": iterations,
+        "ops_per_sec": iterations / wall if wall > 0 else 0.0,
+        "mean_us": sum(samples) / len(samples) * 1e6,
+        "p50_us": percentile(samples, 0.50) * 1e6,
+        "p90_us": percentile(samples, 0.90) * 1e6,
+        "p99_us": percentile(samples, 0.99) * 1e6,
+        "max_us": samples[-1] * 1e6,
+    }
+
+
+def _benchmarks(fabric, sysfs):
+    root = sysfs.root
+    endpoints = fabric.endpoints
+    bridges = fabric.bridges
+    count = len(endpoints)
+    bcount = len(bridges)
+    bar_size = fabric.bar_size
+
+    def cfg_read(i):
+        config_access.read_u32(endpoints[i % count], 0x00, sysfs_root=root)
+
+    def bar_read(i):
+        offset = (i * 4) % bar_size
+        bar_access.read_u32(endpoints[i % count], 0, offset, sysfs_root=root)
+
+    def bar_write(i):
+        offset = (i * 4) % bar_size
+        bar_access.write_u32(
+            endpoints[i % count], 0, offset, i & 0xFFFFFFFF, sysfs_root=root
+        )
+
+    mapped = bar_access.PciBar(sysfs, endpoints[0], 0).open()
+
+    def bar_mapped_read(i):
+        mapped.read_u32((i * 4) % bar_size)
+
+    def bar_mapped_write(i):
+        mapped.write_u32((i * 4) % bar_size, i & 0xFFFFFFFF)
+
+    def cap_walk(i):
+        capability.find_pcie_capability(bridges[i % bcount], sysfs_root=root)
+
+    def ext_cap_walk(i):
+        capability.find_ext_capability(
+            bridges[i % bcount], PCI_EXT_CAP_ID_ERR, sysfs_root=root
+        )
+
+    def list_devices(i):
+        discover.list_devices(sysfs=sysfs)
+
+    def find_by_id(i):
+        discover.find_by_id(0x1234, 0x5678, sysfs=sysfs)
+
+    def build_tree(i):
+        discover.build_device_tree(sysfs=sysfs)
+
+    def render_tree(i):
+        discover.render_device_tree(sysfs=sysfs)
+
+    # (name, op, scans_whole_fabric), in BENCHMARKS order.
+    table = [
+        ("config.read_u32", cfg_read, False),
+        ("bar.read_u32", bar_read, False),
+        ("bar.write_u32", bar_write, False),
+        ("bar.mapped_read_u32", bar_mapped_read, False),
+        ("bar.mapped_write_u32", bar_mapped_write, False),
+        ("capability.find_pcie", cap_walk, False),
+        ("capability.find_ext", ext_cap_walk, False),
+        ("discover.list_devices", list_devices, True),
+        ("discover.find_by_id", find_by_id, True),
+        ("discover.build_device_tree", build_tree, True),
+        ("cli.render_tree", render_tree, True),
+    ]
+    return table, mapped.close
+
+
+def run_suite(
+    iterations=2000,
+    scan_iterations=20,
+    warmup=10,
+    only=None,
+    workdir=None,
+    **shape
+):
+    """Build a synthetic fabric, run the benchmarks and return a result dict.
+
+    ``iterations`` applies to per-register operations and ``scan_iterations``
+    to operations that walk the whole fabric. ``shape`` overrides
+    DEFAULT_SHAPE (see ``synthetic.create_fabric``). The fabric is built in a
+    temporary directory unless ``workdir`` is given.
+    """
+    if iterations <= 0 or scan_iterations <= 0:
+        raise ValueRangeError("iterations must be positive")
+    for key, value in shape.items():
+        check_shape(key, value)
+    params = dict(DEFAULT_SHAPE)
+    params.update(shape)
+    if only is not None:
+        unknown = set(only) - set(BENCHMARKS)
+        if unknown:
+            raise ValueRangeError(
+                "unknown benchmark(s): %s" % ", ".join(sorted(unknown))
+            )
+
+    tmpdir = None
+    if workdir is None:
+        tmpdir = tempfile.mkdtemp(prefix="pypcie-bench-")
+        workdir = tmpdir
+    try:
+        devices_root = os.path.join(workdir, "sys", "bus", "pci", "devices")
+        started = time.perf_counter()
+        fabric = create_fabric(devices_root, **params)
+        build_s = time.perf_counter() - started
+        sysfs = Sysfs(root=devices_root)
+        table, cleanup = _benchmarks(fabric, sysfs)
+        results = {}
+        try:
+            for name, op, scans in table:
+                if only is not None and name not in only:
+                    continue
+                count = scan_iterations if scans else iterations
+                results[name] = _measure(op, count, min(warmup, count))
+        finally:
+            cleanup()
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return {
+        "pypcie_version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "fabric": dict(
+            params,
+            devices=len(fabric),
+            endpoints=len(fabric.endpoints),
+            bridges=len(fabric.bridges),
+            build_s=build_s,
+        ),
+        "results": results,
+    }
+
+
+def compare_results(baseline, current):
+    """Return rows of (name, baseline ops/s, current ops/s, change ratio)."""
+    rows = []
+    base_results = baseline.get("results", {})
+    for name, result in sorted(current.get("results", {}).items()):
+        base = base_results.get(name)
+        if base is None:
+            continue
+        before = base["ops_per_sec"]
+        after = result["ops_per_sec"]
+        ratio = (after / before - 1.0) if before else 0.0
+        rows.append((name, before, after, ratio))
+    return rows
+
+
+def format_results(report):
+    """Return human-readable lines for a run_suite() report."""
+    fabric = report["fabric"]
+    lines = [
+        "pypcie %s, python %s, %d devices (%d endpoints, %d bridges)"
+        % (
+            report["pypcie_version"],
+            report["python"],
+            fabric["devices"],
+            fabric["endpoints"],
+            fabric["bridges"],
+        ),
+        "%-28s %12s %10s %10s %10s"
+        % ("benchmark", "ops/s", "p50(us)", "p90(us)", "p99(us)"),
+    ]
+    for name, result in report["results"].items():
+        lines.append(
+            "%-28s %12.1f %10.2f %10.2f %10.2f"
+            % (
+                name,
+                result["ops_per_sec"],
+                result["p50_us"],
+                result["p90_us"],
+                result["p99_us"],
+            )
+        )
+    return lines
+
+
+def format_comparison(rows):
+    """Return human-readable lines for compare_results() rows."""
+    lines = ["%-28s %12s %12s %9s" % ("benchmark", "base ops/s", "ops/s", "change")]
+    for name, before, after, ratio in rows:
+        lines.append(
+            "%-28s %12.1f %12.1f %+8.1f%%" % (name, before, after, ratio * 100.0)
+        )
+    return lines
+
+
+def load_results(path):
+    with open(path, "r") as handle:
+        return json.load(handle)
+
+
+__all__ = [
+    "BENCHMARKS",
+    "DEFAULT_SHAPE",
+    "compare_results",
+    "format_comparison",
+    "format_results",
+    "load_results",
+    "percentile",
+    "run_suite",
+]
@@ -2,7 +2,7 @@
 
 import os
 
-from . import config
+from . import config, instrument
 from .errors import PermissionDeniedError, ResourceNotFoundError
 from .sysfs import Sysfs
 from .types import validate_u16, validate_u8
@@ -20,6 +20,71 @@ PCI_CAP_ID_EXP = 0x10
 PCI_STD_HEADER_SIZEOF = 0x40
 PCI_FIND_CAP_TTL = 48
 PCI_CFG_SPACE_SIZE = 0x100
+PCI_CFG_SPACE_EXP_SIZE = 0x1000
+
+PCI_CAP_NAMES = {
+    0x01: "Power Management",
+    0x02: "AGP",
+    0x03: "VPD",
+    0x04: "Slot ID",
+    0x05: "MSI",
+    0x06: "CompactPCI Hot Swap",
+    0x07: "PCI-X",
+    0x08: "HyperTransport",
+    0x09: "Vendor Specific",
+    0x0A: "Debug Port",
+    0x0B: "CompactPCI CRC",
+    0x0C: "Hot Plug",
+    0x0D: "Bridge Subsystem ID",
+    0x0E: "AGP 8x",
+    0x0F: "Secure Device",
+    0x10: "PCI Express",
+    0x11: "MSI-X",
+    0x12: "SATA",
+    0x13: "Advanced Features",
+    0x14: "Enhanced Allocation",
+    0x15: "Flattening Portal Bridge",
+}
+
+PCI_EXT_CAP_NAMES = {
+    0x0001: "Advanced Error Reporting",
+    0x0002: "Virtual Channel",
+    0x0003: "Device Serial Number",
+    0x0004: "Power Budgeting",
+    0x0005: "Root Complex Link Declaration",
+    0x0006: "Root Complex Internal Link Control",
+    0x0007: "Root Complex Event Collector",
+    0x0008: "Multi-Function VC",
+    0x0009: "Virtual Channel (MFVC)",
+    0x000A: "RCRB Header",
+    0x000B: "Vendor Specific",
+    0x000C: "Configuration Access Correlation",
+    0x000D: "Access Control Services",
+    0x000E: "Alternative Routing-ID",
+    0x000F: "Address Translation Services",
+    0x0010: "SR-IOV",
+    0x0011: "MR-IOV",
+    0x0012: "Multicast",
+    0x0013: "Page Request",
+    0x0015: "Resizable BAR",
+    0x0016: "Dynamic Power Allocation",
+    0x0017: "TPH Requester",
+    0x0018: "Latency Tolerance Reporting",
+    0x0019: "Secondary PCI Express",
+    0x001A: "Protocol Multiplexing",
+    0x001B: "Process Address Space ID",
+    0x001C: "LN Requester",
+    0x001D: "Downstream Port Containment",
+    0x001E: "L1 PM Substates",
+    0x001F: "Precision Time Measurement",
+    0x0023: "Designated Vendor-Specific",
+    0x0024: "VF Resizable BAR",
+    0x0025: "Data Link Feature",
+    0x0026: "Physical Layer 16.0 GT/s",
+    0x0027: "Lane Margining at the Receiver",
+    0x002A: "Physical Layer 32.0 GT/s",
+    0x0031: "Physical Layer 64.0 GT/s",
+}
 
 
 def _config_size(address, sysfs_root=None):
@@ -48,6 +113,7 @@ def _cap_list_start(address, sysfs_root=None):
     return 0
 
 
+@instrument.timed("capability")
 def find_pci_capability(address, cap_id, sysfs_root=None):
     """Return the offset of a standard PCI capability, or 0 if not found."""
     cap_id = validate_u8(cap_id)
@@ -76,6 +142,7 @@ def find_pcie_capability(address, sysfs_root=None):
     return find_pci_capability(address, PCI_CAP_ID_EXP, sysfs_root=sysfs_root)
 
 
+@instrument.timed("capability")
 def find_ext_capability(address, cap_id, sysfs_root=None):
     """Return the offset of a PCIe extended capability, or 0 if not found."""
     cap_id = validate_u16(cap_id)
@@ -105,9 +172,94 @@ def find_pcie_ext_capability(address, cap_id, sysfs_root=None):
     return find_ext_capability(address, cap_id, sysfs_root=sysfs_root)
 
 
+def walk_pci_capabilities(data):
+    """Yield (cap_id, offset) for each standard capability in a config buffer."""
+    if len(data) < PCI_STD_HEADER_SIZEOF:
+        return
+    status = data[PCI_STATUS] | (data[PCI_STATUS + 1] << 8)
+    if not (status & PCI_STATUS_CAP_LIST):
+        return
+    hdr_type = data[PCI_HEADER_TYPE] & PCI_HEADER_TYPE_MASK
+    if hdr_type in (PCI_HEADER_TYPE_NORMAL, PCI_HEADER_TYPE_BRIDGE):
+        pos = data[PCI_CAPABILITY_LIST]
+    elif hdr_type == PCI_HEADER_TYPE_CARDBUS:
+        pos = data[PCI_CB_CAPABILITY_LIST]
+    else:
+        return
+    ttl = PCI_FIND_CAP_TTL
+    while ttl > 0:
+        ttl -= 1
+        if pos < PCI_STD_HEADER_SIZEOF:
+            break
+        pos &= 0xFC
+        if pos + 2 > len(data):
+            break
+        ent_id = data[pos]
+        if ent_id == 0xFF:
+            break
+        yield ent_id, pos
+        pos = data[pos + 1]
+
+
+def walk_ext_capabilities(data):
+    """Yield (cap_id, version, offset) for each extended capability in a buffer."""
+    size = len(data)
+    if size <= PCI_CFG_SPACE_SIZE:
+        return
+    pos = PCI_CFG_SPACE_SIZE
+    ttl = max(1, (size - PCI_CFG_SPACE_SIZE) // 8)
+    while ttl > 0 and pos >= PCI_CFG_SPACE_SIZE:
+        ttl -= 1
+        if pos + 4 > size:
+            break
+        header = (
+            data[pos]
+            | (data[pos + 1] << 8)
+            | (data[pos + 2] << 16)
+            | (data[pos + 3] << 24)
+        )
+        if header in (0, 0xFFFFFFFF):
+            break
+        yield header & 0xFFFF, (header >> 16) & 0xF, pos
+        next_pos = (header >> 20) & 0xFFF
+        if next_pos == 0 or next_pos == pos or next_pos < PCI_CFG_SPACE_SIZE:
+            break
+        pos = next_pos
+
+
+def find_pci_capability_in(data, cap_id):
+    """Return the offset of a standard capability in a config buffer, or 0."""
+    for ent_id, pos in walk_pci_capabilities(data):
+        if ent_id == cap_id:
+            return pos
+    return 0
+
+
+def find_ext_capability_in(data, cap_id):
+    """Return the offset of an extended capability in a config buffer, or 0."""
+    for ent_id, _, pos in walk_ext_capabilities(data):
+        if ent_id == cap_id:
+            return pos
+    return 0
+
+
+def capability_name(cap_id, extended=False):
+    """Return a human-readable name for a capability ID."""
+    if extended:
+        return PCI_EXT_CAP_NAMES.get(cap_id, "ext cap 0x%04x" % cap_id)
+    return PCI_CAP_NAMES.get(cap_id, "cap 0x%02x" % cap_id)
+
+
 __all__ = [
+    "PCI_CAP_NAMES",
+    "PCI_EXT_CAP_NAMES",
+    "capability_name",
     "find_ext_capability",
+    "find_ext_capability_in",
     "find_pci_capability",
+    "find_pci_capability_in",
     "find_pcie_capability",
     "find_pcie_ext_capability",
+    "walk_ext_capabilities",
+    "walk_pci_capabilities",
 ]
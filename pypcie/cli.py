@@ -1,13 +1,33 @@
 """Command-line interface for pypcie."""
 
 import argparse
+import json
 import os
+import runpy
 import sys
+import time
 
+from . import aer
+from . import aspm as aspm_access
+from . import audit
+from . import bandwidth as bandwidth_access
 from . import bar as bar_access
+from . import bench
+from . import devctl as devctl_access
+from . import exporter as exporter_access
+from . import mps as mps_access
+from . import msix as msix_access
+from . import p2p as p2p_access
+from . import rebar as rebar_access
+from . import report
+from . import reset as reset_access
+from . import retrain as retrain_access
+from . import instrument
+from . import snapshot as snapshot_access
+from . import trace
 from . import link as link_access
 from . import config as config_access
-from .discover import build_device_tree, find_by_id, find_root_port
+from .discover import find_by_id, find_root_port, list_devices, render_device_tree
 from .errors import (
     OutOfRangeError,
     PciError,
@@ -44,6 +64,23 @@ def _parse_non_negative(value, name):
     return number
 
 
+def _parse_positive(value, name):
+    number = _parse_int(value, name)
+    if number < 1:
+        raise ValueRangeError("%s must be at least 1" % name)
+    return number
+
+
+def _parse_seconds(value, name):
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueRangeError("invalid %s: %r" % (name, value))
+    if not number >= 0 or number == float("inf"):
+        raise ValueRangeError("%s must be a non-negative number of seconds" % name)
+    return number
+
+
 def _parse_address(value):
     return PciAddress.parse(value)
 
@@ -60,58 +97,11 @@ def _resolve_link_target(args):
     return find_root_port(args.bdf, sysfs=_get_sysfs(args))
 
 
-def _should_display(node, children, matched, cache):
-    if matched is None:
-        return True
-    if node in cache:
-        return cache[node]
-    if node in matched:
-        cache[node] = True
-        return True
-    for child in children.get(node, []):
-        if _should_display(child, children, matched, cache):
-            cache[node] = True
-            return True
-    cache[node] = False
-    return False
-
-
-def _render_tree(sysfs, vendor=None, device=None):
-    roots, children = build_device_tree(sysfs=sysfs)
-    matched = None
-    if vendor is not None or device is not None:
-        matched = set(find_by_id(vendor, device, sysfs=sysfs))
-    root_set = set(roots)
-    cache = {}
-    lines = []
-
-    def render(node, prefix, has_parent, is_last):
-        display_children = [
-            child
-            for child in children.get(node, [])
-            if _should_display(child, children, matched, cache)
-        ]
-        role = "RC" if node in root_set else ("SW" if display_children else "EP")
-        connector = ""
-        if has_parent:
-            connector = "\\-- " if is_last else "|-- "
-        lines.append(prefix + connector + "[%s] %s" % (role, node.bdf))
-        child_prefix = prefix
-        if has_parent:
-            child_prefix += "    " if is_last else "|   "
-        for idx, child in enumerate(display_children):
-            render(child, child_prefix, True, idx == len(display_children) - 1)
-
-    for idx, root in enumerate(roots):
-        if not _should_display(root, children, matched, cache):
-            continue
-        render(root, "", False, idx == len(roots) - 1)
-    return lines
-
-
 def _cmd_list(args):
     sysfs = _get_sysfs(args)
-    tree_lines = _render_tree(sysfs, vendor=args.vendor, device=args.device)
+    tree_lines = render_device_tree(
+        sysfs=sysfs, vendor_id=args.vendor, device_id=args.device
+    )
     for line in tree_lines:
         print(line)
     return 0
@@ -192,6 +182,266 @@ def _cmd_dump_config(args):
     return 0
 
 
+def _cmd_show(args):
+    sysfs = _get_sysfs(args)
+    addresses = args.bdf or list_devices(sysfs=sysfs)
+    reports = report.describe_devices(addresses, sysfs=sysfs, workers=args.workers)
+    if args.json:
+        print(json.dumps(reports, indent=2, sort_keys=True))
+    else:
+        for index, entry in enumerate(reports):
+            if index:
+                print("")
+            for line in report.format_report(entry):
+                print(line)
+    return 1 if any("error" in entry for entry in reports) else 0
+
+
+def _format_aer_line(address, status, totals, rates):
+    parts = ["%s" % address.bdf]
+    if status is not None:
+        parts.append("uncor=0x%08x cor=0x%08x" % (status.uncor_status, status.cor_status))
+    for key in sorted(totals):
+        value = totals[key]
+        if not isinstance(value, int):
+            continue
+        if rates is None:
+            parts.append("%s=%d" % (key, value))
+        else:
+            parts.append("%s=%d (%.2f/s)" % (key, value, rates.get(key, 0.0)))
+    if status is not None and (status.uncorrectable or status.correctable):
+        parts.append("[%s]" % " ".join(status.uncorrectable + status.correctable))
+    return " ".join(parts)
+
+
+def _cmd_aer(args):
+    sysfs = _get_sysfs(args)
+    collector = aer.AerCollector(
+        addresses=args.bdf or None,
+        sysfs=sysfs,
+        clear=args.clear,
+        kernel_counters=not args.no_kernel,
+    )
+    with collector:
+        statuses = collector.sample()
+        first = collector.counters()
+        started = time.monotonic()
+        rates = None
+        for _ in range(args.count - 1):
+            time.sleep(args.interval)
+            statuses = collector.sample()
+        totals = collector.counters()
+        if args.count > 1:
+            rates = aer.counter_rates(first, totals, time.monotonic() - started)
+    if args.json:
+        report = {}
+        for address in sorted(totals):
+            entry = dict(totals[address])
+            status = statuses.get(address)
+            if status is not None:
+                entry["status"] = status.as_dict()
+            if rates is not None:
+                entry["rates"] = rates[address]
+            report[address.bdf] = entry
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        for address in sorted(totals):
+            print(
+                _format_aer_line(
+                    address,
+                    statuses.get(address),
+                    totals[address],
+                    None if rates is None else rates[address],
+                )
+            )
+    return 0
+
+
+def _cmd_export(args):
+    exporter = exporter_access.Exporter(
+        addresses=args.bdf or None,
+        sysfs=_get_sysfs(args),
+        interval=args.interval,
+        aer=not args.no_aer,
+    )
+    server = exporter_access.make_server(exporter, args.listen)
+    exporter.start()
+    host, port = server.server_address[:2]
+    print("serving metrics on http://%s:%d/metrics" % (host, port), file=sys.stderr)
+    sys.stderr.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        exporter.stop()
+    return 0
+
+
+def _cmd_bus_reset(args):
+    results = reset_access.reset_bridges(
+        args.bdf,
+        sysfs=_get_sysfs(args),
+        concurrency=args.concurrency,
+        assert_s=args.delay_ms / 1000.0,
+        settle_s=args.settle_ms / 1000.0,
+        timeout_s=args.timeout,
+        restore=not args.no_restore,
+    )
+    if args.json:
+        print(json.dumps([result.as_dict() for result in results], indent=2, sort_keys=True))
+    else:
+        for line in reset_access.format_results(results):
+            print(line)
+    return 0 if all(result.ok for result in results) else 1
+
+
+def _cmd_mps_tune(args):
+    sysfs = _get_sysfs(args)
+    settings = mps_access.plan(args.policy, sysfs=sysfs, workers=args.workers)
+    if args.json:
+        print(
+            json.dumps([setting.as_dict() for setting in settings], indent=2, sort_keys=True)
+        )
+    else:
+        for line in mps_access.format_plan(settings, show_all=args.all):
+            print(line)
+    if args.apply:
+        written = mps_access.apply(settings, sysfs=sysfs)
+        print("applied %d changes" % written, file=sys.stderr)
+    return 0
+
+
+def _cmd_aspm(args):
+    sysfs = _get_sysfs(args)
+    if args.aspm_command != "show":
+        written = aspm_access.set_path_aspm(
+            args.bdf,
+            states=args.state,
+            enable=args.aspm_command == "enable",
+            sysfs=sysfs,
+        )
+        print("%d registers written" % written, file=sys.stderr)
+    links = aspm_access.path_links(args.bdf, sysfs=sysfs)
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    "links": [link.as_dict() for link in links],
+                    "exit_latency": aspm_access.path_exit_latency(links),
+                },
+                indent=2,
+                sort_keys=True,
+            )
+        )
+    else:
+        for line in aspm_access.format_path(links):
+            print(line)
+    return 0
+
+
+def _cmd_devctl(args):
+    sysfs = _get_sysfs(args)
+    settings = devctl_access.plan(
+        enable=args.enable, disable=args.disable, sysfs=sysfs, workers=args.workers
+    )
+    if args.json:
+        print(
+            json.dumps([setting.as_dict() for setting in settings], indent=2, sort_keys=True)
+        )
+    else:
+        for line in devctl_access.format_settings(settings, show_all=args.all):
+            print(line)
+    if args.apply:
+        written = devctl_access.apply(settings, sysfs=sysfs)
+        print("applied %d changes" % written, file=sys.stderr)
+    return 0
+
+
+def _cmd_rebar(args):
+    sysfs = _get_sysfs(args)
+    if args.size is not None:
+        if args.bar is None:
+            raise ValueRangeError("--size requires --bar")
+        method = rebar_access.resize_bar(
+            args.bdf, args.bar, args.size, sysfs=sysfs, method=args.method
+        )
+        print(
+            "BAR %d resized to %s via %s"
+            % (args.bar, rebar_access.format_size(args.size), method),
+            file=sys.stderr,
+        )
+    bars = rebar_access.read_rebar(args.bdf, sysfs=sysfs)
+    if args.json:
+        print(json.dumps([entry.as_dict() for entry in bars], indent=2, sort_keys=True))
+    else:
+        for line in rebar_access.format_rebar(bars):
+            print(line)
+    return 0
+
+
+def _cmd_p2p_path(args):
+    sysfs = _get_sysfs(args)
+    if args.matrix:
+        paths = p2p_access.p2p_matrix(
+            args.devices or None, sysfs=sysfs, workers=args.workers
+        )
+        if args.json:
+            print(
+                json.dumps([path.as_dict() for path in paths], indent=2, sort_keys=True)
+            )
+        else:
+            for line in p2p_access.format_matrix(paths):
+                print(line)
+        return 0
+    if len(args.devices) != 2:
+        raise ValueRangeError("p2p-path needs two devices (or --matrix)")
+    path = p2p_access.p2p_path(args.devices[0], args.devices[1], sysfs=sysfs)
+    if args.json:
+        print(json.dumps(path.as_dict(), indent=2, sort_keys=True))
+    else:
+        for line in p2p_access.format_path(path):
+            print(line)
+    return 0
+
+
+def _cmd_path_bandwidth(args):
+    sysfs = _get_sysfs(args)
+    if args.bdf and len(args.bdf) == 1:
+        paths = [bandwidth_access.path_bandwidth(args.bdf[0], sysfs=sysfs)]
+    else:
+        paths = bandwidth_access.path_bandwidths(
+            args.bdf or None, sysfs=sysfs, workers=args.workers
+        )
+    if args.json:
+        print(json.dumps([path.as_dict() for path in paths], indent=2, sort_keys=True))
+    else:
+        for line in bandwidth_access.format_paths(paths, hops=args.hops):
+            print(line)
+    return 0
+
+
+def _cmd_msix(args):
+    sysfs = _get_sysfs(args)
+    for vectors, masked in ((args.mask, True), (args.unmask, False)):
+        if vectors is not None:
+            written = msix_access.set_mask(
+                args.bdf, vectors, masked=masked, sysfs=sysfs
+            )
+            print(
+                "%s %d vectors" % ("masked" if masked else "unmasked", written),
+                file=sys.stderr,
+            )
+    table = msix_access.read_table(args.bdf, sysfs=sysfs)
+    if args.json:
+        print(json.dumps(table.as_dict(), indent=2, sort_keys=True))
+    else:
+        for line in msix_access.format_table(table, show_all=args.all):
+            print(line)
+    return 0
+
+
 def _cmd_link_disable(args):
     target = _resolve_link_target(args)
     link_access.link_disable(target, sysfs_root=args.sysfs_root)
@@ -204,7 +454,62 @@ def _cmd_link_enable(args):
     return 0
 
 
+_BATCH_RETRAIN_OPTIONS = (
+    ("speed", "--speed"),
+    ("concurrency", "--concurrency"),
+    ("retries", "--retries"),
+    ("timeout", "--timeout"),
+    ("json", "--json"),
+)
+
+
 def _cmd_link_retrain(args):
+    if args.all_downstream_of is not None:
+        single = [
+            flag
+            for flag, given in (
+                ("--bdf", args.bdf is not None),
+                ("--endpoint", args.endpoint),
+                ("--port-bdf", args.port_bdf is not None),
+                ("--clear-after", args.clear_after),
+            )
+            if given
+        ]
+        if single:
+            raise ValueRangeError(
+                "%s cannot be combined with --all-downstream-of" % ", ".join(single)
+            )
+        sysfs = _get_sysfs(args)
+        ports = retrain_access.downstream_ports(args.all_downstream_of, sysfs=sysfs)
+        results = retrain_access.retrain_ports(
+            ports,
+            speed=args.speed,
+            sysfs=sysfs,
+            concurrency=8 if args.concurrency is None else args.concurrency,
+            timeout_s=1.0 if args.timeout is None else args.timeout,
+            retries=2 if args.retries is None else args.retries,
+        )
+        if args.json:
+            print(
+                json.dumps(
+                    [result.as_dict() for result in results], indent=2, sort_keys=True
+                )
+            )
+        else:
+            for line in retrain_access.format_results(results):
+                print(line)
+        return 0 if all(result.ok for result in results) else 1
+    if args.bdf is None:
+        raise ValueRangeError("link-retrain needs --bdf or --all-downstream-of")
+    batch = [
+        flag
+        for name, flag in _BATCH_RETRAIN_OPTIONS
+        if getattr(args, name) not in (None, False)
+    ]
+    if batch:
+        raise ValueRangeError(
+            "%s only apply with --all-downstream-of" % ", ".join(batch)
+        )
     target = _resolve_link_target(args)
     link_access.retrain_link(
         target, sysfs_root=args.sysfs_root, clear_after=args.clear_after
@@ -214,24 +519,44 @@ def _cmd_link_retrain(args):
 
 def _cmd_link_status(args):
     target = _resolve_link_target(args)
-    status = link_access.read_link_status(target, sysfs_root=args.sysfs_root)
+    status = link_access.read_link_status(
+        target,
+        sysfs_root=args.sysfs_root,
+        source=args.source or "config",
+        with_source=True,
+    )
     speed = status["speed_gtps"]
     if speed is None:
         speed_text = "unknown(0x%x)" % status["speed_code"]
     else:
         speed_text = "%sGT/s" % speed
-    print(
-        "speed=%s width=x%d training=%d dll_link_active=%d"
-        % (
-            speed_text,
-            status["width"],
+    line = "speed=%s width=x%d" % (speed_text, status["width"])
+    if status["training"] is not None:
+        line += " training=%d dll_link_active=%d" % (
             int(status["training"]),
             int(status["dll_link_active"]),
         )
-    )
+    if args.source not in (None, "config"):
+        line += " source=%s" % status["source"]
+    print(line)
     return 0
 
 
+def _cmd_link_audit(args):
+    audits = audit.audit_links(
+        addresses=args.bdf or None,
+        sysfs=_get_sysfs(args),
+        workers=args.workers,
+        compare_sysfs=args.sysfs_attrs,
+    )
+    if args.json:
+        print(json.dumps([entry.as_dict() for entry in audits], indent=2, sort_keys=True))
+    else:
+        for line in audit.format_audit(audits, show_all=args.all):
+            print(line)
+    return 1 if any(entry.degraded for entry in audits) else 0
+
+
 def _cmd_link_set_speed(args):
     target = _resolve_link_target(args)
     link_access.set_target_link_speed(
@@ -275,8 +600,166 @@ def _cmd_link_control(args):
     return 0
 
 
-def _add_link_target_args(parser):
-    parser.add_argument("--bdf", required=True, type=_parse_address)
+def _cmd_bench(args):
+    shape = {
+        "root_ports": args.root_ports,
+        "switch_depth": args.switch_depth,
+        "switch_ports": args.switch_ports,
+        "functions": args.functions,
+        "bar_size": args.bar_size,
+    }
+    report = bench.run_suite(
+        iterations=args.iterations,
+        scan_iterations=args.scan_iterations,
+        only=args.only,
+        **shape
+    )
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        for line in bench.format_results(report):
+            print(line)
+    if args.compare:
+        try:
+            baseline = bench.load_results(args.compare)
+        except (OSError, ValueError) as exc:
+            raise ResourceNotFoundError("cannot load baseline: %s" % exc)
+        out = sys.stderr if args.json else sys.stdout
+        for line in bench.format_comparison(bench.compare_results(baseline, report)):
+            print(line, file=out)
+    return 0
+
+
+def _cmd_trace_record(args):
+    script_argv = [args.script] + list(args.script_args)
+    saved_argv = sys.argv
+    exit_code = 0
+    recorder = trace.TraceRecorder(args.output)
+    sys.argv = script_argv
+    try:
+        with recorder:
+            try:
+                runpy.run_path(args.script, run_name="__main__")
+            except SystemExit as exc:
+                if exc.code is None:
+                    exit_code = 0
+                elif isinstance(exc.code, int):
+                    exit_code = exc.code
+                else:
+                    exit_code = 1
+    finally:
+        sys.argv = saved_argv
+    print("recorded %d accesses to %s" % (recorder.count, args.output), file=sys.stderr)
+    return exit_code
+
+
+def _cmd_trace_replay(args):
+    _, records = trace.read_trace(args.trace)
+    result = trace.replay(
+        records, sysfs_root=args.sysfs_root, timing=args.timing, verify=args.verify
+    )
+    print(
+        "replayed %d accesses (%d reads, %d writes) in %.3fs"
+        % (result["ops"], result["reads"], result["writes"], result["elapsed_s"])
+    )
+    for record, value in result["mismatches"]:
+        print(
+            "mismatch %s %s+0x%x: recorded 0x%x read 0x%x"
+            % (
+                record.address.bdf,
+                record.space_name,
+                record.offset,
+                record.value,
+                value,
+            )
+        )
+    return 1 if result["mismatches"] else 0
+
+
+def _cmd_trace_stats(args):
+    started, records = trace.read_trace(args.trace)
+    stats = trace.trace_stats(records, top=args.top)
+    if args.json:
+        stats["started"] = started
+        print(json.dumps(stats, indent=2, sort_keys=True))
+        return 0
+    print(
+        "%d accesses (%d reads, %d writes) over %.3fs, %.1f ops/s"
+        % (
+            stats["ops"],
+            stats["reads"],
+            stats["writes"],
+            stats["duration_s"],
+            stats["rate_per_s"],
+        )
+    )
+    for bdf, count in stats["devices"].items():
+        print("device %s: %d" % (bdf, count))
+    for entry in stats["hot_registers"]:
+        print(
+            "%s %s+0x%x: %d (%d writes, %.1f/s)"
+            % (
+                entry["bdf"],
+                entry["space"],
+                entry["offset"],
+                entry["count"],
+                entry["writes"],
+                entry["rate_per_s"],
+            )
+        )
+    return 0
+
+
+def _cmd_snapshot(args):
+    sysfs = _get_sysfs(args)
+    started = time.monotonic()
+    snap = snapshot_access.capture(
+        addresses=args.bdf or None, sysfs=sysfs, workers=args.workers
+    )
+    snapshot_access.write_archive(snap, args.output)
+    print(
+        "captured %d devices in %.3fs to %s"
+        % (len(snap), time.monotonic() - started, args.output),
+        file=sys.stderr,
+    )
+    return 0
+
+
+def _format_dword(value):
+    return "--------" if value is None else "%08x" % value
+
+
+def _cmd_diff(args):
+    old = snapshot_access.read_archive(args.old)
+    new = snapshot_access.read_archive(args.new)
+    result = snapshot_access.diff(old, new)
+    if args.json:
+        print(json.dumps(result.as_dict(), indent=2, sort_keys=True))
+        return 1 if result else 0
+    for address in result.removed:
+        print("- %s" % address.bdf)
+    for address in result.added:
+        print("+ %s" % address.bdf)
+    for address in sorted(result.changed):
+        print("~ %s" % address.bdf)
+        for change in result.changed[address]:
+            print(
+                "    0x%03x: %s -> %s  %s"
+                % (
+                    change.offset,
+                    _format_dword(change.old),
+                    _format_dword(change.new),
+                    change.region,
+                )
+            )
+    return 1 if result else 0
+
+
+def _add_link_target_args(parser, required=True):
+    parser.add_argument("--bdf", required=required, type=_parse_address)
     group = parser.add_mutually_exclusive_group()
     group.add_argument(
         "--endpoint",
@@ -298,6 +781,11 @@ def build_parser():
         default=None,
         help="sysfs devices root (default: /sys/bus/pci/devices)",
     )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="print syscall and timing statistics to stderr on exit",
+    )
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     list_parser = subparsers.add_parser("list", help="list PCI devices")
@@ -342,6 +830,23 @@ def build_parser():
         type=lambda v: _parse_non_negative(v, "len"),
     )
 
+    show = subparsers.add_parser(
+        "show", help="decode header, capabilities, BARs and link state"
+    )
+    show.add_argument(
+        "--bdf",
+        action="append",
+        type=_parse_address,
+        help="show only this device (repeatable, default: all devices)",
+    )
+    show.add_argument("--json", action="store_true", help="print JSON")
+    show.add_argument(
+        "--workers",
+        type=lambda v: _parse_positive(v, "workers"),
+        default=1,
+        help="parallel reader threads (default: 1)",
+    )
+
     link_disable = subparsers.add_parser("link-disable", help="disable PCIe link")
     _add_link_target_args(link_disable)
 
@@ -349,15 +854,80 @@ def build_parser():
     _add_link_target_args(link_enable)
 
     link_retrain = subparsers.add_parser("link-retrain", help="retrain PCIe link")
-    _add_link_target_args(link_retrain)
+    _add_link_target_args(link_retrain, required=False)
     link_retrain.add_argument(
         "--clear-after",
         action="store_true",
         help="clear retrain bit after setting it",
     )
+    link_retrain.add_argument(
+        "--all-downstream-of",
+        type=_parse_address,
+        help="retrain every root/downstream port below this BDF concurrently",
+    )
+    link_retrain.add_argument(
+        "--speed",
+        help="with --all-downstream-of: target speed to set first "
+        "(2.5/5/8/16/32/64 or TLS code)",
+    )
+    link_retrain.add_argument(
+        "--concurrency",
+        type=lambda v: _parse_positive(v, "concurrency"),
+        help="with --all-downstream-of: ports trained at the same time "
+        "(default: 8)",
+    )
+    link_retrain.add_argument(
+        "--retries",
+        type=lambda v: _parse_non_negative(v, "retries"),
+        help="with --all-downstream-of: retries per port after a failed "
+        "training (default: 2)",
+    )
+    link_retrain.add_argument(
+        "--timeout",
+        type=lambda v: _parse_seconds(v, "timeout"),
+        help="with --all-downstream-of: seconds to wait for each training "
+        "(default: 1.0)",
+    )
+    link_retrain.add_argument(
+        "--json",
+        action="store_true",
+        help="with --all-downstream-of: print JSON",
+    )
 
     link_status = subparsers.add_parser("link-status", help="read PCIe link status")
     _add_link_target_args(link_status)
+    link_status.add_argument(
+        "--source",
+        choices=link_access.LINK_STATUS_SOURCES,
+        help="read LNKSTA (config), the kernel link attributes (sysfs) "
+        "or sysfs with config fallback (auto); the source is printed when "
+        "given (default: config)",
+    )
+
+    link_audit = subparsers.add_parser(
+        "link-audit", help="find links trained below the capability of both ends"
+    )
+    link_audit.add_argument(
+        "--bdf",
+        action="append",
+        type=_parse_address,
+        help="only links below this device (repeatable, default: all devices)",
+    )
+    link_audit.add_argument(
+        "--workers",
+        type=lambda v: _parse_positive(v, "workers"),
+        default=8,
+        help="parallel config readers (default: 8)",
+    )
+    link_audit.add_argument(
+        "--sysfs-attrs",
+        action="store_true",
+        help="also compare against the kernel current/max_link_* attributes",
+    )
+    link_audit.add_argument(
+        "--all", action="store_true", help="list healthy links as well"
+    )
+    link_audit.add_argument("--json", action="store_true", help="print JSON")
 
     link_set_speed = subparsers.add_parser(
         "link-set-speed", help="set target PCIe link speed"
@@ -385,6 +955,189 @@ def build_parser():
         help="delay between assert/deassert (milliseconds)",
     )
 
+    mps_tune = subparsers.add_parser(
+        "mps-tune", help="plan (and apply) Max Payload / Max Read Request sizes"
+    )
+    mps_tune.add_argument(
+        "--policy",
+        choices=mps_access.POLICIES,
+        default="safe",
+        help="sizing policy (default: safe)",
+    )
+    mps_tune.add_argument(
+        "--apply",
+        action="store_true",
+        help="write the changes (default: dry-run diff only)",
+    )
+    mps_tune.add_argument(
+        "--workers",
+        type=lambda v: _parse_positive(v, "workers"),
+        default=8,
+        help="parallel config readers (default: 8)",
+    )
+    mps_tune.add_argument(
+        "--all", action="store_true", help="list unchanged functions as well"
+    )
+    mps_tune.add_argument("--json", action="store_true", help="print JSON")
+
+    devctl_parser = subparsers.add_parser(
+        "devctl",
+        help="show or set tag, relaxed ordering and no-snoop enables fabric-wide",
+    )
+    devctl_parser.add_argument(
+        "--enable",
+        action="append",
+        choices=devctl_access.FEATURES,
+        help="feature to enable where both link partners allow it (repeatable)",
+    )
+    devctl_parser.add_argument(
+        "--disable",
+        action="append",
+        choices=devctl_access.FEATURES,
+        help="feature to disable (repeatable)",
+    )
+    devctl_parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="write the changes (default: dry-run diff only)",
+    )
+    devctl_parser.add_argument(
+        "--workers",
+        type=lambda v: _parse_positive(v, "workers"),
+        default=8,
+        help="parallel config readers (default: 8)",
+    )
+    devctl_parser.add_argument(
+        "--all", action="store_true", help="list unchanged functions as well"
+    )
+    devctl_parser.add_argument("--json", action="store_true", help="print JSON")
+
+    rebar_parser = subparsers.add_parser(
+        "rebar", help="show or change Resizable BAR sizes"
+    )
+    rebar_parser.add_argument("--bdf", required=True, type=_parse_address)
+    rebar_parser.add_argument(
+        "--bar",
+        type=lambda v: _parse_non_negative(v, "bar"),
+        help="BAR index to resize",
+    )
+    rebar_parser.add_argument(
+        "--size",
+        type=rebar_access.parse_size,
+        help="new BAR size, e.g. 256M or 16G",
+    )
+    rebar_parser.add_argument(
+        "--method",
+        choices=rebar_access.RESIZE_METHODS,
+        default="auto",
+        help="resourceN_resize in sysfs or the config register (default: auto)",
+    )
+    rebar_parser.add_argument("--json", action="store_true", help="print JSON")
+
+    msix_parser = subparsers.add_parser(
+        "msix", help="show the MSI-X vector table or mask vectors"
+    )
+    msix_parser.add_argument("--bdf", required=True, type=_parse_address)
+    msix_parser.add_argument(
+        "--mask",
+        type=msix_access.parse_vectors,
+        metavar="VECTORS",
+        help="vectors to mask, e.g. 0-15,32",
+    )
+    msix_parser.add_argument(
+        "--unmask",
+        type=msix_access.parse_vectors,
+        metavar="VECTORS",
+        help="vectors to unmask",
+    )
+    msix_parser.add_argument(
+        "--all", action="store_true", help="list masked idle vectors as well"
+    )
+    msix_parser.add_argument("--json", action="store_true", help="print JSON")
+
+    p2p_parser = subparsers.add_parser(
+        "p2p-path", help="show the peer-to-peer route and ACS between devices"
+    )
+    p2p_parser.add_argument(
+        "devices",
+        nargs="*",
+        type=_parse_address,
+        help="two devices, or the devices of the --matrix (default: all endpoints)",
+    )
+    p2p_parser.add_argument(
+        "--matrix", action="store_true", help="report every pair of devices"
+    )
+    p2p_parser.add_argument(
+        "--workers",
+        type=lambda v: _parse_positive(v, "workers"),
+        default=8,
+        help="parallel config readers (default: 8)",
+    )
+    p2p_parser.add_argument("--json", action="store_true", help="print JSON")
+
+    path_bw = subparsers.add_parser(
+        "path-bandwidth",
+        help="usable bandwidth and bottleneck from endpoints up to the root",
+    )
+    path_bw.add_argument(
+        "--bdf",
+        action="append",
+        type=_parse_address,
+        help="device to report (repeatable, default: all endpoints)",
+    )
+    path_bw.add_argument(
+        "--hops", action="store_true", help="list every hop below each device"
+    )
+    path_bw.add_argument(
+        "--workers",
+        type=lambda v: _parse_positive(v, "workers"),
+        default=8,
+        help="parallel config readers (default: 8)",
+    )
+    path_bw.add_argument("--json", action="store_true", help="print JSON")
+
+    bus_reset = subparsers.add_parser(
+        "bus-reset",
+        help="secondary bus reset of bridges with downstream config save/restore",
+    )
+    bus_reset.add_argument(
+        "--bdf",
+        action="append",
+        required=True,
+        type=_parse_address,
+        help="bridge to reset (repeatable; bridges are reset concurrently)",
+    )
+    bus_reset.add_argument(
+        "--delay-ms",
+        type=lambda v: _parse_non_negative(v, "delay-ms"),
+        default=2,
+        help="time secondary bus reset stays asserted (default: 2)",
+    )
+    bus_reset.add_argument(
+        "--settle-ms",
+        type=lambda v: _parse_non_negative(v, "settle-ms"),
+        default=100,
+        help="delay after the link is back before config access (default: 100)",
+    )
+    bus_reset.add_argument(
+        "--timeout",
+        type=lambda v: _parse_seconds(v, "timeout"),
+        default=1.0,
+        help="seconds to wait for the link and each function (default: 1.0)",
+    )
+    bus_reset.add_argument(
+        "--concurrency",
+        type=lambda v: _parse_positive(v, "concurrency"),
+        default=8,
+        help="bridges reset at the same time (default: 8)",
+    )
+    bus_reset.add_argument(
+        "--no-restore",
+        action="store_true",
+        help="do not save and restore downstream config state",
+    )
+    bus_reset.add_argument("--json", action="store_true", help="print JSON")
+
     link_wait = subparsers.add_parser(
         "link-wait", help="wait for PCIe link training to complete"
     )
@@ -418,47 +1171,271 @@ def build_parser():
         help="clear mask bits instead of setting",
     )
 
+    aspm_parser = subparsers.add_parser(
+        "aspm", help="show or change ASPM along a device's upstream path"
+    )
+    aspm_sub = aspm_parser.add_subparsers(dest="aspm_command", required=True)
+    for name, text in (
+        ("show", "show ASPM state and exit latency of every link on the path"),
+        ("disable", "disable ASPM states, device end first"),
+        ("enable", "enable ASPM states both ends support, root port first"),
+    ):
+        action = aspm_sub.add_parser(name, help=text)
+        action.add_argument(
+            "--bdf", required=True, type=_parse_address, help="device at the path end"
+        )
+        if name != "show":
+            action.add_argument(
+                "--state",
+                action="append",
+                choices=link_access.ASPM_STATES,
+                help="state to change (repeatable, default: all)",
+            )
+        action.add_argument("--json", action="store_true", help="print JSON")
+
+    aer_parser = subparsers.add_parser(
+        "aer", help="report AER status and error counters"
+    )
+    aer_parser.add_argument(
+        "--bdf",
+        action="append",
+        type=_parse_address,
+        help="only this device (repeatable, default: all devices)",
+    )
+    aer_parser.add_argument(
+        "--count",
+        type=lambda v: _parse_positive(v, "count"),
+        default=1,
+        help="sampling passes; rates are reported when > 1 (default: 1)",
+    )
+    aer_parser.add_argument(
+        "--interval",
+        type=lambda v: _parse_seconds(v, "interval"),
+        default=1.0,
+        help="seconds between passes (default: 1.0)",
+    )
+    aer_parser.add_argument(
+        "--clear",
+        action="store_true",
+        help="clear (RW1C) the status bits after each pass",
+    )
+    aer_parser.add_argument(
+        "--no-kernel",
+        action="store_true",
+        help="skip the kernel aer_dev_* counters",
+    )
+    aer_parser.add_argument("--json", action="store_true", help="print JSON")
+
+    export_parser = subparsers.add_parser(
+        "export", help="serve link and AER metrics in Prometheus text format"
+    )
+    export_parser.add_argument(
+        "--listen",
+        default="127.0.0.1:9464",
+        help="host:port to listen on (default: 127.0.0.1:9464)",
+    )
+    export_parser.add_argument(
+        "--interval",
+        type=lambda v: _parse_seconds(v, "interval"),
+        default=10.0,
+        help="seconds between sampling passes (default: 10)",
+    )
+    export_parser.add_argument(
+        "--bdf",
+        action="append",
+        type=_parse_address,
+        help="only this device (repeatable, default: all devices)",
+    )
+    export_parser.add_argument(
+        "--no-aer", action="store_true", help="do not collect AER counters"
+    )
+
+    snapshot_parser = subparsers.add_parser(
+        "snapshot", help="capture config space of all devices into an archive"
+    )
+    snapshot_parser.add_argument("--output", required=True, help="archive to write")
+    snapshot_parser.add_argument(
+        "--bdf",
+        action="append",
+        type=_parse_address,
+        help="capture only this device (repeatable)",
+    )
+    snapshot_parser.add_argument(
+        "--workers",
+        type=lambda v: _parse_positive(v, "workers"),
+        default=1,
+        help="parallel reader threads (default: 1)",
+    )
+
+    diff_parser = subparsers.add_parser(
+        "diff", help="compare two snapshot archives (exit 1 if they differ)"
+    )
+    diff_parser.add_argument("old", help="baseline archive")
+    diff_parser.add_argument("new", help="archive to compare")
+    diff_parser.add_argument("--json", action="store_true", help="print JSON")
+
+    trace_parser = subparsers.add_parser(
+        "trace", help="record, replay and analyze config/BAR access traces"
+    )
+    trace_sub = trace_parser.add_subparsers(dest="trace_command", required=True)
+    trace_record = trace_sub.add_parser(
+        "record", help="run a Python script and record its accesses"
+    )
+    trace_record.add_argument("--output", required=True, help="trace file to write")
+    trace_record.add_argument("script", help="Python script to run")
+    trace_record.add_argument("script_args", nargs=argparse.REMAINDER)
+    trace_replay = trace_sub.add_parser(
+        "replay", help="re-issue a trace against the sysfs tree"
+    )
+    trace_replay.add_argument("trace", help="trace file")
+    trace_replay.add_argument(
+        "--timing", action="store_true", help="reproduce the original timing"
+    )
+    trace_replay.add_argument(
+        "--verify", action="store_true", help="compare reads to recorded values"
+    )
+    trace_stats = trace_sub.add_parser(
+        "stats", help="report hot registers and access rates"
+    )
+    trace_stats.add_argument("trace", help="trace file")
+    trace_stats.add_argument(
+        "--top",
+        type=lambda v: _parse_non_negative(v, "top"),
+        default=10,
+        help="number of hot registers to show (default: 10)",
+    )
+    trace_stats.add_argument("--json", action="store_true", help="print JSON")
+
+    bench_parser = subparsers.add_parser(
+        "bench", help="benchmark pypcie on a synthetic sysfs tree"
+    )
+    bench_parser.add_argument(
+        "--iterations",
+        type=lambda v: _parse_positive(v, "iterations"),
+        default=2000,
+        help="iterations for per-register operations (default: 2000)",
+    )
+    bench_parser.add_argument(
+        "--scan-iterations",
+        type=lambda v: _parse_positive(v, "scan-iterations"),
+        default=20,
+        help="iterations for fabric-wide operations (default: 20)",
+    )
+    for name, default in sorted(bench.DEFAULT_SHAPE.items()):
+        bench_parser.add_argument(
+            "--" + name.replace("_", "-"),
+            dest=name,
+            type=lambda v, n=name: bench.check_shape(n, _parse_int(v, n)),
+            default=default,
+            help="synthetic fabric %s (default: %d)"
+            % (name.replace("_", " "), default),
+        )
+    bench_parser.add_argument(
+        "--only",
+        action="append",
+        choices=bench.BENCHMARKS,
+        help="run only the named benchmark (repeatable)",
+    )
+    bench_parser.add_argument("--json", action="store_true", help="print JSON report")
+    bench_parser.add_argument("--output", help="write the JSON report to a file")
+    bench_parser.add_argument(
+        "--compare", help="compare against a previous JSON report"
+    )
+
     return parser
 
 
+def _dispatch(args):
+    if args.command == "list":
+        return _cmd_list(args)
+    if args.command == "find":
+        return _cmd_find(args)
+    if args.command == "cfg-read":
+        return _cmd_cfg_read(args)
+    if args.command == "cfg-write":
+        return _cmd_cfg_write(args)
+    if args.command == "bar-read":
+        return _cmd_bar_read(args)
+    if args.command == "bar-write":
+        return _cmd_bar_write(args)
+    if args.command == "dump-config":
+        return _cmd_dump_config(args)
+    if args.command == "show":
+        return _cmd_show(args)
+    if args.command == "link-disable":
+        return _cmd_link_disable(args)
+    if args.command == "link-enable":
+        return _cmd_link_enable(args)
+    if args.command == "link-retrain":
+        return _cmd_link_retrain(args)
+    if args.command == "link-status":
+        return _cmd_link_status(args)
+    if args.command == "link-audit":
+        return _cmd_link_audit(args)
+    if args.command == "link-set-speed":
+        return _cmd_link_set_speed(args)
+    if args.command == "link-hot-reset":
+        return _cmd_link_hot_reset(args)
+    if args.command == "mps-tune":
+        return _cmd_mps_tune(args)
+    if args.command == "devctl":
+        return _cmd_devctl(args)
+    if args.command == "rebar":
+        return _cmd_rebar(args)
+    if args.command == "msix":
+        return _cmd_msix(args)
+    if args.command == "p2p-path":
+        return _cmd_p2p_path(args)
+    if args.command == "path-bandwidth":
+        return _cmd_path_bandwidth(args)
+    if args.command == "bus-reset":
+        return _cmd_bus_reset(args)
+    if args.command == "link-wait":
+        return _cmd_link_wait(args)
+    if args.command == "link-control":
+        return _cmd_link_control(args)
+    if args.command == "bench":
+        return _cmd_bench(args)
+    if args.command == "aspm":
+        return _cmd_aspm(args)
+    if args.command == "aer":
+        return _cmd_aer(args)
+    if args.command == "export":
+        return _cmd_export(args)
+    if args.command == "snapshot":
+        return _cmd_snapshot(args)
+    if args.command == "diff":
+        return _cmd_diff(args)
+    if args.command == "trace":
+        if args.trace_command == "record":
+            return _cmd_trace_record(args)
+        if args.trace_command == "replay":
+            return _cmd_trace_replay(args)
+        if args.trace_command == "stats":
+            return _cmd_trace_stats(args)
+    return 1
+
+
 def main(argv=None):
     parser = build_parser()
-    args = parser.parse_args(argv)
     try:
-        if args.command == "list":
-            return _cmd_list(args)
-        if args.command == "find":
-            return _cmd_find(args)
-        if args.command == "cfg-read":
-            return _cmd_cfg_read(args)
-        if args.command == "cfg-write":
-            return _cmd_cfg_write(args)
-        if args.command == "bar-read":
-            return _cmd_bar_read(args)
-        if args.command == "bar-write":
-            return _cmd_bar_write(args)
-        if args.command == "dump-config":
-            return _cmd_dump_config(args)
-        if args.command == "link-disable":
-            return _cmd_link_disable(args)
-        if args.command == "link-enable":
-            return _cmd_link_enable(args)
-        if args.command == "link-retrain":
-            return _cmd_link_retrain(args)
-        if args.command == "link-status":
-            return _cmd_link_status(args)
-        if args.command == "link-set-speed":
-            return _cmd_link_set_speed(args)
-        if args.command == "link-hot-reset":
-            return _cmd_link_hot_reset(args)
-        if args.command == "link-wait":
-            return _cmd_link_wait(args)
-        if args.command == "link-control":
-            return _cmd_link_control(args)
+        args = parser.parse_args(argv)
+    except PciError as exc:
+        # Raised by the argument type parsers; report it as a usage error.
+        parser.error(str(exc))
+    if args.stats:
+        instrument.reset()
+        instrument.enable()
+    try:
+        return _dispatch(args)
     except PciError as exc:
         print("error: %s" % exc, file=sys.stderr)
         return 1
-    return 1
+    finally:
+        if args.stats:
+            instrument.disable()
+            for line in instrument.format_summary():
+                print(line, file=sys.stderr)
 
 
 if __name__ == "__main__":
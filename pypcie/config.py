@@ -2,7 +2,9 @@
 
 import os
 import struct
+import threading
 
+from . import instrument
 from .errors import (
     AlignmentError,
     OutOfRangeError,
@@ -11,6 +13,7 @@ from .errors import (
     ValueRangeError,
 )
 from .sysfs import Sysfs
+from .types import AccessGuard
 
 
 def _config_path(address, sysfs_root=None):
@@ -19,6 +22,8 @@ def _config_path(address, sysfs_root=None):
 
 
 def _open_fd(path, flags):
+    if instrument.state.enabled:
+        instrument.count_syscall("open")
     try:
         return os.open(path, flags)
     except FileNotFoundError as exc:
@@ -65,6 +70,9 @@ def _validate_value(value, width):
         raise ValueRangeError("value out of range")
 
 
+_FORMATS = {1: "<B", 2: "<H", 4: "<I"}
+
+
 def _read_bytes(address, offset, width, sysfs_root=None):
     path = _config_path(address, sysfs_root)
     fd = _open_fd(path, os.O_RDONLY)
@@ -74,6 +82,8 @@ def _read_bytes(address, offset, width, sysfs_root=None):
         data = os.pread(fd, width, offset)
     finally:
         os.close(fd)
+    if instrument.state.enabled:
+        instrument.count_syscall("pread", len(data))
     if len(data) != width:
         raise OutOfRangeError("short read from config")
     return data
@@ -88,10 +98,34 @@ def _write_bytes(address, offset, data, sysfs_root=None):
         written = os.pwrite(fd, data, offset)
     finally:
         os.close(fd)
+    if instrument.state.enabled:
+        instrument.count_syscall("pwrite", written, write=True)
     if written != len(data):
         raise OutOfRangeError("short write to config")
 
 
+@instrument.timed("config")
+def read_space(address, length=None, sysfs_root=None):
+    """Return the whole readable config space (or ``length`` bytes) in one pread.
+
+    Unprivileged readers usually get only the first 64 bytes even though the
+    file size says otherwise; the returned data is simply shorter then.
+    """
+    path = _config_path(address, sysfs_root)
+    fd = _open_fd(path, os.O_RDONLY)
+    try:
+        size = _config_size(fd)
+        if length is None or length > size:
+            length = size
+        data = os.pread(fd, length, 0)
+    finally:
+        os.close(fd)
+    if instrument.state.enabled:
+        instrument.count_syscall("pread", len(data))
+    return data
+
+
+@instrument.timed("config")
 def read(address, offset, width, sysfs_root=None):
     _validate_offset(offset)
     if width not in (1, 2, 4, 8):
@@ -100,10 +134,13 @@ def read(address, offset, width, sysfs_root=None):
     if width == 8:
         return read_u64(address, offset, sysfs_root=sysfs_root)
     data = _read_bytes(address, offset, width, sysfs_root=sysfs_root)
-    fmt = {1: "<B", 2: "<H", 4: "<I"}[width]
-    return struct.unpack(fmt, data)[0]
+    value = struct.unpack(_FORMATS[width], data)[0]
+    if instrument.state.tracing:
+        instrument.notify_access("config", address, None, offset, width, value, False)
+    return value
 
 
+@instrument.timed("config")
 def write(address, offset, width, value, sysfs_root=None):
     _validate_offset(offset)
     if width not in (1, 2, 4, 8):
@@ -113,9 +150,195 @@ def write(address, offset, width, value, sysfs_root=None):
         write_u64(address, offset, value, sysfs_root=sysfs_root)
         return
     _validate_value(value, width)
-    fmt = {1: "<B", 2: "<H", 4: "<I"}[width]
-    data = struct.pack(fmt, value)
+    data = struct.pack(_FORMATS[width], value)
     _write_bytes(address, offset, data, sysfs_root=sysfs_root)
+    if instrument.state.tracing:
+        instrument.notify_access("config", address, None, offset, width, value, True)
+
+
+class ConfigHandle(object):
+    """Config space of one device kept open across accesses.
+
+    The read-only descriptor is opened on the first read and a read-write
+    one on the first write; both stay open until ``close()``. A handle may
+    be shared between threads; ``close()`` waits for accesses in flight.
+    """
+
+    __slots__ = (
+        "address",
+        "path",
+        "_ro_fd",
+        "_rw_fd",
+        "_size",
+        "_lock",
+        "_guard",
+        "_rmw_locks",
+    )
+
+    def __init__(self, address, sysfs_root=None):
+        self.address = address
+        self.path = _config_path(address, sysfs_root)
+        self._ro_fd = None
+        self._rw_fd = None
+        self._size = None
+        self._lock = threading.Lock()
+        self._guard = AccessGuard()
+        self._rmw_locks = {}
+
+    def _read_fd(self):
+        fd = self._rw_fd
+        if fd is None:
+            fd = self._ro_fd
+        if fd is None:
+            with self._lock:
+                if self._ro_fd is None:
+                    self._ro_fd = self._open(os.O_RDONLY)
+                fd = self._ro_fd
+        return fd
+
+    def _write_fd(self):
+        fd = self._rw_fd
+        if fd is None:
+            with self._lock:
+                if self._rw_fd is None:
+                    self._rw_fd = self._open(os.O_RDWR)
+                fd = self._rw_fd
+        return fd
+
+    def _open(self, flags):
+        fd = _open_fd(self.path, flags)
+        if self._size is None:
+            try:
+                self._size = _config_size(fd)
+            except ResourceNotFoundError:
+                os.close(fd)
+                raise
+        return fd
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._read_fd()
+        return self._size
+
+    def read_space(self, length=None):
+        with self._guard:
+            fd = self._read_fd()
+            if length is None or length > self._size:
+                length = self._size
+            data = os.pread(fd, length, 0)
+        if instrument.state.enabled:
+            instrument.count_syscall("pread", len(data))
+        return data
+
+    def read_block(self, offset, length):
+        """Return ``length`` bytes starting at ``offset`` with one pread."""
+        _validate_offset(offset)
+        with self._guard:
+            fd = self._read_fd()
+            _validate_bounds(offset, length, self._size)
+            data = os.pread(fd, length, offset)
+        if instrument.state.enabled:
+            instrument.count_syscall("pread", len(data))
+        if len(data) != length:
+            raise OutOfRangeError("short read from config")
+        return data
+
+    def write_block(self, offset, data):
+        """Write ``data`` at ``offset`` with one pwrite.
+
+        The kernel splits the write into naturally aligned config accesses.
+        """
+        _validate_offset(offset)
+        with self._guard:
+            fd = self._write_fd()
+            _validate_bounds(offset, len(data), self._size)
+            written = os.pwrite(fd, data, offset)
+        if instrument.state.enabled:
+            instrument.count_syscall("pwrite", written, write=True)
+        if written != len(data):
+            raise OutOfRangeError("short write to config")
+
+    def read(self, offset, width):
+        _validate_offset(offset)
+        if width not in (1, 2, 4, 8):
+            raise ValueRangeError("width must be 1, 2, 4, or 8")
+        _validate_alignment(offset, width)
+        if width == 8:
+            low = self.read(offset, 4)
+            return (self.read(offset + 4, 4) << 32) | low
+        with self._guard:
+            fd = self._read_fd()
+            _validate_bounds(offset, width, self._size)
+            data = os.pread(fd, width, offset)
+        if instrument.state.enabled:
+            instrument.count_syscall("pread", len(data))
+        if len(data) != width:
+            raise OutOfRangeError("short read from config")
+        value = struct.unpack(_FORMATS[width], data)[0]
+        if instrument.state.tracing:
+            instrument.notify_access(
+                "config", self.address, None, offset, width, value, False
+            )
+        return value
+
+    def write(self, offset, width, value):
+        _validate_offset(offset)
+        if width not in (1, 2, 4, 8):
+            raise ValueRangeError("width must be 1, 2, 4, or 8")
+        _validate_alignment(offset, width)
+        _validate_value(value, width)
+        if width == 8:
+            self.write(offset, 4, value & 0xFFFFFFFF)
+            self.write(offset + 4, 4, value >> 32)
+            return
+        with self._guard:
+            fd = self._write_fd()
+            _validate_bounds(offset, width, self._size)
+            written = os.pwrite(fd, struct.pack(_FORMATS[width], value), offset)
+        if instrument.state.enabled:
+            instrument.count_syscall("pwrite", written, write=True)
+        if written != width:
+            raise OutOfRangeError("short write to config")
+        if instrument.state.tracing:
+            instrument.notify_access(
+                "config", self.address, None, offset, width, value, True
+            )
+
+    def modify(self, offset, width, clear_bits=0, set_bits=0):
+        """Clear then set bits in one register; returns the new value.
+
+        Read-modify-write sequences on the same dword are serialized across
+        threads sharing this handle, whatever their width.
+        """
+        key = offset & ~0x3
+        lock = self._rmw_locks.get(key)
+        if lock is None:
+            lock = self._rmw_locks.setdefault(key, threading.Lock())
+        with lock:
+            value = (self.read(offset, width) & ~clear_bits) | set_bits
+            self.write(offset, width, value)
+        return value
+
+    def close(self):
+        self._guard.drain()
+        try:
+            with self._lock:
+                fds = (self._ro_fd, self._rw_fd)
+                self._ro_fd = None
+                self._rw_fd = None
+            for fd in fds:
+                if fd is not None:
+                    os.close(fd)
+        finally:
+            self._guard.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
 
 
 def read_u8(address, offset, sysfs_root=None):
@@ -164,11 +387,13 @@ def write_u64(address, offset, value, sysfs_root=None):
 
 
 __all__ = [
+    "ConfigHandle",
     "read",
     "read_u8",
     "read_u16",
     "read_u32",
     "read_u64",
+    "read_space",
     "write",
     "write_u8",
     "write_u16",
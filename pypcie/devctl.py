@@ -0,0 +1,309 @@
+"""Tag, relaxed ordering and no-snoop management across the fabric."""
+
+from . import config as config_access
+from .discover import read_device_tree, walk_subtree
+from .errors import (
+    PciError,
+    PermissionDeniedError,
+    ResourceNotFoundError,
+    ValueRangeError,
+)
+from .link import (
+    PCI_EXP_DEVCAP,
+    PCI_EXP_DEVCAP2,
+    PCI_EXP_DEVCAP2_10BIT_TAG_COMP,
+    PCI_EXP_DEVCAP2_10BIT_TAG_REQ,
+    PCI_EXP_DEVCAP_EXT_TAG,
+    PCI_EXP_DEVCTL,
+    PCI_EXP_DEVCTL2,
+    PCI_EXP_DEVCTL2_10BIT_TAG_REQ_EN,
+    PCI_EXP_DEVCTL_EXT_TAG,
+    PCI_EXP_DEVCTL_NOSNOOP_EN,
+    PCI_EXP_DEVCTL_RELAX_EN,
+    read_pcie_caps,
+)
+from .sysfs import Sysfs
+
+FEATURES = ("ext-tag", "10bit-tag", "relaxed-ordering", "no-snoop")
+
+# Feature -> (control register, enable bit).
+_CONTROL = {
+    "ext-tag": (PCI_EXP_DEVCTL, PCI_EXP_DEVCTL_EXT_TAG),
+    "10bit-tag": (PCI_EXP_DEVCTL2, PCI_EXP_DEVCTL2_10BIT_TAG_REQ_EN),
+    "relaxed-ordering": (PCI_EXP_DEVCTL, PCI_EXP_DEVCTL_RELAX_EN),
+    "no-snoop": (PCI_EXP_DEVCTL, PCI_EXP_DEVCTL_NOSNOOP_EN),
+}
+
+_DEVCTL_MASK = (
+    PCI_EXP_DEVCTL_EXT_TAG | PCI_EXP_DEVCTL_RELAX_EN | PCI_EXP_DEVCTL_NOSNOOP_EN
+)
+
+
+class DevctlSetting(object):
+    """DEVCAP/DEVCTL(2) of one function and the planned control values.
+
+    ``skipped`` maps a requested feature to the reason it was not enabled.
+    ``devcap2``/``devctl2`` are None on version 1 capabilities.
+    """
+
+    __slots__ = (
+        "address",
+        "bridge",
+        "cap_offset",
+        "devcap",
+        "devctl",
+        "devcap2",
+        "devctl2",
+        "new_devctl",
+        "new_devctl2",
+        "skipped",
+    )
+
+    def __init__(self, address, bridge, cap_offset, devcap, devctl, devcap2, devctl2):
+        self.address = address
+        self.bridge = bridge
+        self.cap_offset = cap_offset
+        self.devcap = devcap
+        self.devctl = devctl
+        self.devcap2 = devcap2
+        self.devctl2 = devctl2
+        self.new_devctl = devctl
+        self.new_devctl2 = devctl2
+        self.skipped = {}
+
+    def supports(self, feature):
+        if feature == "ext-tag":
+            return bool(self.devcap & PCI_EXP_DEVCAP_EXT_TAG)
+        if feature == "10bit-tag":
+            return bool((self.devcap2 or 0) & PCI_EXP_DEVCAP2_10BIT_TAG_REQ)
+        # Relaxed ordering and no-snoop have no capability bit.
+        return True
+
+    def completes(self, feature):
+        """Whether this port can pass ``feature`` tags from the devices below."""
+        if feature == "ext-tag":
+            return bool(self.devcap & PCI_EXP_DEVCAP_EXT_TAG)
+        if feature == "10bit-tag":
+            return bool((self.devcap2 or 0) & PCI_EXP_DEVCAP2_10BIT_TAG_COMP)
+        return True
+
+    def _enabled(self, devctl, devctl2):
+        values = {PCI_EXP_DEVCTL: devctl, PCI_EXP_DEVCTL2: devctl2 or 0}
+        return [
+            feature
+            for feature in FEATURES
+            if values[_CONTROL[feature][0]] & _CONTROL[feature][1]
+        ]
+
+    @property
+    def supported(self):
+        return [feature for feature in FEATURES if self.supports(feature)]
+
+    @property
+    def enabled(self):
+        return self._enabled(self.devctl, self.devctl2)
+
+    @property
+    def new_enabled(self):
+        return self._enabled(self.new_devctl, self.new_devctl2)
+
+    @property
+    def changed(self):
+        return self.new_devctl != self.devctl or self.new_devctl2 != self.devctl2
+
+    def as_dict(self):
+        return {
+            "bdf": self.address.bdf,
+            "bridge": self.bridge,
+            "supported": self.supported,
+            "enabled": self.enabled,
+            "new_enabled": self.new_enabled,
+            "changed": self.changed,
+            "skipped": dict(self.skipped),
+        }
+
+    def __repr__(self):
+        return "DevctlSetting(%s, %s -> %s)" % (
+            self.address.bdf,
+            ",".join(self.enabled) or "none",
+            ",".join(self.new_enabled) or "none",
+        )
+
+
+def _read_setting(address, sysfs):
+    try:
+        caps = read_pcie_caps(address, sysfs=sysfs)
+    except (PermissionDeniedError, ResourceNotFoundError):
+        return None
+    devcap = caps.u32(PCI_EXP_DEVCAP)
+    devctl = caps.u16(PCI_EXP_DEVCTL)
+    if devcap is None or devctl is None:
+        return None
+    return DevctlSetting(
+        address,
+        caps.bridge,
+        caps.base,
+        devcap,
+        devctl,
+        caps.u32(PCI_EXP_DEVCAP2),
+        caps.u16(PCI_EXP_DEVCTL2),
+    )
+
+
+def _normalize_features(features, name):
+    features = list(features or ())
+    unknown = sorted(set(features) - set(FEATURES))
+    if unknown:
+        raise ValueRangeError(
+            "unknown %s feature %s (expected %s)"
+            % (name, ", ".join(unknown), ", ".join(FEATURES))
+        )
+    return features
+
+
+def plan(enable=(), disable=(), sysfs=None, workers=8):
+    """Return a DevctlSetting per PCIe function with the requested changes.
+
+    A feature in ``enable`` is turned on where the function supports it and
+    every port above it can complete (or forward) the tags it would use;
+    otherwise the reason is recorded in ``skipped``. ``disable`` always
+    applies. With neither, the settings just describe the fabric.
+    """
+    enable = _normalize_features(enable, "enable")
+    disable = _normalize_features(disable, "disable")
+    both = sorted(set(enable) & set(disable))
+    if both:
+        raise ValueRangeError("cannot enable and disable %s" % ", ".join(both))
+    if sysfs is None:
+        sysfs = Sysfs()
+    roots, children, settings = read_device_tree(
+        lambda addr: _read_setting(addr, sysfs), sysfs=sysfs, workers=workers
+    )
+
+    result = []
+    for root in roots:
+        for node, ancestors in walk_subtree(root, children):
+            setting = settings.get(node)
+            if setting is None:
+                continue
+            ports = [settings[port] for port in ancestors if port in settings]
+            _plan_one(setting, ports, enable, disable)
+            result.append(setting)
+    return result
+
+
+def _plan_one(setting, ports, enable, disable):
+    values = {PCI_EXP_DEVCTL: setting.devctl, PCI_EXP_DEVCTL2: setting.devctl2}
+    for feature in enable:
+        register, bit = _CONTROL[feature]
+        if not setting.supports(feature):
+            # Switch ports rarely issue requests of their own; only note
+            # devices the feature was meant for.
+            if not setting.bridge:
+                setting.skipped[feature] = "not supported"
+            continue
+        blocking = [port for port in ports if not port.completes(feature)]
+        if blocking:
+            setting.skipped[feature] = "not supported by %s" % (
+                blocking[-1].address.bdf
+            )
+            continue
+        values[register] |= bit
+    for feature in disable:
+        register, bit = _CONTROL[feature]
+        if values[register] is not None:
+            values[register] &= ~bit
+    setting.new_devctl = values[PCI_EXP_DEVCTL]
+    setting.new_devctl2 = values[PCI_EXP_DEVCTL2]
+
+
+def _write_control(handle, setting, devctl, devctl2):
+    """Write only the feature bits of DEVCTL and DEVCTL2."""
+    base = setting.cap_offset
+    handle.modify(base + PCI_EXP_DEVCTL, 2, _DEVCTL_MASK, devctl & _DEVCTL_MASK)
+    if devctl2 is not None:
+        handle.modify(
+            base + PCI_EXP_DEVCTL2,
+            2,
+            PCI_EXP_DEVCTL2_10BIT_TAG_REQ_EN,
+            devctl2 & PCI_EXP_DEVCTL2_10BIT_TAG_REQ_EN,
+        )
+
+
+def apply(settings, sysfs=None):
+    """Write the planned values, one DEVCTL(2) read-modify-write per function.
+
+    Functions are written in plan order. If any write fails, every function
+    touched so far is restored in reverse order and the error is raised.
+    Returns the number of functions written.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    done = []
+    try:
+        for setting in settings:
+            if not setting.changed:
+                continue
+            done.append(setting)
+            with config_access.ConfigHandle(
+                setting.address, sysfs_root=sysfs.root
+            ) as handle:
+                _write_control(handle, setting, setting.new_devctl, setting.new_devctl2)
+    except (PciError, OSError):
+        for setting in reversed(done):
+            try:
+                with config_access.ConfigHandle(
+                    setting.address, sysfs_root=sysfs.root
+                ) as handle:
+                    _write_control(handle, setting, setting.devctl, setting.devctl2)
+            except (PciError, OSError):
+                pass
+        raise
+    for setting in done:
+        setting.devctl = setting.new_devctl
+        setting.devctl2 = setting.new_devctl2
+    return len(done)
+
+
+def _features_text(features):
+    return ",".join(features) or "-"
+
+
+def format_settings(settings, show_all=False):
+    """Return lines: a table without changes planned, a diff otherwise."""
+    if not any(setting.changed or setting.skipped for setting in settings):
+        lines = ["%-12s  %-44s  %s" % ("DEVICE", "SUPPORTED", "ENABLED")]
+        for setting in settings:
+            lines.append(
+                "%-12s  %-44s  %s"
+                % (
+                    setting.address.bdf,
+                    _features_text(setting.supported),
+                    _features_text(setting.enabled),
+                )
+            )
+        return lines
+    lines = []
+    for setting in settings:
+        if setting.changed:
+            lines.append(
+                "- %s %s" % (setting.address.bdf, _features_text(setting.enabled))
+            )
+            lines.append(
+                "+ %s %s" % (setting.address.bdf, _features_text(setting.new_enabled))
+            )
+        elif show_all:
+            lines.append(
+                "  %s %s" % (setting.address.bdf, _features_text(setting.enabled))
+            )
+        for feature in sorted(setting.skipped):
+            lines.append(
+                "! %s %s: %s"
+                % (setting.address.bdf, feature, setting.skipped[feature])
+            )
+    changed = sum(1 for setting in settings if setting.changed)
+    lines.append("%d functions, %d to change" % (len(settings), changed))
+    return lines
+
+
+__all__ = ["DevctlSetting", "FEATURES", "apply", "format_settings", "plan"]
@@ -1,79 +1,178 @@
 """Device wrapper for PCI access."""
 
-import os
+import threading
 
 from . import bar as bar_access
 from . import config as config_access
-from .errors import ResourceNotFoundError
+from . import rebar as rebar_access
+from .errors import ResourceNotFoundError, ValueRangeError
 from .sysfs import Sysfs
 from .types import PciAddress
 
 
+_IDENTITY_ATTRS = {"vendor_id": "vendor", "device_id": "device", "class_code": "class"}
+
+
 class _ConfigAccessor(object):
+    __slots__ = ("_device",)
+
     def __init__(self, device):
         self._device = device
 
     def read(self, width, offset):
-        return config_access.read(
-            self._device.address, offset, width, sysfs_root=self._device.sysfs.root
-        )
+        return self._device.cfg_read(width, offset)
 
     def write(self, width, offset, value):
-        config_access.write(
-            self._device.address,
-            offset,
-            width,
-            value,
-            sysfs_root=self._device.sysfs.root,
-        )
+        self._device.cfg_write(width, offset, value)
 
 
 class PciDevice(object):
-    """Represents a PCI device in sysfs."""
+    """A session on one PCI device in sysfs.
+
+    Identity attributes are read once and cached until ``refresh()``. The
+    config space handle and BAR mappings are opened on first use and kept
+    until ``close()`` (or the end of a ``with`` block).
+    """
+
+    __slots__ = (
+        "sysfs",
+        "_address",
+        "_identity",
+        "_bar_table",
+        "_config",
+        "_bars",
+        "_lock",
+        "__weakref__",
+    )
 
     def __init__(self, sysfs, addr):
         self.sysfs = sysfs or Sysfs()
         self._address = PciAddress.parse(addr)
-        self._config = _ConfigAccessor(self)
+        self._identity = {}
+        self._bar_table = None
+        self._config = None
+        self._bars = {}
+        self._lock = threading.Lock()
+        bar_access.register_bar_cache(self)
 
     @property
     def address(self):
         return self._address
 
+    def _identity_attr(self, name):
+        identity = self._identity
+        if not identity:
+            values = self.sysfs.read_attrs(self._address, _IDENTITY_ATTRS.values())
+            for key, attr in _IDENTITY_ATTRS.items():
+                identity[key] = values.get(attr)
+        value = identity[name]
+        if value is None and name != "class_code":
+            raise ResourceNotFoundError(
+                "%s: missing %s attribute" % (self._address.bdf, _IDENTITY_ATTRS[name])
+            )
+        return value
+
     @property
     def vendor_id(self):
-        path = os.path.join(self.sysfs.device_dir(self._address), "vendor")
-        return self.sysfs.read_hex_attr(path)
+        return self._identity_attr("vendor_id")
 
     @property
     def device_id(self):
-        path = os.path.join(self.sysfs.device_dir(self._address), "device")
-        return self.sysfs.read_hex_attr(path)
+        return self._identity_attr("device_id")
 
     @property
     def class_code(self):
-        path = os.path.join(self.sysfs.device_dir(self._address), "class")
-        try:
-            return self.sysfs.read_hex_attr(path)
-        except ResourceNotFoundError:
-            return None
+        return self._identity_attr("class_code")
+
+    @property
+    def bars(self):
+        """Tuple of BarInfo for this device, read once and cached."""
+        table = self._bar_table
+        if table is None:
+            table = self._bar_table = bar_access.read_bar_table(
+                self._address, sysfs_root=self.sysfs.root
+            )
+        return table
+
+    def refresh(self):
+        """Drop cached identity attributes and the BAR table.
+
+        Already open BAR handles keep their mapping until ``close()``.
+        """
+        self._identity.clear()
+        self._bar_table = None
+
+    def invalidate_bars(self, addr=None):
+        """Close every BAR mapping and drop the BAR table after a resize.
+
+        With ``addr`` only act if it is this device. Later ``bar()`` calls
+        re-read ``resource`` and map the BARs again.
+        """
+        if addr is not None and PciAddress.parse(addr) != self._address:
+            return
+        with self._lock:
+            bars = list(self._bars.values())
+            self._bars.clear()
+            self._bar_table = None
+        for pci_bar in bars:
+            pci_bar.close()
+
+    def resize_bar(self, index, size, method="auto"):
+        """Resize a BAR through the ReBAR capability and drop stale mappings."""
+        return rebar_access.resize_bar(
+            self._address, index, size, sysfs=self.sysfs, method=method
+        )
 
     @property
     def config(self):
-        return self._config
+        return _ConfigAccessor(self)
+
+    def _config_handle(self):
+        handle = self._config
+        if handle is None:
+            with self._lock:
+                if self._config is None:
+                    self._config = config_access.ConfigHandle(
+                        self._address, sysfs_root=self.sysfs.root
+                    )
+                handle = self._config
+        return handle
 
     def bar(self, index):
-        return bar_access.PciBar(self.sysfs, self._address, index)
+        """Return the session's PciBar for ``index``, created on first use."""
+        pci_bar = self._bars.get(index)
+        if pci_bar is None:
+            with self._lock:
+                pci_bar = self._bars.get(index)
+                if pci_bar is None:
+                    pci_bar = self._bars[index] = bar_access.PciBar.from_table(
+                        self.sysfs, self.bars, index
+                    )
+        return pci_bar
+
+    def close(self):
+        """Close the config handle and every BAR mapping of this session."""
+        with self._lock:
+            handle, self._config = self._config, None
+            bars = list(self._bars.values())
+            self._bars.clear()
+        if handle is not None:
+            handle.close()
+        for pci_bar in bars:
+            pci_bar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
 
     def cfg_read(self, width, offset):
-        return config_access.read(
-            self._address, offset, width, sysfs_root=self.sysfs.root
-        )
+        return self._config_handle().read(offset, width)
 
     def cfg_write(self, width, offset, value):
-        config_access.write(
-            self._address, offset, width, value, sysfs_root=self.sysfs.root
-        )
+        self._config_handle().write(offset, width, value)
 
     def cfgrd8(self, offset):
         return self.cfg_read(1, offset)
@@ -94,14 +193,29 @@ class PciDevice(object):
         self.cfg_write(4, offset, value)
 
     def bar_read(self, index, width, offset):
-        return bar_access.read(
-            self._address, index, offset, width, sysfs_root=self.sysfs.root
-        )
+        pci_bar = self.bar(index)
+        if width == 1:
+            return pci_bar.read_u8(offset)
+        if width == 2:
+            return pci_bar.read_u16(offset)
+        if width == 4:
+            return pci_bar.read_u32(offset)
+        if width == 8:
+            return pci_bar.read_u64(offset)
+        raise ValueRangeError("width must be 1, 2, 4, or 8")
 
     def bar_write(self, index, width, offset, value):
-        bar_access.write(
-            self._address, index, offset, width, value, sysfs_root=self.sysfs.root
-        )
+        pci_bar = self.bar(index)
+        if width == 1:
+            pci_bar.write_u8(offset, value)
+        elif width == 2:
+            pci_bar.write_u16(offset, value)
+        elif width == 4:
+            pci_bar.write_u32(offset, value)
+        elif width == 8:
+            pci_bar.write_u64(offset, value)
+        else:
+            raise ValueRangeError("width must be 1, 2, 4, or 8")
 
     def memrd8(self, index, offset):
         return self.bar_read(index, 1, offset)
@@ -1,8 +1,10 @@
 """PCI device discovery helpers."""
 
+import concurrent.futures
 import os
 import re
 
+from . import instrument
 from .errors import (
     DeviceNotFoundError,
     MultipleDevicesFoundError,
@@ -11,10 +13,11 @@ from .errors import (
     SysfsFormatError,
     ValueRangeError,
 )
-from .sysfs import Sysfs
-from .types import PciAddress
+from .sysfs import Sysfs, iter_device_addresses
+from .types import PciAddress, validate_workers
 
 _PCI_DOMAIN_DIR_RE = re.compile(r"^pci[0-9a-fA-F]{4}:[0-9a-fA-F]{2}$")
+_INFO_ATTRS = ("vendor", "device", "subsystem_vendor", "subsystem_device", "class")
 
 
 def _parse_id(value, name):
@@ -32,45 +35,134 @@ def _parse_id(value, name):
     return value
 
 
-def list_devices(sysfs=None):
-    """Return PciAddress entries for all devices in sysfs."""
+def iter_devices(
+    sysfs=None,
+    vendor_id=None,
+    device_id=None,
+    class_code=None,
+    class_mask=0xFFFFFF,
+    driver=None,
+    bus_range=None,
+    parent=None,
+):
+    """Yield PciAddress entries lazily while scanning sysfs.
+
+    Every argument after ``sysfs`` is an optional filter; they are applied
+    cheapest first (bus range, parent port, then sysfs attributes) and only
+    as far as the caller consumes the generator.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    devices = iter_device_addresses(sysfs.root)
+    if bus_range is not None:
+        devices = filter_bus_range(devices, *bus_range)
+    if parent is not None:
+        devices = filter_parent(devices, parent, sysfs=sysfs)
+    if vendor_id is not None or device_id is not None:
+        devices = filter_id(devices, vendor_id, device_id, sysfs=sysfs)
+    if class_code is not None:
+        devices = filter_class(devices, class_code, class_mask, sysfs=sysfs)
+    if driver is not None:
+        devices = filter_driver(devices, driver, sysfs=sysfs)
+    return devices
+
+
+def filter_bus_range(addresses, first, last):
+    """Yield addresses whose bus number lies in ``first..last`` inclusive."""
+    for address in addresses:
+        if first <= address.bus <= last:
+            yield address
+
+
+def filter_parent(addresses, parent, sysfs=None):
+    """Yield addresses located below the bridge or port ``parent``."""
     if sysfs is None:
         sysfs = Sysfs()
+    parent = PciAddress.parse(parent)
+    for address in addresses:
+        try:
+            chain = _extract_bdfs_from_path(sysfs.device_dir(address))
+        except ResourceNotFoundError:
+            continue
+        if parent in chain[:-1]:
+            yield address
+
+
+def _read_ids(sysfs, address, names):
     try:
-        entries = os.listdir(sysfs.root)
-    except FileNotFoundError as exc:
-        raise ResourceNotFoundError(str(exc))
-    except PermissionError as exc:
-        raise PermissionDeniedError(str(exc))
-    devices = []
-    for entry in entries:
+        values = sysfs.read_attrs(address, names)
+    except (ResourceNotFoundError, PermissionDeniedError, SysfsFormatError):
+        return None
+    if len(values) != len(names):
+        return None
+    return values
+
+
+def filter_id(addresses, vendor_id=None, device_id=None, sysfs=None):
+    """Yield addresses matching a vendor and/or device ID."""
+    if sysfs is None:
+        sysfs = Sysfs()
+    vendor_id = _parse_id(vendor_id, "vendor_id")
+    device_id = _parse_id(device_id, "device_id")
+    names = tuple(
+        name
+        for name, wanted in (("vendor", vendor_id), ("device", device_id))
+        if wanted is not None
+    )
+    for address in addresses:
+        ids = _read_ids(sysfs, address, names)
+        if ids is None:
+            continue
+        if vendor_id is not None and ids["vendor"] != vendor_id:
+            continue
+        if device_id is not None and ids["device"] != device_id:
+            continue
+        yield address
+
+
+def filter_class(addresses, class_code, mask=0xFFFFFF, sysfs=None):
+    """Yield addresses whose 24-bit class code matches under ``mask``.
+
+    For example ``class_code=0x010800, mask=0xFFFF00`` matches every NVMe
+    controller regardless of programming interface.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    wanted = class_code & mask
+    for address in addresses:
+        ids = _read_ids(sysfs, address, ("class",))
+        if ids is not None and ids["class"] & mask == wanted:
+            yield address
+
+
+def filter_driver(addresses, driver, sysfs=None):
+    """Yield addresses bound to the kernel driver named ``driver``."""
+    if sysfs is None:
+        sysfs = Sysfs()
+    for address in addresses:
         try:
-            devices.append(PciAddress.parse(entry))
-        except Exception:
+            target = os.readlink(os.path.join(sysfs.device_dir(address), "driver"))
+        except OSError:
             continue
-    return devices
+        if os.path.basename(target) == driver:
+            yield address
 
 
+@instrument.timed("discovery")
+def list_devices(sysfs=None):
+    """Return PciAddress entries for all devices in sysfs."""
+    return list(iter_devices(sysfs=sysfs))
+
+
+@instrument.timed("discovery")
 def get_device_info(addr, sysfs=None):
     """Return a dict of available sysfs attributes for a device."""
     if sysfs is None:
         sysfs = Sysfs()
-    base = sysfs.device_dir(addr)
-    mapping = {
-        "vendor": "vendor",
-        "device": "device",
-        "subsystem_vendor": "subsystem_vendor",
-        "subsystem_device": "subsystem_device",
-        "class": "class",
-    }
-    info = {}
-    for key, filename in mapping.items():
-        path = os.path.join(base, filename)
-        try:
-            info[key] = sysfs.read_hex_attr(path)
-        except ResourceNotFoundError:
-            continue
-    return info
+    try:
+        return sysfs.read_attrs(addr, _INFO_ATTRS)
+    except ResourceNotFoundError:
+        return {}
 
 
 def _extract_bdfs_from_path(path):
@@ -93,6 +185,7 @@ def _extract_bdfs_from_path(path):
     return chain
 
 
+@instrument.timed("discovery")
 def find_root_port(addr, sysfs=None):
     """Return the root-complex port PciAddress for a given endpoint BDF."""
     if sysfs is None:
@@ -107,6 +200,7 @@ def find_root_port(addr, sysfs=None):
     return chain[0]
 
 
+@instrument.timed("discovery")
 def build_device_tree(sysfs=None):
     """Return (roots, children) describing PCI topology derived from sysfs."""
     if sysfs is None:
@@ -132,43 +226,75 @@ def build_device_tree(sysfs=None):
                 continue
             seen_edges.add(edge)
             children.setdefault(parent, []).append(child)
-    roots = sorted(roots, key=lambda a: a.bdf)
+    roots = sorted(roots)
     for key in list(children.keys()):
-        children[key] = sorted(children[key], key=lambda a: a.bdf)
+        children[key] = sorted(children[key])
     return roots, children
 
 
+def read_device_tree(read, sysfs=None, workers=8):
+    """Build the device tree and call ``read(address)`` on every node in parallel.
+
+    Returns (roots, children, values); ``values`` maps each address to what
+    ``read`` returned for it, leaving out None.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    workers = validate_workers(workers)
+    roots, children = build_device_tree(sysfs=sysfs)
+    nodes = set(roots)
+    for parent, kids in children.items():
+        nodes.add(parent)
+        nodes.update(kids)
+    nodes = sorted(nodes)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(read, nodes)
+        values = {
+            address: value
+            for address, value in zip(nodes, results)
+            if value is not None
+        }
+    return roots, children, values
+
+
+def walk_subtree(root, children):
+    """Yield (address, ancestors) depth first from ``root``, parents first.
+
+    ``ancestors`` lists the nodes from ``root`` down to the parent.
+    """
+    stack = [(root, ())]
+    while stack:
+        node, ancestors = stack.pop()
+        yield node, ancestors
+        below = ancestors + (node,)
+        for child in reversed(children.get(node, [])):
+            stack.append((child, below))
+
+
+@instrument.timed("discovery")
 def find_by_id(vendor_id, device_id=None, sysfs=None):
     """Return PciAddress entries matching vendor/device ids."""
     if sysfs is None:
         sysfs = Sysfs()
-    vendor_id = _parse_id(vendor_id, "vendor_id")
-    device_id = _parse_id(device_id, "device_id")
-    matches = []
-    for addr in list_devices(sysfs=sysfs):
-        base = sysfs.device_dir(addr)
-        try:
-            vendor = sysfs.read_hex_attr(os.path.join(base, "vendor"))
-            device = sysfs.read_hex_attr(os.path.join(base, "device"))
-        except ResourceNotFoundError:
-            continue
-        except (PermissionDeniedError, SysfsFormatError):
-            continue
-        if vendor_id is not None and vendor != vendor_id:
-            continue
-        if device_id is not None and device != device_id:
-            continue
-        matches.append(addr)
-    return matches
+    devices = iter_device_addresses(sysfs.root)
+    return list(filter_id(devices, vendor_id, device_id, sysfs=sysfs))
 
 
 def find_one_by_id(vendor_id, device_id=None, sysfs=None):
-    matches = find_by_id(vendor_id, device_id, sysfs=sysfs)
-    if not matches:
-        raise DeviceNotFoundError("no devices found")
-    if len(matches) > 1:
-        raise MultipleDevicesFoundError("multiple devices found")
-    return matches[0]
+    """Return the single matching device; stops scanning at a second match."""
+    if sysfs is None:
+        sysfs = Sysfs()
+    devices = iter_device_addresses(sysfs.root)
+    matches = filter_id(devices, vendor_id, device_id, sysfs=sysfs)
+    try:
+        first = next(matches, None)
+        if first is None:
+            raise DeviceNotFoundError("no devices found")
+        if next(matches, None) is not None:
+            raise MultipleDevicesFoundError("multiple devices found")
+    finally:
+        matches.close()
+    return first
 
 
 def find_devices(vendor_id=None, device_id=None, sysfs=None):
@@ -176,3 +302,59 @@ def find_devices(vendor_id=None, device_id=None, sysfs=None):
     if vendor_id is None and device_id is None:
         return list_devices(sysfs=sysfs)
     return find_by_id(vendor_id, device_id, sysfs=sysfs)
+
+
+def _should_display(node, children, matched, cache):
+    if matched is None:
+        return True
+    if node in cache:
+        return cache[node]
+    if node in matched:
+        cache[node] = True
+        return True
+    for child in children.get(node, []):
+        if _should_display(child, children, matched, cache):
+            cache[node] = True
+            return True
+    cache[node] = False
+    return False
+
+
+def render_device_tree(sysfs=None, vendor_id=None, device_id=None):
+    """Return the device tree as text lines, one ``[RC|SW|EP] bdf`` per node.
+
+    With ``vendor_id``/``device_id`` only matching devices and the bridges
+    above them are shown.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    roots, children = build_device_tree(sysfs=sysfs)
+    matched = None
+    if vendor_id is not None or device_id is not None:
+        matched = set(find_by_id(vendor_id, device_id, sysfs=sysfs))
+    root_set = set(roots)
+    cache = {}
+    lines = []
+
+    def render(node, prefix, has_parent, is_last):
+        display_children = [
+            child
+            for child in children.get(node, [])
+            if _should_display(child, children, matched, cache)
+        ]
+        role = "RC" if node in root_set else ("SW" if display_children else "EP")
+        connector = ""
+        if has_parent:
+            connector = "\\-- " if is_last else "|-- "
+        lines.append(prefix + connector + "[%s] %s" % (role, node.bdf))
+        child_prefix = prefix
+        if has_parent:
+            child_prefix += "    " if is_last else "|   "
+        for idx, child in enumerate(display_children):
+            render(child, child_prefix, True, idx == len(display_children) - 1)
+
+    for idx, root in enumerate(roots):
+        if not _should_display(root, children, matched, cache):
+            continue
+        render(root, "", False, idx == len(roots) - 1)
+    return lines
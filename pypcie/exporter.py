@@ -0,0 +1,334 @@
+"""Prometheus text-format exporter for PCIe link and AER telemetry.
+
+A background sampler reads every device at a fixed interval and renders the
+metrics text once per pass; HTTP scrapes only return the cached text, so
+scrape frequency never changes how often config space is read.
+"""
+
+import http.server
+import logging
+import socket
+import struct
+import threading
+import time
+
+from . import aer as aer_access
+from . import config as config_access
+from .capability import find_pcie_capability
+from .discover import list_devices
+from .errors import (
+    OutOfRangeError,
+    PciError,
+    PermissionDeniedError,
+    ResourceNotFoundError,
+)
+from .link import PCI_EXP_LNKCAP, decode_link_capabilities, decode_link_status
+from .sysfs import Sysfs
+from .types import PciAddress
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_log = logging.getLogger(__name__)
+
+# LNKCAP (u32), LNKCTL (u16) and LNKSTA (u16) in one pread.
+_LINK_BLOCK = struct.Struct("<IHH")
+
+_METRICS = (
+    ("pcie_device_info", "gauge", "Device identity; always 1."),
+    ("pcie_link_speed_gtps", "gauge", "Current link speed in GT/s."),
+    ("pcie_link_width", "gauge", "Negotiated link width in lanes."),
+    ("pcie_link_max_speed_gtps", "gauge", "Maximum link speed from LNKCAP in GT/s."),
+    ("pcie_link_max_width", "gauge", "Maximum link width from LNKCAP."),
+    ("pcie_link_degraded", "gauge", "1 when speed or width is below capability."),
+    ("pcie_link_dll_active", "gauge", "Data Link Layer Link Active (LNKSTA)."),
+    ("pcie_link_training", "gauge", "Link training in progress (LNKSTA)."),
+    ("pcie_aer_errors_total", "counter", "AER errors seen by the sampler."),
+    ("pcie_aer_kernel_errors_total", "counter", "Kernel aer_dev_* TOTAL_ERR counters."),
+    ("pypcie_exporter_devices", "gauge", "Devices sampled."),
+    ("pypcie_exporter_samples_total", "counter", "Sampling passes completed."),
+    ("pypcie_exporter_sample_seconds", "gauge", "Duration of the last sampling pass."),
+    ("pypcie_exporter_sample_seconds_total", "counter", "Time spent sampling."),
+    ("pypcie_exporter_last_sample_timestamp_seconds", "gauge", "Wall time of the last pass."),
+    ("pypcie_exporter_scrapes_total", "counter", "HTTP scrapes served."),
+    ("pypcie_exporter_scrape_seconds_total", "counter", "Time spent serving scrapes."),
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (key, _escape(value)) for key, value in labels
+    )
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return "%d" % value
+    return repr(float(value))
+
+
+class _Port(object):
+    __slots__ = ("address", "labels", "link_offset", "handle")
+
+    def __init__(self, address, labels, link_offset, handle):
+        self.address = address
+        self.labels = labels
+        self.link_offset = link_offset
+        self.handle = handle
+
+
+class Exporter(object):
+    """Sample devices in the background and keep rendered metrics text."""
+
+    def __init__(self, addresses=None, sysfs=None, interval=10.0, aer=True):
+        if not interval > 0 or interval == float("inf"):
+            raise OutOfRangeError("interval must be a positive number of seconds")
+        self.sysfs = sysfs if sysfs is not None else Sysfs()
+        self.interval = float(interval)
+        self._addresses = addresses
+        self._aer_enabled = bool(aer)
+        self._aer = None
+        self._ports = None
+        self._text = b""
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.samples = 0
+        self.sample_seconds = 0.0
+        self.sample_seconds_total = 0.0
+        self.last_sample = None
+        self.scrapes = 0
+        self.scrape_seconds_total = 0.0
+
+    def _open(self):
+        addresses = self._addresses
+        if addresses is None:
+            addresses = list_devices(sysfs=self.sysfs)
+        addresses = sorted(set(PciAddress.parse(addr) for addr in addresses))
+        root = self.sysfs.root
+        ports = []
+        for address in addresses:
+            try:
+                ids = self.sysfs.read_attrs(address, ("vendor", "device", "class"))
+                base = find_pcie_capability(address, sysfs_root=root)
+            except (ResourceNotFoundError, PermissionDeniedError, OutOfRangeError):
+                continue
+            labels = (
+                ("bdf", address.bdf),
+                ("vendor", "0x%04x" % ids.get("vendor", 0xFFFF)),
+                ("device", "0x%04x" % ids.get("device", 0xFFFF)),
+                ("class", "0x%06x" % ids.get("class", 0)),
+            )
+            handle = None
+            link_offset = 0
+            if base:
+                handle = config_access.ConfigHandle(address, sysfs_root=root)
+                link_offset = base + PCI_EXP_LNKCAP
+            ports.append(_Port(address, labels, link_offset, handle))
+        self._ports = ports
+        if self._aer_enabled:
+            self._aer = aer_access.AerCollector(
+                [port.address for port in ports], sysfs=self.sysfs
+            ).open()
+
+    def refresh(self):
+        """Run one sampling pass and replace the cached metrics text."""
+        started = time.perf_counter()
+        if self._ports is None:
+            self._open()
+        values = {name: [] for name, _, _ in _METRICS}
+        for port in self._ports:
+            values["pcie_device_info"].append((port.labels, 1))
+            if port.handle is None:
+                continue
+            try:
+                block = port.handle.read_block(port.link_offset, _LINK_BLOCK.size)
+            except (PciError, OSError):
+                # A device that vanished or stopped answering only loses its
+                # link metrics for this pass.
+                continue
+            lnkcap, _, lnksta = _LINK_BLOCK.unpack(block)
+            status = decode_link_status(lnksta)
+            bdf = port.labels[:1]
+            caps = decode_link_capabilities(lnkcap)
+            max_speed = caps["max_speed_gtps"]
+            max_width = caps["max_width"]
+            if status["speed_gtps"] is not None:
+                values["pcie_link_speed_gtps"].append((bdf, status["speed_gtps"]))
+            values["pcie_link_width"].append((bdf, status["width"]))
+            if max_speed is not None:
+                values["pcie_link_max_speed_gtps"].append((bdf, max_speed))
+                degraded = (
+                    (status["speed_gtps"] or 0) < max_speed
+                    or status["width"] < max_width
+                )
+                values["pcie_link_degraded"].append((bdf, degraded))
+            values["pcie_link_max_width"].append((bdf, max_width))
+            values["pcie_link_dll_active"].append((bdf, status["dll_link_active"]))
+            values["pcie_link_training"].append((bdf, status["training"]))
+        if self._aer is not None:
+            self._aer.sample()
+            for address, entry in sorted(self._aer.counters().items()):
+                bdf = (("bdf", address.bdf),)
+                for severity in ("correctable", "uncorrectable"):
+                    values["pcie_aer_errors_total"].append(
+                        (bdf + (("severity", severity),), entry[severity])
+                    )
+                for key, value in sorted(entry.items()):
+                    if key.startswith("kernel_"):
+                        values["pcie_aer_kernel_errors_total"].append(
+                            (bdf + (("severity", key[len("kernel_") :]),), value)
+                        )
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.samples += 1
+            self.sample_seconds = elapsed
+            self.sample_seconds_total += elapsed
+            self.last_sample = time.time()
+            values["pypcie_exporter_devices"].append(((), len(self._ports)))
+            self._text = self._render(values)
+        return self._text
+
+    def _render(self, values):
+        values["pypcie_exporter_samples_total"].append(((), self.samples))
+        values["pypcie_exporter_sample_seconds"].append(((), self.sample_seconds))
+        values["pypcie_exporter_sample_seconds_total"].append(
+            ((), self.sample_seconds_total)
+        )
+        values["pypcie_exporter_last_sample_timestamp_seconds"].append(
+            ((), self.last_sample)
+        )
+        lines = []
+        for name, kind, help_text in _METRICS:
+            if name.startswith("pypcie_exporter_scrape"):
+                continue
+            samples = values[name]
+            if not samples:
+                continue
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, value in samples:
+                lines.append("%s%s %s" % (name, _labels(labels), _number(value)))
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def scrape(self):
+        """Return the cached metrics text plus the scrape self-metrics."""
+        started = time.perf_counter()
+        with self._lock:
+            text = self._text
+            scrapes = self.scrapes
+            scrape_total = self.scrape_seconds_total
+        tail = []
+        for name, kind, help_text in _METRICS:
+            if not name.startswith("pypcie_exporter_scrape"):
+                continue
+            value = scrapes if name.endswith("scrapes_total") else scrape_total
+            tail.append("# HELP %s %s" % (name, help_text))
+            tail.append("# TYPE %s %s" % (name, kind))
+            tail.append("%s %s" % (name, _number(value)))
+        body = text + ("\n".join(tail) + "\n").encode("utf-8")
+        with self._lock:
+            self.scrapes += 1
+            self.scrape_seconds_total += time.perf_counter() - started
+        return body
+
+    def start(self):
+        """Sample once, then keep refreshing in a daemon thread."""
+        if self._thread is not None:
+            return self
+        self.refresh()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="pypcie-exporter", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except (PciError, OSError):
+                # Keep serving the last good sample; the stale timestamp
+                # metric shows that sampling has stopped advancing.
+                _log.warning("sampling pass failed", exc_info=True)
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self._aer is not None:
+            self._aer.close()
+            self._aer = None
+        for port in self._ports or ():
+            if port.handle is not None:
+                port.handle.close()
+        self._ports = None
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    exporter = None
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] == "/metrics":
+            body = self.exporter.scrape()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+        elif self.path == "/":
+            body = b'<html><body><a href="/metrics">metrics</a></body></html>\n'
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+        else:
+            body = b"not found\n"
+            self.send_response(404)
+            self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+def parse_listen(value):
+    """Split "host:port" (or ":port") into a (host, port) tuple.
+
+    IPv6 hosts are written in brackets, as in ``[::1]:9464``.
+    """
+    host, sep, port = value.rpartition(":")
+    if not sep:
+        host, port = "", value
+    try:
+        port = int(port)
+    except ValueError:
+        raise OutOfRangeError("invalid listen address: %r" % value)
+    if not (0 <= port <= 0xFFFF):
+        raise OutOfRangeError("port out of range: %d" % port)
+    return host.strip("[]") or "0.0.0.0", port
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _Server6(_Server):
+    address_family = socket.AF_INET6
+
+
+def make_server(exporter, listen="127.0.0.1:9464"):
+    """Return a threading HTTP server that serves ``exporter`` on /metrics."""
+    handler = type("ExporterHandler", (_Handler,), {"exporter": exporter})
+    address = parse_listen(listen)
+    server_class = _Server6 if ":" in address[0] else _Server
+    return server_class(address, handler)
+
+
+__all__ = ["CONTENT_TYPE", "Exporter", "make_server", "parse_listen"]
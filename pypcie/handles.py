@@ -0,0 +1,92 @@
+"""Shared config and BAR handles for multi-threaded pollers."""
+
+import threading
+
+from . import bar as bar_access
+from . import config as config_access
+from .sysfs import Sysfs
+from .types import PciAddress
+
+
+class HandlePool(object):
+    """One config handle per device and one mapping per BAR, shared by threads.
+
+    Every thread asking for the same device or BAR gets the same handle, so
+    a collector with many threads maps each BAR once. Handles stay open
+    until ``close()``.
+    """
+
+    def __init__(self, sysfs_root=None):
+        self.sysfs = Sysfs(root=sysfs_root) if sysfs_root else Sysfs()
+        self._lock = threading.Lock()
+        self._configs = {}
+        self._bars = {}
+        self._tables = {}
+        bar_access.register_bar_cache(self)
+
+    def bar_table(self, addr):
+        """Return the cached BarInfo table for a device."""
+        address = PciAddress.parse(addr)
+        table = self._tables.get(address)
+        if table is None:
+            table = bar_access.read_bar_table(address, sysfs_root=self.sysfs.root)
+            table = self._tables.setdefault(address, table)
+        return table
+
+    def config(self, addr):
+        """Return the shared ConfigHandle for a device."""
+        address = PciAddress.parse(addr)
+        handle = self._configs.get(address)
+        if handle is None:
+            with self._lock:
+                handle = self._configs.get(address)
+                if handle is None:
+                    handle = self._configs[address] = config_access.ConfigHandle(
+                        address, sysfs_root=self.sysfs.root
+                    )
+        return handle
+
+    def bar(self, addr, index):
+        """Return the shared PciBar for a device BAR."""
+        key = (PciAddress.parse(addr), index)
+        pci_bar = self._bars.get(key)
+        if pci_bar is None:
+            with self._lock:
+                pci_bar = self._bars.get(key)
+                if pci_bar is None:
+                    pci_bar = self._bars[key] = bar_access.PciBar.from_table(
+                        self.sysfs, self.bar_table(key[0]), index
+                    )
+        return pci_bar
+
+    def invalidate_bars(self, addr):
+        """Close and forget a device's BAR mappings and BAR table after a resize."""
+        address = PciAddress.parse(addr)
+        with self._lock:
+            keys = [key for key in self._bars if key[0] == address]
+            handles = [self._bars.pop(key) for key in keys]
+            self._tables.pop(address, None)
+        for handle in handles:
+            handle.close()
+
+    def __len__(self):
+        return len(self._configs) + len(self._bars)
+
+    def close(self):
+        with self._lock:
+            handles = list(self._configs.values()) + list(self._bars.values())
+            self._configs = {}
+            self._bars = {}
+            self._tables = {}
+        for handle in handles:
+            handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+__all__ = ["HandlePool"]
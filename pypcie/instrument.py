@@ -0,0 +1,251 @@
+"""Opt-in syscall counters and operation latency histograms.
+
+Instrumentation is off by default. While disabled every hook costs a single
+attribute check; enable it with ``enable()`` (or ``PYPCIE_STATS=1`` in the
+environment) and read the counters back with ``snapshot()``.
+"""
+
+import bisect
+import functools
+import os
+import threading
+import time
+
+SYSCALLS = ("open", "read", "write", "pread", "pwrite", "mmap")
+CATEGORIES = ("config", "bar", "capability", "discovery", "link")
+
+# Histogram bucket upper bounds in seconds: 1us, 2us, 4us, ... ~1s, then +inf.
+BUCKET_BOUNDS = tuple(1e-6 * (1 << shift) for shift in range(21))
+
+
+class _Histogram(object):
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if self.min is None or elapsed < self.min:
+            self.min = elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, elapsed)] += 1
+
+    def as_dict(self):
+        buckets = []
+        for index, count in enumerate(self.buckets):
+            if not count:
+                continue
+            bound = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else None
+            buckets.append((bound, count))
+        return {
+            "count": self.count,
+            "total_s": self.total,
+            "mean_s": self.total / self.count if self.count else 0.0,
+            "min_s": self.min or 0.0,
+            "max_s": self.max,
+            "buckets": buckets,
+        }
+
+
+class _State(object):
+    __slots__ = (
+        "enabled",
+        "tracing",
+        "access_hooks",
+        "callback",
+        "lock",
+        "syscalls",
+        "bytes_read",
+        "bytes_written",
+        "operations",
+        "started",
+    )
+
+    def __init__(self):
+        self.enabled = False
+        self.tracing = False
+        self.access_hooks = ()
+        self.callback = None
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.syscalls = dict.fromkeys(SYSCALLS, 0)
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.operations = {}
+        self.started = time.monotonic()
+
+
+state = _State()
+
+
+def enable(callback=None):
+    """Start collecting; ``callback(op, elapsed_s)`` runs after each timed op."""
+    state.callback = callback
+    state.enabled = True
+
+
+def disable():
+    state.enabled = False
+    state.callback = None
+
+
+def is_enabled():
+    return state.enabled
+
+
+def reset():
+    """Clear all counters and histograms."""
+    with state.lock:
+        state.reset()
+
+
+def count_syscall(name, nbytes=0, write=False):
+    """Count one syscall and the bytes it moved (callers check ``enabled``)."""
+    with state.lock:
+        state.syscalls[name] = state.syscalls.get(name, 0) + 1
+        if write:
+            state.bytes_written += nbytes
+        else:
+            state.bytes_read += nbytes
+
+
+def count_bytes(nbytes, write=False):
+    """Count bytes moved without a syscall, e.g. through an mmap."""
+    with state.lock:
+        if write:
+            state.bytes_written += nbytes
+        else:
+            state.bytes_read += nbytes
+
+
+def record(op, elapsed):
+    with state.lock:
+        hist = state.operations.get(op)
+        if hist is None:
+            hist = state.operations[op] = _Histogram()
+        hist.add(elapsed)
+    callback = state.callback
+    if callback is not None:
+        callback(op, elapsed)
+
+
+def timed(category):
+    """Decorator recording the latency of a function as ``category.name``."""
+
+    def decorator(func):
+        op = "%s.%s" % (category, func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not state.enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(op, time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def add_access_hook(hook):
+    """Call ``hook(space, address, bar, offset, width, value, write)`` on access.
+
+    ``space`` is "config" or "bar"; ``bar`` is None for config accesses.
+    Hooks see every typed config and BAR access until removed.
+    """
+    with state.lock:
+        state.access_hooks = state.access_hooks + (hook,)
+        state.tracing = True
+
+
+def remove_access_hook(hook):
+    with state.lock:
+        state.access_hooks = tuple(h for h in state.access_hooks if h != hook)
+        state.tracing = bool(state.access_hooks)
+
+
+def notify_access(space, address, bar, offset, width, value, write):
+    """Deliver one access to the hooks (callers check ``tracing``)."""
+    for hook in state.access_hooks:
+        hook(space, address, bar, offset, width, value, write)
+
+
+def snapshot():
+    """Return a dict copy of the current counters."""
+    with state.lock:
+        return {
+            "enabled": state.enabled,
+            "elapsed_s": time.monotonic() - state.started,
+            "syscalls": dict(state.syscalls),
+            "bytes": {"read": state.bytes_read, "written": state.bytes_written},
+            "operations": {
+                op: hist.as_dict() for op, hist in sorted(state.operations.items())
+            },
+        }
+
+
+def format_summary(snap=None):
+    """Return human-readable summary lines for a snapshot."""
+    if snap is None:
+        snap = snapshot()
+    syscalls = " ".join(
+        "%s=%d" % (name, count) for name, count in sorted(snap["syscalls"].items())
+    )
+    lines = [
+        "syscalls: %s" % syscalls,
+        "bytes: read=%d written=%d"
+        % (snap["bytes"]["read"], snap["bytes"]["written"]),
+    ]
+    if snap["operations"]:
+        lines.append(
+            "%-34s %8s %10s %10s %10s"
+            % ("operation", "count", "mean(us)", "max(us)", "total(ms)")
+        )
+    for op, info in snap["operations"].items():
+        lines.append(
+            "%-34s %8d %10.2f %10.2f %10.3f"
+            % (
+                op,
+                info["count"],
+                info["mean_s"] * 1e6,
+                info["max_s"] * 1e6,
+                info["total_s"] * 1e3,
+            )
+        )
+    return lines
+
+
+if os.environ.get("PYPCIE_STATS"):
+    enable()
+
+
+__all__ = [
+    "BUCKET_BOUNDS",
+    "CATEGORIES",
+    "SYSCALLS",
+    "add_access_hook",
+    "count_bytes",
+    "count_syscall",
+    "disable",
+    "enable",
+    "format_summary",
+    "is_enabled",
+    "notify_access",
+    "record",
+    "remove_access_hook",
+    "reset",
+    "snapshot",
+    "timed",
+]
@@ -1,14 +1,39 @@
 """PCIe link control helpers."""
 
+import struct
 import time
 
-from . import config
-from .capability import find_pcie_capability
+from . import config, instrument
+from .capability import PCI_CAP_ID_EXP, find_pci_capability_in, find_pcie_capability
 from .errors import ResourceNotFoundError, ValueRangeError
-from .types import validate_u16
+from .sysfs import Sysfs
+from .types import PciAddress, validate_u16
 
 PCI_EXP_FLAGS = 0x02
+PCI_EXP_DEVCAP = 0x04
+PCI_EXP_DEVCAP_PAYLOAD = 0x00000007
+PCI_EXP_DEVCAP_EXT_TAG = 0x00000020
+PCI_EXP_DEVCAP_FLR = 0x10000000
+PCI_EXP_DEVCTL = 0x08
+PCI_EXP_DEVCTL_RELAX_EN = 0x0010
+PCI_EXP_DEVCTL_PAYLOAD = 0x00E0
+PCI_EXP_DEVCTL_PAYLOAD_SHIFT = 5
+PCI_EXP_DEVCTL_EXT_TAG = 0x0100
+PCI_EXP_DEVCTL_NOSNOOP_EN = 0x0800
+PCI_EXP_DEVCTL_READRQ = 0x7000
+PCI_EXP_DEVCTL_READRQ_SHIFT = 12
+PCI_EXP_LNKCAP = 0x0C
+PCI_EXP_LNKCAP_SLS = 0x0000000F
+PCI_EXP_LNKCAP_MLW = 0x000003F0
+PCI_EXP_LNKCAP_ASPMS = 0x00000C00
+PCI_EXP_LNKCAP_L0SEL = 0x00007000
+PCI_EXP_LNKCAP_L1EL = 0x00038000
+PCI_EXP_LNKCAP_DLLLARC = 0x00100000
+PCI_EXP_LNKCAP_PN = 0xFF000000
 PCI_EXP_LNKCTL = 0x10
+PCI_EXP_LNKCTL_ASPM_L0S = 0x0001
+PCI_EXP_LNKCTL_ASPM_L1 = 0x0002
+PCI_EXP_LNKCTL_ASPMC = 0x0003
 PCI_EXP_LNKCTL_LD = 0x0010
 PCI_EXP_LNKCTL_RL = 0x0020
 PCI_EXP_LNKSTA = 0x12
@@ -17,14 +42,56 @@ PCI_EXP_LNKSTA_NLW = 0x03F0
 PCI_EXP_LNKSTA_NLW_SHIFT = 4
 PCI_EXP_LNKSTA_LT = 0x0800
 PCI_EXP_LNKSTA_DLLLA = 0x2000
+PCI_EXP_DEVCAP2 = 0x24
+PCI_EXP_DEVCAP2_10BIT_TAG_COMP = 0x00010000
+PCI_EXP_DEVCAP2_10BIT_TAG_REQ = 0x00020000
+PCI_EXP_DEVCTL2 = 0x28
+PCI_EXP_DEVCTL2_10BIT_TAG_REQ_EN = 0x1000
+PCI_EXP_LNKCAP2 = 0x2C
+PCI_EXP_LNKCAP2_SLS = 0x000000FE
 PCI_EXP_LNKCTL2 = 0x30
 PCI_EXP_LNKCTL2_TLS = 0x000F
+PCI_EXP_LNKSTA2 = 0x32
+PCI_EXP_LNKSTA2_FLIT = 0x0400
+PCI_EXT_CAP_ID_L1SS = 0x001E
+PCI_L1SS_CAP = 0x04
+PCI_L1SS_CAP_PCIPM_L1_2 = 0x00000001
+PCI_L1SS_CAP_PCIPM_L1_1 = 0x00000002
+PCI_L1SS_CAP_ASPM_L1_2 = 0x00000004
+PCI_L1SS_CAP_ASPM_L1_1 = 0x00000008
+PCI_L1SS_CAP_L1_PM_SS = 0x00000010
+PCI_L1SS_CAP_CM_RESTORE_TIME = 0x0000FF00
+PCI_L1SS_CAP_P_PWR_ON_SCALE = 0x00030000
+PCI_L1SS_CAP_P_PWR_ON_VALUE = 0x00F80000
+PCI_L1SS_CTL1 = 0x08
+PCI_L1SS_CTL1_PCIPM_L1_2 = 0x00000001
+PCI_L1SS_CTL1_PCIPM_L1_1 = 0x00000002
+PCI_L1SS_CTL1_ASPM_L1_2 = 0x00000004
+PCI_L1SS_CTL1_ASPM_L1_1 = 0x00000008
+PCI_L1SS_CTL1_L1SS_MASK = 0x0000000F
+PCI_L1SS_CTL1_CM_RESTORE_TIME = 0x0000FF00
+PCI_L1SS_CTL1_LTR_L12_TH_VALUE = 0x03FF0000
+PCI_L1SS_CTL1_LTR_L12_TH_SCALE = 0xE0000000
+PCI_L1SS_CTL2 = 0x0C
+PCI_L1SS_CTL2_T_PWR_ON_SCALE = 0x00000003
+PCI_L1SS_CTL2_T_PWR_ON_VALUE = 0x000000F8
 PCI_BRIDGE_CONTROL = 0x3E
 PCI_BRIDGE_CTL_BUS_RESET = 0x0040
 PCI_HEADER_TYPE = 0x0E
 PCI_HEADER_TYPE_MASK = 0x7F
 PCI_HEADER_TYPE_BRIDGE = 0x01
 
+# Device/Port Type field of the PCIe capability flags.
+PCI_EXP_TYPE_ENDPOINT = 0x0
+PCI_EXP_TYPE_LEG_END = 0x1
+PCI_EXP_TYPE_ROOT_PORT = 0x4
+PCI_EXP_TYPE_UPSTREAM = 0x5
+PCI_EXP_TYPE_DOWNSTREAM = 0x6
+PCI_EXP_TYPE_PCI_BRIDGE = 0x7
+
+# Ports that own the downstream end of a physical link.
+DOWNSTREAM_PORT_TYPES = (PCI_EXP_TYPE_ROOT_PORT, PCI_EXP_TYPE_DOWNSTREAM)
+
 _LINK_SPEED_TO_TLS = {
     2.5: 0x1,
     5.0: 0x2,
@@ -35,6 +102,85 @@ _LINK_SPEED_TO_TLS = {
 }
 _TLS_TO_LINK_SPEED = {value: key for key, value in _LINK_SPEED_TO_TLS.items()}
 
+LINK_STATUS_SOURCES = ("auto", "sysfs", "config")
+
+# Max Payload Size / Max Read Request Size encodings 0-5.
+PAYLOAD_SIZES = (128, 256, 512, 1024, 2048, 4096)
+
+# ASPM states by the name used in the API and CLI.
+ASPM_STATES = ("l0s", "l1", "l1.1", "l1.2")
+
+# T_POWER_ON scale (us) and LTR_L1.2_THRESHOLD scale (ns) encodings.
+_T_POWER_ON_SCALE_US = (2, 10, 100)
+_LTR_SCALE_NS = (1, 32, 1024, 32768, 1048576, 33554432)
+
+# Payload bits per transferred bit: 8b/10b up to 5 GT/s, 128b/130b for
+# 8-32 GT/s and 242B/256B flits at 64 GT/s. Flit mode at the lower rates
+# keeps the line encoding and adds the flit overhead on top.
+_FLIT_EFFICIENCY = 242.0 / 256.0
+
+
+class PcieCaps(object):
+    """A function's config space with its PCIe capability located.
+
+    ``base`` is the capability offset (0 without one) and ``version`` and
+    ``port_type`` come from its flags. ``u16``/``u32`` read registers
+    relative to ``base`` and return None for registers past the end of
+    ``data`` or, on version 1 capabilities, from DEVCAP2 on.
+    """
+
+    __slots__ = ("address", "data", "base", "version", "port_type", "bridge")
+
+    def __init__(self, address, data):
+        self.address = address
+        self.data = data
+        self.bridge = len(data) > PCI_HEADER_TYPE and (
+            data[PCI_HEADER_TYPE] & PCI_HEADER_TYPE_MASK
+        ) == PCI_HEADER_TYPE_BRIDGE
+        self.base = find_pci_capability_in(data, PCI_CAP_ID_EXP)
+        self.version = 0
+        self.port_type = None
+        flags = self.u16(PCI_EXP_FLAGS)
+        if flags is not None:
+            self.version = flags & 0xF
+            self.port_type = (flags >> 4) & 0xF
+
+    def _unpack(self, fmt, register):
+        if not self.base:
+            return None
+        if register >= PCI_EXP_DEVCAP2 and self.version < 2:
+            return None
+        offset = self.base + register
+        if offset + struct.calcsize(fmt) > len(self.data):
+            return None
+        return struct.unpack_from(fmt, self.data, offset)[0]
+
+    def u16(self, register):
+        return self._unpack("<H", register)
+
+    def u32(self, register):
+        return self._unpack("<I", register)
+
+    def __repr__(self):
+        return "PcieCaps(%s, base=0x%02x, type=%s)" % (
+            self.address.bdf,
+            self.base,
+            self.port_type,
+        )
+
+
+def read_pcie_caps(address, sysfs=None, length=0x100):
+    """Read a function's config space once and locate its PCIe capability.
+
+    ``length=None`` reads the whole space, for callers that also walk the
+    extended capabilities. Read errors propagate as PciError subclasses.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    address = PciAddress.parse(address)
+    data = config.read_space(address, length=length, sysfs_root=sysfs.root)
+    return PcieCaps(address, data)
+
 
 def _pcie_cap_base(address, sysfs_root=None):
     base = find_pcie_capability(address, sysfs_root=sysfs_root)
@@ -59,16 +205,19 @@ def _update_link_control(address, mask, enable, sysfs_root=None):
     return value
 
 
+@instrument.timed("link")
 def link_disable(address, sysfs_root=None):
     """Disable the PCIe link by setting the Link Disable bit."""
     return _update_link_control(address, PCI_EXP_LNKCTL_LD, True, sysfs_root=sysfs_root)
 
 
+@instrument.timed("link")
 def link_enable(address, sysfs_root=None):
     """Enable the PCIe link by clearing the Link Disable bit."""
     return _update_link_control(address, PCI_EXP_LNKCTL_LD, False, sysfs_root=sysfs_root)
 
 
+@instrument.timed("link")
 def retrain_link(address, sysfs_root=None, clear_after=False):
     """Request link retraining by setting the Retrain Link bit."""
     value = _update_link_control(address, PCI_EXP_LNKCTL_RL, True, sysfs_root=sysfs_root)
@@ -97,6 +246,7 @@ def _normalize_target_speed(speed):
     raise ValueRangeError("unsupported target link speed: %r" % speed)
 
 
+@instrument.timed("link")
 def set_target_link_speed(address, speed, retrain=True, sysfs_root=None):
     """Set Target Link Speed (LNKCTL2) and optionally retrain."""
     base = _pcie_cap_base(address, sysfs_root=sysfs_root)
@@ -111,10 +261,8 @@ def set_target_link_speed(address, speed, retrain=True, sysfs_root=None):
     return value
 
 
-def read_link_status(address, sysfs_root=None):
-    """Return decoded Link Status fields."""
-    base = _pcie_cap_base(address, sysfs_root=sysfs_root)
-    status = config.read_u16(address, base + PCI_EXP_LNKSTA, sysfs_root=sysfs_root)
+def decode_link_status(status):
+    """Decode a raw Link Status register value."""
     speed_code = status & PCI_EXP_LNKSTA_CLS
     width = (status & PCI_EXP_LNKSTA_NLW) >> PCI_EXP_LNKSTA_NLW_SHIFT
     return {
@@ -126,6 +274,339 @@ def read_link_status(address, sysfs_root=None):
     }
 
 
+def payload_size(code):
+    """Return the byte size of an MPS/MRRS encoding, or None if reserved."""
+    return PAYLOAD_SIZES[code] if code < len(PAYLOAD_SIZES) else None
+
+
+def payload_code(size):
+    """Return the MPS/MRRS encoding of a byte size (128-4096)."""
+    try:
+        return PAYLOAD_SIZES.index(size)
+    except ValueError:
+        raise ValueRangeError("invalid payload size: %r" % (size,))
+
+
+def decode_device_capabilities(devcap):
+    """Decode the Device Capabilities (DEVCAP) register."""
+    return {
+        "max_payload_supported": payload_size(devcap & PCI_EXP_DEVCAP_PAYLOAD),
+        "extended_tags_supported": bool(devcap & PCI_EXP_DEVCAP_EXT_TAG),
+        "flr_supported": bool(devcap & PCI_EXP_DEVCAP_FLR),
+    }
+
+
+def decode_device_control(devctl):
+    """Decode the Device Control (DEVCTL) register."""
+    return {
+        "max_payload": payload_size(
+            (devctl & PCI_EXP_DEVCTL_PAYLOAD) >> PCI_EXP_DEVCTL_PAYLOAD_SHIFT
+        ),
+        "max_read_request": payload_size(
+            (devctl & PCI_EXP_DEVCTL_READRQ) >> PCI_EXP_DEVCTL_READRQ_SHIFT
+        ),
+        "relaxed_ordering": bool(devctl & PCI_EXP_DEVCTL_RELAX_EN),
+        "extended_tags": bool(devctl & PCI_EXP_DEVCTL_EXT_TAG),
+        "no_snoop": bool(devctl & PCI_EXP_DEVCTL_NOSNOOP_EN),
+    }
+
+
+def decode_device_capabilities2(devcap2):
+    """Decode the Device Capabilities 2 (DEVCAP2) tag fields."""
+    return {
+        "ten_bit_tag_completer_supported": bool(
+            devcap2 & PCI_EXP_DEVCAP2_10BIT_TAG_COMP
+        ),
+        "ten_bit_tag_requester_supported": bool(
+            devcap2 & PCI_EXP_DEVCAP2_10BIT_TAG_REQ
+        ),
+    }
+
+
+def decode_device_control2(devctl2):
+    """Decode the Device Control 2 (DEVCTL2) tag fields."""
+    return {"ten_bit_tags": bool(devctl2 & PCI_EXP_DEVCTL2_10BIT_TAG_REQ_EN)}
+
+
+@instrument.timed("link")
+def read_device_control(address, sysfs_root=None):
+    """Return decoded DEVCAP and DEVCTL fields plus the raw register values.
+
+    DEVCAP2/DEVCTL2 are included for version 2 capabilities.
+    """
+    base = _pcie_cap_base(address, sysfs_root=sysfs_root)
+    devcap = config.read_u32(address, base + PCI_EXP_DEVCAP, sysfs_root=sysfs_root)
+    devctl = config.read_u16(address, base + PCI_EXP_DEVCTL, sysfs_root=sysfs_root)
+    decoded = {"devcap": devcap, "devctl": devctl}
+    decoded.update(decode_device_capabilities(devcap))
+    decoded.update(decode_device_control(devctl))
+    if _pcie_cap_version(address, base, sysfs_root=sysfs_root) >= 2:
+        devcap2 = config.read_u32(address, base + PCI_EXP_DEVCAP2, sysfs_root=sysfs_root)
+        devctl2 = config.read_u16(address, base + PCI_EXP_DEVCTL2, sysfs_root=sysfs_root)
+        decoded["devcap2"] = devcap2
+        decoded["devctl2"] = devctl2
+        decoded.update(decode_device_capabilities2(devcap2))
+        decoded.update(decode_device_control2(devctl2))
+    return decoded
+
+
+def decode_link_capabilities(lnkcap, lnkcap2=None):
+    """Decode LNKCAP and, when given, the LNKCAP2 supported speeds vector."""
+    speed_code = lnkcap & PCI_EXP_LNKCAP_SLS
+    vector = (lnkcap2 or 0) & PCI_EXP_LNKCAP2_SLS
+    if vector:
+        codes = [code for code in range(1, 8) if vector & (1 << code)]
+    else:
+        # Pre-2.0 capability: every speed up to the maximum is supported.
+        codes = list(range(1, speed_code + 1))
+    return {
+        "max_speed_code": speed_code,
+        "max_speed_gtps": _TLS_TO_LINK_SPEED.get(speed_code),
+        "max_width": (lnkcap & PCI_EXP_LNKCAP_MLW) >> 4,
+        "supported_speeds_gtps": [
+            _TLS_TO_LINK_SPEED[code] for code in codes if code in _TLS_TO_LINK_SPEED
+        ],
+        "aspm_support": (lnkcap & PCI_EXP_LNKCAP_ASPMS) >> 10,
+        "l0s_exit_latency_ns": l0s_exit_latency_ns(lnkcap),
+        "l1_exit_latency_ns": l1_exit_latency_ns(lnkcap),
+        "dll_link_active_reporting": bool(lnkcap & PCI_EXP_LNKCAP_DLLLARC),
+        "port_number": (lnkcap & PCI_EXP_LNKCAP_PN) >> 24,
+    }
+
+
+def l0s_exit_latency_ns(lnkcap):
+    """Return the worst-case L0s exit latency LNKCAP advertises, in ns.
+
+    The top encoding means "more than 4us"; it is counted as 5us.
+    """
+    code = (lnkcap & PCI_EXP_LNKCAP_L0SEL) >> 12
+    return 5000 if code == 7 else 64 << code
+
+
+def l1_exit_latency_ns(lnkcap):
+    """Return the worst-case L1 exit latency LNKCAP advertises, in ns.
+
+    The top encoding means "more than 64us"; it is counted as 65us.
+    """
+    code = (lnkcap & PCI_EXP_LNKCAP_L1EL) >> 15
+    return 65000 if code == 7 else 1000 << code
+
+
+def decode_aspm_control(lnkctl):
+    """Return the ASPM states enabled in LNKCTL ("l0s", "l1")."""
+    states = []
+    if lnkctl & PCI_EXP_LNKCTL_ASPM_L0S:
+        states.append("l0s")
+    if lnkctl & PCI_EXP_LNKCTL_ASPM_L1:
+        states.append("l1")
+    return states
+
+
+def _t_power_on_us(scale, value):
+    if scale >= len(_T_POWER_ON_SCALE_US):
+        return None
+    return _T_POWER_ON_SCALE_US[scale] * value
+
+
+def decode_l1ss(cap, ctl1=0, ctl2=0):
+    """Decode the L1 PM Substates capability and control registers.
+
+    ``supported``/``enabled`` list the ASPM substates ("l1.1", "l1.2");
+    the PCI-PM (software-directed) ones are reported separately. Times are
+    in microseconds and the LTR threshold in nanoseconds.
+    """
+    supported = []
+    enabled = []
+    if cap & PCI_L1SS_CAP_ASPM_L1_1:
+        supported.append("l1.1")
+    if cap & PCI_L1SS_CAP_ASPM_L1_2:
+        supported.append("l1.2")
+    if ctl1 & PCI_L1SS_CTL1_ASPM_L1_1:
+        enabled.append("l1.1")
+    if ctl1 & PCI_L1SS_CTL1_ASPM_L1_2:
+        enabled.append("l1.2")
+    ltr_scale = (ctl1 & PCI_L1SS_CTL1_LTR_L12_TH_SCALE) >> 29
+    ltr_value = (ctl1 & PCI_L1SS_CTL1_LTR_L12_TH_VALUE) >> 16
+    return {
+        "supported": supported,
+        "enabled": enabled,
+        "pcipm_l1_1_supported": bool(cap & PCI_L1SS_CAP_PCIPM_L1_1),
+        "pcipm_l1_2_supported": bool(cap & PCI_L1SS_CAP_PCIPM_L1_2),
+        "pcipm_l1_1_enabled": bool(ctl1 & PCI_L1SS_CTL1_PCIPM_L1_1),
+        "pcipm_l1_2_enabled": bool(ctl1 & PCI_L1SS_CTL1_PCIPM_L1_2),
+        "port_common_mode_restore_us": (cap & PCI_L1SS_CAP_CM_RESTORE_TIME) >> 8,
+        "port_t_power_on_us": _t_power_on_us(
+            (cap & PCI_L1SS_CAP_P_PWR_ON_SCALE) >> 16,
+            (cap & PCI_L1SS_CAP_P_PWR_ON_VALUE) >> 19,
+        ),
+        "common_mode_restore_us": (ctl1 & PCI_L1SS_CTL1_CM_RESTORE_TIME) >> 8,
+        "t_power_on_us": _t_power_on_us(
+            ctl2 & PCI_L1SS_CTL2_T_PWR_ON_SCALE,
+            (ctl2 & PCI_L1SS_CTL2_T_PWR_ON_VALUE) >> 3,
+        ),
+        "ltr_l1_2_threshold_ns": (
+            ltr_value * _LTR_SCALE_NS[ltr_scale]
+            if ltr_scale < len(_LTR_SCALE_NS)
+            else None
+        ),
+    }
+
+
+def link_encoding(speed_gtps, flit=False):
+    """Return the encoding name and payload efficiency of a link speed.
+
+    ``flit`` is the Flit Mode Status of LNKSTA2; 64 GT/s always uses flits.
+    """
+    if speed_gtps is not None and speed_gtps >= 64.0:
+        return "flit", _FLIT_EFFICIENCY
+    if speed_gtps in (2.5, 5.0):
+        name, efficiency = "8b/10b", 8.0 / 10.0
+    else:
+        name, efficiency = "128b/130b", 128.0 / 130.0
+    if flit:
+        return name + "+flit", efficiency * _FLIT_EFFICIENCY
+    return name, efficiency
+
+
+def link_bandwidth(speed_gtps, width, flit=False):
+    """Return the theoretical per-direction bandwidth in GB/s after encoding."""
+    if not speed_gtps or not width:
+        return 0.0
+    efficiency = link_encoding(speed_gtps, flit)[1]
+    return speed_gtps * efficiency * width / 8.0
+
+
+def link_text(speed_gtps, width):
+    """Return "16GT/s x8" style text; an unknown speed is shown as "?"."""
+    return "%sGT/s x%d" % ("?" if speed_gtps is None else "%g" % speed_gtps, width)
+
+
+@instrument.timed("link")
+def read_link_capabilities(address, sysfs_root=None):
+    """Return decoded LNKCAP (and LNKCAP2 on v2 capabilities) fields."""
+    base = _pcie_cap_base(address, sysfs_root=sysfs_root)
+    lnkcap = config.read_u32(address, base + PCI_EXP_LNKCAP, sysfs_root=sysfs_root)
+    lnkcap2 = None
+    if _pcie_cap_version(address, base, sysfs_root=sysfs_root) >= 2:
+        lnkcap2 = config.read_u32(address, base + PCI_EXP_LNKCAP2, sysfs_root=sysfs_root)
+    return decode_link_capabilities(lnkcap, lnkcap2)
+
+
+def parse_link_speed(text):
+    """Parse a sysfs link speed such as "16.0 GT/s PCIe" into GT/s (or None)."""
+    parts = text.split()
+    if not parts:
+        return None
+    try:
+        speed = float(parts[0])
+    except ValueError:
+        return None
+    return speed if speed in _LINK_SPEED_TO_TLS else None
+
+
+def read_sysfs_link_attrs(address, sysfs=None):
+    """Return the kernel's link attributes for a device.
+
+    Keys are ``current_speed_gtps``, ``current_width``, ``max_speed_gtps``
+    and ``max_width``; attributes the kernel does not provide (or reports as
+    "Unknown") are None. Raises ResourceNotFoundError if none are present.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    values = {}
+    found = False
+    with sysfs.open_device(address) as device:
+        for key, name, parse in _SYSFS_LINK_ATTRS:
+            try:
+                text = device.read_text(name)
+            except ResourceNotFoundError:
+                values[key] = None
+                continue
+            found = True
+            values[key] = parse(text)
+    if not found:
+        raise ResourceNotFoundError(
+            "no link attributes in sysfs for %s" % PciAddress.parse(address).bdf
+        )
+    return values
+
+
+def _parse_link_width(text):
+    try:
+        width = int(text.strip(), 10)
+    except ValueError:
+        return None
+    return width or None
+
+
+_SYSFS_LINK_ATTRS = (
+    ("current_speed_gtps", "current_link_speed", parse_link_speed),
+    ("current_width", "current_link_width", _parse_link_width),
+    ("max_speed_gtps", "max_link_speed", parse_link_speed),
+    ("max_width", "max_link_width", _parse_link_width),
+)
+
+
+def decode_sysfs_link_status(speed_text, width_text):
+    """Build a link status dict from ``current_link_speed``/``current_link_width``.
+
+    The kernel does not expose Link Training or DLLLA there, so
+    ``training`` and ``dll_link_active`` are None.
+    """
+    speed = parse_link_speed(speed_text)
+    return {
+        "speed_code": _LINK_SPEED_TO_TLS.get(speed, 0),
+        "speed_gtps": speed,
+        "width": _parse_link_width(width_text) or 0,
+        "training": None,
+        "dll_link_active": None,
+    }
+
+
+def _read_sysfs_link_status(address, sysfs_root=None):
+    sysfs = Sysfs(root=sysfs_root) if sysfs_root else Sysfs()
+    with sysfs.open_device(address) as device:
+        speed = device.read_text("current_link_speed")
+        width = device.read_text("current_link_width")
+    return decode_sysfs_link_status(speed, width)
+
+
+@instrument.timed("link")
+def read_link_status(address, sysfs_root=None, source="config", with_source=False):
+    """Return decoded Link Status fields.
+
+    ``source="config"`` (the default) reads LNKSTA. ``"auto"`` reads the kernel's ``current_link_speed`` and
+    ``current_link_width`` attributes (no capability walk, no root needed)
+    and falls back to LNKSTA in config space when they are missing, and
+    ``"sysfs"`` requires the attributes. The attributes carry no Link
+    Training or DLLLA state, so those fields are None when they are used.
+    With ``with_source`` the result also carries the ``source`` that was
+    used.
+    """
+    if source not in LINK_STATUS_SOURCES:
+        raise ValueRangeError(
+            "source must be one of %s" % ", ".join(LINK_STATUS_SOURCES)
+        )
+    decoded = None
+    if source != "config":
+        try:
+            decoded = _read_sysfs_link_status(address, sysfs_root=sysfs_root)
+        except ResourceNotFoundError:
+            if source == "sysfs":
+                raise
+    if decoded is not None:
+        used = "sysfs"
+    else:
+        base = _pcie_cap_base(address, sysfs_root=sysfs_root)
+        status = config.read_u16(address, base + PCI_EXP_LNKSTA, sysfs_root=sysfs_root)
+        decoded = decode_link_status(status)
+        used = "config"
+    if with_source:
+        decoded["source"] = used
+    return decoded
+
+
+@instrument.timed("link")
 def wait_for_link_training(address, timeout_s=1.0, poll_s=0.01, sysfs_root=None):
     """Wait until the Link Training bit clears; return True if it does."""
     timeout_s = float(timeout_s)
@@ -140,6 +621,7 @@ def wait_for_link_training(address, timeout_s=1.0, poll_s=0.01, sysfs_root=None)
     return False
 
 
+@instrument.timed("link")
 def link_hot_reset(address, sysfs_root=None, delay_s=0.002):
     """Trigger a hot reset via the secondary bus reset bit on bridges."""
     hdr = config.read_u8(address, PCI_HEADER_TYPE, sysfs_root=sysfs_root)
@@ -162,6 +644,7 @@ def link_hot_reset(address, sysfs_root=None, delay_s=0.002):
     )
 
 
+@instrument.timed("link")
 def set_link_control_bits(address, mask, enable=True, sysfs_root=None):
     """Generic helper to set or clear Link Control bits."""
     mask = validate_u16(mask)
@@ -169,10 +652,42 @@ def set_link_control_bits(address, mask, enable=True, sysfs_root=None):
 
 
 __all__ = [
+    "ASPM_STATES",
+    "DOWNSTREAM_PORT_TYPES",
+    "LINK_STATUS_SOURCES",
+    "PAYLOAD_SIZES",
+    "PCI_EXP_TYPE_DOWNSTREAM",
+    "PCI_EXP_TYPE_ENDPOINT",
+    "PCI_EXP_TYPE_LEG_END",
+    "PCI_EXP_TYPE_PCI_BRIDGE",
+    "PCI_EXP_TYPE_ROOT_PORT",
+    "PCI_EXP_TYPE_UPSTREAM",
+    "PcieCaps",
+    "decode_aspm_control",
+    "decode_device_capabilities",
+    "decode_device_capabilities2",
+    "decode_device_control",
+    "decode_device_control2",
+    "decode_link_capabilities",
+    "decode_l1ss",
+    "decode_link_status",
+    "decode_sysfs_link_status",
+    "l0s_exit_latency_ns",
+    "l1_exit_latency_ns",
+    "link_bandwidth",
     "link_disable",
     "link_enable",
+    "link_encoding",
     "link_hot_reset",
+    "link_text",
+    "parse_link_speed",
+    "payload_code",
+    "payload_size",
+    "read_device_control",
+    "read_link_capabilities",
     "read_link_status",
+    "read_pcie_caps",
+    "read_sysfs_link_attrs",
     "retrain_link",
     "set_link_control_bits",
     "set_target_link_speed",
@@ -0,0 +1,387 @@
+"""Fleet-wide PCIe link status sampling with change events."""
+
+import collections
+import os
+import struct
+import time
+
+from . import config, instrument
+from .capability import find_pcie_capability
+from .errors import (
+    OutOfRangeError,
+    PciError,
+    PermissionDeniedError,
+    ResourceNotFoundError,
+    ValueRangeError,
+)
+from .link import (
+    LINK_STATUS_SOURCES,
+    PCI_EXP_FLAGS,
+    PCI_EXP_LNKSTA,
+    PCI_EXP_LNKSTA2,
+    PCI_EXP_LNKSTA_CLS,
+    PCI_EXP_LNKSTA_DLLLA,
+    PCI_EXP_LNKSTA_LT,
+    PCI_EXP_LNKSTA_NLW,
+    PCI_EXP_LNKSTA_NLW_SHIFT,
+    decode_link_status,
+    decode_sysfs_link_status,
+)
+from .sysfs import Sysfs, _map_os_error
+from .types import PciAddress
+
+_LNKSTA_WATCH_MASK = (
+    PCI_EXP_LNKSTA_CLS | PCI_EXP_LNKSTA_NLW | PCI_EXP_LNKSTA_LT | PCI_EXP_LNKSTA_DLLLA
+)
+_WATCHED_FIELDS = ("speed_code", "width", "dll_link_active", "training")
+_U16 = struct.Struct("<H")
+_SYSFS_LINK_FILES = ("current_link_speed", "current_link_width")
+_ATTR_READ_SIZE = 64
+
+
+class LinkSample(object):
+    """One LNKSTA (and optional LNKSTA2) reading for a port.
+
+    Samples taken from sysfs carry an LNKSTA value rebuilt from the speed
+    and width attributes, so training and DLLLA decode as None.
+    """
+
+    __slots__ = ("timestamp", "lnksta", "lnksta2", "source")
+
+    def __init__(self, timestamp, lnksta, lnksta2=None, source="config"):
+        self.timestamp = timestamp
+        self.lnksta = lnksta
+        self.lnksta2 = lnksta2
+        self.source = source
+
+    def decode(self):
+        status = decode_link_status(self.lnksta)
+        if self.source == "sysfs":
+            status["training"] = None
+            status["dll_link_active"] = None
+        if self.lnksta2 is not None:
+            status["lnksta2"] = self.lnksta2
+        return status
+
+    def __repr__(self):
+        return "LinkSample(t=%.6f, lnksta=0x%04x)" % (self.timestamp, self.lnksta)
+
+
+class LinkEvent(object):
+    """Change event for one port: field name -> (old, new)."""
+
+    __slots__ = ("address", "timestamp", "changes", "sample")
+
+    def __init__(self, address, timestamp, changes, sample):
+        self.address = address
+        self.timestamp = timestamp
+        self.changes = changes
+        self.sample = sample
+
+    def __repr__(self):
+        parts = ", ".join(
+            "%s=%r->%r" % (name, old, new)
+            for name, (old, new) in sorted(self.changes.items())
+        )
+        return "LinkEvent(%s, %s)" % (self.address.bdf, parts)
+
+
+class _Port(object):
+    __slots__ = (
+        "address",
+        "fd",
+        "attr_fds",
+        "lnksta_offset",
+        "lnksta2_offset",
+        "last",
+        "history",
+    )
+
+    def __init__(self, address, history):
+        self.address = address
+        self.fd = None
+        self.attr_fds = None
+        self.lnksta_offset = None
+        self.lnksta2_offset = None
+        self.last = None
+        self.history = collections.deque(maxlen=history)
+
+
+def _read_u16(fd, offset):
+    try:
+        data = os.pread(fd, 2, offset)
+    except OSError as exc:
+        raise _map_os_error(exc)
+    if instrument.state.enabled:
+        instrument.count_syscall("pread", len(data))
+    if len(data) != 2:
+        raise OutOfRangeError("short read from config")
+    return _U16.unpack(data)[0]
+
+
+def _read_attr(fd):
+    # sysfs regenerates an attribute on every read from offset 0.
+    try:
+        data = os.pread(fd, _ATTR_READ_SIZE, 0)
+    except OSError as exc:
+        raise _map_os_error(exc)
+    if instrument.state.enabled:
+        instrument.count_syscall("pread", len(data))
+    return data.decode("ascii", "replace").strip()
+
+
+def _open_file(path):
+    if instrument.state.enabled:
+        instrument.count_syscall("open")
+    try:
+        return os.open(path, os.O_RDONLY)
+    except FileNotFoundError as exc:
+        raise ResourceNotFoundError(str(exc))
+    except PermissionError as exc:
+        raise PermissionDeniedError(str(exc))
+    except OSError as exc:
+        raise ResourceNotFoundError(str(exc))
+
+
+class LinkMonitor(object):
+    """Sample link status for many ports and report only changes.
+
+    The PCIe capability offset of every port is resolved once in ``open()``
+    and each config file stays open until ``close()``, so a sampling pass
+    costs one ``pread`` per port (two with ``include_lnksta2`` on version 2
+    capabilities). A port that fails to read is skipped for that pass and
+    its error kept in ``errors``.
+
+    ``source="sysfs"`` keeps the kernel's ``current_link_speed`` and
+    ``current_link_width`` attributes open instead, which needs no root and
+    no capability walk but cannot see training or DLLLA changes;
+    ``"auto"`` uses them where present and config space elsewhere.
+    """
+
+    def __init__(
+        self,
+        addresses,
+        sysfs_root=None,
+        include_lnksta2=False,
+        history=64,
+        callback=None,
+        source="config",
+    ):
+        if not isinstance(history, int) or isinstance(history, bool) or history <= 0:
+            raise ValueRangeError("history must be a positive integer")
+        if source not in LINK_STATUS_SOURCES:
+            raise ValueRangeError(
+                "source must be one of %s" % ", ".join(LINK_STATUS_SOURCES)
+            )
+        self.source = source
+        self.sysfs = Sysfs(root=sysfs_root) if sysfs_root else Sysfs()
+        self.include_lnksta2 = bool(include_lnksta2)
+        self.callback = callback
+        self.errors = {}
+        self._ports = []
+        self._by_address = {}
+        for addr in addresses:
+            address = PciAddress.parse(addr)
+            if address in self._by_address:
+                continue
+            port = _Port(address, history)
+            self._ports.append(port)
+            self._by_address[address] = port
+        self._opened = False
+
+    @property
+    def addresses(self):
+        return [port.address for port in self._ports]
+
+    def open(self):
+        if self._opened:
+            return self
+        try:
+            for port in self._ports:
+                if self.source != "config" and self._open_attrs(port):
+                    continue
+                base = find_pcie_capability(port.address, sysfs_root=self.sysfs.root)
+                if not base:
+                    raise ResourceNotFoundError(
+                        "PCIe capability not found for %s" % port.address.bdf
+                    )
+                port.lnksta_offset = base + PCI_EXP_LNKSTA
+                if self.include_lnksta2:
+                    flags = config.read_u16(
+                        port.address, base + PCI_EXP_FLAGS, sysfs_root=self.sysfs.root
+                    )
+                    # LNKSTA2 only exists in version 2 capabilities.
+                    if flags & 0xF >= 2:
+                        port.lnksta2_offset = base + PCI_EXP_LNKSTA2
+                port.fd = _open_file(self.sysfs.config_path(port.address))
+        except Exception:
+            self.close()
+            raise
+        self._opened = True
+        return self
+
+    def _open_attrs(self, port):
+        fds = []
+        try:
+            for name in _SYSFS_LINK_FILES:
+                path = os.path.join(self.sysfs.device_dir(port.address), name)
+                fds.append(_open_file(path))
+        except ResourceNotFoundError:
+            for fd in fds:
+                os.close(fd)
+            if self.source == "sysfs":
+                raise
+            return False
+        port.attr_fds = fds
+        return True
+
+    def close(self):
+        for port in self._ports:
+            if port.fd is not None:
+                os.close(port.fd)
+                port.fd = None
+            for fd in port.attr_fds or ():
+                os.close(fd)
+            port.attr_fds = None
+        self._opened = False
+
+    def sources(self):
+        """Return {address: "sysfs" | "config"} for the opened ports."""
+        if not self._opened:
+            self.open()
+        return {
+            port.address: "sysfs" if port.attr_fds else "config"
+            for port in self._ports
+        }
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def poll(self):
+        """Sample every port once and return the list of change events.
+
+        The first sample of a port only establishes its baseline. Ports
+        that fail to read are left out of the pass and their PciError is
+        recorded in ``errors``, which is reset on every pass.
+        """
+        if not self._opened:
+            self.open()
+        events = []
+        self.errors = {}
+        for port in self._ports:
+            now = time.monotonic()
+            try:
+                sample = self._sample(port, now)
+            except PciError as exc:
+                self.errors[port.address] = exc
+                continue
+            lnksta = sample.lnksta
+            last = port.last
+            port.last = sample
+            port.history.append(sample)
+            if last is None:
+                continue
+            if (
+                (last.lnksta ^ lnksta) & _LNKSTA_WATCH_MASK == 0
+                and last.lnksta2 == sample.lnksta2
+            ):
+                continue
+            events.append(LinkEvent(port.address, now, _diff(last, sample), sample))
+        if self.callback is not None:
+            for event in events:
+                self.callback(event)
+        return events
+
+    def _sample(self, port, now):
+        if port.attr_fds:
+            speed_fd, width_fd = port.attr_fds
+            status = decode_sysfs_link_status(
+                _read_attr(speed_fd), _read_attr(width_fd)
+            )
+            lnksta = status["speed_code"] | (
+                status["width"] << PCI_EXP_LNKSTA_NLW_SHIFT
+            )
+            return LinkSample(now, lnksta, source="sysfs")
+        lnksta = _read_u16(port.fd, port.lnksta_offset)
+        lnksta2 = None
+        if port.lnksta2_offset is not None:
+            lnksta2 = _read_u16(port.fd, port.lnksta2_offset)
+        return LinkSample(now, lnksta, lnksta2)
+
+    def events(self, interval_s=0.1, count=None):
+        """Yield change events while sampling at a fixed rate.
+
+        ``count`` limits the number of sampling passes (``None`` runs forever).
+        """
+        for events in self._passes(interval_s, count):
+            for event in events:
+                yield event
+
+    def run(self, interval_s=0.1, count=None, duration_s=None):
+        """Sample at a fixed rate, delivering events to the callback.
+
+        Stops after ``count`` passes or ``duration_s`` seconds, whichever
+        comes first; returns the total number of events seen.
+        """
+        deadline = None
+        if duration_s is not None:
+            deadline = time.monotonic() + float(duration_s)
+        total = 0
+        for events in self._passes(interval_s, count, deadline=deadline):
+            total += len(events)
+        return total
+
+    def _passes(self, interval_s, count, deadline=None):
+        interval_s = float(interval_s)
+        if interval_s < 0:
+            raise ValueRangeError("interval must be non-negative")
+        done = 0
+        next_tick = time.monotonic()
+        while count is None or done < count:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            yield self.poll()
+            done += 1
+            if count is not None and done >= count:
+                return
+            next_tick += interval_s
+            now = time.monotonic()
+            if next_tick < now:
+                # Fell behind by more than one period; skip the missed ticks.
+                next_tick = now
+            else:
+                time.sleep(next_tick - now)
+
+    def last(self, addr):
+        """Return the most recent LinkSample for a port, or None."""
+        return self._port(addr).last
+
+    def history(self, addr):
+        """Return the buffered LinkSample history for a port, oldest first."""
+        return list(self._port(addr).history)
+
+    def _port(self, addr):
+        address = PciAddress.parse(addr)
+        try:
+            return self._by_address[address]
+        except KeyError:
+            raise ValueRangeError("port not monitored: %s" % address.bdf)
+
+
+def _diff(old, new):
+    before = old.decode()
+    after = new.decode()
+    changes = {}
+    for name in _WATCHED_FIELDS:
+        if before[name] != after[name]:
+            changes[name] = (before[name], after[name])
+    if old.lnksta2 != new.lnksta2:
+        changes["lnksta2"] = (old.lnksta2, new.lnksta2)
+    return changes
+
+
+__all__ = ["LinkEvent", "LinkMonitor", "LinkSample"]
@@ -0,0 +1,208 @@
+"""Max Payload Size / Max Read Request Size planning and tuning."""
+
+from . import config as config_access
+from .discover import read_device_tree, walk_subtree
+from .errors import PermissionDeniedError, ResourceNotFoundError, ValueRangeError
+from .link import (
+    PAYLOAD_SIZES,
+    PCI_EXP_DEVCAP,
+    PCI_EXP_DEVCTL,
+    PCI_EXP_DEVCTL_PAYLOAD,
+    PCI_EXP_DEVCTL_PAYLOAD_SHIFT,
+    PCI_EXP_DEVCTL_READRQ,
+    PCI_EXP_DEVCTL_READRQ_SHIFT,
+    PCI_EXP_TYPE_ROOT_PORT,
+    decode_device_capabilities,
+    decode_device_control,
+    payload_code,
+    read_pcie_caps,
+)
+from .sysfs import Sysfs
+
+POLICIES = ("safe", "performance", "peer-to-peer")
+
+
+class MpsSetting(object):
+    """Current and planned MPS/MRRS of one function."""
+
+    __slots__ = (
+        "address",
+        "bridge",
+        "cap_offset",
+        "mpss",
+        "mps",
+        "mrrs",
+        "new_mps",
+        "new_mrrs",
+    )
+
+    def __init__(self, address, bridge, cap_offset, mpss, mps, mrrs):
+        self.address = address
+        self.bridge = bridge
+        self.cap_offset = cap_offset
+        self.mpss = mpss
+        self.mps = mps
+        self.mrrs = mrrs
+        self.new_mps = mps
+        self.new_mrrs = mrrs
+
+    @property
+    def changed(self):
+        return self.new_mps != self.mps or self.new_mrrs != self.mrrs
+
+    def as_dict(self):
+        return {
+            "bdf": self.address.bdf,
+            "bridge": self.bridge,
+            "max_payload_supported": self.mpss,
+            "max_payload": self.mps,
+            "max_read_request": self.mrrs,
+            "new_max_payload": self.new_mps,
+            "new_max_read_request": self.new_mrrs,
+            "changed": self.changed,
+        }
+
+    def __repr__(self):
+        return "MpsSetting(%s, mps %s->%s, mrrs %s->%s)" % (
+            self.address.bdf,
+            self.mps,
+            self.new_mps,
+            self.mrrs,
+            self.new_mrrs,
+        )
+
+
+def _read_setting(address, sysfs):
+    try:
+        caps = read_pcie_caps(address, sysfs=sysfs)
+    except (PermissionDeniedError, ResourceNotFoundError):
+        return None
+    devcap = caps.u32(PCI_EXP_DEVCAP)
+    devctl = caps.u16(PCI_EXP_DEVCTL)
+    if devcap is None or devctl is None:
+        return None
+    mpss = decode_device_capabilities(devcap)["max_payload_supported"]
+    if mpss is None:
+        return None
+    control = decode_device_control(devctl)
+    setting = MpsSetting(
+        address,
+        caps.bridge,
+        caps.base,
+        mpss,
+        control["max_payload"],
+        control["max_read_request"],
+    )
+    return setting, caps.port_type
+
+
+def plan(policy="safe", sysfs=None, workers=8):
+    """Return an MpsSetting per PCIe function below every root port.
+
+    ``safe`` gives every device in a root-port subtree the smallest MPS
+    supported anywhere in it and leaves MRRS alone. ``performance`` gives
+    each device the smallest MPS supported on its own path from the root
+    port and sets endpoint MRRS to that MPS, so no completion it asks for
+    exceeds what it accepts. ``peer-to-peer`` uses one MPS for the whole
+    fabric, so any device can write to any other, and raises endpoint MRRS
+    to 4096 since completions are already limited to that common MPS.
+    """
+    if policy not in POLICIES:
+        raise ValueRangeError("policy must be one of %s" % ", ".join(POLICIES))
+    if sysfs is None:
+        sysfs = Sysfs()
+    roots, children, read = read_device_tree(
+        lambda addr: _read_setting(addr, sysfs), sysfs=sysfs, workers=workers
+    )
+    settings = {address: setting for address, (setting, _) in read.items()}
+
+    subtrees = []
+    for root in roots:
+        if root not in read or read[root][1] != PCI_EXP_TYPE_ROOT_PORT:
+            continue
+        members = []
+        for node, ancestors in walk_subtree(root, children):
+            setting = settings.get(node)
+            if setting is None:
+                continue
+            path = [settings[port] for port in ancestors if port in settings]
+            path_min = min(entry.mpss for entry in path + [setting])
+            members.append((setting, path_min))
+        subtrees.append(members)
+
+    fabric_min = min(
+        [setting.mpss for members in subtrees for setting, _ in members]
+        or [PAYLOAD_SIZES[0]]
+    )
+    result = []
+    for members in subtrees:
+        subtree_min = min(setting.mpss for setting, _ in members)
+        for setting, path_min in members:
+            if policy == "safe":
+                setting.new_mps = subtree_min
+            elif policy == "performance":
+                setting.new_mps = path_min
+                if not setting.bridge:
+                    setting.new_mrrs = path_min
+            else:
+                setting.new_mps = fabric_min
+                if not setting.bridge:
+                    setting.new_mrrs = PAYLOAD_SIZES[-1]
+            result.append(setting)
+    return result
+
+
+def apply(settings, sysfs=None):
+    """Write the planned values, one DEVCTL read-modify-write per changed function.
+
+    Functions are written in plan order (each root port before the devices
+    below it). Returns the number of functions written.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    written = 0
+    for setting in settings:
+        if not setting.changed:
+            continue
+        mask = bits = 0
+        if setting.new_mps != setting.mps:
+            mask |= PCI_EXP_DEVCTL_PAYLOAD
+            bits |= payload_code(setting.new_mps) << PCI_EXP_DEVCTL_PAYLOAD_SHIFT
+        if setting.new_mrrs != setting.mrrs:
+            mask |= PCI_EXP_DEVCTL_READRQ
+            bits |= payload_code(setting.new_mrrs) << PCI_EXP_DEVCTL_READRQ_SHIFT
+        with config_access.ConfigHandle(setting.address, sysfs_root=sysfs.root) as handle:
+            handle.modify(setting.cap_offset + PCI_EXP_DEVCTL, 2, mask, bits)
+        setting.mps = setting.new_mps
+        setting.mrrs = setting.new_mrrs
+        written += 1
+    return written
+
+
+def format_plan(settings, show_all=False):
+    """Return dry-run diff lines ("-" current, "+" planned)."""
+    lines = []
+    for setting in settings:
+        if not (show_all or setting.changed):
+            continue
+        kind = "bridge" if setting.bridge else "endpoint"
+        if not setting.changed:
+            lines.append(
+                "  %s %-8s MPS %s MRRS %s (MPSS %s)"
+                % (setting.address.bdf, kind, setting.mps, setting.mrrs, setting.mpss)
+            )
+            continue
+        lines.append(
+            "- %s %-8s MPS %s MRRS %s (MPSS %s)"
+            % (setting.address.bdf, kind, setting.mps, setting.mrrs, setting.mpss)
+        )
+        lines.append(
+            "+ %s %-8s MPS %s MRRS %s"
+            % (setting.address.bdf, kind, setting.new_mps, setting.new_mrrs)
+        )
+    changed = sum(1 for setting in settings if setting.changed)
+    lines.append("%d functions, %d to change" % (len(settings), changed))
+    return lines
+
+
+__all__ = ["MpsSetting", "POLICIES", "apply", "format_plan", "plan"]
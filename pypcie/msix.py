@@ -0,0 +1,330 @@
+"""MSI-X capability, vector table and pending bits."""
+
+import array
+import struct
+import sys
+
+from . import bar as bar_access
+from . import config as config_access
+from .capability import find_pci_capability_in
+from .errors import OutOfRangeError, ResourceNotFoundError, ValueRangeError
+from .sysfs import Sysfs
+from .types import PciAddress
+
+PCI_CAP_ID_MSIX = 0x11
+PCI_MSIX_FLAGS = 0x02
+PCI_MSIX_FLAGS_QSIZE = 0x07FF
+PCI_MSIX_FLAGS_MASKALL = 0x4000
+PCI_MSIX_FLAGS_ENABLE = 0x8000
+PCI_MSIX_TABLE = 0x04
+PCI_MSIX_PBA = 0x08
+PCI_MSIX_BIR = 0x00000007
+PCI_MSIX_ENTRY_SIZE = 16
+PCI_MSIX_ENTRY_VECTOR_CTRL = 0x0C
+PCI_MSIX_ENTRY_CTRL_MASKBIT = 0x00000001
+
+
+def decode_msix(control, table, pba):
+    """Decode the MSI-X Message Control, Table and PBA registers."""
+    return {
+        "enabled": bool(control & PCI_MSIX_FLAGS_ENABLE),
+        "function_mask": bool(control & PCI_MSIX_FLAGS_MASKALL),
+        "table_size": (control & PCI_MSIX_FLAGS_QSIZE) + 1,
+        "table_bar": table & PCI_MSIX_BIR,
+        "table_offset": table & ~PCI_MSIX_BIR,
+        "pba_bar": pba & PCI_MSIX_BIR,
+        "pba_offset": pba & ~PCI_MSIX_BIR,
+    }
+
+
+class MsixCapability(object):
+    """Location and state of a function's MSI-X capability."""
+
+    __slots__ = (
+        "address",
+        "offset",
+        "enabled",
+        "function_mask",
+        "table_size",
+        "table_bar",
+        "table_offset",
+        "pba_bar",
+        "pba_offset",
+    )
+
+    def __init__(self, address, offset, control, table, pba):
+        self.address = address
+        self.offset = offset
+        decoded = decode_msix(control, table, pba)
+        for key, value in decoded.items():
+            setattr(self, key, value)
+
+    def as_dict(self):
+        return {
+            "bdf": self.address.bdf,
+            "offset": self.offset,
+            "enabled": self.enabled,
+            "function_mask": self.function_mask,
+            "table_size": self.table_size,
+            "table_bar": self.table_bar,
+            "table_offset": self.table_offset,
+            "pba_bar": self.pba_bar,
+            "pba_offset": self.pba_offset,
+        }
+
+    def __repr__(self):
+        return "MsixCapability(%s, %d vectors, table BAR %d+0x%x)" % (
+            self.address.bdf,
+            self.table_size,
+            self.table_bar,
+            self.table_offset,
+        )
+
+
+def find_msix(address, sysfs=None):
+    """Return the MsixCapability of a function, or None if it has none."""
+    if sysfs is None:
+        sysfs = Sysfs()
+    address = PciAddress.parse(address)
+    data = config_access.read_space(address, length=0x100, sysfs_root=sysfs.root)
+    pos = find_pci_capability_in(data, PCI_CAP_ID_MSIX)
+    if not pos or pos + PCI_MSIX_PBA + 4 > len(data):
+        return None
+    control, table, pba = struct.unpack_from("<HII", data, pos + PCI_MSIX_FLAGS)
+    return MsixCapability(address, pos, control, table, pba)
+
+
+def _dwords(data):
+    words = array.array("I")
+    words.frombytes(data)
+    if sys.byteorder != "little":
+        words.byteswap()
+    return words
+
+
+def _qwords(low, high):
+    return array.array("Q", [lo | (hi << 32) for lo, hi in zip(low, high)])
+
+
+class MsixTable(object):
+    """The vector table decoded into parallel arrays, one slot per vector.
+
+    ``addresses`` holds the 64-bit message addresses, ``data`` the message
+    data and ``control`` the vector control words. ``pending`` holds the
+    Pending Bit Array as 64-bit words, or None if it was not read.
+    """
+
+    __slots__ = ("capability", "addresses", "data", "control", "pending")
+
+    def __init__(self, capability, raw, pending=None):
+        words = _dwords(raw)
+        self.capability = capability
+        self.addresses = _qwords(words[0::4], words[1::4])
+        self.data = words[2::4]
+        self.control = words[3::4]
+        self.pending = pending
+
+    def __len__(self):
+        return len(self.control)
+
+    def masked(self, vector):
+        return bool(self.control[vector] & PCI_MSIX_ENTRY_CTRL_MASKBIT)
+
+    def is_pending(self, vector):
+        if self.pending is None:
+            return None
+        return bool(self.pending[vector // 64] >> (vector % 64) & 1)
+
+    def vector(self, vector):
+        return {
+            "vector": vector,
+            "address": self.addresses[vector],
+            "data": self.data[vector],
+            "masked": self.masked(vector),
+            "pending": self.is_pending(vector),
+        }
+
+    @property
+    def masked_count(self):
+        return sum(word & PCI_MSIX_ENTRY_CTRL_MASKBIT for word in self.control)
+
+    def as_dict(self):
+        return {
+            "capability": self.capability.as_dict(),
+            "vectors": [self.vector(index) for index in range(len(self))],
+        }
+
+
+class _Bars(object):
+    """BAR mappings used by one call: the pool's, or private ones closed after."""
+
+    __slots__ = ("address", "sysfs", "pool", "_owned")
+
+    def __init__(self, address, sysfs, pool):
+        self.address = address
+        self.sysfs = sysfs
+        self.pool = pool
+        self._owned = {}
+
+    def get(self, index):
+        if self.pool is not None:
+            return self.pool.bar(self.address, index)
+        pci_bar = self._owned.get(index)
+        if pci_bar is None:
+            pci_bar = self._owned[index] = bar_access.PciBar(
+                self.sysfs, self.address, index
+            )
+        return pci_bar
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for pci_bar in self._owned.values():
+            pci_bar.close()
+        return False
+
+
+def _capability(address, sysfs):
+    capability = find_msix(address, sysfs=sysfs)
+    if capability is None:
+        raise ResourceNotFoundError(
+            "%s has no MSI-X capability" % PciAddress.parse(address).bdf
+        )
+    return capability
+
+
+def _read_raw(bars, capability):
+    return bars.get(capability.table_bar).read_bytes(
+        capability.table_offset, capability.table_size * PCI_MSIX_ENTRY_SIZE
+    )
+
+
+def read_table(address, sysfs=None, pool=None, pending=True):
+    """Read the whole vector table, and the PBA, with one read each.
+
+    ``pool`` is an optional HandlePool whose BAR mappings are reused;
+    otherwise the BARs are mapped for the duration of the call.
+    """
+    if sysfs is None:
+        sysfs = pool.sysfs if pool is not None else Sysfs()
+    capability = _capability(address, sysfs)
+    pba = None
+    with _Bars(capability.address, sysfs, pool) as bars:
+        raw = _read_raw(bars, capability)
+        if pending:
+            words = _dwords(
+                bars.get(capability.pba_bar).read_bytes(
+                    capability.pba_offset, (capability.table_size + 63) // 64 * 8
+                )
+            )
+            pba = _qwords(words[0::2], words[1::2])
+    return MsixTable(capability, raw, pba)
+
+
+def parse_vectors(text):
+    """Parse "0-15,32,40-47" into a sorted list of vector numbers."""
+    vectors = set()
+    for part in str(text).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                first, last = part.split("-", 1)
+                vectors.update(range(int(first, 0), int(last, 0) + 1))
+            else:
+                vectors.add(int(part, 0))
+        except ValueError:
+            raise ValueRangeError("invalid vector range: %r" % (part,))
+    return sorted(vectors)
+
+
+def set_mask(address, vectors, masked=True, sysfs=None, pool=None):
+    """Mask (or unmask) vectors in one pass over the table.
+
+    The table is read once and only vectors whose mask bit changes get
+    their vector control word written; a final read flushes the posted
+    writes. Returns the number of vectors written.
+    """
+    if sysfs is None:
+        sysfs = pool.sysfs if pool is not None else Sysfs()
+    capability = _capability(address, sysfs)
+    vectors = sorted(set(vectors))
+    if vectors and (vectors[0] < 0 or vectors[-1] >= capability.table_size):
+        raise OutOfRangeError(
+            "vector out of range (table has %d entries)" % capability.table_size
+        )
+    written = 0
+    with _Bars(capability.address, sysfs, pool) as bars:
+        pci_bar = bars.get(capability.table_bar)
+        control = _dwords(_read_raw(bars, capability))[3::4]
+        offset = None
+        for vector in vectors:
+            word = control[vector]
+            if masked:
+                new = word | PCI_MSIX_ENTRY_CTRL_MASKBIT
+            else:
+                new = word & ~PCI_MSIX_ENTRY_CTRL_MASKBIT
+            if new == word:
+                continue
+            offset = (
+                capability.table_offset
+                + vector * PCI_MSIX_ENTRY_SIZE
+                + PCI_MSIX_ENTRY_VECTOR_CTRL
+            )
+            pci_bar.write_u32(offset, new)
+            written += 1
+        if offset is not None:
+            pci_bar.read_u32(offset)
+    return written
+
+
+def format_table(table, show_all=False):
+    """Return a capability summary line and one line per vector.
+
+    Without ``show_all`` only unmasked or pending vectors are listed.
+    """
+    cap = table.capability
+    lines = [
+        "MSI-X: %d vectors (%d masked), %s%s, table BAR %d+0x%x, PBA BAR %d+0x%x"
+        % (
+            len(table),
+            table.masked_count,
+            "enabled" if cap.enabled else "disabled",
+            ", function masked" if cap.function_mask else "",
+            cap.table_bar,
+            cap.table_offset,
+            cap.pba_bar,
+            cap.pba_offset,
+        ),
+        "%6s  %-18s  %-10s  %-6s  %s"
+        % ("VECTOR", "ADDRESS", "DATA", "MASKED", "PENDING"),
+    ]
+    for index in range(len(table)):
+        pending = table.is_pending(index)
+        if not (show_all or pending or not table.masked(index)):
+            continue
+        lines.append(
+            "%6d  0x%016x  0x%08x  %-6s  %s"
+            % (
+                index,
+                table.addresses[index],
+                table.data[index],
+                "yes" if table.masked(index) else "no",
+                "-" if pending is None else ("yes" if pending else "no"),
+            )
+        )
+    return lines
+
+
+__all__ = [
+    "MsixCapability",
+    "MsixTable",
+    "decode_msix",
+    "find_msix",
+    "format_table",
+    "parse_vectors",
+    "read_table",
+    "set_mask",
+]
@@ -0,0 +1,433 @@
+"""Peer-to-peer routes between devices and the ACS settings along them."""
+
+import concurrent.futures
+import itertools
+import os
+import struct
+
+from .capability import find_ext_capability_in
+from .discover import _PCI_DOMAIN_DIR_RE, _extract_bdfs_from_path, list_devices
+from .errors import PermissionDeniedError, ResourceNotFoundError, ValueRangeError
+from .link import (
+    DOWNSTREAM_PORT_TYPES,
+    PCI_EXP_LNKSTA,
+    PCI_EXP_TYPE_DOWNSTREAM,
+    PCI_EXP_TYPE_ENDPOINT,
+    PCI_EXP_TYPE_LEG_END,
+    PCI_EXP_TYPE_ROOT_PORT,
+    PCI_EXP_TYPE_UPSTREAM,
+    decode_link_status,
+    link_bandwidth,
+    link_text,
+    read_pcie_caps,
+)
+from .sysfs import Sysfs
+from .types import PciAddress, validate_workers
+
+PCI_EXT_CAP_ID_ACS = 0x000D
+PCI_ACS_CAP = 0x04
+PCI_ACS_CTRL = 0x06
+PCI_ACS_SV = 0x0001
+PCI_ACS_TB = 0x0002
+PCI_ACS_RR = 0x0004
+PCI_ACS_CR = 0x0008
+PCI_ACS_UF = 0x0010
+PCI_ACS_EC = 0x0020
+PCI_ACS_DT = 0x0040
+
+# ACS controls by the name used in the API and CLI.
+ACS_CONTROLS = (
+    ("source-validation", PCI_ACS_SV),
+    ("translation-blocking", PCI_ACS_TB),
+    ("request-redirect", PCI_ACS_RR),
+    ("completion-redirect", PCI_ACS_CR),
+    ("upstream-forwarding", PCI_ACS_UF),
+    ("egress-control", PCI_ACS_EC),
+    ("direct-translated", PCI_ACS_DT),
+)
+
+# Any of these sends peer requests up to the root complex instead of
+# across the switch (the set the kernel's p2pdma checks).
+_ACS_REDIRECT = PCI_ACS_RR | PCI_ACS_CR | PCI_ACS_EC
+
+ROUTES = ("same-device", "switch-local", "root-port", "cross-root-complex")
+
+_PORT_TYPES = {
+    PCI_EXP_TYPE_ENDPOINT: "endpoint",
+    PCI_EXP_TYPE_LEG_END: "endpoint",
+    PCI_EXP_TYPE_ROOT_PORT: "root-port",
+    PCI_EXP_TYPE_UPSTREAM: "upstream",
+    PCI_EXP_TYPE_DOWNSTREAM: "downstream",
+}
+_SWITCH_PORTS = (PCI_EXP_TYPE_UPSTREAM, PCI_EXP_TYPE_DOWNSTREAM)
+
+
+def decode_acs(cap, ctrl):
+    """Decode the ACS Capability and Control registers into control names."""
+    return {
+        "supported": [name for name, bit in ACS_CONTROLS if cap & bit],
+        "enabled": [name for name, bit in ACS_CONTROLS if ctrl & bit],
+    }
+
+
+class P2pNode(object):
+    """PCIe port type, link status and ACS registers of one function.
+
+    ``status`` is the decoded Link Status, None when config space could
+    not be read. ``acs_offset`` is 0 without an ACS capability.
+    """
+
+    __slots__ = ("address", "port_type", "status", "acs_offset", "acs_cap", "acs_ctrl")
+
+    def __init__(self, address, port_type=None, status=None):
+        self.address = address
+        self.port_type = port_type
+        self.status = status
+        self.acs_offset = 0
+        self.acs_cap = 0
+        self.acs_ctrl = 0
+
+    @property
+    def redirects(self):
+        """Whether ACS redirects peer traffic arriving at this function."""
+        return bool(self.acs_ctrl & _ACS_REDIRECT)
+
+    def as_dict(self):
+        return {
+            "bdf": self.address.bdf,
+            "type": _PORT_TYPES.get(self.port_type),
+            "acs": (
+                decode_acs(self.acs_cap, self.acs_ctrl) if self.acs_offset else None
+            ),
+            "redirects": self.redirects,
+        }
+
+
+def read_node(address, sysfs_root=None):
+    """Read one function's P2pNode with a single config space read."""
+    address = PciAddress.parse(address)
+    sysfs = Sysfs(root=sysfs_root) if sysfs_root else Sysfs()
+    try:
+        caps = read_pcie_caps(address, sysfs=sysfs, length=None)
+    except (PermissionDeniedError, ResourceNotFoundError):
+        return P2pNode(address)
+    lnksta = caps.u16(PCI_EXP_LNKSTA)
+    if lnksta is None:
+        return P2pNode(address)
+    node = P2pNode(address, caps.port_type, decode_link_status(lnksta))
+    data = caps.data
+    acs = find_ext_capability_in(data, PCI_EXT_CAP_ID_ACS)
+    if acs and acs + PCI_ACS_CTRL + 2 <= len(data):
+        node.acs_offset = acs
+        node.acs_cap, node.acs_ctrl = struct.unpack_from("<HH", data, acs + PCI_ACS_CAP)
+    return node
+
+
+class P2pPath(object):
+    """The route peer traffic takes from ``source`` to ``target``.
+
+    ``ports`` lists the bridges crossed in order, up from the source and
+    down to the target; ``common`` is the turning point shared by both
+    sides, or None when the route crosses the host bridge. ``links`` holds
+    every physical link crossed as dicts with the port, the device below it
+    and the link's speed, width and bandwidth.
+    """
+
+    __slots__ = ("source", "target", "route", "common", "ports", "links")
+
+    def __init__(self, source, target, route, common, ports, links):
+        self.source = source
+        self.target = target
+        self.route = route
+        self.common = common
+        self.ports = ports
+        self.links = links
+
+    @property
+    def acs_redirect(self):
+        """Ports whose ACS settings redirect peer traffic upstream."""
+        return [node.address for node in self.ports if node.redirects]
+
+    @property
+    def redirected(self):
+        """Whether a switch-local route is sent through the root complex."""
+        return self.route == "switch-local" and bool(self.acs_redirect)
+
+    @property
+    def weakest(self):
+        """The crossed link with the least bandwidth, or None."""
+        if not self.links:
+            return None
+        return min(self.links, key=lambda entry: entry["bandwidth_gbps"])
+
+    def as_dict(self):
+        return {
+            "source": self.source.bdf,
+            "target": self.target.bdf,
+            "route": self.route,
+            "common": self.common.bdf if self.common is not None else None,
+            "redirected": self.redirected,
+            "acs_redirect": [address.bdf for address in self.acs_redirect],
+            "ports": [node.as_dict() for node in self.ports],
+            "links": [dict(entry) for entry in self.links],
+            "weakest": dict(self.weakest) if self.weakest else None,
+        }
+
+    def __repr__(self):
+        return "P2pPath(%s -> %s, %s%s)" % (
+            self.source.bdf,
+            self.target.bdf,
+            self.route,
+            ", redirected" if self.redirected else "",
+        )
+
+
+def _host_bridge(path):
+    for part in os.path.realpath(path).split(os.sep):
+        if _PCI_DOMAIN_DIR_RE.match(part):
+            return part
+    return None
+
+
+def _slot(address):
+    return (address.domain, address.bus, address.device)
+
+
+class _Topology(object):
+    """Chains and nodes read at most once per device for a set of paths."""
+
+    def __init__(self, sysfs):
+        self.sysfs = sysfs
+        self.chains = {}
+        self.nodes = {}
+
+    def chain(self, address):
+        if address not in self.chains:
+            path = self.sysfs.device_dir(address)
+            chain = _extract_bdfs_from_path(path)
+            if not chain or chain[-1] != address:
+                raise ResourceNotFoundError(
+                    "device %s not found in sysfs" % address.bdf
+                )
+            self.chains[address] = (_host_bridge(path), chain)
+        return self.chains[address]
+
+    def node(self, address):
+        if address not in self.nodes:
+            self.nodes[address] = read_node(address, sysfs_root=self.sysfs.root)
+        return self.nodes[address]
+
+    def prefetch(self, addresses, workers):
+        wanted = set()
+        for address in addresses:
+            wanted.update(self.chain(address)[1])
+        wanted = sorted(wanted - set(self.nodes))
+        root = self.sysfs.root
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            for node in pool.map(lambda addr: read_node(addr, sysfs_root=root), wanted):
+                self.nodes[node.address] = node
+
+    def links(self, chain, start):
+        """Physical links crossed going down ``chain`` from index ``start``."""
+        links = []
+        for port, device in zip(chain[start:], chain[start + 1 :]):
+            if self.node(port).port_type not in DOWNSTREAM_PORT_TYPES:
+                continue
+            status = self.node(device).status
+            if status is None:
+                continue
+            links.append(
+                {
+                    "port": port.bdf,
+                    "device": device.bdf,
+                    "speed_gtps": status["speed_gtps"],
+                    "width": status["width"],
+                    "bandwidth_gbps": round(
+                        link_bandwidth(status["speed_gtps"], status["width"]), 3
+                    ),
+                }
+            )
+        return links
+
+    def path(self, source, target):
+        if source == target:
+            raise ValueRangeError("source and target are the same device")
+        host_a, chain_a = self.chain(source)
+        host_b, chain_b = self.chain(target)
+        if source in chain_b or target in chain_a:
+            raise ValueRangeError(
+                "%s and %s are on one branch; P2P needs two peers"
+                % (source.bdf, target.bdf)
+            )
+        shared = 0
+        for a, b in zip(chain_a[:-1], chain_b[:-1]):
+            if a != b:
+                break
+            shared += 1
+        if (
+            _slot(source) == _slot(target)
+            and shared == len(chain_a) - 1 == len(chain_b) - 1
+        ):
+            # Functions of one device talk inside it; no port is crossed.
+            return P2pPath(source, target, "same-device", None, [], [])
+        if shared:
+            common = chain_a[shared - 1]
+            if self.node(common).port_type in _SWITCH_PORTS:
+                route = "switch-local"
+            else:
+                route = "root-port"
+            ports = chain_a[shared - 1 : -1][::-1] + chain_b[shared:-1]
+            start = shared - 1
+        else:
+            common = None
+            route = "root-port" if host_a == host_b else "cross-root-complex"
+            ports = chain_a[:-1][::-1] + chain_b[:-1]
+            start = 0
+        links = self.links(chain_a, start)[::-1] + self.links(chain_b, start)
+        return P2pPath(
+            source,
+            target,
+            route,
+            common,
+            [self.node(address) for address in ports],
+            links,
+        )
+
+
+def p2p_path(source, target, sysfs=None):
+    """Return the P2pPath between two devices.
+
+    The route is "switch-local" when both sit below a common switch,
+    "root-port" when traffic turns at a root port or crosses the root
+    complex between root ports, "cross-root-complex" when the devices are
+    below different host bridges and "same-device" between functions of one
+    device. ACS is read on every port crossed; a switch-local route with
+    request, completion redirect or egress control enabled on the way is
+    ``redirected`` to the root complex.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    topology = _Topology(sysfs)
+    return topology.path(PciAddress.parse(source), PciAddress.parse(target))
+
+
+def p2p_matrix(addresses=None, sysfs=None, workers=8):
+    """Return a P2pPath for every pair of ``addresses``, in one pass.
+
+    Each device on any of the paths is read once, in parallel. Without
+    ``addresses`` every PCIe endpoint is included.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    workers = validate_workers(workers)
+    topology = _Topology(sysfs)
+    if addresses is None:
+        addresses = list_devices(sysfs=sysfs)
+        topology.prefetch(addresses, workers)
+        addresses = [
+            address
+            for address in addresses
+            if topology.node(address).port_type
+            in (PCI_EXP_TYPE_ENDPOINT, PCI_EXP_TYPE_LEG_END)
+        ]
+    else:
+        addresses = sorted(set(PciAddress.parse(addr) for addr in addresses))
+        topology.prefetch(addresses, workers)
+    return [
+        topology.path(source, target)
+        for source, target in itertools.combinations(addresses, 2)
+    ]
+
+
+def _weakest_text(path):
+    weakest = path.weakest
+    if weakest is None:
+        return "-", 0.0
+    link = link_text(weakest["speed_gtps"], weakest["width"])
+    return link, weakest["bandwidth_gbps"]
+
+
+def _route_text(path):
+    if path.redirected:
+        return "%s (acs-redirect)" % path.route
+    return path.route
+
+
+def format_path(path):
+    """Return the route, one line per port crossed and the weakest link."""
+    lines = [
+        "%s -> %s: %s%s"
+        % (
+            path.source.bdf,
+            path.target.bdf,
+            _route_text(path),
+            " via %s" % path.common.bdf if path.common is not None else "",
+        )
+    ]
+    for node in path.ports:
+        if not node.acs_offset:
+            acs = "no ACS"
+        else:
+            enabled = decode_acs(node.acs_cap, node.acs_ctrl)["enabled"]
+            acs = "ACS %s" % (",".join(enabled) or "-")
+        lines.append(
+            "  %-12s  %-10s  %s%s"
+            % (
+                node.address.bdf,
+                _PORT_TYPES.get(node.port_type, "?"),
+                acs,
+                "  (redirects)" if node.redirects else "",
+            )
+        )
+    weakest = path.weakest
+    if weakest is not None:
+        lines.append(
+            "  weakest link: %s -> %s %s (%.2f GB/s)"
+            % (
+                weakest["port"],
+                weakest["device"],
+                link_text(weakest["speed_gtps"], weakest["width"]),
+                weakest["bandwidth_gbps"],
+            )
+        )
+    return lines
+
+
+def format_matrix(paths):
+    """Return one table line per device pair and a route summary."""
+    lines = [
+        "%-12s  %-12s  %-33s  %-13s  %s"
+        % ("SOURCE", "TARGET", "ROUTE", "WEAKEST", "GB/s")
+    ]
+    for path in paths:
+        link, bandwidth = _weakest_text(path)
+        lines.append(
+            "%-12s  %-12s  %-33s  %-13s  %.2f"
+            % (path.source.bdf, path.target.bdf, _route_text(path), link, bandwidth)
+        )
+    counts = []
+    for route in ROUTES:
+        count = sum(1 for path in paths if path.route == route)
+        if count:
+            counts.append("%d %s" % (count, route))
+    redirected = sum(1 for path in paths if path.redirected)
+    lines.append(
+        "%d pairs: %s; %d redirected by ACS"
+        % (len(paths), ", ".join(counts) or "none", redirected)
+    )
+    return lines
+
+
+__all__ = [
+    "ACS_CONTROLS",
+    "P2pNode",
+    "P2pPath",
+    "PCI_EXT_CAP_ID_ACS",
+    "ROUTES",
+    "decode_acs",
+    "format_matrix",
+    "format_path",
+    "p2p_matrix",
+    "p2p_path",
+    "read_node",
+]
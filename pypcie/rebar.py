@@ -0,0 +1,230 @@
+"""Resizable BAR capability: supported sizes, current size and resizing."""
+
+import os
+import struct
+
+from . import bar as bar_access
+from . import config as config_access
+from .capability import find_ext_capability_in
+from .errors import PermissionDeniedError, ResourceNotFoundError, ValueRangeError
+from .sysfs import Sysfs
+from .types import PciAddress
+
+PCI_EXT_CAP_ID_REBAR = 0x0015
+PCI_REBAR_CAP = 0x04
+PCI_REBAR_CAP_SIZES = 0xFFFFFFF0
+PCI_REBAR_CTRL = 0x08
+PCI_REBAR_CTRL_BAR_IDX = 0x00000007
+PCI_REBAR_CTRL_NBAR_MASK = 0x000000E0
+PCI_REBAR_CTRL_NBAR_SHIFT = 5
+PCI_REBAR_CTRL_BAR_SIZE = 0x00003F00
+PCI_REBAR_CTRL_BAR_SHIFT = 8
+
+PCI_COMMAND = 0x04
+PCI_COMMAND_MEMORY = 0x0002
+
+RESIZE_METHODS = ("auto", "sysfs", "config")
+
+_MB = 1 << 20
+_SUFFIXES = (("T", 1 << 40), ("G", 1 << 30), ("M", _MB), ("K", 1 << 10))
+
+
+def size_code(size):
+    """Return the ReBAR encoding of a byte size (1MB << code)."""
+    if size < _MB or size & (size - 1):
+        raise ValueRangeError("BAR size must be a power of two of at least 1M")
+    return (size // _MB).bit_length() - 1
+
+
+def parse_size(text):
+    """Parse "256M", "16G", "1T" or a byte count."""
+    text = str(text).strip().upper()
+    if text.endswith("B"):
+        text = text[:-1]
+    for suffix, scale in _SUFFIXES:
+        if text.endswith(suffix):
+            number, multiplier = text[: -len(suffix)], scale
+            break
+    else:
+        number, multiplier = text, 1
+    try:
+        return int(number, 0) * multiplier
+    except ValueError:
+        raise ValueRangeError("invalid size: %r" % (text,))
+
+
+def format_size(size):
+    """Return a byte size as "256M", "16G" and the like."""
+    for suffix, scale in _SUFFIXES:
+        if size >= scale and size % scale == 0:
+            return "%d%s" % (size // scale, suffix)
+    return "%d" % size
+
+
+class RebarBar(object):
+    """One resizable BAR: supported and current size.
+
+    ``offset`` is the config offset of the entry's capability register; its
+    control register follows it.
+    """
+
+    __slots__ = ("address", "bar", "offset", "cap", "ctrl")
+
+    def __init__(self, address, bar, offset, cap, ctrl):
+        self.address = address
+        self.bar = bar
+        self.offset = offset
+        self.cap = cap
+        self.ctrl = ctrl
+
+    @property
+    def sizes(self):
+        """Supported sizes in bytes, smallest first."""
+        bits = (self.cap & PCI_REBAR_CAP_SIZES) >> 4
+        return [_MB << code for code in range(28) if bits & (1 << code)]
+
+    @property
+    def size(self):
+        code = (self.ctrl & PCI_REBAR_CTRL_BAR_SIZE) >> PCI_REBAR_CTRL_BAR_SHIFT
+        return _MB << code
+
+    def as_dict(self):
+        return {
+            "bdf": self.address.bdf,
+            "bar": self.bar,
+            "size": self.size,
+            "sizes": self.sizes,
+        }
+
+    def __repr__(self):
+        return "RebarBar(%s BAR %d, %s of %s)" % (
+            self.address.bdf,
+            self.bar,
+            format_size(self.size),
+            "/".join(format_size(size) for size in self.sizes),
+        )
+
+
+def read_rebar(address, sysfs=None):
+    """Return a RebarBar per resizable BAR (empty without the capability).
+
+    The whole capability comes from one config space read.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    address = PciAddress.parse(address)
+    data = config_access.read_space(address, sysfs_root=sysfs.root)
+    base = find_ext_capability_in(data, PCI_EXT_CAP_ID_REBAR)
+    if not base or base + PCI_REBAR_CTRL + 4 > len(data):
+        return []
+    (first_ctrl,) = struct.unpack_from("<I", data, base + PCI_REBAR_CTRL)
+    count = (first_ctrl & PCI_REBAR_CTRL_NBAR_MASK) >> PCI_REBAR_CTRL_NBAR_SHIFT
+    bars = []
+    for entry in range(min(count, 6)):
+        offset = base + PCI_REBAR_CAP + 8 * entry
+        if offset + 8 > len(data):
+            break
+        cap, ctrl = struct.unpack_from("<II", data, offset)
+        bar = ctrl & PCI_REBAR_CTRL_BAR_IDX
+        bars.append(RebarBar(address, bar, offset, cap, ctrl))
+    return bars
+
+
+def _find_bar(address, bar, sysfs):
+    for entry in read_rebar(address, sysfs=sysfs):
+        if entry.bar == bar:
+            return entry
+    raise ResourceNotFoundError("%s BAR %d is not resizable" % (address.bdf, bar))
+
+
+def _resize_config(entry, code, sysfs):
+    # Memory decode is left off: the BAR keeps its old address, which no
+    # longer fits the new size, until it is reassigned (e.g. a remove and
+    # rescan, which also turns decode back on).
+    with config_access.ConfigHandle(entry.address, sysfs_root=sysfs.root) as handle:
+        command = handle.read(PCI_COMMAND, 2)
+        if command & PCI_COMMAND_MEMORY:
+            handle.write(PCI_COMMAND, 2, command & ~PCI_COMMAND_MEMORY)
+        handle.modify(
+            entry.offset + PCI_REBAR_CTRL - PCI_REBAR_CAP,
+            4,
+            PCI_REBAR_CTRL_BAR_SIZE,
+            code << PCI_REBAR_CTRL_BAR_SHIFT,
+        )
+
+
+def resize_bar(address, bar, size, sysfs=None, method="auto"):
+    """Resize a BAR and return the method used ("sysfs" or "config").
+
+    ``size`` is in bytes and must be one the capability lists. ``"sysfs"``
+    writes the kernel's ``resourceN_resize`` attribute, which also moves the
+    BAR and updates ``resource``; the driver must be unbound. ``"config"``
+    programs the ReBAR control register directly with memory decode off and
+    leaves both off until the BAR is reassigned. ``"auto"`` uses sysfs when
+    the attribute exists.
+
+    Every PciDevice and HandlePool drops its mappings and BAR table for the
+    device. A PciBar opened on its own must be closed first, otherwise
+    PermissionDeniedError is raised.
+    """
+    if method not in RESIZE_METHODS:
+        raise ValueRangeError("method must be one of %s" % ", ".join(RESIZE_METHODS))
+    if sysfs is None:
+        sysfs = Sysfs()
+    address = PciAddress.parse(address)
+    entry = _find_bar(address, bar, sysfs)
+    if size not in entry.sizes:
+        raise ValueRangeError(
+            "%s BAR %d does not support %s (supported: %s)"
+            % (
+                address.bdf,
+                bar,
+                format_size(size),
+                " ".join(format_size(value) for value in entry.sizes),
+            )
+        )
+    code = size_code(size)
+    # Closing the cached mappings first leaves only stand-alone ones open.
+    bar_access.invalidate_bars(address)
+    if bar_access.open_bars(address):
+        raise PermissionDeniedError(
+            "%s has open BAR mappings; close them before resizing" % address.bdf
+        )
+    name = "resource%d_resize" % bar
+    with sysfs.open_device(address) as device:
+        if method == "auto":
+            exists = os.path.exists(os.path.join(device.path, name))
+            method = "sysfs" if exists else "config"
+        if method == "sysfs":
+            device.write_text(name, "%d\n" % code)
+    if method == "config":
+        _resize_config(entry, code, sysfs)
+    bar_access.invalidate_bars(address)
+    return method
+
+
+def format_rebar(bars):
+    """Return one line per resizable BAR."""
+    return [
+        "%s BAR %d: %s (supported: %s)"
+        % (
+            entry.address.bdf,
+            entry.bar,
+            format_size(entry.size),
+            " ".join(format_size(size) for size in entry.sizes),
+        )
+        for entry in bars
+    ]
+
+
+__all__ = [
+    "PCI_EXT_CAP_ID_REBAR",
+    "RESIZE_METHODS",
+    "RebarBar",
+    "format_rebar",
+    "format_size",
+    "parse_size",
+    "read_rebar",
+    "resize_bar",
+    "size_code",
+]
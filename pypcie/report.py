@@ -0,0 +1,412 @@
+"""Decoded device reports built from a single config space read."""
+
+import concurrent.futures
+import struct
+
+from . import config
+from .bar import read_bar_table
+from .capability import (
+    PCI_HEADER_TYPE_BRIDGE,
+    PCI_HEADER_TYPE_MASK,
+    PCI_STD_HEADER_SIZEOF,
+    capability_name,
+    walk_ext_capabilities,
+    walk_pci_capabilities,
+)
+from .errors import PermissionDeniedError, ResourceNotFoundError, SysfsFormatError
+from .link import (
+    decode_device_capabilities,
+    decode_device_control,
+    decode_link_capabilities,
+    decode_link_status,
+)
+from .msix import decode_msix
+from .sysfs import Sysfs
+from .types import PciAddress, validate_workers
+
+PCI_EXP_TYPE_NAMES = {
+    0x0: "Endpoint",
+    0x1: "Legacy Endpoint",
+    0x4: "Root Port",
+    0x5: "Upstream Port",
+    0x6: "Downstream Port",
+    0x7: "PCIe to PCI Bridge",
+    0x8: "PCI to PCIe Bridge",
+    0x9: "Root Complex Integrated Endpoint",
+    0xA: "Root Complex Event Collector",
+}
+
+_COMMAND_BITS = (
+    ("io", 0x0001),
+    ("memory", 0x0002),
+    ("bus_master", 0x0004),
+    ("parity_error_response", 0x0040),
+    ("serr", 0x0100),
+    ("intx_disable", 0x0400),
+)
+_STATUS_BITS = (
+    ("interrupt", 0x0008),
+    ("cap_list", 0x0010),
+    ("master_data_parity_error", 0x0100),
+    ("signaled_target_abort", 0x0800),
+    ("received_target_abort", 0x1000),
+    ("received_master_abort", 0x2000),
+    ("signaled_system_error", 0x4000),
+    ("detected_parity_error", 0x8000),
+)
+# Decoded fields shown in decimal; everything else is a register value.
+_COUNT_FIELDS = ("vectors_capable", "vectors_enabled", "table_size", "table_bar", "pba_bar")
+
+
+def _u8(data, offset):
+    return data[offset] if offset < len(data) else None
+
+
+def _u16(data, offset):
+    if offset + 2 > len(data):
+        return None
+    return struct.unpack_from("<H", data, offset)[0]
+
+
+def _u32(data, offset):
+    if offset + 4 > len(data):
+        return None
+    return struct.unpack_from("<I", data, offset)[0]
+
+
+def _bits(value, table):
+    return {name: bool(value & mask) for name, mask in table}
+
+
+def decode_header(data):
+    """Decode the standard 64-byte header of a config buffer."""
+    command = _u16(data, 0x04)
+    status = _u16(data, 0x06)
+    class_rev = _u32(data, 0x08)
+    header_type = data[0x0E]
+    header = {
+        "vendor_id": _u16(data, 0x00),
+        "device_id": _u16(data, 0x02),
+        "command": command,
+        "command_bits": _bits(command, _COMMAND_BITS),
+        "status": status,
+        "status_bits": _bits(status, _STATUS_BITS),
+        "revision": class_rev & 0xFF,
+        "class_code": class_rev >> 8,
+        "header_type": header_type & PCI_HEADER_TYPE_MASK,
+        "multifunction": bool(header_type & 0x80),
+        "interrupt_line": data[0x3C],
+        "interrupt_pin": data[0x3D],
+    }
+    if header["header_type"] == PCI_HEADER_TYPE_BRIDGE:
+        header.update(
+            {
+                "primary_bus": data[0x18],
+                "secondary_bus": data[0x19],
+                "subordinate_bus": data[0x1A],
+                "bridge_control": _u16(data, 0x3E),
+            }
+        )
+    else:
+        header.update(
+            {
+                "subsystem_vendor_id": _u16(data, 0x2C),
+                "subsystem_id": _u16(data, 0x2E),
+            }
+        )
+    return header
+
+
+def _decode_pm(data, pos):
+    pmcsr = _u16(data, pos + 4)
+    if pmcsr is None:
+        return {}
+    return {"pmc": _u16(data, pos + 2), "power_state": "D%d" % (pmcsr & 0x3)}
+
+
+def _decode_msi(data, pos):
+    control = _u16(data, pos + 2)
+    if control is None:
+        return {}
+    return {
+        "enabled": bool(control & 0x0001),
+        "vectors_capable": 1 << ((control >> 1) & 0x7),
+        "vectors_enabled": 1 << ((control >> 4) & 0x7),
+        "address_64bit": bool(control & 0x0080),
+        "per_vector_masking": bool(control & 0x0100),
+    }
+
+
+def _decode_msix(data, pos):
+    control = _u16(data, pos + 2)
+    table = _u32(data, pos + 4)
+    pba = _u32(data, pos + 8)
+    if pba is None:
+        return {}
+    return decode_msix(control, table, pba)
+
+
+def _decode_pcie(data, pos):
+    flags = _u16(data, pos + 0x02)
+    devcap = _u32(data, pos + 0x04)
+    devctl = _u16(data, pos + 0x08)
+    devsta = _u16(data, pos + 0x0A)
+    lnkcap = _u32(data, pos + 0x0C)
+    lnkctl = _u16(data, pos + 0x10)
+    lnksta = _u16(data, pos + 0x12)
+    if lnksta is None:
+        return {}
+    port_type = (flags >> 4) & 0xF
+    decoded = {
+        "version": flags & 0xF,
+        "port_type": port_type,
+        "port_type_name": PCI_EXP_TYPE_NAMES.get(port_type, "unknown"),
+        "devcap": devcap,
+        "devctl": devctl,
+        "devsta": devsta,
+        "correctable_error": bool(devsta & 0x0001),
+        "nonfatal_error": bool(devsta & 0x0002),
+        "fatal_error": bool(devsta & 0x0004),
+        "unsupported_request": bool(devsta & 0x0008),
+        "transactions_pending": bool(devsta & 0x0020),
+        "lnkcap": lnkcap,
+        "lnkctl": lnkctl,
+        "aspm_control": lnkctl & 0x3,
+        "link_disable": bool(lnkctl & 0x0010),
+        "lnksta": lnksta,
+    }
+    decoded.update(decode_device_capabilities(devcap))
+    decoded.update(decode_device_control(devctl))
+    decoded.update(decode_link_status(lnksta))
+    lnkcap2 = None
+    if decoded["version"] >= 2:
+        lnkcap2 = _u32(data, pos + 0x2C)
+        decoded["devcap2"] = _u32(data, pos + 0x24)
+        decoded["devctl2"] = _u16(data, pos + 0x28)
+        decoded["lnkcap2"] = lnkcap2
+        decoded["lnkctl2"] = _u16(data, pos + 0x30)
+        decoded["lnksta2"] = _u16(data, pos + 0x32)
+    caps = decode_link_capabilities(lnkcap, lnkcap2)
+    decoded["max_speed_gtps"] = caps["max_speed_gtps"]
+    decoded["max_width"] = caps["max_width"]
+    decoded["supported_speeds_gtps"] = caps["supported_speeds_gtps"]
+    decoded["aspm_support"] = caps["aspm_support"]
+    return decoded
+
+
+def _decode_aer(data, pos):
+    fields = (
+        ("uncorrectable_status", 0x04),
+        ("uncorrectable_mask", 0x08),
+        ("uncorrectable_severity", 0x0C),
+        ("correctable_status", 0x10),
+        ("correctable_mask", 0x14),
+        ("capabilities_control", 0x18),
+    )
+    return {name: _u32(data, pos + offset) for name, offset in fields}
+
+
+_PCI_DECODERS = {0x01: _decode_pm, 0x05: _decode_msi, 0x10: _decode_pcie, 0x11: _decode_msix}
+_EXT_DECODERS = {0x0001: _decode_aer}
+
+
+def decode_capabilities(data):
+    """Return a decoded entry for every standard and extended capability."""
+    caps = []
+    for cap_id, pos in walk_pci_capabilities(data):
+        entry = {
+            "id": cap_id,
+            "name": capability_name(cap_id),
+            "offset": pos,
+            "extended": False,
+        }
+        decoder = _PCI_DECODERS.get(cap_id)
+        if decoder is not None:
+            entry["decoded"] = decoder(data, pos)
+        caps.append(entry)
+    for cap_id, version, pos in walk_ext_capabilities(data):
+        entry = {
+            "id": cap_id,
+            "name": capability_name(cap_id, extended=True),
+            "offset": pos,
+            "extended": True,
+            "version": version,
+        }
+        decoder = _EXT_DECODERS.get(cap_id)
+        if decoder is not None:
+            entry["decoded"] = decoder(data, pos)
+        caps.append(entry)
+    return caps
+
+
+def describe_device(addr, sysfs=None):
+    """Return a decoded report for one device from one config read."""
+    if sysfs is None:
+        sysfs = Sysfs()
+    address = PciAddress.parse(addr)
+    data = config.read_space(address, sysfs_root=sysfs.root)
+    report = {"bdf": address.bdf, "config_size": len(data)}
+    if len(data) < PCI_STD_HEADER_SIZEOF:
+        report["error"] = "config space truncated to %d bytes" % len(data)
+        return report
+    report["header"] = decode_header(data)
+    report["capabilities"] = decode_capabilities(data)
+    try:
+        report["bars"] = [
+            info.as_dict()
+            for info in read_bar_table(address, sysfs_root=sysfs.root)[:6]
+            if info.size
+        ]
+    except (ResourceNotFoundError, PermissionDeniedError, SysfsFormatError):
+        report["bars"] = []
+    return report
+
+
+def describe_devices(addresses, sysfs=None, workers=1):
+    """Describe many devices, optionally in parallel; keeps input order."""
+    if sysfs is None:
+        sysfs = Sysfs()
+    workers = validate_workers(workers)
+
+    def one(addr):
+        try:
+            return describe_device(addr, sysfs=sysfs)
+        except (ResourceNotFoundError, PermissionDeniedError) as exc:
+            return {"bdf": PciAddress.parse(addr).bdf, "error": str(exc)}
+
+    if workers == 1:
+        return [one(addr) for addr in addresses]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(one, addresses))
+
+
+def _flag(name, value):
+    return "%s%s" % (name, "+" if value else "-")
+
+
+def _size_text(size):
+    for unit, shift in (("G", 30), ("M", 20), ("K", 10)):
+        if size >= (1 << shift) and size % (1 << shift) == 0:
+            return "%d%s" % (size >> shift, unit)
+    return "%d" % size
+
+
+def format_report(report):
+    """Return lspci -vv style text lines for a describe_device() report."""
+    if "error" in report and "header" not in report:
+        return ["%s: %s" % (report["bdf"], report["error"])]
+    header = report["header"]
+    lines = [
+        "%s [%04x:%04x] class %06x rev %02x (header type %d)"
+        % (
+            report["bdf"],
+            header["vendor_id"],
+            header["device_id"],
+            header["class_code"],
+            header["revision"],
+            header["header_type"],
+        )
+    ]
+    lines.append(
+        "    Control: "
+        + " ".join(_flag(n, v) for n, v in sorted(header["command_bits"].items()))
+    )
+    lines.append(
+        "    Status: "
+        + " ".join(_flag(n, v) for n, v in sorted(header["status_bits"].items()))
+    )
+    if "subsystem_vendor_id" in header:
+        lines.append(
+            "    Subsystem: %04x:%04x"
+            % (header["subsystem_vendor_id"], header["subsystem_id"])
+        )
+    else:
+        lines.append(
+            "    Bus: primary=%02x secondary=%02x subordinate=%02x"
+            % (
+                header["primary_bus"],
+                header["secondary_bus"],
+                header["subordinate_bus"],
+            )
+        )
+    for bar in report.get("bars", []):
+        kind = "I/O" if bar["io"] else "Memory"
+        lines.append(
+            "    Region %d: %s at %x [size=%s]%s%s%s"
+            % (
+                bar["index"],
+                kind,
+                bar["start"],
+                _size_text(bar["size"]),
+                " 64-bit" if bar["mem_64bit"] else "",
+                " prefetchable" if bar["prefetchable"] else "",
+                " wc" if bar["write_combining"] else "",
+            )
+        )
+    for cap in report.get("capabilities", []):
+        if cap["extended"]:
+            label = "[%03x v%d] %s" % (cap["offset"], cap["version"], cap["name"])
+        else:
+            label = "[%02x] %s" % (cap["offset"], cap["name"])
+        decoded = cap.get("decoded") or {}
+        if cap["id"] == 0x10 and not cap["extended"] and decoded:
+            label += " v%d %s" % (decoded["version"], decoded["port_type_name"])
+            lines.append("    " + label)
+            lines.append(
+                "        DevCtl: MaxPayload %s bytes, MaxReadReq %s bytes %s %s %s"
+                % (
+                    decoded["max_payload"],
+                    decoded["max_read_request"],
+                    _flag("RlxdOrd", decoded["relaxed_ordering"]),
+                    _flag("ExtTag", decoded["extended_tags"]),
+                    _flag("NoSnoop", decoded["no_snoop"]),
+                )
+            )
+            lines.append(
+                "        DevSta: %s %s %s %s %s"
+                % (
+                    _flag("CorrErr", decoded["correctable_error"]),
+                    _flag("NonFatalErr", decoded["nonfatal_error"]),
+                    _flag("FatalErr", decoded["fatal_error"]),
+                    _flag("UnsupReq", decoded["unsupported_request"]),
+                    _flag("TransPend", decoded["transactions_pending"]),
+                )
+            )
+            lines.append(
+                "        LnkCap: Speed %sGT/s, Width x%d"
+                % (decoded["max_speed_gtps"], decoded["max_width"])
+            )
+            lines.append(
+                "        LnkCtl: ASPM %d %s"
+                % (decoded["aspm_control"], _flag("Disabled", decoded["link_disable"]))
+            )
+            lines.append(
+                "        LnkSta: Speed %sGT/s, Width x%d %s %s"
+                % (
+                    decoded["speed_gtps"],
+                    decoded["width"],
+                    _flag("Train", decoded["training"]),
+                    _flag("DLActive", decoded["dll_link_active"]),
+                )
+            )
+            continue
+        lines.append("    " + label)
+        for key, value in sorted(decoded.items()):
+            if isinstance(value, bool):
+                lines.append("        %s: %s" % (key, "yes" if value else "no"))
+            elif key in _COUNT_FIELDS:
+                lines.append("        %s: %d" % (key, value))
+            elif isinstance(value, int):
+                lines.append("        %s: 0x%x" % (key, value))
+            else:
+                lines.append("        %s: %s" % (key, value))
+    return lines
+
+
+__all__ = [
+    "decode_capabilities",
+    "decode_header",
+    "describe_device",
+    "describe_devices",
+    "format_report",
+]
@@ -0,0 +1,383 @@
+"""Secondary bus reset of several bridges with downstream config save/restore."""
+
+import concurrent.futures
+import struct
+import time
+
+from . import config as config_access
+from .capability import walk_pci_capabilities
+from .discover import _extract_bdfs_from_path, iter_devices
+from .errors import (
+    OutOfRangeError,
+    PermissionDeniedError,
+    ResourceNotFoundError,
+    ValueRangeError,
+)
+from .link import (
+    PCI_BRIDGE_CONTROL,
+    PCI_BRIDGE_CTL_BUS_RESET,
+    PCI_EXP_DEVCTL,
+    PCI_EXP_DEVCTL2,
+    PCI_EXP_LNKCAP,
+    PCI_EXP_LNKCAP_DLLLARC,
+    PCI_EXP_LNKCTL,
+    PCI_EXP_LNKCTL2,
+    PCI_EXP_LNKCTL_RL,
+    PCI_EXP_LNKSTA,
+    PCI_EXP_LNKSTA_DLLLA,
+    PcieCaps,
+)
+from .sysfs import Sysfs
+from .types import PciAddress, validate_workers
+
+PCI_COMMAND = 0x04
+PCI_CAP_ID_MSI = 0x05
+PCI_CAP_ID_MSIX = 0x11
+PCI_MSI_FLAGS_64BIT = 0x0080
+PCI_MSI_FLAGS_MASKBIT = 0x0100
+
+# Vendor ID returned while a device answers with Configuration Request
+# Retry Status and CRS Software Visibility is enabled.
+PCI_VENDOR_ID_CRS = 0x0001
+
+STAGES = ("save", "reset", "link", "ready", "restore")
+
+# (offset, length) of the writable header fields restored after reset.
+# The bridge secondary status (0x1E) is RW1C and left alone.
+_TYPE0_REGIONS = ((0x0C, 2), (0x10, 24), (0x30, 4), (0x3C, 1))
+_TYPE1_REGIONS = (
+    (0x0C, 2),
+    (0x10, 8),
+    (0x18, 4),
+    (0x1C, 2),
+    (0x20, 20),
+    (0x38, 4),
+    (0x3C, 1),
+    (0x3E, 2),
+)
+
+
+def _coalesce(regions, data):
+    """Merge contiguous (offset, length) regions into (offset, bytes) writes."""
+    spans = []
+    for offset, length in sorted(regions):
+        if offset + length > len(data):
+            continue
+        if spans and spans[-1][0] + spans[-1][1] == offset:
+            spans[-1][1] += length
+        else:
+            spans.append([offset, length])
+    return [(offset, bytes(data[offset : offset + length])) for offset, length in spans]
+
+
+class SavedState(object):
+    """Config state of one function, split into ordered restore writes.
+
+    ``writes`` hold BARs, bridge windows and capability registers as
+    coalesced blocks; ``enables`` (MSI/MSI-X control, then the command
+    register) are written afterwards so decoding and interrupts come back
+    only once everything they depend on is in place.
+    """
+
+    __slots__ = ("address", "writes", "enables")
+
+    def __init__(self, address, writes, enables):
+        self.address = address
+        self.writes = writes
+        self.enables = enables
+
+    @classmethod
+    def from_config(cls, address, data):
+        caps = PcieCaps(address, bytes(data))
+        data = bytearray(data)
+        regions = list(_TYPE1_REGIONS if caps.bridge else _TYPE0_REGIONS)
+        if caps.bridge:
+            # Never restore a pending secondary bus reset.
+            data[PCI_BRIDGE_CONTROL] &= ~PCI_BRIDGE_CTL_BUS_RESET & 0xFF
+        enables = []
+        base = caps.base
+        if caps.u16(PCI_EXP_LNKCTL) is not None:
+            regions.append((base + PCI_EXP_DEVCTL, 2))
+            regions.append((base + PCI_EXP_LNKCTL, 2))
+            data[base + PCI_EXP_LNKCTL] &= ~PCI_EXP_LNKCTL_RL & 0xFF
+            if caps.u16(PCI_EXP_LNKCTL2) is not None:
+                regions.append((base + PCI_EXP_DEVCTL2, 2))
+                regions.append((base + PCI_EXP_LNKCTL2, 2))
+        for cap_id, pos in walk_pci_capabilities(bytes(data)):
+            if cap_id == PCI_CAP_ID_MSI:
+                (control,) = struct.unpack_from("<H", data, pos + 2)
+                data_offset = pos + (0x0C if control & PCI_MSI_FLAGS_64BIT else 0x08)
+                regions.append((pos + 4, data_offset + 2 - (pos + 4)))
+                if control & PCI_MSI_FLAGS_MASKBIT:
+                    regions.append((data_offset + 4, 4))
+                enables.append((pos + 2, 2))
+            elif cap_id == PCI_CAP_ID_MSIX:
+                enables.append((pos + 2, 2))
+        enables.append((PCI_COMMAND, 2))
+        return cls(
+            address,
+            _coalesce(regions, data),
+            [(offset, bytes(data[offset : offset + length])) for offset, length in enables],
+        )
+
+    def restore(self, handle):
+        """Write the saved state through a ConfigHandle; returns the write count."""
+        for offset, data in self.writes:
+            handle.write_block(offset, data)
+        for offset, data in self.enables:
+            handle.write_block(offset, data)
+        return len(self.writes) + len(self.enables)
+
+    def __repr__(self):
+        return "SavedState(%s, %d writes, %d enables)" % (
+            self.address.bdf,
+            len(self.writes),
+            len(self.enables),
+        )
+
+
+def save_state(addr, sysfs_root=None):
+    """Capture the restorable config state of one function with one read."""
+    address = PciAddress.parse(addr)
+    data = config_access.read_space(address, length=0x100, sysfs_root=sysfs_root)
+    return SavedState.from_config(address, data)
+
+
+def restore_state(state, sysfs_root=None):
+    """Restore a SavedState; returns the number of pwrite calls."""
+    with config_access.ConfigHandle(state.address, sysfs_root=sysfs_root) as handle:
+        return state.restore(handle)
+
+
+def wait_config_ready(handle, timeout_s=1.0, poll_s=0.01):
+    """Poll the vendor/device dword until the function answers config reads.
+
+    All-ones means the function is not responding yet and vendor 0x0001
+    is a Configuration Request Retry Status completion.
+    """
+    deadline = time.monotonic() + float(timeout_s)
+    while True:
+        try:
+            value = handle.read(0x00, 4)
+        except OutOfRangeError:
+            value = 0xFFFFFFFF
+        if value != 0xFFFFFFFF and value & 0xFFFF != PCI_VENDOR_ID_CRS:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(poll_s)
+
+
+def _wait_link_active(handle, base, timeout_s, poll_s):
+    if not base or not handle.read(base + PCI_EXP_LNKCAP, 4) & PCI_EXP_LNKCAP_DLLLARC:
+        return True
+    deadline = time.monotonic() + timeout_s
+    while True:
+        if handle.read(base + PCI_EXP_LNKSTA, 2) & PCI_EXP_LNKSTA_DLLLA:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(poll_s)
+
+
+class BusResetResult(object):
+    """Outcome of resetting one bridge: stage timings and restored functions."""
+
+    __slots__ = ("bridge", "functions", "ok", "error", "stages", "writes")
+
+    def __init__(self, bridge, functions):
+        self.bridge = bridge
+        self.functions = functions
+        self.ok = False
+        self.error = None
+        self.stages = dict((stage, 0.0) for stage in STAGES)
+        self.writes = 0
+
+    def as_dict(self):
+        return {
+            "bridge": self.bridge.bdf,
+            "functions": [address.bdf for address in self.functions],
+            "ok": self.ok,
+            "error": self.error,
+            "stages": dict(self.stages),
+            "writes": self.writes,
+        }
+
+    def __repr__(self):
+        return "BusResetResult(%s, ok=%s, %d functions)" % (
+            self.bridge.bdf,
+            self.ok,
+            len(self.functions),
+        )
+
+
+def _reset_one(result, states, root, assert_s, settle_s, timeout_s, poll_s, restore):
+    bridge = result.bridge
+    with config_access.ConfigHandle(bridge, sysfs_root=root) as handle:
+        started = time.monotonic()
+        caps = PcieCaps(bridge, handle.read_space(0x100))
+        if not caps.bridge:
+            raise ValueRangeError("secondary bus reset requires a bridge device")
+        control = handle.read(PCI_BRIDGE_CONTROL, 2)
+        handle.write(PCI_BRIDGE_CONTROL, 2, control | PCI_BRIDGE_CTL_BUS_RESET)
+        time.sleep(assert_s)
+        handle.write(PCI_BRIDGE_CONTROL, 2, control & ~PCI_BRIDGE_CTL_BUS_RESET)
+        result.stages["reset"] = time.monotonic() - started
+
+        started = time.monotonic()
+        if not _wait_link_active(handle, caps.base, timeout_s, poll_s):
+            result.stages["link"] = time.monotonic() - started
+            raise OutOfRangeError("link did not come back (DLLLA clear)")
+        if settle_s:
+            time.sleep(settle_s)
+        result.stages["link"] = time.monotonic() - started
+
+    # Parents first: a switch needs its bus numbers back before anything
+    # below it answers config requests.
+    for address in result.functions:
+        with config_access.ConfigHandle(address, sysfs_root=root) as handle:
+            started = time.monotonic()
+            ready = wait_config_ready(handle, timeout_s=timeout_s, poll_s=poll_s)
+            result.stages["ready"] += time.monotonic() - started
+            if not ready:
+                raise OutOfRangeError("%s not ready after reset" % address.bdf)
+            state = states.get(address)
+            if restore and state is not None:
+                started = time.monotonic()
+                result.writes += state.restore(handle)
+                result.stages["restore"] += time.monotonic() - started
+
+
+def _depth(address, sysfs):
+    try:
+        return len(_extract_bdfs_from_path(sysfs.device_dir(address)))
+    except ResourceNotFoundError:
+        return 0
+
+
+def reset_bridges(
+    bridges,
+    sysfs=None,
+    concurrency=8,
+    assert_s=0.002,
+    settle_s=0.1,
+    timeout_s=1.0,
+    poll_s=0.01,
+    restore=True,
+):
+    """Hot reset several bridges concurrently and restore what sits below them.
+
+    The config state of every function below the bridges is saved first in
+    one parallel pass. Each bridge then asserts Secondary Bus Reset for
+    ``assert_s``, waits for DLLLA (when the port reports it) plus
+    ``settle_s``, waits for every downstream function to answer config
+    reads and restores its state. Bridges must not sit below one another.
+    Returns one BusResetResult per bridge, in order.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    concurrency = validate_workers(concurrency, "concurrency")
+    bridges = [PciAddress.parse(addr) for addr in bridges]
+    if len(set(bridges)) != len(bridges):
+        raise ValueRangeError("bridge listed twice")
+    chains = {}
+    for bridge in bridges:
+        try:
+            chains[bridge] = _extract_bdfs_from_path(sysfs.device_dir(bridge))
+        except ResourceNotFoundError:
+            chains[bridge] = [bridge]
+    for bridge in bridges:
+        for other in bridges:
+            if other != bridge and other in chains[bridge][:-1]:
+                raise ValueRangeError(
+                    "%s is below %s; reset the upper bridge only"
+                    % (bridge.bdf, other.bdf)
+                )
+    root = sysfs.root
+    results = []
+    for bridge in bridges:
+        functions = list(iter_devices(sysfs=sysfs, parent=bridge))
+        functions.sort(key=lambda address: (_depth(address, sysfs), address))
+        results.append(BusResetResult(bridge, functions))
+
+    started = time.monotonic()
+    states = {}
+
+    def save(address):
+        try:
+            return address, save_state(address, sysfs_root=root)
+        except (PermissionDeniedError, ResourceNotFoundError):
+            return address, None
+
+    if restore:
+        everything = [address for result in results for address in result.functions]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for address, state in pool.map(save, everything):
+                if state is not None:
+                    states[address] = state
+    elapsed = time.monotonic() - started
+    for result in results:
+        result.stages["save"] = elapsed
+
+    def run(result):
+        try:
+            _reset_one(
+                result,
+                states,
+                root,
+                float(assert_s),
+                float(settle_s),
+                float(timeout_s),
+                float(poll_s),
+                restore,
+            )
+            result.ok = True
+        except (
+            OutOfRangeError,
+            PermissionDeniedError,
+            ResourceNotFoundError,
+            ValueRangeError,
+        ) as exc:
+            result.error = str(exc)
+        return result
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(run, results))
+
+
+def format_results(results):
+    """Return table lines with per-stage timings in milliseconds."""
+    lines = [
+        "%-12s  %-6s  %5s  %s  %s"
+        % (
+            "BRIDGE",
+            "STATUS",
+            "FUNCS",
+            "  ".join("%11s" % ("%s ms" % stage.upper()) for stage in STAGES),
+            "ERROR",
+        )
+    ]
+    for result in results:
+        lines.append(
+            "%-12s  %-6s  %5d  %s  %s"
+            % (
+                result.bridge.bdf,
+                "ok" if result.ok else "failed",
+                len(result.functions),
+                "  ".join("%11.2f" % (result.stages[stage] * 1000.0) for stage in STAGES),
+                result.error or "",
+            )
+        )
+    return lines
+
+
+__all__ = [
+    "BusResetResult",
+    "STAGES",
+    "SavedState",
+    "format_results",
+    "reset_bridges",
+    "restore_state",
+    "save_state",
+    "wait_config_ready",
+]
@@ -0,0 +1,221 @@
+"""Retrain or change the speed of many PCIe links at once."""
+
+import concurrent.futures
+import time
+
+from . import config as config_access
+from .capability import find_pcie_capability
+from .discover import iter_devices
+from .errors import (
+    OutOfRangeError,
+    PermissionDeniedError,
+    ResourceNotFoundError,
+    ValueRangeError,
+)
+from .link import (
+    DOWNSTREAM_PORT_TYPES,
+    PCI_EXP_FLAGS,
+    PCI_EXP_LNKCAP,
+    PCI_EXP_LNKCAP_DLLLARC,
+    PCI_EXP_LNKCTL,
+    PCI_EXP_LNKCTL2,
+    PCI_EXP_LNKCTL2_TLS,
+    PCI_EXP_LNKCTL_RL,
+    PCI_EXP_LNKSTA,
+    PCI_EXP_LNKSTA_LT,
+    _TLS_TO_LINK_SPEED,
+    _normalize_target_speed,
+    decode_link_status,
+    read_pcie_caps,
+)
+from .sysfs import Sysfs
+from .types import PciAddress, validate_workers
+
+
+class RetrainResult(object):
+    """Outcome of retraining one port."""
+
+    __slots__ = (
+        "address",
+        "ok",
+        "speed_gtps",
+        "width",
+        "target_speed_gtps",
+        "seconds",
+        "retries",
+        "error",
+    )
+
+    def __init__(self, address, target_speed_gtps=None):
+        self.address = address
+        self.ok = False
+        self.speed_gtps = None
+        self.width = None
+        self.target_speed_gtps = target_speed_gtps
+        self.seconds = 0.0
+        self.retries = 0
+        self.error = None
+
+    def as_dict(self):
+        return {
+            "bdf": self.address.bdf,
+            "ok": self.ok,
+            "speed_gtps": self.speed_gtps,
+            "width": self.width,
+            "target_speed_gtps": self.target_speed_gtps,
+            "seconds": self.seconds,
+            "retries": self.retries,
+            "error": self.error,
+        }
+
+    def __repr__(self):
+        return "RetrainResult(%s, ok=%s, %sGT/s x%s, retries=%d)" % (
+            self.address.bdf,
+            self.ok,
+            self.speed_gtps,
+            self.width,
+            self.retries,
+        )
+
+
+def downstream_ports(addr, sysfs=None):
+    """Return the root and downstream ports located below ``addr``."""
+    if sysfs is None:
+        sysfs = Sysfs()
+    ports = []
+    for address in iter_devices(
+        sysfs=sysfs, class_code=0x060400, class_mask=0xFFFF00, parent=addr
+    ):
+        try:
+            caps = read_pcie_caps(address, sysfs=sysfs)
+        except (ResourceNotFoundError, PermissionDeniedError, OutOfRangeError):
+            continue
+        if caps.port_type in DOWNSTREAM_PORT_TYPES:
+            ports.append(address)
+    return sorted(ports)
+
+
+def _wait_trained(handle, offset, deadline, poll_s):
+    # Link Training may not be set yet right after Retrain Link is
+    # written, so a clear LT is only trusted after one poll interval.
+    time.sleep(poll_s)
+    while True:
+        status = handle.read(offset, 2)
+        if not status & PCI_EXP_LNKSTA_LT:
+            return status
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(poll_s)
+
+
+def _retrain_one(address, tls, sysfs_root, timeout_s, poll_s, retries):
+    result = RetrainResult(address, _TLS_TO_LINK_SPEED.get(tls))
+    started = time.monotonic()
+    try:
+        base = find_pcie_capability(address, sysfs_root=sysfs_root)
+        if not base:
+            raise ResourceNotFoundError("PCIe capability not found")
+        with config_access.ConfigHandle(address, sysfs_root=sysfs_root) as handle:
+            reports_dllla = handle.read(base + PCI_EXP_LNKCAP, 4) & PCI_EXP_LNKCAP_DLLLARC
+            if tls is not None:
+                if handle.read(base + PCI_EXP_FLAGS, 2) & 0xF < 2:
+                    raise ValueRangeError(
+                        "link control 2 not supported by PCIe capability"
+                    )
+                handle.modify(base + PCI_EXP_LNKCTL2, 2, PCI_EXP_LNKCTL2_TLS, tls)
+            for attempt in range(retries + 1):
+                result.retries = attempt
+                handle.modify(base + PCI_EXP_LNKCTL, 2, 0, PCI_EXP_LNKCTL_RL)
+                deadline = time.monotonic() + timeout_s
+                status = _wait_trained(handle, base + PCI_EXP_LNKSTA, deadline, poll_s)
+                if status is None:
+                    result.error = "link training did not complete"
+                    continue
+                decoded = decode_link_status(status)
+                result.speed_gtps = decoded["speed_gtps"]
+                result.width = decoded["width"]
+                if reports_dllla and not decoded["dll_link_active"]:
+                    result.error = "data link layer not active"
+                elif tls is not None and decoded["speed_code"] < tls:
+                    result.error = "trained below target speed"
+                elif tls is not None and decoded["speed_code"] != tls:
+                    result.error = "trained above target speed"
+                else:
+                    result.error = None
+                    result.ok = True
+                    break
+    except (
+        ResourceNotFoundError,
+        PermissionDeniedError,
+        OutOfRangeError,
+        ValueRangeError,
+    ) as exc:
+        result.error = str(exc)
+    result.seconds = time.monotonic() - started
+    return result
+
+
+def retrain_ports(
+    ports,
+    speed=None,
+    sysfs=None,
+    concurrency=8,
+    timeout_s=1.0,
+    poll_s=0.01,
+    retries=2,
+):
+    """Retrain many ports concurrently and return one RetrainResult each.
+
+    With ``speed`` (GT/s or a TLS code) the Target Link Speed is written
+    first. At most ``concurrency`` ports train at a time; a port whose link
+    does not finish training, comes up without DLLLA or trains at any speed
+    other than the target is retrained up to ``retries`` more times.
+    Results keep the order of ``ports``.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    concurrency = validate_workers(concurrency, "concurrency")
+    if retries < 0:
+        raise ValueRangeError("retries must be non-negative")
+    tls = None if speed is None else _normalize_target_speed(speed)
+    addresses = [PciAddress.parse(addr) for addr in ports]
+    root = sysfs.root
+    timeout_s = float(timeout_s)
+    poll_s = float(poll_s)
+
+    def one(address):
+        return _retrain_one(address, tls, root, timeout_s, poll_s, retries)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, addresses))
+
+
+def format_results(results):
+    """Return table lines for retrain results."""
+    lines = [
+        "%-12s  %-6s  %-13s  %8s  %7s  %s"
+        % ("PORT", "STATUS", "LINK", "SECONDS", "RETRIES", "ERROR")
+    ]
+    for result in results:
+        if result.speed_gtps is None and result.width is None:
+            link = "-"
+        else:
+            link = "%sGT/s x%s" % (
+                "?" if result.speed_gtps is None else "%g" % result.speed_gtps,
+                result.width,
+            )
+        lines.append(
+            "%-12s  %-6s  %-13s  %8.3f  %7d  %s"
+            % (
+                result.address.bdf,
+                "ok" if result.ok else "failed",
+                link,
+                result.seconds,
+                result.retries,
+                result.error or "",
+            )
+        )
+    return lines
+
+
+__all__ = ["RetrainResult", "downstream_ports", "format_results", "retrain_ports"]
@@ -0,0 +1,322 @@
+"""Fabric-wide config space snapshots, archives and diffs."""
+
+import concurrent.futures
+import socket
+import struct
+import time
+import zlib
+
+from . import config
+from .capability import (
+    PCI_CFG_SPACE_SIZE,
+    PCI_HEADER_TYPE,
+    PCI_HEADER_TYPE_BRIDGE,
+    PCI_HEADER_TYPE_MASK,
+    PCI_STD_HEADER_SIZEOF,
+    capability_name,
+    walk_ext_capabilities,
+    walk_pci_capabilities,
+)
+from .discover import list_devices
+from .errors import PermissionDeniedError, ResourceNotFoundError, SysfsFormatError
+from .sysfs import Sysfs
+from .types import PciAddress, validate_workers
+
+ARCHIVE_MAGIC = b"PPCISNP1"
+
+_ARCHIVE_HEADER = struct.Struct("<8sdI")
+_ENTRY_HEADER = struct.Struct("<II")
+_DWORDS = struct.Struct("<I")
+
+_TYPE0_FIELDS = {
+    0x00: "vendor/device",
+    0x04: "command/status",
+    0x08: "revision/class",
+    0x0C: "cacheline/latency/header/bist",
+    0x10: "bar0",
+    0x14: "bar1",
+    0x18: "bar2",
+    0x1C: "bar3",
+    0x20: "bar4",
+    0x24: "bar5",
+    0x28: "cardbus cis",
+    0x2C: "subsystem",
+    0x30: "expansion rom",
+    0x34: "capabilities pointer",
+    0x38: "reserved",
+    0x3C: "interrupt/min_gnt/max_lat",
+}
+
+_TYPE1_FIELDS = dict(_TYPE0_FIELDS)
+_TYPE1_FIELDS.update(
+    {
+        0x18: "bus numbers",
+        0x1C: "io base/limit/secondary status",
+        0x20: "memory base/limit",
+        0x24: "prefetch base/limit",
+        0x28: "prefetch base upper",
+        0x2C: "prefetch limit upper",
+        0x30: "io base/limit upper",
+        0x38: "expansion rom",
+        0x3C: "interrupt/bridge control",
+    }
+)
+
+# Known register block sizes; other capabilities extend to the next one.
+_PCI_CAP_SIZES = {0x01: 8, 0x05: 24, 0x10: 0x3C, 0x11: 12}
+_EXT_CAP_SIZES = {0x0001: 0x48, 0x0003: 12, 0x000D: 8, 0x000E: 8, 0x001E: 16}
+
+
+class Snapshot(object):
+    """Config space of many devices captured at one point in time."""
+
+    def __init__(self, devices=None, timestamp=None, hostname=None):
+        self.devices = devices if devices is not None else {}
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.hostname = socket.gethostname() if hostname is None else hostname
+
+    def __len__(self):
+        return len(self.devices)
+
+
+class RegisterChange(object):
+    """One changed dword: offset, old and new values and its decoded region."""
+
+    __slots__ = ("offset", "old", "new", "region")
+
+    def __init__(self, offset, old, new, region):
+        self.offset = offset
+        self.old = old
+        self.new = new
+        self.region = region
+
+    def as_dict(self):
+        return {
+            "offset": self.offset,
+            "old": self.old,
+            "new": self.new,
+            "region": self.region,
+        }
+
+    def __repr__(self):
+        old = "--------" if self.old is None else "%08x" % self.old
+        new = "--------" if self.new is None else "%08x" % self.new
+        return "RegisterChange(0x%03x %s -> %s %s)" % (
+            self.offset,
+            old,
+            new,
+            self.region,
+        )
+
+
+class SnapshotDiff(object):
+    """Devices added, removed and changed between two snapshots."""
+
+    def __init__(self, added, removed, changed):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    __nonzero__ = __bool__
+
+    def as_dict(self):
+        return {
+            "added": [addr.bdf for addr in self.added],
+            "removed": [addr.bdf for addr in self.removed],
+            "changed": {
+                addr.bdf: [change.as_dict() for change in changes]
+                for addr, changes in sorted(self.changed.items())
+            },
+        }
+
+
+def _read_one(address, sysfs_root):
+    try:
+        return address, config.read_space(address, sysfs_root=sysfs_root)
+    except (PermissionDeniedError, ResourceNotFoundError):
+        return address, None
+
+
+def capture(addresses=None, sysfs=None, workers=1):
+    """Read the full config space of every device with one pread each.
+
+    Devices whose config cannot be opened are left out. ``workers`` > 1
+    reads devices in parallel threads.
+    """
+    if sysfs is None:
+        sysfs = Sysfs()
+    if addresses is None:
+        addresses = list_devices(sysfs=sysfs)
+    else:
+        addresses = [PciAddress.parse(addr) for addr in addresses]
+    workers = validate_workers(workers)
+    root = sysfs.root
+    if workers == 1:
+        results = [_read_one(addr, root) for addr in addresses]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda addr: _read_one(addr, root), addresses))
+    devices = {}
+    for address, data in results:
+        if data is not None:
+            devices[address] = data
+    return Snapshot(devices)
+
+
+def write_archive(snapshot, path, level=1):
+    """Write a snapshot as one zlib-compressed archive file."""
+    hostname = snapshot.hostname.encode("utf-8")
+    parts = [struct.pack("<H", len(hostname)), hostname]
+    for address in sorted(snapshot.devices):
+        data = snapshot.devices[address]
+        parts.append(_ENTRY_HEADER.pack(address.packed, len(data)))
+        parts.append(data)
+    body = zlib.compress(b"".join(parts), level)
+    with open(path, "wb") as handle:
+        handle.write(
+            _ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, snapshot.timestamp, len(snapshot))
+        )
+        handle.write(body)
+
+
+def read_archive(path):
+    """Load a snapshot written by write_archive()."""
+    try:
+        with open(path, "rb") as handle:
+            raw = handle.read()
+    except OSError as exc:
+        raise ResourceNotFoundError(str(exc))
+    if len(raw) < _ARCHIVE_HEADER.size:
+        raise SysfsFormatError("snapshot archive too short: %s" % path)
+    magic, timestamp, count = _ARCHIVE_HEADER.unpack_from(raw, 0)
+    if magic != ARCHIVE_MAGIC:
+        raise SysfsFormatError("not a pypcie snapshot: %s" % path)
+    try:
+        body = zlib.decompress(raw[_ARCHIVE_HEADER.size :])
+    except zlib.error as exc:
+        raise SysfsFormatError("corrupt snapshot archive %s: %s" % (path, exc))
+    if len(body) < 2:
+        raise SysfsFormatError("truncated snapshot archive: %s" % path)
+    (name_len,) = struct.unpack_from("<H", body, 0)
+    pos = 2 + name_len
+    if pos > len(body):
+        raise SysfsFormatError("truncated snapshot archive: %s" % path)
+    hostname = body[2:pos].decode("utf-8", "replace")
+    devices = {}
+    for _ in range(count):
+        if pos + _ENTRY_HEADER.size > len(body):
+            raise SysfsFormatError("truncated snapshot archive: %s" % path)
+        key, length = _ENTRY_HEADER.unpack_from(body, pos)
+        pos += _ENTRY_HEADER.size
+        if pos + length > len(body):
+            raise SysfsFormatError("truncated snapshot archive: %s" % path)
+        devices[PciAddress.intern(key)] = body[pos : pos + length]
+        pos += length
+    return Snapshot(devices, timestamp=timestamp, hostname=hostname)
+
+
+def _regions(data):
+    """Return sorted (start, end, name) capability regions for a buffer."""
+    regions = []
+    std = sorted(walk_pci_capabilities(data), key=lambda item: item[1])
+    for index, (cap_id, pos) in enumerate(std):
+        limit = std[index + 1][1] if index + 1 < len(std) else PCI_CFG_SPACE_SIZE
+        size = _PCI_CAP_SIZES.get(cap_id)
+        end = min(limit, pos + size) if size else limit
+        regions.append((pos, end, capability_name(cap_id)))
+    ext = sorted(walk_ext_capabilities(data), key=lambda item: item[2])
+    for index, (cap_id, _, pos) in enumerate(ext):
+        limit = ext[index + 1][2] if index + 1 < len(ext) else len(data)
+        size = _EXT_CAP_SIZES.get(cap_id)
+        end = min(limit, pos + size) if size else limit
+        regions.append((pos, end, capability_name(cap_id, extended=True)))
+    return regions
+
+
+def describe_offset(data, offset, regions=None):
+    """Name the header field or capability that a config offset belongs to."""
+    if offset < PCI_STD_HEADER_SIZEOF:
+        fields = _TYPE0_FIELDS
+        if len(data) > PCI_HEADER_TYPE:
+            hdr = data[PCI_HEADER_TYPE] & PCI_HEADER_TYPE_MASK
+            if hdr == PCI_HEADER_TYPE_BRIDGE:
+                fields = _TYPE1_FIELDS
+        return "header %s" % fields[offset & ~0x3]
+    if regions is None:
+        regions = _regions(data)
+    for start, end, name in regions:
+        if start <= offset < end:
+            return "%s+0x%02x" % (name, offset - start)
+    return "unknown"
+
+
+def diff_config(old, new):
+    """Return RegisterChange entries for the dwords that differ."""
+    changes = []
+    if old == new:
+        return changes
+    length = max(len(old), len(new))
+    common = min(len(old), len(new)) & ~0x3
+    regions_new = _regions(new) if new else []
+    regions_old = None
+    old_words = _DWORDS.iter_unpack(old[:common])
+    new_words = _DWORDS.iter_unpack(new[:common])
+    for index, ((a,), (b,)) in enumerate(zip(old_words, new_words)):
+        if a == b:
+            continue
+        offset = index * 4
+        region = describe_offset(new, offset, regions_new)
+        changes.append(RegisterChange(offset, a, b, region))
+    for offset in range(common, length & ~0x3, 4):
+        a = _dword(old, offset)
+        b = _dword(new, offset)
+        if a == b:
+            continue
+        if b is None:
+            if regions_old is None:
+                regions_old = _regions(old)
+            region = describe_offset(old, offset, regions_old)
+        else:
+            region = describe_offset(new, offset, regions_new)
+        changes.append(RegisterChange(offset, a, b, region))
+    return changes
+
+
+def _dword(data, offset):
+    if offset + 4 > len(data):
+        return None
+    return _DWORDS.unpack_from(data, offset)[0]
+
+
+def diff(old, new):
+    """Compare two snapshots device by device."""
+    old_devices = old.devices
+    new_devices = new.devices
+    added = sorted(addr for addr in new_devices if addr not in old_devices)
+    removed = sorted(addr for addr in old_devices if addr not in new_devices)
+    changed = {}
+    for address, data in new_devices.items():
+        before = old_devices.get(address)
+        if before is None or before == data:
+            continue
+        changes = diff_config(before, data)
+        if changes:
+            changed[address] = changes
+    return SnapshotDiff(added, removed, changed)
+
+
+__all__ = [
+    "ARCHIVE_MAGIC",
+    "RegisterChange",
+    "Snapshot",
+    "SnapshotDiff",
+    "capture",
+    "describe_offset",
+    "diff",
+    "diff_config",
+    "read_archive",
+    "write_archive",
+]
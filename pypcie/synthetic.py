@@ -0,0 +1,267 @@
+"""Synthetic sysfs trees for tests and benchmarks."""
+
+import os
+import struct
+
+from .errors import ValueRangeError
+from .types import PciAddress
+
+IORESOURCE_MEM = 0x00000200
+IORESOURCE_PREFETCH = 0x00002000
+IORESOURCE_MEM_64 = 0x00100000
+
+PCI_EXP_TYPE_ENDPOINT = 0x0
+PCI_EXP_TYPE_ROOT_PORT = 0x4
+PCI_EXP_TYPE_UPSTREAM = 0x5
+PCI_EXP_TYPE_DOWNSTREAM = 0x6
+
+_PM_CAP = 0x40
+_MSI_CAP = 0x50
+_PCIE_CAP = 0x70
+_AER_EXT_CAP = 0x100
+
+
+def _write_bytes(path, data):
+    with open(path, "wb") as handle:
+        handle.write(bytes(data))
+
+
+def _write_text(path, text):
+    with open(path, "w") as handle:
+        handle.write(text)
+
+
+def create_device(
+    sysfs_root,
+    bdf,
+    vendor=0x1234,
+    device=0x5678,
+    config_size=256,
+    config_bytes=None,
+    resource_entries=None,
+    resource_files=None,
+    class_code=None,
+    real_dir=None,
+):
+    """Create a device directory under ``sysfs_root``; return its path.
+
+    With ``real_dir`` the device is created there and ``sysfs_root/<bdf>``
+    becomes a symlink to it, mirroring /sys/bus/pci/devices.
+    """
+    sysfs_root = str(sysfs_root)
+    link_path = os.path.join(sysfs_root, bdf)
+    if real_dir is None:
+        dev_path = link_path
+    else:
+        dev_path = str(real_dir)
+    os.makedirs(dev_path)
+    if real_dir is not None:
+        os.symlink(dev_path, link_path)
+
+    _write_text(os.path.join(dev_path, "vendor"), "0x%04x\n" % vendor)
+    _write_text(os.path.join(dev_path, "device"), "0x%04x\n" % device)
+    if class_code is not None:
+        _write_text(os.path.join(dev_path, "class"), "0x%06x\n" % class_code)
+
+    if config_bytes is None:
+        config_bytes = bytes([0] * config_size)
+    _write_bytes(os.path.join(dev_path, "config"), config_bytes)
+
+    if resource_entries is None:
+        resource_entries = [(0, 0, 0)] * 6
+    with open(os.path.join(dev_path, "resource"), "w") as handle:
+        for start, end, flags in resource_entries:
+            handle.write("0x%016x 0x%016x 0x%016x\n" % (start, end, flags))
+
+    if resource_files:
+        for bar, data in resource_files.items():
+            _write_bytes(os.path.join(dev_path, "resource%d" % bar), data)
+
+    return link_path
+
+
+def build_config(
+    vendor=0x1234,
+    device=0x5678,
+    class_code=0x020000,
+    bridge=False,
+    port_type=PCI_EXP_TYPE_ENDPOINT,
+    speed=3,
+    width=8,
+    max_speed=None,
+    max_width=None,
+    buses=None,
+    size=4096,
+):
+    """Return config space bytes with PM, MSI, PCIe and AER capabilities.
+
+    ``speed`` and ``max_speed`` are LNKSTA/LNKCAP speed codes (1 = 2.5GT/s).
+    ``buses`` is a (primary, secondary, subordinate) tuple for bridges.
+    """
+    if max_speed is None:
+        max_speed = speed
+    if max_width is None:
+        max_width = width
+    data = bytearray(size)
+    struct.pack_into("<HH", data, 0x00, vendor, device)
+    struct.pack_into("<HH", data, 0x04, 0x0006, 0x0010)
+    struct.pack_into("<I", data, 0x08, (class_code << 8) | 0x01)
+    data[0x0E] = 0x01 if bridge else 0x00
+    data[0x34] = _PM_CAP
+    if bridge and buses is not None:
+        data[0x18], data[0x19], data[0x1A] = buses
+
+    struct.pack_into("<BBHH", data, _PM_CAP, 0x01, _MSI_CAP, 0x0003, 0x0008)
+    struct.pack_into("<BBH", data, _MSI_CAP, 0x05, _PCIE_CAP, 0x0080)
+
+    struct.pack_into("<BBH", data, _PCIE_CAP, 0x10, 0x00, 0x0002 | (port_type << 4))
+    # DEVCAP: 256B MPS, extended tags; DEVCTL: 128B MPS, 512B MRRS.
+    struct.pack_into("<I", data, _PCIE_CAP + 0x04, 0x00000021)
+    struct.pack_into("<H", data, _PCIE_CAP + 0x08, 0x2810)
+    lnkcap = max_speed | (max_width << 4) | (0x3 << 10)
+    if port_type in (PCI_EXP_TYPE_ROOT_PORT, PCI_EXP_TYPE_DOWNSTREAM):
+        lnkcap |= 0x00100000
+    struct.pack_into("<I", data, _PCIE_CAP + 0x0C, lnkcap)
+    lnksta = speed | (width << 4)
+    if lnkcap & 0x00100000:
+        lnksta |= 0x2000
+    struct.pack_into("<H", data, _PCIE_CAP + 0x12, lnksta)
+    lnkcap2 = 0
+    for code in range(1, max_speed + 1):
+        lnkcap2 |= 1 << code
+    struct.pack_into("<I", data, _PCIE_CAP + 0x2C, lnkcap2)
+    struct.pack_into("<H", data, _PCIE_CAP + 0x30, max_speed)
+
+    if size > _AER_EXT_CAP:
+        struct.pack_into("<I", data, _AER_EXT_CAP, (2 << 16) | 0x0001)
+        struct.pack_into("<I", data, _AER_EXT_CAP + 0x14, 0x00002000)
+    return bytes(data)
+
+
+class Fabric(object):
+    """Description of a generated tree: root, bridges and endpoints."""
+
+    def __init__(self, sysfs_root):
+        self.sysfs_root = str(sysfs_root)
+        self.root_ports = []
+        self.bridges = []
+        self.endpoints = []
+        self.bar_size = 0
+
+    @property
+    def devices(self):
+        return sorted(self.bridges + self.endpoints)
+
+    def __len__(self):
+        return len(self.bridges) + len(self.endpoints)
+
+
+def create_fabric(
+    sysfs_root,
+    root_ports=2,
+    switch_depth=1,
+    switch_ports=4,
+    functions=1,
+    bar_size=4096,
+    domain=0,
+    speed=4,
+    width=16,
+):
+    """Generate a PCIe hierarchy with symlinked topology under ``sysfs_root``.
+
+    ``sysfs_root`` plays the role of /sys/bus/pci/devices; the real device
+    directories are created under ``<sys>/devices/pciDDDD:00`` three levels up.
+    Every root port carries ``switch_depth`` levels of switches with
+    ``switch_ports`` downstream ports each, and every leaf port carries one
+    endpoint with ``functions`` functions and a file-backed BAR0.
+    """
+    sysfs_root = str(sysfs_root)
+    if not os.path.isdir(sysfs_root):
+        os.makedirs(sysfs_root)
+    sys_root = os.path.dirname(os.path.dirname(os.path.dirname(sysfs_root)))
+    host_dir = os.path.join(sys_root, "devices", "pci%04x:00" % domain)
+    fabric = Fabric(sysfs_root)
+    fabric.bar_size = bar_size
+    state = {"next_bus": 1, "next_bar": 0x80000000}
+
+    def add(address, parent_dir, config_bytes, class_code, resources=None, files=None):
+        real = os.path.join(parent_dir, address.bdf)
+        create_device(
+            sysfs_root,
+            address.bdf,
+            vendor=struct.unpack_from("<H", config_bytes, 0)[0],
+            device=struct.unpack_from("<H", config_bytes, 2)[0],
+            config_bytes=config_bytes,
+            resource_entries=resources,
+            resource_files=files,
+            class_code=class_code,
+            real_dir=real,
+        )
+        return real
+
+    def add_bridge(address, parent_dir, port_type, primary):
+        secondary = state["next_bus"]
+        if secondary > 0xFF:
+            raise ValueRangeError("fabric needs more than 256 buses in one domain")
+        state["next_bus"] += 1
+        cfg = build_config(
+            vendor=0x8086,
+            device=0x2000 + port_type,
+            class_code=0x060400,
+            bridge=True,
+            port_type=port_type,
+            speed=speed,
+            width=width,
+            buses=(primary, secondary, 0xFF),
+        )
+        real = add(address, parent_dir, cfg, 0x060400)
+        fabric.bridges.append(address)
+        return real, secondary
+
+    def add_endpoint(bus, parent_dir):
+        for fn in range(functions):
+            address = PciAddress(domain, bus, 0, fn)
+            start = state["next_bar"]
+            state["next_bar"] += max(bar_size, 4096)
+            resources = [(start, start + bar_size - 1, IORESOURCE_MEM)]
+            resources += [(0, 0, 0)] * 5
+            cfg = build_config(
+                vendor=0x1234,
+                device=0x5678,
+                class_code=0x010802,
+                port_type=PCI_EXP_TYPE_ENDPOINT,
+                speed=speed,
+                width=width,
+            )
+            add(
+                address,
+                parent_dir,
+                cfg,
+                0x010802,
+                resources=resources,
+                files={0: bytes(bar_size)},
+            )
+            fabric.endpoints.append(address)
+
+    def add_level(parent_dir, bus, depth):
+        if depth == 0:
+            add_endpoint(bus, parent_dir)
+            return
+        upstream = PciAddress(domain, bus, 0, 0)
+        up_dir, internal = add_bridge(upstream, parent_dir, PCI_EXP_TYPE_UPSTREAM, bus)
+        for port in range(switch_ports):
+            downstream = PciAddress(domain, internal, port, 0)
+            down_dir, secondary = add_bridge(
+                downstream, up_dir, PCI_EXP_TYPE_DOWNSTREAM, internal
+            )
+            add_level(down_dir, secondary, depth - 1)
+
+    for index in range(root_ports):
+        address = PciAddress(domain, 0, 1 + index, 0)
+        real, secondary = add_bridge(address, host_dir, PCI_EXP_TYPE_ROOT_PORT, 0)
+        fabric.root_ports.append(address)
+        add_level(real, secondary, switch_depth)
+    return fabric
+
+
+__all__ = ["Fabric", "build_config", "create_device", "create_fabric"]
@@ -1,17 +1,23 @@
 """Helpers for interacting with sysfs."""
 
+import errno
 import os
 
+from . import instrument
 from .errors import (
     OutOfRangeError,
     PermissionDeniedError,
     ResourceNotFoundError,
     SysfsFormatError,
+    ValueRangeError,
 )
 from .types import PciAddress
 
 DEFAULT_SYSFS_ROOT = "/sys/bus/pci/devices"
 
+# sysfs attributes never exceed one page.
+_ATTR_BUFFER_SIZE = 4096
+
 
 class Sysfs(object):
     """Access sysfs entries for PCI devices."""
@@ -33,7 +39,18 @@ class Sysfs(object):
             raise OutOfRangeError("bar_index must be non-negative")
         return os.path.join(self.device_dir(addr), "resource%d" % bar_index)
 
+    def open_device(self, addr):
+        """Return an opened DeviceDir for reading many attributes of a device."""
+        return DeviceDir(addr, root=self.root).open()
+
+    def read_attrs(self, addr, names):
+        """Read hex attributes of one device; missing ones are left out."""
+        with self.open_device(addr) as device:
+            return device.read_attrs(names)
+
     def read_hex_attr(self, path):
+        if instrument.state.enabled:
+            instrument.count_syscall("open")
         try:
             with open(path, "r") as handle:
                 value = handle.read().strip()
@@ -51,6 +68,125 @@ class Sysfs(object):
             raise SysfsFormatError("invalid hex value in %s" % path)
 
 
+def _map_os_error(exc):
+    if isinstance(exc, FileNotFoundError):
+        return ResourceNotFoundError(str(exc))
+    if isinstance(exc, PermissionError):
+        return PermissionDeniedError(str(exc))
+    return ResourceNotFoundError(str(exc))
+
+
+class DeviceDir(object):
+    """A device's sysfs directory, opened once.
+
+    Attributes are opened relative to the directory descriptor and read
+    with a raw ``readv`` into a buffer owned by the handle, so reading many
+    attributes resolves the device path (and its symlink) only once. Keep
+    the handle around (closing it only releases the descriptor) to reuse
+    both across calls.
+    """
+
+    __slots__ = ("address", "path", "_fd", "_buffer")
+
+    def __init__(self, addr, root=None):
+        self.address = PciAddress.parse(addr)
+        self.path = device_path(self.address, root)
+        self._fd = None
+        self._buffer = bytearray(_ATTR_BUFFER_SIZE)
+
+    def open(self):
+        if self._fd is None:
+            if instrument.state.enabled:
+                instrument.count_syscall("open")
+            try:
+                self._fd = os.open(self.path, os.O_RDONLY | os.O_DIRECTORY)
+            except OSError as exc:
+                raise _map_os_error(exc)
+        return self
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def read_raw(self, name):
+        """Return the raw bytes of one attribute."""
+        if self._fd is None:
+            self.open()
+        if instrument.state.enabled:
+            instrument.count_syscall("open")
+        try:
+            fd = os.open(name, os.O_RDONLY, dir_fd=self._fd)
+        except OSError as exc:
+            raise _map_os_error(exc)
+        try:
+            count = os.readv(fd, [self._buffer])
+        except OSError as exc:
+            raise _map_os_error(exc)
+        finally:
+            os.close(fd)
+        if instrument.state.enabled:
+            instrument.count_syscall("read", count)
+        return bytes(memoryview(self._buffer)[:count])
+
+    def read_text(self, name):
+        return self.read_raw(name).decode("ascii", "replace").strip()
+
+    def read_hex(self, name):
+        value = self.read_raw(name).strip()
+        if not value:
+            raise SysfsFormatError("empty value in %s/%s" % (self.path, name))
+        try:
+            return int(value, 16)
+        except ValueError:
+            raise SysfsFormatError("invalid hex value in %s/%s" % (self.path, name))
+
+    def write_text(self, name, text):
+        """Write ``text`` to one attribute with a single write.
+
+        EBUSY (the kernel refusing while a driver is bound) is reported as
+        PermissionDeniedError.
+        """
+        if self._fd is None:
+            self.open()
+        if instrument.state.enabled:
+            instrument.count_syscall("open")
+        try:
+            fd = os.open(name, os.O_WRONLY, dir_fd=self._fd)
+        except OSError as exc:
+            raise _map_os_error(exc)
+        data = text.encode("ascii")
+        try:
+            written = os.write(fd, data)
+        except OSError as exc:
+            if exc.errno == errno.EBUSY:
+                raise PermissionDeniedError(
+                    "%s/%s: device busy (unbind the driver first)" % (self.path, name)
+                )
+            raise _map_os_error(exc)
+        finally:
+            os.close(fd)
+        if instrument.state.enabled:
+            instrument.count_syscall("write", written, write=True)
+
+    def read_attrs(self, names):
+        """Return {name: int} for hex attributes; missing ones are left out."""
+        values = {}
+        for name in names:
+            try:
+                values[name] = self.read_hex(name)
+            except ResourceNotFoundError:
+                continue
+        return values
+
+
 def sysfs_root(root=None):
     return root or DEFAULT_SYSFS_ROOT
 
@@ -63,28 +199,29 @@ def read_hex_file(path):
     return Sysfs().read_hex_attr(path)
 
 
-def list_device_bdfs(root=None):
-    base = sysfs_root(root)
+def iter_device_addresses(root=None):
+    """Yield the PciAddress of every device directory as sysfs is scanned."""
     try:
-        entries = os.listdir(base)
-    except FileNotFoundError as exc:
-        raise ResourceNotFoundError(str(exc))
-    except PermissionError as exc:
-        raise PermissionDeniedError(str(exc))
+        iterator = os.scandir(sysfs_root(root))
     except OSError as exc:
-        raise ResourceNotFoundError(str(exc))
-    bdfs = []
-    for entry in entries:
-        try:
-            bdfs.append(PciAddress.parse(entry))
-        except Exception:
-            continue
-    return bdfs
+        raise _map_os_error(exc)
+    with iterator:
+        for entry in iterator:
+            try:
+                yield PciAddress.parse(entry.name)
+            except (SysfsFormatError, ValueRangeError):
+                continue
+
+
+def list_device_bdfs(root=None):
+    return list(iter_device_addresses(root))
 
 
 def parse_resource_file(address, root=None):
     """Return list of (start, end, flags) tuples for each BAR."""
     path = os.path.join(device_path(address, root), "resource")
+    if instrument.state.enabled:
+        instrument.count_syscall("open")
     try:
         with open(path, "r") as handle:
             lines = [line.strip() for line in handle if line.strip()]
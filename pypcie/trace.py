@@ -0,0 +1,309 @@
+"""Record and replay config/BAR access traces.
+
+A trace file starts with an 8-byte magic and the wall-clock start time,
+followed by fixed-size 32-byte records::
+
+    u64 nanoseconds since start
+    u32 packed BDF (domain << 16 | bus << 8 | device << 3 | function)
+    u8  space (0 = config, 1 = BAR)
+    u8  BAR index (0xff for config)
+    u8  width in bytes
+    u8  flags (bit 0 = write)
+    u64 offset
+    u64 value
+"""
+
+import collections
+import struct
+import threading
+import time
+
+from . import bar as bar_access
+from . import config as config_access
+from . import instrument
+from .errors import ResourceNotFoundError, SysfsFormatError, ValueRangeError
+from .sysfs import Sysfs
+from .types import PciAddress
+
+TRACE_MAGIC = b"PPCITRC1"
+SPACE_CONFIG = 0
+SPACE_BAR = 1
+
+_HEADER = struct.Struct("<8sd")
+_RECORD = struct.Struct("<QIBBBBQQ")
+_FLAG_WRITE = 0x01
+_NO_BAR = 0xFF
+_FLUSH_BYTES = 64 * 1024
+
+
+class TraceRecord(object):
+    """One recorded access; ``timestamp`` is seconds since trace start."""
+
+    __slots__ = (
+        "timestamp",
+        "address",
+        "space",
+        "bar",
+        "offset",
+        "width",
+        "value",
+        "write",
+    )
+
+    def __init__(self, timestamp, address, space, bar, offset, width, value, write):
+        self.timestamp = timestamp
+        self.address = address
+        self.space = space
+        self.bar = bar
+        self.offset = offset
+        self.width = width
+        self.value = value
+        self.write = write
+
+    @property
+    def space_name(self):
+        if self.space == SPACE_CONFIG:
+            return "config"
+        return "bar%d" % self.bar
+
+    def __repr__(self):
+        return "TraceRecord(%.6f, %s, %s, 0x%x, %d, 0x%x, %s)" % (
+            self.timestamp,
+            self.address.bdf,
+            self.space_name,
+            self.offset,
+            self.width,
+            self.value,
+            "w" if self.write else "r",
+        )
+
+
+class TraceRecorder(object):
+    """Capture every typed config and BAR access into a trace file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._handle = None
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._start = None
+
+    def start(self):
+        if self._handle is not None:
+            return self
+        self._handle = open(self.path, "wb")
+        self._handle.write(_HEADER.pack(TRACE_MAGIC, time.time()))
+        self._start = time.perf_counter()
+        instrument.add_access_hook(self._on_access)
+        return self
+
+    def stop(self):
+        if self._handle is None:
+            return
+        instrument.remove_access_hook(self._on_access)
+        with self._lock:
+            self._flush()
+            self._handle.close()
+            self._handle = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def _on_access(self, space, address, bar, offset, width, value, write):
+        elapsed_ns = int((time.perf_counter() - self._start) * 1e9)
+        key = PciAddress.parse(address).packed
+        if space == "config":
+            space_code, bar_index = SPACE_CONFIG, _NO_BAR
+        else:
+            space_code, bar_index = SPACE_BAR, bar
+        record = _RECORD.pack(
+            elapsed_ns,
+            key,
+            space_code,
+            bar_index,
+            width,
+            _FLAG_WRITE if write else 0,
+            offset,
+            value,
+        )
+        with self._lock:
+            self._buffer += record
+            self.count += 1
+            if len(self._buffer) >= _FLUSH_BYTES:
+                self._flush()
+
+    def _flush(self):
+        if self._buffer and self._handle is not None:
+            self._handle.write(self._buffer)
+            self._buffer = bytearray()
+
+
+def read_trace(path):
+    """Return (start_wall_time, list of TraceRecord) for a trace file."""
+    try:
+        with open(path, "rb") as handle:
+            data = handle.read()
+    except OSError as exc:
+        raise ResourceNotFoundError(str(exc))
+    if len(data) < _HEADER.size:
+        raise SysfsFormatError("trace file too short: %s" % path)
+    magic, started = _HEADER.unpack_from(data, 0)
+    if magic != TRACE_MAGIC:
+        raise SysfsFormatError("not a pypcie trace: %s" % path)
+    body = len(data) - _HEADER.size
+    if body % _RECORD.size:
+        raise SysfsFormatError("truncated trace record in %s" % path)
+    records = []
+    for fields in _RECORD.iter_unpack(memoryview(data)[_HEADER.size :]):
+        elapsed_ns, key, space, bar_index, width, flags, offset, value = fields
+        records.append(
+            TraceRecord(
+                elapsed_ns / 1e9,
+                PciAddress.intern(key),
+                space,
+                None if space == SPACE_CONFIG else bar_index,
+                offset,
+                width,
+                value,
+                bool(flags & _FLAG_WRITE),
+            )
+        )
+    return started, records
+
+
+def replay(records, sysfs_root=None, timing=False, verify=False):
+    """Re-issue recorded accesses against a sysfs tree.
+
+    With ``timing`` the original inter-access delays are reproduced,
+    otherwise the trace runs at full speed. With ``verify`` every read is
+    compared to the recorded value. Returns a summary dict.
+    """
+    sysfs = Sysfs(root=sysfs_root) if sysfs_root else Sysfs()
+    bars = {}
+    mismatches = []
+    reads = writes = 0
+    origin = records[0].timestamp if records else 0.0
+    started = time.perf_counter()
+    try:
+        for record in records:
+            if timing:
+                target = record.timestamp - origin
+                delay = target - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            if record.width == 8:
+                raise ValueRangeError("64-bit trace records are not supported")
+            if record.space == SPACE_CONFIG:
+                if record.write:
+                    config_access.write(
+                        record.address,
+                        record.offset,
+                        record.width,
+                        record.value,
+                        sysfs_root=sysfs.root,
+                    )
+                    writes += 1
+                    continue
+                value = config_access.read(
+                    record.address, record.offset, record.width, sysfs_root=sysfs.root
+                )
+            else:
+                key = (record.address, record.bar)
+                pci_bar = bars.get(key)
+                if pci_bar is None:
+                    pci_bar = bars[key] = bar_access.PciBar(
+                        sysfs, record.address, record.bar
+                    ).open()
+                if record.write:
+                    _bar_write(pci_bar, record.offset, record.width, record.value)
+                    writes += 1
+                    continue
+                value = _bar_read(pci_bar, record.offset, record.width)
+            reads += 1
+            if verify and value != record.value:
+                mismatches.append((record, value))
+    finally:
+        for pci_bar in bars.values():
+            pci_bar.close()
+    return {
+        "ops": reads + writes,
+        "reads": reads,
+        "writes": writes,
+        "elapsed_s": time.perf_counter() - started,
+        "mismatches": mismatches,
+    }
+
+
+def _bar_read(pci_bar, offset, width):
+    if width == 1:
+        return pci_bar.read_u8(offset)
+    if width == 2:
+        return pci_bar.read_u16(offset)
+    return pci_bar.read_u32(offset)
+
+
+def _bar_write(pci_bar, offset, width, value):
+    if width == 1:
+        pci_bar.write_u8(offset, value)
+    elif width == 2:
+        pci_bar.write_u16(offset, value)
+    else:
+        pci_bar.write_u32(offset, value)
+
+
+def trace_stats(records, top=10):
+    """Summarize access rates and the most frequently accessed registers."""
+    registers = collections.Counter()
+    register_writes = collections.Counter()
+    devices = collections.Counter()
+    writes = 0
+    for record in records:
+        key = (record.address, record.space_name, record.offset)
+        registers[key] += 1
+        devices[record.address] += 1
+        if record.write:
+            writes += 1
+            register_writes[key] += 1
+    total = len(records)
+    duration = records[-1].timestamp - records[0].timestamp if total > 1 else 0.0
+    hot = []
+    for key, count in registers.most_common(top):
+        address, space, offset = key
+        hot.append(
+            {
+                "bdf": address.bdf,
+                "space": space,
+                "offset": offset,
+                "count": count,
+                "writes": register_writes[key],
+                "rate_per_s": count / duration if duration else 0.0,
+            }
+        )
+    return {
+        "ops": total,
+        "reads": total - writes,
+        "writes": writes,
+        "duration_s": duration,
+        "rate_per_s": total / duration if duration else 0.0,
+        "devices": {
+            address.bdf: count for address, count in devices.most_common()
+        },
+        "hot_registers": hot,
+    }
+
+
+__all__ = [
+    "SPACE_BAR",
+    "SPACE_CONFIG",
+    "TRACE_MAGIC",
+    "TraceRecord",
+    "TraceRecorder",
+    "read_trace",
+    "replay",
+    "trace_stats",
+]
@@ -1,6 +1,9 @@
 """Core types and validation helpers for pypcie."""
 
+import array
+import bisect
 import re
+import threading
 
 from .errors import SysfsFormatError, ValueRangeError
 
@@ -46,56 +49,185 @@ def validate_u64(value):
     return _validate_value_range(value, 64, "u64")
 
 
+def validate_workers(value, name="workers"):
+    """Validate a thread pool size (a positive integer)."""
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+        raise ValueRangeError("%s must be a positive integer" % name)
+    return value
+
+
+class AccessGuard(object):
+    """Count accesses in flight on a shared handle so ``close()`` can wait.
+
+    Accessors wrap each use of a descriptor or mapping in ``with guard:``;
+    the count is only locked while it changes, so accesses run in
+    parallel. ``drain()`` blocks new accesses and waits for running ones,
+    and ``release()`` lets accesses in again once the handle is torn down.
+    """
+
+    __slots__ = ("_cond", "_active", "_closing")
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._active = 0
+        self._closing = False
+
+    def __enter__(self):
+        with self._cond:
+            while self._closing:
+                self._cond.wait()
+            self._active += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._cond:
+            self._active -= 1
+            if not self._active:
+                self._cond.notify_all()
+        return False
+
+    def drain(self):
+        with self._cond:
+            while self._closing:
+                self._cond.wait()
+            self._closing = True
+            while self._active:
+                self._cond.wait()
+
+    def release(self):
+        with self._cond:
+            self._closing = False
+            self._cond.notify_all()
+
+
+# Interned addresses keyed by packed value, and parsed strings by text.
+_BY_PACKED = {}
+_BY_TEXT = {}
+_INTERN_LIMIT = 1 << 16
+_LOWER_HEX = frozenset("0123456789abcdef")
+
+
+def _intern(packed):
+    address = _BY_PACKED.get(packed)
+    if address is None:
+        if len(_BY_PACKED) >= _INTERN_LIMIT:
+            _BY_PACKED.clear()
+            _BY_TEXT.clear()
+        address = _BY_PACKED.setdefault(packed, PciAddress.from_packed(packed))
+    return address
+
+
 class PciAddress(object):
-    """Represents a PCI domain:bus:device.function address."""
+    """Represents a PCI domain:bus:device.function address.
 
-    __slots__ = ("domain", "bus", "device", "function")
+    Addresses are immutable and identified by a packed 32-bit integer
+    (``domain << 16 | bus << 8 | device << 3 | function``), which is used
+    for hashing and ordering.
+    """
+
+    __slots__ = ("domain", "bus", "device", "function", "packed", "_bdf")
 
     def __init__(self, domain, bus, device, function):
-        self.domain = int(domain)
-        self.bus = int(bus)
-        self.device = int(device)
-        self.function = int(function)
-        self._validate()
-
-    def _validate(self):
-        if not (0 <= self.domain <= 0xFFFF):
+        domain = int(domain)
+        bus = int(bus)
+        device = int(device)
+        function = int(function)
+        if not (0 <= domain <= 0xFFFF):
             raise ValueRangeError("domain out of range")
-        if not (0 <= self.bus <= 0xFF):
+        if not (0 <= bus <= 0xFF):
             raise ValueRangeError("bus out of range")
-        if not (0 <= self.device <= 0x1F):
+        if not (0 <= device <= 0x1F):
             raise ValueRangeError("device out of range")
-        if not (0 <= self.function <= 0x7):
+        if not (0 <= function <= 0x7):
             raise ValueRangeError("function out of range")
+        setter = object.__setattr__
+        setter(self, "domain", domain)
+        setter(self, "bus", bus)
+        setter(self, "device", device)
+        setter(self, "function", function)
+        setter(self, "packed", (domain << 16) | (bus << 8) | (device << 3) | function)
+        setter(self, "_bdf", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PciAddress is immutable")
+
+    def __reduce__(self):
+        return (self.__class__, (self.domain, self.bus, self.device, self.function))
+
+    @classmethod
+    def from_packed(cls, packed):
+        """Build an address from its packed 32-bit integer form."""
+        if not isinstance(packed, int) or not (0 <= packed <= 0xFFFFFFFF):
+            raise ValueRangeError("packed address out of range")
+        return cls(packed >> 16, (packed >> 8) & 0xFF, (packed >> 3) & 0x1F, packed & 0x7)
+
+    @classmethod
+    def intern(cls, packed):
+        """Return the shared instance for a packed address."""
+        return _intern(packed)
 
     @classmethod
     def parse(cls, text):
-        """Parse a BDF string like '0000:00:1f.6' or '00:1f.6'."""
+        """Parse a BDF string like '0000:00:1f.6' or '00:1f.6'.
+
+        Results are interned, so parsing the same address twice returns
+        the same object. Canonical lowercase 'DDDD:BB:DD.F' strings skip
+        the regex.
+        """
         if isinstance(text, cls):
             return text
         if not isinstance(text, str):
             raise SysfsFormatError("address must be a string")
-        match = _BDF_RE.match(text.strip())
-        if not match:
-            raise SysfsFormatError("invalid PCI address: %r" % (text,))
-        domain = match.group("domain")
-        if domain is None:
-            domain = "0000"
-        return cls(
-            int(domain, 16),
-            int(match.group("bus"), 16),
-            int(match.group("device"), 16),
-            int(match.group("function"), 16),
-        )
+        address = _BY_TEXT.get(text)
+        if address is not None:
+            return address
+        if (
+            len(text) == 12
+            and text[4] == ":"
+            and text[7] == ":"
+            and text[10] == "."
+            and _LOWER_HEX.issuperset(text[0:4] + text[5:7] + text[8:10] + text[11])
+        ):
+            device = int(text[8:10], 16)
+            function = int(text[11], 16)
+            if device <= 0x1F and function <= 0x7:
+                address = _intern(
+                    (int(text[0:4], 16) << 16)
+                    | (int(text[5:7], 16) << 8)
+                    | (device << 3)
+                    | function
+                )
+        if address is None:
+            match = _BDF_RE.match(text.strip())
+            if not match:
+                raise SysfsFormatError("invalid PCI address: %r" % (text,))
+            domain = match.group("domain")
+            if domain is None:
+                domain = "0000"
+            parsed = cls(
+                int(domain, 16),
+                int(match.group("bus"), 16),
+                int(match.group("device"), 16),
+                int(match.group("function"), 16),
+            )
+            address = _intern(parsed.packed)
+        if len(_BY_TEXT) >= _INTERN_LIMIT:
+            _BY_TEXT.clear()
+        _BY_TEXT[text] = address
+        return address
 
     @property
     def bdf(self):
-        return "%04x:%02x:%02x.%x" % (
-            self.domain,
-            self.bus,
-            self.device,
-            self.function,
-        )
+        bdf = self._bdf
+        if bdf is None:
+            bdf = "%04x:%02x:%02x.%x" % (
+                self.domain,
+                self.bus,
+                self.device,
+                self.function,
+            )
+            object.__setattr__(self, "_bdf", bdf)
+        return bdf
 
     def __str__(self):
         return self.bdf
@@ -109,22 +241,119 @@ class PciAddress(object):
                 other = PciAddress.parse(other)
             except Exception:
                 return False
-        return (
-            self.domain == other.domain
-            and self.bus == other.bus
-            and self.device == other.device
-            and self.function == other.function
-        )
+        return self.packed == other.packed
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __lt__(self, other):
+        if not isinstance(other, PciAddress):
+            return NotImplemented
+        return self.packed < other.packed
+
+    def __le__(self, other):
+        if not isinstance(other, PciAddress):
+            return NotImplemented
+        return self.packed <= other.packed
+
+    def __gt__(self, other):
+        if not isinstance(other, PciAddress):
+            return NotImplemented
+        return self.packed > other.packed
+
+    def __ge__(self, other):
+        if not isinstance(other, PciAddress):
+            return NotImplemented
+        return self.packed >= other.packed
 
     def __hash__(self):
-        return hash((self.domain, self.bus, self.device, self.function))
+        return hash(self.packed)
+
+
+class PciAddressSet(object):
+    """Sorted set of addresses stored as packed 32-bit integers.
+
+    Uses 4 bytes per address, which keeps inventories of many thousands
+    of virtual functions compact. Iteration yields interned PciAddress
+    objects in address order.
+    """
+
+    __slots__ = ("_keys",)
+
+    def __init__(self, addresses=()):
+        self._keys = array.array("I")
+        self.update(addresses)
+
+    @classmethod
+    def from_packed(cls, keys):
+        result = cls()
+        result._keys = array.array("I", sorted(set(keys)))
+        return result
+
+    def add(self, address):
+        packed = PciAddress.parse(address).packed
+        keys = self._keys
+        index = bisect.bisect_left(keys, packed)
+        if index == len(keys) or keys[index] != packed:
+            keys.insert(index, packed)
+
+    def update(self, addresses):
+        packed = set(PciAddress.parse(address).packed for address in addresses)
+        if not packed:
+            return
+        packed.update(self._keys)
+        self._keys = array.array("I", sorted(packed))
+
+    def discard(self, address):
+        packed = PciAddress.parse(address).packed
+        keys = self._keys
+        index = bisect.bisect_left(keys, packed)
+        if index < len(keys) and keys[index] == packed:
+            del keys[index]
+
+    def __contains__(self, address):
+        try:
+            packed = PciAddress.parse(address).packed
+        except (SysfsFormatError, ValueRangeError):
+            return False
+        keys = self._keys
+        index = bisect.bisect_left(keys, packed)
+        return index < len(keys) and keys[index] == packed
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        for packed in self._keys:
+            yield _intern(packed)
+
+    def __eq__(self, other):
+        if not isinstance(other, PciAddressSet):
+            return NotImplemented
+        return self._keys == other._keys
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def packed(self):
+        """Return a copy of the underlying packed-key array."""
+        return array.array("I", self._keys)
+
+    def __repr__(self):
+        return "PciAddressSet(%d addresses)" % len(self._keys)
 
 
 __all__ = [
+    "AccessGuard",
     "PciAddress",
+    "PciAddressSet",
     "validate_u8",
     "validate_u16",
     "validate_u32",
     "validate_u64",
     "validate_width",
+    "validate_workers",
 ]
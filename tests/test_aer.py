@@ -0,0 +1,85 @@
+from pypcie import aer, config, instrument
+from pypcie.synthetic import create_fabric
+from pypcie.sysfs import Sysfs
+
+AER = 0x100
+
+
+def test_collector_counts_transitions_and_kernel_counters(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    root_port, endpoint = fabric.root_ports[0], fabric.endpoints[0]
+    root = str(sysfs_root)
+    (sysfs_root / endpoint.bdf / "aer_dev_correctable").write_text(
+        "RxErr 2\nBadTLP 5\nTOTAL_ERR_COR 7\n"
+    )
+
+    with aer.AerCollector(sysfs=Sysfs(root=root)) as collector:
+        assert collector.addresses == [root_port, endpoint]
+        collector.sample()
+        assert collector.counters()[endpoint]["correctable"] == 0
+
+        config.write_u32(endpoint, AER + 0x10, 0x00000041, sysfs_root=root)
+        config.write_u32(endpoint, AER + 0x04, 1 << 14, sysfs_root=root)
+        statuses = collector.sample()
+        status = statuses[endpoint]
+        assert status.correctable == ["RxErr", "BadTLP"]
+        assert status.uncorrectable == ["CompletionTimeout"]
+        assert status.cor_mask == 0x2000
+
+        # Sticky bits that stay set are not counted again.
+        collector.sample()
+        counters = collector.counters()[endpoint]
+    assert counters["correctable"] == 2 and counters["uncorrectable"] == 1
+    assert counters["errors"]["correctable.RxErr"] == 1
+    assert counters["kernel_cor"] == 7
+
+
+def test_collector_clear_writes_status_back(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    endpoint = fabric.endpoints[0]
+    root = str(sysfs_root)
+    config.write_u32(endpoint, AER + 0x10, 0x1, sysfs_root=root)
+    writes = []
+
+    def hook(space, address, bar, offset, width, value, write):
+        if write:
+            writes.append((offset, value))
+
+    instrument.add_access_hook(hook)
+    try:
+        with aer.AerCollector([endpoint], sysfs=Sysfs(root=root), clear=True) as collector:
+            collector.sample()
+            collector.sample()
+            # The synthetic file keeps the bit, so each pass sees a new error.
+            assert collector.counters()[endpoint]["correctable"] == 2
+    finally:
+        instrument.remove_access_hook(hook)
+    assert writes == [(AER + 0x10, 0x1), (AER + 0x10, 0x1)]
+    assert aer.read_aer(endpoint, sysfs_root=root).correctable == ["RxErr"]
+
+
+def test_counter_rates():
+    before = {"a": {"correctable": 2, "errors": {}}}
+    after = {"a": {"correctable": 12, "errors": {}}}
+    assert aer.counter_rates(before, after, 2.0) == {"a": {"correctable": 5.0}}
+
+
+def test_collector_keeps_sysfs_directory_open(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    endpoint = fabric.endpoints[0]
+    (sysfs_root / endpoint.bdf / "aer_dev_correctable").write_text("TOTAL_ERR_COR 3\n")
+
+    with aer.AerCollector(sysfs=Sysfs(root=str(sysfs_root))) as collector:
+        collector.sample()
+        instrument.reset()
+        instrument.enable()
+        try:
+            collector.sample()
+            syscalls = instrument.snapshot()["syscalls"]
+        finally:
+            instrument.disable()
+            instrument.reset()
+    # Only the counter files are opened (two devices), and only the one
+    # that exists is read; the device directories come from the first pass.
+    assert syscalls["open"] == 2 * len(aer.KERNEL_COUNTER_FILES)
+    assert syscalls["read"] == 1
@@ -0,0 +1,120 @@
+import pytest
+
+from pypcie import aspm, config, instrument, link
+from pypcie.errors import ValueRangeError
+from pypcie.sysfs import Sysfs
+from pypcie.synthetic import create_fabric
+
+L1SS = 0x150
+LNKCTL = 0x80
+
+
+def _fabric(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=1, switch_ports=2)
+    root = str(sysfs_root)
+    dp, endpoint = fabric.bridges[2], fabric.endpoints[0]
+    # Endpoint LNKCAP: ASPM L0s+L1, L0s exit 128-256ns, L1 exit 4-8us.
+    lnkcap = config.read_u32(endpoint, 0x7C, sysfs_root=root)
+    config.write_u32(endpoint, 0x7C, lnkcap | (2 << 12) | (3 << 15), sysfs_root=root)
+    # L1 PM Substates behind AER on both ends of the lower link: ASPM
+    # L1.1/L1.2, 10us common mode restore, T_POWER_ON 5 x 10us.
+    for address in (dp, endpoint):
+        header = config.read_u32(address, 0x100, sysfs_root=root)
+        config.write_u32(address, 0x100, header | (L1SS << 20), sysfs_root=root)
+        config.write_u32(address, L1SS, (1 << 16) | 0x001E, sysfs_root=root)
+        config.write_u32(address, L1SS + 0x04, 0x1F | (10 << 8), sysfs_root=root)
+        config.write_u32(address, L1SS + 0x08, 10 << 8, sysfs_root=root)
+        config.write_u32(address, L1SS + 0x0C, (5 << 3) | 1, sysfs_root=root)
+    return fabric
+
+
+def test_decode_aspm_registers():
+    caps = link.decode_link_capabilities((3 << 10) | (7 << 12) | (2 << 15))
+    assert caps["l0s_exit_latency_ns"] == 5000
+    assert caps["l1_exit_latency_ns"] == 4000
+    assert link.decode_aspm_control(0x0042) == ["l1"]
+    decoded = link.decode_l1ss(
+        0x1F | (10 << 8) | (2 << 16) | (3 << 19),
+        0x4 | (5 << 16) | (1 << 29),
+        0x2 | (4 << 3),
+    )
+    assert decoded["supported"] == ["l1.1", "l1.2"]
+    assert decoded["enabled"] == ["l1.2"]
+    assert decoded["port_common_mode_restore_us"] == 10
+    assert decoded["port_t_power_on_us"] == 300
+    assert decoded["t_power_on_us"] == 400
+    assert decoded["ltr_l1_2_threshold_ns"] == 160
+
+
+def test_path_links_and_latency(sysfs_root):
+    fabric = _fabric(sysfs_root)
+    sysfs = Sysfs(str(sysfs_root))
+    links = aspm.path_links(fabric.endpoints[0], sysfs=sysfs)
+    assert [(l.port.address, l.functions[0].address) for l in links] == [
+        (fabric.root_ports[0], fabric.bridges[1]),
+        (fabric.bridges[2], fabric.endpoints[0]),
+    ]
+    assert links[0].supported == ["l0s", "l1"]
+    assert links[1].supported == ["l0s", "l1", "l1.1", "l1.2"]
+    assert all(l.enabled == [] for l in links)
+    assert aspm.path_exit_latency(links) == {"l0s_ns": 0, "l1_ns": 0}
+
+
+def test_enable_then_disable_path(sysfs_root):
+    fabric = _fabric(sysfs_root)
+    root = str(sysfs_root)
+    sysfs = Sysfs(root)
+    rp, up, dp = fabric.bridges[:3]
+    endpoint = fabric.endpoints[0]
+    writes = []
+
+    def hook(space, address, bar, offset, width, value, write):
+        if write:
+            writes.append((address, offset, value))
+
+    instrument.add_access_hook(hook)
+    try:
+        assert aspm.set_path_aspm(endpoint, sysfs=sysfs) == 6
+    finally:
+        instrument.remove_access_hook(hook)
+    # Root port before the switch, then substates before L1 on the lower link.
+    assert writes == [
+        (rp, LNKCTL, 0x3),
+        (up, LNKCTL, 0x3),
+        (dp, L1SS + 0x08, (10 << 8) | 0xC),
+        (endpoint, L1SS + 0x08, (10 << 8) | 0xC),
+        (dp, LNKCTL, 0x3),
+        (endpoint, LNKCTL, 0x3),
+    ]
+    links = aspm.path_links(endpoint, sysfs=sysfs)
+    assert links[1].enabled == ["l0s", "l1", "l1.1", "l1.2"]
+    # Upper link: 64ns L0s, 1us L1 plus one switch. Lower link: 256ns L0s,
+    # 8us L1 plus 50us T_POWER_ON and 10us common mode restore.
+    assert aspm.path_exit_latency(links) == {"l0s_ns": 320, "l1_ns": 68000}
+
+    del writes[:]
+    instrument.add_access_hook(hook)
+    try:
+        written = aspm.set_path_aspm(
+            endpoint, states=["l1.2"], enable=False, sysfs=sysfs
+        )
+    finally:
+        instrument.remove_access_hook(hook)
+    assert written == 6
+    # L1 drops device end first while the substate changes, then returns.
+    assert writes == [
+        (endpoint, LNKCTL, 0x1),
+        (dp, LNKCTL, 0x1),
+        (endpoint, L1SS + 0x08, (10 << 8) | 0x8),
+        (dp, L1SS + 0x08, (10 << 8) | 0x8),
+        (dp, LNKCTL, 0x3),
+        (endpoint, LNKCTL, 0x3),
+    ]
+
+    aspm.set_path_aspm(endpoint, states=["l1"], enable=False, sysfs=sysfs)
+    links = aspm.path_links(endpoint, sysfs=sysfs)
+    assert [l.enabled for l in links] == [["l0s"], ["l0s"]]
+    assert config.read_u32(endpoint, L1SS + 0x08, sysfs_root=root) == 10 << 8
+
+    with pytest.raises(ValueRangeError):
+        aspm.set_path_aspm(endpoint, states=["l2"], sysfs=sysfs)
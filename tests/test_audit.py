@@ -0,0 +1,44 @@
+from pypcie import audit, config
+from pypcie.sysfs import Sysfs
+from pypcie.synthetic import create_fabric
+
+
+def test_audit_links_flags_downtrained_link(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=2, switch_depth=1, switch_ports=2)
+    sysfs = Sysfs(str(sysfs_root))
+    endpoint = fabric.endpoints[0]
+    # Gen4 x16 capable on both ends, trained at Gen3 x8.
+    config.write_u16(endpoint, 0x82, 0x3 | (8 << 4), sysfs_root=str(sysfs_root))
+
+    audits = audit.audit_links(sysfs=sysfs, workers=4)
+    # One link per root port to its switch plus one per endpoint.
+    assert len(audits) == len(fabric.root_ports) + len(fabric.endpoints)
+    degraded = [entry for entry in audits if entry.degraded]
+    assert [entry.device for entry in degraded] == [endpoint]
+    entry = degraded[0]
+    assert entry.port == fabric.bridges[2]
+    assert (entry.speed_gtps, entry.width) == (8.0, 8)
+    assert (entry.capable_speed_gtps, entry.capable_width) == (16.0, 16)
+    assert entry.lost_gbps == entry.capable_gbps - entry.bandwidth_gbps
+    assert entry.as_dict()["degraded"] is True
+
+    lines = audit.format_audit(audits)
+    assert len(lines) == 3
+    assert lines[1].startswith("%s  %s" % (entry.port.bdf, endpoint.bdf))
+    assert lines[-1].startswith("%d links audited, 1 degraded" % len(audits))
+
+
+def test_audit_links_compares_sysfs(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    endpoint = fabric.endpoints[0]
+    device_dir = sysfs_root / endpoint.bdf
+    (device_dir / "current_link_speed").write_text("16.0 GT/s PCIe\n")
+    (device_dir / "current_link_width").write_text("8\n")
+
+    audits = audit.audit_links(
+        [endpoint], sysfs=Sysfs(str(sysfs_root)), workers=1, compare_sysfs=True
+    )
+    assert len(audits) == 1
+    assert audits[0].port == fabric.root_ports[0]
+    assert audits[0].sysfs_mismatch == ["current_width"]
+    assert not audits[0].degraded
@@ -0,0 +1,82 @@
+import pytest
+
+from pypcie import bandwidth, config, instrument
+from pypcie.errors import ResourceNotFoundError
+from pypcie.sysfs import Sysfs
+from pypcie.synthetic import create_fabric
+
+LNKSTA = 0x82
+LNKSTA2 = 0xA2
+
+
+def _fabric(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=1, switch_ports=2)
+    root = str(sysfs_root)
+    # Root port to switch trained at 8 GT/s x16; second endpoint at x4.
+    config.write_u16(fabric.bridges[1], LNKSTA, 3 | (16 << 4), sysfs_root=root)
+    config.write_u16(fabric.endpoints[1], LNKSTA, 4 | (4 << 4), sysfs_root=root)
+    return fabric
+
+
+def test_path_bandwidth_names_bottleneck(sysfs_root):
+    fabric = _fabric(sysfs_root)
+    sysfs = Sysfs(str(sysfs_root))
+    rp, up, dp0, dp1 = fabric.bridges[:4]
+    e0, e1 = fabric.endpoints
+
+    path = bandwidth.path_bandwidth(e0, sysfs=sysfs)
+    assert [(hop.port, hop.device) for hop in path.hops] == [(rp, up), (dp0, e0)]
+    assert (path.bottleneck.port, path.bottleneck.device) == (rp, up)
+    assert path.bandwidth_gbps == pytest.approx(15.754, abs=1e-3)
+    assert path.capable_gbps == pytest.approx(31.508, abs=1e-3)
+    assert path.limited is True
+    assert path.hops[0].degraded is True
+    assert path.hops[0].encoding == "128b/130b"
+
+    paths = bandwidth.path_bandwidths(sysfs=sysfs, workers=4)
+    assert [p.endpoint for p in paths] == [e0, e1]
+    assert paths[1].bottleneck.device == e1
+    assert paths[1].bandwidth_gbps == pytest.approx(7.877, abs=1e-3)
+
+    lines = bandwidth.format_paths(paths, hops=True)
+    assert lines[1].split() == [
+        e0.bdf,
+        "15.75",
+        "31.51",
+        rp.bdf,
+        "->",
+        up.bdf,
+        "8GT/s",
+        "x16",
+        "128b/130b",
+    ]
+    assert lines[2].endswith("15.75 GB/s  bottleneck")
+    assert lines[-1] == "2 endpoints, 2 below their capable bandwidth"
+
+    with pytest.raises(ResourceNotFoundError):
+        bandwidth.path_bandwidth(rp, sysfs=sysfs)
+
+
+def test_flit_mode_and_reader_reuses_offsets(sysfs_root):
+    fabric = _fabric(sysfs_root)
+    root = str(sysfs_root)
+    e0 = fabric.endpoints[0]
+    config.write_u16(e0, LNKSTA2, 0x0400, sysfs_root=root)
+    reader = bandwidth.BandwidthReader(sysfs=Sysfs(root), workers=2)
+
+    hop = reader.read([e0])[0].hops[1]
+    assert hop.encoding == "128b/130b+flit"
+    assert hop.bandwidth_gbps == pytest.approx(31.508 * 242 / 256, abs=1e-3)
+
+    # Later passes read only the link registers of the four devices.
+    config.write_u16(e0, LNKSTA, 4 | (8 << 4), sysfs_root=root)
+    instrument.reset()
+    instrument.enable()
+    try:
+        path = reader.read([e0])[0]
+        snap = instrument.snapshot()
+    finally:
+        instrument.disable()
+    assert path.hops[1].width == 8
+    assert snap["syscalls"]["pread"] == 4
+    assert snap["bytes"]["read"] == 4 * 0x28
@@ -1,6 +1,7 @@
 import pytest
 
 from pypcie.bar import PciBar
+from pypcie.device import PciDevice
 from pypcie.errors import AlignmentError, OutOfRangeError
 from pypcie.sysfs import Sysfs
 
@@ -84,3 +85,39 @@ def test_bar_alignment(sysfs_root, make_device):
     with pci_bar.open():
         with pytest.raises(AlignmentError):
             pci_bar.read_u32(2)
+
+
+def test_bar_table_decodes_resource_flags(sysfs_root, make_device):
+    resource_entries = [
+        (0xF0000000, 0xF0003FFF, 0x0014220C),
+        (0, 0, 0),
+        (0x2000, 0x201F, 0x00040101),
+        (0, 0, 0),
+        (0, 0, 0),
+        (0, 0, 0),
+    ]
+    path = make_device(
+        bdf="0000:00:0d.0",
+        resource_entries=resource_entries,
+        resource_files={0: bytes(0x4000), 2: bytes(0x20)},
+    )
+    (path / "resource0_wc").write_bytes(b"")
+
+    sysfs = Sysfs(root=str(sysfs_root))
+    with PciDevice(sysfs, "0000:00:0d.0") as dev:
+        table = dev.bars
+        assert dev.bars is table
+        assert len(table) == 6
+        bar0, bar1, bar2 = table[0], table[1], table[2]
+        assert (bar0.size, bar0.is_mem, bar0.is_64bit) == (0x4000, True, True)
+        assert bar0.prefetchable and bar0.has_wc and bar0.mmappable
+        assert bar1.size == 0 and not bar1.mmappable
+        assert bar2.is_io and not bar2.mmappable and not bar2.has_wc
+
+        pci_bar = dev.bar(0)
+        assert pci_bar.info is bar0 and pci_bar.length == 0x4000
+        with pytest.raises(OutOfRangeError):
+            dev.bar(6)
+
+        dev.refresh()
+        assert dev.bars is not table
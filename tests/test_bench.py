@@ -0,0 +1,100 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from pypcie import bench
+from pypcie.errors import ValueRangeError
+
+
+def test_run_suite_reports_percentiles(tmp_path):
+    report = bench.run_suite(
+        iterations=20,
+        scan_iterations=2,
+        warmup=1,
+        workdir=str(tmp_path),
+        root_ports=1,
+        switch_ports=2,
+        functions=1,
+    )
+    assert report["fabric"]["devices"] == 6
+    assert list(report["results"]) == list(bench.BENCHMARKS)
+    result = report["results"]["config.read_u32"]
+    assert result["ops"] == 20
+    assert result["ops_per_sec"] > 0
+    assert result["p50_us"] <= result["p99_us"] <= result["max_us"]
+
+    rows = bench.compare_results(report, report)
+    assert len(rows) == len(bench.BENCHMARKS)
+    assert all(row[3] == 0.0 for row in rows)
+
+
+def test_run_suite_validation():
+    with pytest.raises(ValueRangeError):
+        bench.run_suite(iterations=0)
+    with pytest.raises(ValueRangeError):
+        bench.run_suite(only=["nope"])
+    with pytest.raises(ValueRangeError):
+        bench.run_suite(depth=3)
+    with pytest.raises(ValueRangeError):
+        bench.run_suite(root_ports=0)
+    with pytest.raises(ValueRangeError):
+        bench.run_suite(bar_size=6)
+
+
+def test_run_suite_small_bar(tmp_path):
+    report = bench.run_suite(
+        iterations=40,
+        scan_iterations=1,
+        warmup=0,
+        only=["bar.read_u32", "bar.mapped_write_u32"],
+        workdir=str(tmp_path),
+        root_ports=1,
+        switch_depth=0,
+        bar_size=64,
+    )
+    assert list(report["results"]) == ["bar.read_u32", "bar.mapped_write_u32"]
+
+
+def test_cli_bench_json(tmp_path):
+    repo_root = Path(__file__).resolve().parents[1]
+    output = tmp_path / "bench.json"
+    cmd = [
+        sys.executable,
+        "-m",
+        "pypcie.cli",
+        "bench",
+        "--iterations",
+        "10",
+        "--scan-iterations",
+        "1",
+        "--root-ports",
+        "1",
+        "--only",
+        "config.read_u32",
+        "--json",
+        "--output",
+        str(output),
+    ]
+    result = subprocess.run(cmd, cwd=str(repo_root), capture_output=True, text=True)
+    assert result.returncode == 0
+    report = json.loads(result.stdout)
+    assert list(report["results"]) == ["config.read_u32"]
+    assert json.loads(output.read_text())["results"].keys() == report["results"].keys()
+
+
+def test_cli_bench_rejects_empty_fabric():
+    repo_root = Path(__file__).resolve().parents[1]
+    for args in (
+        ["--root-ports", "0"],
+        ["--bar-size", "0"],
+        ["--iterations", "0"],
+        ["--scan-iterations", "0"],
+    ):
+        cmd = [sys.executable, "-m", "pypcie.cli", "bench"] + args
+        result = subprocess.run(cmd, cwd=str(repo_root), capture_output=True, text=True)
+        assert result.returncode == 2
+        assert "must be at least" in result.stderr
+        assert "Traceback" not in result.stderr
@@ -55,3 +55,31 @@ def test_find_ext_capability_short_config(sysfs_root, make_device):
     make_device(bdf="0000:00:03.0", config_bytes=bytearray(256))
     addr = "0000:00:03.0"
     assert capability.find_ext_capability(addr, 0x0001, sysfs_root=str(sysfs_root)) == 0
+
+
+def test_walk_capabilities_in_buffer():
+    config_bytes = bytearray(0x1000)
+    config_bytes[0x06:0x08] = (0x0010).to_bytes(2, "little")
+    config_bytes[0x34] = 0x50
+    config_bytes[0x50] = 0x01
+    config_bytes[0x51] = 0x60
+    config_bytes[0x60] = 0x10
+    header_one = (0x200 << 20) | (1 << 16) | 0x0010
+    header_two = (0x000 << 20) | (1 << 16) | 0x0001
+    config_bytes[0x100:0x104] = header_one.to_bytes(4, "little")
+    config_bytes[0x200:0x204] = header_two.to_bytes(4, "little")
+    data = bytes(config_bytes)
+
+    assert list(capability.walk_pci_capabilities(data)) == [(0x01, 0x50), (0x10, 0x60)]
+    assert list(capability.walk_ext_capabilities(data)) == [
+        (0x0010, 1, 0x100),
+        (0x0001, 1, 0x200),
+    ]
+    assert capability.find_pci_capability_in(data, 0x10) == 0x60
+    assert capability.find_ext_capability_in(data, 0x0001) == 0x200
+    assert capability.find_ext_capability_in(data[:0x100], 0x0001) == 0
+    assert capability.capability_name(0x10) == "PCI Express"
+    assert capability.capability_name(0x0001, extended=True) == (
+        "Advanced Error Reporting"
+    )
+    assert capability.capability_name(0x7E) == "cap 0x7e"
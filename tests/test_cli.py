@@ -1,8 +1,10 @@
+import json
 import subprocess
 import sys
 from pathlib import Path
 
 from pypcie import config
+from pypcie.synthetic import create_fabric
 
 
 def _run_cli(args, cwd):
@@ -227,6 +229,28 @@ def test_cli_link_ops(sysfs_root, make_device):
         == "speed=8.0GT/s width=x4 training=0 dll_link_active=0"
     )
 
+    result = _run_cli(
+        base + ["link-status", "--bdf", "0000:00:0e.0", "--source", "auto"],
+        cwd=str(repo_root),
+    )
+    assert result.returncode == 0
+    assert (
+        result.stdout.strip()
+        == "speed=8.0GT/s width=x4 training=0 dll_link_active=0 source=config"
+    )
+    (sysfs_root / "0000:00:0e.0" / "current_link_speed").write_text("2.5 GT/s PCIe\n")
+    (sysfs_root / "0000:00:0e.0" / "current_link_width").write_text("1\n")
+    result = _run_cli(
+        base + ["link-status", "--bdf", "0000:00:0e.0", "--source", "auto"],
+        cwd=str(repo_root),
+    )
+    assert result.stdout.strip() == "speed=2.5GT/s width=x1 source=sysfs"
+    # Without --source the output stays the config-space one.
+    result = _run_cli(
+        base + ["link-status", "--bdf", "0000:00:0e.0"], cwd=str(repo_root)
+    )
+    assert result.stdout.strip() == "speed=8.0GT/s width=x4 training=0 dll_link_active=0"
+
     result = _run_cli(
         base + ["link-disable", "--bdf", "0000:00:0e.0"], cwd=str(repo_root)
     )
@@ -289,3 +313,342 @@ def test_cli_link_uses_root_port(sysfs_root):
     )
     assert result.returncode == 0
     assert result.stdout.strip() == "speed=5.0GT/s width=x1 training=0 dll_link_active=0"
+
+
+def test_cli_snapshot_and_diff(sysfs_root, make_device, tmp_path):
+    make_device(bdf="0000:00:0d.0", config_bytes=bytes(64))
+    make_device(bdf="0000:00:0e.0", config_bytes=bytes(64))
+    repo_root = Path(__file__).resolve().parents[1]
+    base = ["--sysfs-root", str(sysfs_root)]
+    old = str(tmp_path / "old.snap")
+    new = str(tmp_path / "new.snap")
+
+    result = _run_cli(
+        base + ["snapshot", "--output", old, "--workers", "2"], cwd=str(repo_root)
+    )
+    assert result.returncode == 0
+    assert "captured 2 devices" in result.stderr
+
+    config.write_u16("0000:00:0e.0", 0x04, 0x0006, sysfs_root=str(sysfs_root))
+    result = _run_cli(base + ["snapshot", "--output", new], cwd=str(repo_root))
+    assert result.returncode == 0
+
+    result = _run_cli(["diff", old, old], cwd=str(repo_root))
+    assert result.returncode == 0
+    assert result.stdout == ""
+
+    result = _run_cli(["diff", old, new], cwd=str(repo_root))
+    assert result.returncode == 1
+    assert result.stdout.splitlines() == [
+        "~ 0000:00:0e.0",
+        "    0x004: 00000000 -> 00000006  header command/status",
+    ]
+
+
+def test_cli_show(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    repo_root = Path(__file__).resolve().parents[1]
+    base = ["--sysfs-root", str(sysfs_root), "show"]
+    endpoint = fabric.endpoints[0]
+
+    result = _run_cli(base + ["--bdf", endpoint.bdf], cwd=str(repo_root))
+    assert result.returncode == 0
+    assert result.stdout.startswith(endpoint.bdf)
+    assert "[70] PCI Express v2 Endpoint" in result.stdout
+    assert "[100 v2] Advanced Error Reporting" in result.stdout
+
+    result = _run_cli(base + ["--json", "--workers", "2"], cwd=str(repo_root))
+    assert result.returncode == 0
+    reports = json.loads(result.stdout)
+    assert [entry["bdf"] for entry in reports] == [a.bdf for a in fabric.devices]
+
+
+def test_cli_aer(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    endpoint = fabric.endpoints[0]
+    config.write_u32(endpoint, 0x110, 0x1, sysfs_root=str(sysfs_root))
+    repo_root = Path(__file__).resolve().parents[1]
+    base = ["--sysfs-root", str(sysfs_root), "aer"]
+
+    result = _run_cli(base, cwd=str(repo_root))
+    assert result.returncode == 0
+    lines = result.stdout.splitlines()
+    assert len(lines) == 2
+    assert lines[1].startswith(endpoint.bdf + " uncor=0x00000000 cor=0x00000001")
+    assert lines[1].endswith("[RxErr]")
+
+    result = _run_cli(
+        base + ["--bdf", endpoint.bdf, "--count", "2", "--interval", "0.01", "--json"],
+        cwd=str(repo_root),
+    )
+    assert result.returncode == 0
+    report = json.loads(result.stdout)
+    assert report[endpoint.bdf]["correctable"] == 1
+    assert report[endpoint.bdf]["rates"]["correctable"] == 0.0
+
+    for extra, message in (
+        (["--count", "0"], "count must be at least 1"),
+        (["--interval", "-1"], "interval must be a non-negative"),
+        (["--interval", "nan"], "interval must be a non-negative"),
+    ):
+        result = _run_cli(base + extra, cwd=str(repo_root))
+        assert result.returncode == 2
+        assert message in result.stderr
+        assert "Traceback" not in result.stderr
+
+
+def test_cli_export_rejects_nan_interval(sysfs_root):
+    repo_root = Path(__file__).resolve().parents[1]
+    base = ["--sysfs-root", str(sysfs_root), "export", "--interval", "nan"]
+    result = _run_cli(base, cwd=str(repo_root))
+    assert result.returncode == 2
+    assert "interval must be a non-negative" in result.stderr
+
+
+def test_cli_link_audit(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=2, switch_depth=0)
+    repo_root = Path(__file__).resolve().parents[1]
+    base = ["--sysfs-root", str(sysfs_root), "link-audit"]
+
+    result = _run_cli(base, cwd=str(repo_root))
+    assert result.returncode == 0
+    assert result.stdout.splitlines()[-1].startswith("2 links audited, 0 degraded")
+
+    endpoint = fabric.endpoints[1]
+    config.write_u16(endpoint, 0x82, 0x4 | (4 << 4), sysfs_root=str(sysfs_root))
+    result = _run_cli(base + ["--json"], cwd=str(repo_root))
+    assert result.returncode == 1
+    audits = json.loads(result.stdout)
+    assert [entry["device"] for entry in audits if entry["degraded"]] == [endpoint.bdf]
+
+
+def test_cli_link_retrain_all_downstream(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=1, switch_ports=2)
+    repo_root = Path(__file__).resolve().parents[1]
+
+    result = _run_cli(
+        [
+            "--sysfs-root",
+            str(sysfs_root),
+            "link-retrain",
+            "--all-downstream-of",
+            fabric.root_ports[0].bdf,
+            "--speed",
+            "16",
+            "--json",
+        ],
+        cwd=str(repo_root),
+    )
+    assert result.returncode == 0
+    results = json.loads(result.stdout)
+    assert [entry["bdf"] for entry in results] == [
+        port.bdf for port in fabric.bridges[2:4]
+    ]
+    assert all(entry["ok"] and entry["retries"] == 0 for entry in results)
+
+    base = ["--sysfs-root", str(sysfs_root), "link-retrain"]
+    result = _run_cli(
+        base
+        + ["--all-downstream-of", fabric.root_ports[0].bdf, "--clear-after"],
+        cwd=str(repo_root),
+    )
+    assert result.returncode == 1
+    assert "--clear-after cannot be combined with --all-downstream-of" in result.stderr
+    result = _run_cli(
+        base + ["--bdf", fabric.endpoints[0].bdf, "--speed", "8", "--json"],
+        cwd=str(repo_root),
+    )
+    assert result.returncode == 1
+    assert "--speed, --json only apply with --all-downstream-of" in result.stderr
+
+
+def test_cli_bus_reset(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=2, switch_depth=0)
+    repo_root = Path(__file__).resolve().parents[1]
+    args = ["--sysfs-root", str(sysfs_root), "bus-reset", "--settle-ms", "0"]
+    for port in fabric.root_ports:
+        args += ["--bdf", port.bdf]
+
+    result = _run_cli(args + ["--json"], cwd=str(repo_root))
+    assert result.returncode == 0
+    results = json.loads(result.stdout)
+    assert [entry["functions"] for entry in results] == [
+        [endpoint.bdf] for endpoint in fabric.endpoints
+    ]
+    assert all(entry["ok"] and entry["writes"] for entry in results)
+    value = config.read_u16(fabric.root_ports[0], 0x3E, sysfs_root=str(sysfs_root))
+    assert not value & 0x0040
+
+    result = _run_cli(args + ["--timeout", "nan"], cwd=str(repo_root))
+    assert result.returncode == 2
+    assert "timeout must be a non-negative number of seconds" in result.stderr
+
+
+def test_cli_mps_tune(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    endpoint = fabric.endpoints[0]
+    repo_root = Path(__file__).resolve().parents[1]
+    base = ["--sysfs-root", str(sysfs_root), "mps-tune", "--policy", "performance"]
+
+    result = _run_cli(base, cwd=str(repo_root))
+    assert result.returncode == 0
+    assert result.stdout.splitlines() == [
+        "- %s bridge   MPS 128 MRRS 512 (MPSS 256)" % fabric.root_ports[0].bdf,
+        "+ %s bridge   MPS 256 MRRS 512" % fabric.root_ports[0].bdf,
+        "- %s endpoint MPS 128 MRRS 512 (MPSS 256)" % endpoint.bdf,
+        "+ %s endpoint MPS 256 MRRS 256" % endpoint.bdf,
+        "2 functions, 2 to change",
+    ]
+    assert config.read_u16(endpoint, 0x78, sysfs_root=str(sysfs_root)) == 0x2810
+
+    result = _run_cli(base + ["--apply"], cwd=str(repo_root))
+    assert result.returncode == 0
+    assert result.stderr.strip() == "applied 2 changes"
+    assert config.read_u16(endpoint, 0x78, sysfs_root=str(sysfs_root)) == 0x1830
+
+
+def test_cli_aspm(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    endpoint = fabric.endpoints[0]
+    repo_root = Path(__file__).resolve().parents[1]
+    base = ["--sysfs-root", str(sysfs_root), "aspm"]
+
+    result = _run_cli(
+        base + ["enable", "--bdf", endpoint.bdf, "--state", "l1"], cwd=str(repo_root)
+    )
+    assert result.returncode == 0
+    assert result.stderr.strip() == "2 registers written"
+    lines = result.stdout.splitlines()
+    assert lines[1].split() == [
+        fabric.root_ports[0].bdf, endpoint.bdf, "l0s,l1", "l1", "0", "1000"
+    ]
+    assert lines[-1] == "worst-case exit latency: L0s 0 ns, L1 1000 ns"
+
+    result = _run_cli(
+        base + ["disable", "--bdf", endpoint.bdf, "--json"], cwd=str(repo_root)
+    )
+    assert result.returncode == 0
+    data = json.loads(result.stdout)
+    assert data["links"][0]["enabled"] == []
+    assert data["exit_latency"] == {"l0s_ns": 0, "l1_ns": 0}
+
+
+def test_cli_devctl(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    endpoint = fabric.endpoints[0]
+    repo_root = Path(__file__).resolve().parents[1]
+    base = ["--sysfs-root", str(sysfs_root), "devctl"]
+
+    result = _run_cli(base, cwd=str(repo_root))
+    assert result.returncode == 0
+    assert result.stdout.splitlines()[2].split() == [
+        endpoint.bdf, "ext-tag,relaxed-ordering,no-snoop", "relaxed-ordering,no-snoop"
+    ]
+
+    result = _run_cli(
+        base + ["--enable", "ext-tag", "--enable", "10bit-tag", "--apply"],
+        cwd=str(repo_root),
+    )
+    assert result.returncode == 0
+    assert "! %s 10bit-tag: not supported" % endpoint.bdf in result.stdout
+    assert result.stderr.strip() == "applied 2 changes"
+    assert config.read_u16(endpoint, 0x78, sysfs_root=str(sysfs_root)) == 0x2910
+
+
+def test_cli_rebar(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    endpoint = fabric.endpoints[0]
+    root = str(sysfs_root)
+    header = config.read_u32(endpoint, 0x100, sysfs_root=root)
+    config.write_u32(endpoint, 0x100, header | (0x160 << 20), sysfs_root=root)
+    config.write_u32(endpoint, 0x160, (1 << 16) | 0x0015, sysfs_root=root)
+    config.write_u32(endpoint, 0x164, 0x0070, sysfs_root=root)
+    config.write_u32(endpoint, 0x168, 1 << 5, sysfs_root=root)
+    repo_root = Path(__file__).resolve().parents[1]
+    base = ["--sysfs-root", root, "rebar", "--bdf", endpoint.bdf]
+
+    result = _run_cli(base + ["--bar", "0", "--size", "4M"], cwd=str(repo_root))
+    assert result.returncode == 0
+    assert result.stderr.strip() == "BAR 0 resized to 4M via config"
+    assert result.stdout.splitlines() == [
+        "%s BAR 0: 4M (supported: 1M 2M 4M)" % endpoint.bdf
+    ]
+
+    result = _run_cli(base + ["--size", "8M"], cwd=str(repo_root))
+    assert result.returncode != 0
+    assert "--size requires --bar" in result.stderr
+
+
+def test_cli_msix(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    endpoint = fabric.endpoints[0]
+    root = str(sysfs_root)
+    config.write_u8(endpoint, 0x71, 0xB0, sysfs_root=root)
+    config.write_u32(endpoint, 0xB0, 0x11 | (0x8003 << 16), sysfs_root=root)
+    config.write_u32(endpoint, 0xB4, 0x100, sysfs_root=root)
+    config.write_u32(endpoint, 0xB8, 0x800, sysfs_root=root)
+    repo_root = Path(__file__).resolve().parents[1]
+    base = ["--sysfs-root", root, "msix", "--bdf", endpoint.bdf]
+
+    result = _run_cli(base + ["--mask", "1-3"], cwd=str(repo_root))
+    assert result.returncode == 0
+    assert result.stderr.strip() == "masked 3 vectors"
+    lines = result.stdout.splitlines()
+    assert lines[0] == (
+        "MSI-X: 4 vectors (3 masked), enabled, table BAR 0+0x100, PBA BAR 0+0x800"
+    )
+    assert [line.split()[0] for line in lines[2:]] == ["0"]
+
+    result = _run_cli(base + ["--unmask", "2", "--all", "--json"], cwd=str(repo_root))
+    assert result.returncode == 0
+    payload = json.loads(result.stdout)
+    assert [v["masked"] for v in payload["vectors"]] == [False, True, False, True]
+
+
+def test_cli_p2p_path(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=2, switch_depth=1, switch_ports=2)
+    e0, e1, e2 = fabric.endpoints[:3]
+    repo_root = Path(__file__).resolve().parents[1]
+    base = ["--sysfs-root", str(sysfs_root), "p2p-path"]
+
+    result = _run_cli(base + [e0.bdf, e1.bdf], cwd=str(repo_root))
+    assert result.returncode == 0
+    lines = result.stdout.splitlines()
+    assert lines[0] == "%s -> %s: switch-local via %s" % (
+        e0.bdf,
+        e1.bdf,
+        fabric.bridges[1].bdf,
+    )
+    assert lines[-1].endswith("16GT/s x16 (31.51 GB/s)")
+
+    result = _run_cli(base + ["--matrix", "--json", e0.bdf, e2.bdf], cwd=str(repo_root))
+    assert result.returncode == 0
+    payload = json.loads(result.stdout)
+    assert [entry["route"] for entry in payload] == ["root-port"]
+    assert list(payload[0]) == sorted(payload[0])
+
+    result = _run_cli(base + [e0.bdf], cwd=str(repo_root))
+    assert result.returncode != 0
+    assert "needs two devices" in result.stderr
+
+
+def test_cli_path_bandwidth(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=1, switch_ports=2)
+    root = str(sysfs_root)
+    e0, e1 = fabric.endpoints
+    config.write_u16(e1, 0x82, 4 | (4 << 4), sysfs_root=root)
+    repo_root = Path(__file__).resolve().parents[1]
+    base = ["--sysfs-root", root, "path-bandwidth"]
+
+    result = _run_cli(base + ["--bdf", e1.bdf, "--hops"], cwd=str(repo_root))
+    assert result.returncode == 0
+    lines = result.stdout.splitlines()
+    assert lines[1].split()[:3] == [e1.bdf, "7.88", "31.51"]
+    assert len(lines) == 5
+    assert lines[3].endswith("7.88 GB/s  bottleneck")
+
+    result = _run_cli(base + ["--json"], cwd=str(repo_root))
+    assert result.returncode == 0
+    payload = json.loads(result.stdout)
+    assert [entry["endpoint"] for entry in payload] == [e0.bdf, e1.bdf]
+    assert payload[0]["limited"] is False
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from pypcie import config, devctl, link
+from pypcie.errors import ResourceNotFoundError, ValueRangeError
+from pypcie.sysfs import Sysfs
+from pypcie.synthetic import create_fabric
+
+
+def _fabric(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=2, switch_depth=0)
+    root = str(sysfs_root)
+    # Both endpoints request 10-bit tags; only the first root port completes them.
+    for endpoint in fabric.endpoints:
+        config.write_u32(endpoint, 0x94, 0x00020000, sysfs_root=root)
+    config.write_u32(fabric.root_ports[0], 0x94, 0x00010000, sysfs_root=root)
+    return fabric
+
+
+def test_read_device_control_tags(sysfs_root):
+    fabric = _fabric(sysfs_root)
+    status = link.read_device_control(fabric.endpoints[0], sysfs_root=str(sysfs_root))
+    assert status["extended_tags_supported"] is True
+    assert status["extended_tags"] is False
+    assert status["ten_bit_tag_requester_supported"] is True
+    assert status["ten_bit_tag_completer_supported"] is False
+    assert status["ten_bit_tags"] is False
+
+
+def test_plan_and_apply(sysfs_root):
+    fabric = _fabric(sysfs_root)
+    root = str(sysfs_root)
+    sysfs = Sysfs(root)
+    first, second = fabric.endpoints
+
+    settings = devctl.plan(sysfs=sysfs)
+    assert not any(setting.changed for setting in settings)
+    assert settings[1].supported == list(devctl.FEATURES)
+    assert settings[1].enabled == ["relaxed-ordering", "no-snoop"]
+
+    settings = devctl.plan(
+        enable=["ext-tag", "10bit-tag"], disable=["no-snoop"], sysfs=sysfs
+    )
+    assert [setting.address for setting in settings] == [
+        fabric.root_ports[0], first, fabric.root_ports[1], second
+    ]
+    assert settings[1].new_enabled == ["ext-tag", "10bit-tag", "relaxed-ordering"]
+    assert settings[3].new_enabled == ["ext-tag", "relaxed-ordering"]
+    assert settings[3].skipped == {
+        "10bit-tag": "not supported by %s" % fabric.root_ports[1].bdf
+    }
+    assert settings[0].skipped == {}
+    lines = devctl.format_settings(settings)
+    assert "! %s 10bit-tag: not supported by %s" % (
+        second.bdf, fabric.root_ports[1].bdf
+    ) in lines
+    assert lines[-1] == "4 functions, 4 to change"
+
+    assert devctl.apply(settings, sysfs=sysfs) == 4
+    assert config.read_u16(first, 0x78, sysfs_root=root) == 0x2110
+    assert config.read_u16(first, 0x98, sysfs_root=root) == 0x1000
+    assert config.read_u16(second, 0x98, sysfs_root=root) == 0
+    assert not any(setting.changed for setting in settings)
+
+    with pytest.raises(ValueRangeError):
+        devctl.plan(enable=["ext-tag"], disable=["ext-tag"], sysfs=sysfs)
+    with pytest.raises(ValueRangeError):
+        devctl.plan(enable=["phantom"], sysfs=sysfs)
+
+
+def test_apply_rolls_back(sysfs_root):
+    fabric = _fabric(sysfs_root)
+    root = str(sysfs_root)
+    sysfs = Sysfs(root)
+    settings = devctl.plan(enable=["ext-tag"], sysfs=sysfs)
+    os.unlink(sysfs.config_path(fabric.endpoints[1]))
+
+    with pytest.raises(ResourceNotFoundError):
+        devctl.apply(settings, sysfs=sysfs)
+    for address in fabric.bridges + fabric.endpoints[:1]:
+        assert config.read_u16(address, 0x78, sysfs_root=root) == 0x2810
@@ -1,3 +1,4 @@
+from pypcie import instrument
 from pypcie.device import PciDevice
 from pypcie.discover import find_by_id
 from pypcie.sysfs import Sysfs
@@ -45,3 +46,42 @@ def test_pcidevice_config_and_bar(sysfs_root, make_device):
     with bar.open():
         bar.write_u8(0, 0x5A)
         assert bar.read_u8(0) == 0x5A
+
+
+def test_pcidevice_session_reuses_handles(sysfs_root, make_device):
+    resource_entries = [(0x1000, 0x1FFF, 0x00000200)] + [(0, 0, 0)] * 5
+    make_device(
+        bdf="0000:00:0b.0",
+        vendor=0x1234,
+        device=0x5678,
+        config_bytes=bytes(256),
+        resource_entries=resource_entries,
+        resource_files={0: bytes(4096)},
+    )
+    sysfs = Sysfs(root=str(sysfs_root))
+
+    instrument.reset()
+    instrument.enable()
+    try:
+        with PciDevice(sysfs, "0000:00:0b.0") as dev:
+            for _ in range(3):
+                assert dev.vendor_id == 0x1234
+                dev.cfg_write(4, 0x40, 0x11223344)
+                assert dev.cfg_read(4, 0x40) == 0x11223344
+                dev.bar_write(0, 4, 0x10, 0xCAFEF00D)
+                assert dev.bar_read(0, 4, 0x10) == 0xCAFEF00D
+            bar0 = dev.bar(0)
+            assert dev.bar(0) is bar0
+        syscalls = instrument.snapshot()["syscalls"]
+    finally:
+        instrument.disable()
+    # Device directory plus vendor/device/class, resource file, config (rw)
+    # and resource0 (rw).
+    assert syscalls["open"] == 7
+    assert syscalls["mmap"] == 1
+    assert bar0._fd is None
+
+    (sysfs_root / "0000:00:0b.0" / "vendor").write_text("0x8086\n")
+    assert dev.vendor_id == 0x1234
+    dev.refresh()
+    assert dev.vendor_id == 0x8086
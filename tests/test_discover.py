@@ -1,13 +1,19 @@
 import pytest
 
+from pypcie import instrument
 from pypcie.discover import (
     find_by_id,
     find_one_by_id,
     get_device_info,
+    iter_devices,
     list_devices,
     find_root_port,
+    read_device_tree,
+    render_device_tree,
+    walk_subtree,
 )
 from pypcie.errors import DeviceNotFoundError, MultipleDevicesFoundError
+from pypcie.synthetic import create_fabric
 from pypcie.sysfs import Sysfs
 
 
@@ -40,6 +46,7 @@ def test_get_device_info(sysfs_root, make_device):
     assert info["subsystem_vendor"] == 0x1AF4
     assert info["subsystem_device"] == 0x1000
     assert info["class"] == 0x010802
+    assert get_device_info("0000:00:04.0", sysfs=sysfs) == {}
 
 
 def test_find_by_id(sysfs_root, make_device):
@@ -97,3 +104,82 @@ def test_find_root_port_missing_device(sysfs_root):
     sysfs = Sysfs(root=str(sysfs_root))
     with pytest.raises(DeviceNotFoundError):
         find_root_port("0000:0a:00.0", sysfs=sysfs)
+
+
+def test_iter_devices_lazy_filters(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=2, switch_ports=2, functions=2)
+    sysfs = Sysfs(root=str(sysfs_root))
+    first_root = fabric.root_ports[0]
+    driver_dir = sysfs_root.parent.parent / "drivers" / "nvme"
+    driver_dir.mkdir(parents=True)
+    (sysfs_root / fabric.endpoints[0].bdf / "driver").symlink_to(driver_dir)
+
+    everything = iter_devices(sysfs=sysfs)
+    assert next(everything) in fabric.devices
+    everything.close()
+
+    nvme = sorted(iter_devices(sysfs=sysfs, class_code=0x010800, class_mask=0xFFFF00))
+    assert nvme == sorted(fabric.endpoints)
+    bridges = sorted(iter_devices(sysfs=sysfs, vendor_id=0x8086))
+    assert bridges == sorted(fabric.bridges)
+    below = sorted(iter_devices(sysfs=sysfs, parent=first_root, device_id=0x5678))
+    assert below == sorted(fabric.endpoints[: len(fabric.endpoints) // 2])
+    assert all(addr.bus >= 1 for addr in below)
+    in_range = list(iter_devices(sysfs=sysfs, bus_range=(0, 0)))
+    assert sorted(in_range) == sorted(fabric.root_ports)
+    assert list(iter_devices(sysfs=sysfs, driver="nvme")) == [fabric.endpoints[0]]
+
+
+def test_find_one_by_id_stops_at_second_match(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=4, switch_depth=0, functions=4)
+    sysfs = Sysfs(root=str(sysfs_root))
+    instrument.reset()
+    instrument.enable()
+    try:
+        with pytest.raises(MultipleDevicesFoundError):
+            find_one_by_id(0x1234, sysfs=sysfs)
+        opens = instrument.snapshot()["syscalls"]["open"]
+    finally:
+        instrument.disable()
+    # Each inspected device costs a directory and a vendor attribute open;
+    # the scan ends long before all of them have been read.
+    assert opens < 2 * len(fabric)
+
+
+def test_read_device_tree_and_walk_subtree(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=1, switch_ports=2)
+    sysfs = Sysfs(root=str(sysfs_root))
+    root_port = fabric.root_ports[0]
+
+    roots, children, values = read_device_tree(
+        lambda addr: None if addr == root_port else addr.bdf, sysfs=sysfs, workers=3
+    )
+    assert roots == [root_port]
+    assert root_port not in values
+    assert sorted(values) == sorted(set(fabric.devices) - {root_port})
+
+    walked = list(walk_subtree(root_port, children))
+    assert walked[0] == (root_port, ())
+    order = [node for node, _ in walked]
+    assert sorted(order) == sorted(fabric.devices)
+    for node, ancestors in walked[1:]:
+        assert node in children[ancestors[-1]]
+        assert ancestors[0] == root_port
+        # Depth first: every ancestor was yielded before the node.
+        assert all(order.index(port) < order.index(node) for port in ancestors)
+
+
+def test_render_device_tree(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=1, switch_ports=2)
+    rp, up, dp0, dp1 = fabric.bridges
+    e0, e1 = fabric.endpoints
+    sysfs = Sysfs(root=str(sysfs_root))
+    assert render_device_tree(sysfs=sysfs) == [
+        "[RC] %s" % rp.bdf,
+        "\\-- [SW] %s" % up.bdf,
+        "    |-- [SW] %s" % dp0.bdf,
+        "    |   \\-- [EP] %s" % e0.bdf,
+        "    \\-- [SW] %s" % dp1.bdf,
+        "        \\-- [EP] %s" % e1.bdf,
+    ]
+    assert render_device_tree(sysfs=sysfs, vendor_id=0xDEAD) == []
@@ -0,0 +1,111 @@
+import errno
+import socket
+import threading
+import urllib.request
+
+import pytest
+
+from pypcie import config, instrument
+from pypcie.errors import OutOfRangeError
+from pypcie.exporter import Exporter, make_server, parse_listen
+from pypcie.synthetic import create_fabric
+from pypcie.sysfs import Sysfs
+
+
+def test_refresh_renders_link_and_aer_metrics(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0, speed=3, width=8)
+    endpoint = fabric.endpoints[0]
+    # Downtrain the endpoint to x4 and flag a correctable error.
+    lnksta = config.read_u16(endpoint, 0x70 + 0x12, sysfs_root=str(sysfs_root))
+    config.write_u16(
+        endpoint, 0x70 + 0x12, (lnksta & ~0x03F0) | (4 << 4), sysfs_root=str(sysfs_root)
+    )
+    config.write_u32(endpoint, 0x110, 0x1, sysfs_root=str(sysfs_root))
+
+    exporter = Exporter(sysfs=Sysfs(root=str(sysfs_root)), interval=60)
+    try:
+        text = exporter.refresh().decode("utf-8")
+    finally:
+        exporter.stop()
+    lines = text.splitlines()
+    bdf = endpoint.bdf
+    assert (
+        'pcie_device_info{bdf="%s",vendor="0x1234",device="0x5678",class="0x010802"} 1'
+        % bdf
+    ) in lines
+    assert 'pcie_link_width{bdf="%s"} 4' % bdf in lines
+    assert 'pcie_link_max_width{bdf="%s"} 8' % bdf in lines
+    assert 'pcie_link_speed_gtps{bdf="%s"} 8.0' % bdf in lines
+    assert 'pcie_link_degraded{bdf="%s"} 1' % bdf in lines
+    assert 'pcie_aer_errors_total{bdf="%s",severity="correctable"} 1' % bdf in lines
+    assert "# TYPE pcie_aer_errors_total counter" in lines
+    assert "pypcie_exporter_devices 2" in lines
+    assert "pypcie_exporter_samples_total 1" in lines
+
+
+def test_scrapes_are_served_from_cache(sysfs_root):
+    create_fabric(sysfs_root, root_ports=2, switch_depth=0)
+    exporter = Exporter(sysfs=Sysfs(root=str(sysfs_root)), interval=60).start()
+    server = make_server(exporter, "127.0.0.1:0")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = "http://127.0.0.1:%d/metrics" % server.server_address[1]
+    instrument.reset()
+    instrument.enable()
+    try:
+        bodies = [urllib.request.urlopen(url).read().decode("utf-8") for _ in range(5)]
+        preads = instrument.snapshot()["syscalls"]["pread"]
+    finally:
+        instrument.disable()
+        server.shutdown()
+        server.server_close()
+        exporter.stop()
+    assert preads == 0
+    assert "pypcie_exporter_scrapes_total 4" in bodies[-1].splitlines()
+    assert "pypcie_exporter_samples_total 1" in bodies[-1].splitlines()
+
+
+def test_parse_listen():
+    assert parse_listen("127.0.0.1:9464") == ("127.0.0.1", 9464)
+    assert parse_listen(":9100") == ("0.0.0.0", 9100)
+    assert parse_listen("[::1]:80") == ("::1", 80)
+
+
+def test_interval_must_be_finite_and_positive(sysfs_root):
+    for interval in (0, -1, float("nan"), float("inf")):
+        with pytest.raises(OutOfRangeError):
+            Exporter(sysfs=Sysfs(root=str(sysfs_root)), interval=interval)
+
+
+def test_make_server_binds_ipv6(sysfs_root):
+    exporter = Exporter(sysfs=Sysfs(root=str(sysfs_root)), interval=60)
+    try:
+        server = make_server(exporter, "[::1]:0")
+    except OSError:
+        pytest.skip("IPv6 loopback not available")
+    try:
+        assert server.address_family == socket.AF_INET6
+    finally:
+        server.server_close()
+
+
+def test_refresh_skips_device_that_fails_with_oserror(sysfs_root, monkeypatch):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    root_port, endpoint = fabric.root_ports[0], fabric.endpoints[0]
+    read_block = config.ConfigHandle.read_block
+
+    def failing_read_block(handle, offset, length):
+        if handle.address == endpoint:
+            raise OSError(errno.ENODEV, "No such device")
+        return read_block(handle, offset, length)
+
+    monkeypatch.setattr(config.ConfigHandle, "read_block", failing_read_block)
+    exporter = Exporter(sysfs=Sysfs(root=str(sysfs_root)), interval=60)
+    try:
+        lines = exporter.refresh().decode("utf-8").splitlines()
+    finally:
+        exporter.stop()
+    width = 'pcie_link_width{bdf="%s"}' % root_port.bdf
+    assert any(line.startswith(width) for line in lines)
+    assert not any(endpoint.bdf in line for line in lines if "link" in line)
+    assert "pypcie_exporter_devices 2" in lines
@@ -0,0 +1,172 @@
+import sys
+import threading
+
+from pypcie import instrument
+from pypcie.handles import HandlePool
+
+THREADS = 8
+ITERATIONS = 300
+
+
+def _make(make_device):
+    make_device(
+        bdf="0000:00:0c.0",
+        config_bytes=bytes(256),
+        resource_entries=[(0x1000, 0x1FFF, 0x00000200)] + [(0, 0, 0)] * 5,
+        resource_files={0: bytes(4096)},
+    )
+
+
+def _run_threads(target):
+    errors = []
+
+    def wrapper(index):
+        try:
+            target(index)
+        except Exception as exc:  # pragma: no cover - reported below
+            errors.append(exc)
+
+    threads = [threading.Thread(target=wrapper, args=(i,)) for i in range(THREADS)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+
+
+def test_shared_bar_concurrent_reads_upgrade_and_rmw(sysfs_root, make_device):
+    _make(make_device)
+    instrument.reset()
+    instrument.enable()
+    try:
+        with HandlePool(sysfs_root=str(sysfs_root)) as pool:
+            bar = pool.bar("0000:00:0c.0", 0)
+            assert pool.bar("0000:00:0c.0", 0) is bar
+            bar.read_u32(0)
+
+            def worker(index):
+                shared = pool.bar("0000:00:0c.0", 0)
+                bit = 1 << index
+                for step in range(ITERATIONS):
+                    shared.read_u32(0x100)
+                    if step == ITERATIONS // 2:
+                        # The first write upgrades the read-only mapping
+                        # while the other threads keep reading.
+                        shared.write_u32(0x200 + index * 4, step)
+                    shared.modify_u32(0x10, set_bits=bit)
+                    shared.modify_u32(0x10, clear_bits=bit)
+                shared.modify_u32(0x10, set_bits=bit)
+
+            _run_threads(worker)
+            assert bar.read_u32(0x10) == (1 << THREADS) - 1
+            assert [bar.read_u32(0x200 + i * 4) for i in range(THREADS)] == [
+                ITERATIONS // 2
+            ] * THREADS
+        syscalls = instrument.snapshot()["syscalls"]
+    finally:
+        instrument.disable()
+    # One read-only mapping plus one upgrade, shared by every thread.
+    assert syscalls["mmap"] == 2
+
+
+def test_shared_bar_reads_do_not_take_the_lock(sysfs_root, make_device):
+    _make(make_device)
+    with HandlePool(sysfs_root=str(sysfs_root)) as pool:
+        bar = pool.bar("0000:00:0c.0", 0)
+        bar.write_u32(0x100, 0x12345678)
+        values = []
+        # With the open/upgrade lock held elsewhere, reads on the existing
+        # mapping still go through.
+        with bar._lock:
+            reader = threading.Thread(target=lambda: values.append(bar.read_u32(0x100)))
+            reader.start()
+            reader.join(5)
+            assert not reader.is_alive()
+        assert values == [0x12345678]
+
+
+def test_close_waits_for_accesses_in_flight(sysfs_root, make_device):
+    _make(make_device)
+    pool = HandlePool(sysfs_root=str(sysfs_root))
+    bar = pool.bar("0000:00:0c.0", 0)
+    handle = pool.config("0000:00:0c.0")
+    bar.read_u32(0)
+    handle.read(0, 4)
+    for target in (bar, handle):
+        closer = threading.Thread(target=target.close)
+        with target._guard:
+            closer.start()
+            closer.join(0.1)
+            # The access in flight keeps its descriptor open.
+            assert closer.is_alive()
+        closer.join(5)
+        assert not closer.is_alive()
+    assert bar._mmap is None
+    assert handle._ro_fd is None
+    assert bar.read_u32(0) == 0
+    pool.close()
+
+
+def test_shared_bar_mixed_width_rmw(sysfs_root, make_device):
+    _make(make_device)
+    with HandlePool(sysfs_root=str(sysfs_root)) as pool:
+        bar = pool.bar("0000:00:0c.0", 0)
+
+        def worker(index):
+            # Half the threads flip bits of byte 0x11 with byte accesses,
+            # the other half flip bits of byte 0x10 through the whole dword.
+            bit = 1 << index
+            for _ in range(ITERATIONS):
+                if index % 2:
+                    bar.modify_u8(0x11, set_bits=bit)
+                    bar.modify_u8(0x11, clear_bits=bit)
+                else:
+                    bar.modify_u32(0x10, set_bits=bit)
+                    bar.modify_u32(0x10, clear_bits=bit)
+            if index % 2:
+                bar.modify_u8(0x11, set_bits=bit)
+            else:
+                bar.modify_u32(0x10, set_bits=bit)
+
+        _run_threads(worker)
+        assert bar.read_u8(0x10) == 0x55
+        assert bar.read_u8(0x11) == 0xAA
+
+
+def test_shared_bar_close_during_access(sysfs_root, make_device):
+    _make(make_device)
+    with HandlePool(sysfs_root=str(sysfs_root)) as pool:
+        bar = pool.bar("0000:00:0c.0", 0)
+        bar.write_u32(0x100, 0x12345678)
+
+        def worker(index):
+            for _ in range(ITERATIONS):
+                if index == 0:
+                    bar.close()
+                else:
+                    assert bar.read_u32(0x100) == 0x12345678
+
+        _run_threads(worker)
+
+
+def test_shared_config_rmw(sysfs_root, make_device):
+    _make(make_device)
+    with HandlePool(sysfs_root=str(sysfs_root)) as pool:
+
+        def worker(index):
+            handle = pool.config("0000:00:0c.0")
+            bit = 1 << index
+            for _ in range(ITERATIONS):
+                handle.modify(0x40, 2, set_bits=bit)
+                handle.modify(0x40, 2, clear_bits=bit)
+            handle.modify(0x40, 2, set_bits=bit)
+
+        _run_threads(worker)
+        assert pool.config("0000:00:0c.0").read(0x40, 2) == (1 << THREADS) - 1
+        assert len(pool) == 1
+    assert len(pool) == 0
@@ -0,0 +1,76 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import pypcie
+from pypcie import config, discover, instrument
+from pypcie.sysfs import Sysfs
+
+
+@pytest.fixture
+def stats_enabled():
+    instrument.reset()
+    yield
+    instrument.disable()
+    instrument.reset()
+
+
+def test_disabled_by_default(sysfs_root, make_device):
+    make_device(bdf="0000:00:01.0")
+    instrument.reset()
+    config.read_u32("0000:00:01.0", 0, sysfs_root=str(sysfs_root))
+    snap = pypcie.stats()
+    assert snap["enabled"] is False
+    assert snap["syscalls"]["pread"] == 0
+    assert snap["operations"] == {}
+
+
+def test_counts_syscalls_and_latency(sysfs_root, make_device, stats_enabled):
+    make_device(bdf="0000:00:01.0")
+    seen = []
+    pypcie.enable_stats(callback=lambda op, elapsed: seen.append(op))
+
+    config.read_u32("0000:00:01.0", 0, sysfs_root=str(sysfs_root))
+    config.write_u16("0000:00:01.0", 4, 0x7, sysfs_root=str(sysfs_root))
+    discover.list_devices(sysfs=Sysfs(root=str(sysfs_root)))
+
+    snap = pypcie.stats()
+    assert snap["syscalls"]["open"] == 2
+    assert snap["syscalls"]["pread"] == 1
+    assert snap["syscalls"]["pwrite"] == 1
+    assert snap["bytes"] == {"read": 4, "written": 2}
+    assert snap["operations"]["config.read"]["count"] == 1
+    assert snap["operations"]["config.write"]["count"] == 1
+    assert snap["operations"]["discovery.list_devices"]["count"] == 1
+    assert sum(count for _, count in snap["operations"]["config.read"]["buckets"]) == 1
+    assert seen == ["config.read", "config.write", "discovery.list_devices"]
+
+    pypcie.reset_stats()
+    assert pypcie.stats()["operations"] == {}
+
+
+def test_cli_stats_flag(sysfs_root, make_device):
+    make_device(bdf="0000:00:0d.0", config_bytes=bytes(range(64)))
+    repo_root = Path(__file__).resolve().parents[1]
+    cmd = [
+        sys.executable,
+        "-m",
+        "pypcie.cli",
+        "--sysfs-root",
+        str(sysfs_root),
+        "--stats",
+        "cfg-read",
+        "--bdf",
+        "0000:00:0d.0",
+        "--offset",
+        "0",
+        "--width",
+        "32",
+    ]
+    result = subprocess.run(cmd, cwd=str(repo_root), capture_output=True, text=True)
+    assert result.returncode == 0
+    assert result.stdout.strip() == "0x03020100"
+    assert "pread=1" in result.stderr
+    assert "config.read" in result.stderr
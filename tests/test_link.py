@@ -1,7 +1,8 @@
 import pytest
 
 from pypcie import config, link
-from pypcie.errors import ValueRangeError
+from pypcie.errors import ResourceNotFoundError, ValueRangeError
+from pypcie.sysfs import Sysfs
 
 
 def _make_pcie_device(
@@ -97,3 +98,107 @@ def test_link_hot_reset_bridge(sysfs_root, make_device):
     link.link_hot_reset(addr, sysfs_root=str(sysfs_root), delay_s=0)
     value = config.read_u16(addr, 0x3E, sysfs_root=str(sysfs_root))
     assert not (value & 0x0040)
+
+
+def test_decode_link_capabilities():
+    # Gen5 x16 with ASPM L0s/L1 and a 2.5-32 GT/s supported speeds vector.
+    caps = link.decode_link_capabilities(0x07100C05 | (16 << 4), 0x3E)
+    assert caps["max_speed_gtps"] == 32.0
+    assert caps["max_width"] == 16
+    assert caps["supported_speeds_gtps"] == [2.5, 5.0, 8.0, 16.0, 32.0]
+    assert caps["aspm_support"] == 0x3
+    assert caps["dll_link_active_reporting"] is True
+    assert caps["port_number"] == 0x07
+
+    caps = link.decode_link_capabilities(0x02 | (4 << 4))
+    assert caps["supported_speeds_gtps"] == [2.5, 5.0]
+
+    assert link.link_bandwidth(2.5, 1) == pytest.approx(0.25)
+    assert link.link_bandwidth(16.0, 16) == pytest.approx(31.508, abs=1e-3)
+    assert link.link_bandwidth(None, 16) == 0.0
+    assert link.link_bandwidth(64.0, 16) == pytest.approx(121.0)
+    assert link.link_bandwidth(32.0, 16, flit=True) == pytest.approx(59.56, abs=1e-2)
+    assert link.link_encoding(5.0) == ("8b/10b", 0.8)
+    assert link.link_encoding(16.0, flit=True)[0] == "128b/130b+flit"
+
+
+def test_read_sysfs_link_attrs(sysfs_root, make_device):
+    path = make_device(bdf="0000:00:16.0")
+    (path / "current_link_speed").write_text("8.0 GT/s PCIe\n")
+    (path / "current_link_width").write_text("4\n")
+    (path / "max_link_speed").write_text("Unknown\n")
+    attrs = link.read_sysfs_link_attrs("0000:00:16.0", sysfs=Sysfs(str(sysfs_root)))
+    assert attrs == {
+        "current_speed_gtps": 8.0,
+        "current_width": 4,
+        "max_speed_gtps": None,
+        "max_width": None,
+    }
+
+    make_device(bdf="0000:00:17.0")
+    with pytest.raises(ResourceNotFoundError):
+        link.read_sysfs_link_attrs("0000:00:17.0", sysfs=Sysfs(str(sysfs_root)))
+
+
+def test_read_link_status_sources(sysfs_root, make_device):
+    path = make_device(bdf="0000:00:18.0")
+    (path / "current_link_speed").write_text("16.0 GT/s PCIe\n")
+    (path / "current_link_width").write_text("8\n")
+    _make_pcie_device(make_device, "0000:00:19.0", lnksta=0x2043)
+    root = str(sysfs_root)
+
+    status = link.read_link_status("0000:00:18.0", sysfs_root=root, source="auto")
+    assert status == {
+        "speed_code": 4,
+        "speed_gtps": 16.0,
+        "width": 8,
+        "training": None,
+        "dll_link_active": None,
+    }
+    status = link.read_link_status(
+        "0000:00:19.0", sysfs_root=root, source="auto", with_source=True
+    )
+    assert status["source"] == "config"
+    assert status["dll_link_active"] is True
+    status = link.read_link_status("0000:00:19.0", sysfs_root=root)
+    assert "source" not in status
+    assert status["width"] == 4
+    with pytest.raises(ResourceNotFoundError):
+        # The default reads config space even where the attributes exist.
+        link.read_link_status("0000:00:18.0", sysfs_root=root)
+
+    with pytest.raises(ResourceNotFoundError):
+        link.read_link_status("0000:00:19.0", sysfs_root=root, source="sysfs")
+    with pytest.raises(ValueRangeError):
+        link.read_link_status("0000:00:19.0", sysfs_root=root, source="lspci")
+
+
+def test_read_pcie_caps(sysfs_root, make_device):
+    config_bytes = bytearray(256)
+    config_bytes[0x50 + 0x24 : 0x50 + 0x28] = (0x00030000).to_bytes(4, "little")
+    _make_pcie_device(
+        make_device,
+        "0000:00:1a.0",
+        config_bytes=config_bytes,
+        header_type=0x01,
+        pcie_version=0x0042,
+        lnksta=0x0043,
+    )
+    _make_pcie_device(make_device, "0000:00:1b.0", pcie_version=0x0001)
+    make_device(bdf="0000:00:1c.0")
+    sysfs = Sysfs(root=str(sysfs_root))
+
+    caps = link.read_pcie_caps("0000:00:1a.0", sysfs=sysfs)
+    assert (caps.base, caps.version, caps.port_type, caps.bridge) == (0x50, 2, 4, True)
+    assert caps.u16(link.PCI_EXP_LNKSTA) == 0x0043
+    assert caps.u32(link.PCI_EXP_DEVCAP2) == 0x00030000
+
+    # Version 1 capabilities end before DEVCAP2.
+    caps = link.read_pcie_caps("0000:00:1b.0", sysfs=sysfs)
+    assert caps.version == 1
+    assert caps.u16(link.PCI_EXP_LNKSTA) == 0
+    assert caps.u32(link.PCI_EXP_DEVCAP2) is None
+
+    caps = link.read_pcie_caps("0000:00:1c.0", sysfs=sysfs, length=0x40)
+    assert (caps.base, caps.port_type) == (0, None)
+    assert caps.u16(link.PCI_EXP_FLAGS) is None
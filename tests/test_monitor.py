@@ -0,0 +1,147 @@
+import errno
+import os
+
+import pytest
+
+from pypcie.errors import PciError, ResourceNotFoundError, ValueRangeError
+from pypcie.monitor import LinkMonitor
+from pypcie.types import PciAddress
+
+
+def _make_port(make_device, bdf, lnksta=0x0043, version=2):
+    config_bytes = bytearray(256)
+    config_bytes[0x06:0x08] = (0x0010).to_bytes(2, "little")
+    config_bytes[0x0E] = 0x01
+    config_bytes[0x34] = 0x50
+    config_bytes[0x50] = 0x10
+    config_bytes[0x52] = 0x40 | version
+    config_bytes[0x62:0x64] = int(lnksta).to_bytes(2, "little")
+    make_device(bdf=bdf, config_bytes=config_bytes)
+
+
+def _set_lnksta(sysfs_root, bdf, value, offset=0x62):
+    with open(str(sysfs_root / bdf / "config"), "r+b") as handle:
+        handle.seek(offset)
+        handle.write(int(value).to_bytes(2, "little"))
+
+
+def test_monitor_emits_only_changes(sysfs_root, make_device):
+    _make_port(make_device, "0000:00:1c.0", lnksta=0x2083)
+    _make_port(make_device, "0000:00:1d.0", lnksta=0x2083)
+
+    seen = []
+    monitor = LinkMonitor(
+        ["0000:00:1c.0", "0000:00:1d.0"],
+        sysfs_root=str(sysfs_root),
+        history=2,
+        callback=seen.append,
+    )
+    with monitor:
+        assert monitor.poll() == []
+        assert monitor.poll() == []
+
+        # Downtrain 1c.0 from x8 Gen3 to x4 Gen1 and drop DLLLA.
+        _set_lnksta(sysfs_root, "0000:00:1c.0", 0x0041)
+        events = monitor.poll()
+        assert [event.address.bdf for event in events] == ["0000:00:1c.0"]
+        assert events[0].changes == {
+            "speed_code": (3, 1),
+            "width": (8, 4),
+            "dll_link_active": (True, False),
+        }
+        assert seen == events
+
+        history = monitor.history("0000:00:1c.0")
+        assert len(history) == 2
+        assert history[-1].lnksta == 0x0041
+        assert monitor.last("0000:00:1d.0").decode()["width"] == 8
+
+
+def test_monitor_lnksta2_and_iterator(sysfs_root, make_device):
+    _make_port(make_device, "0000:00:1c.0")
+    monitor = LinkMonitor(
+        ["0000:00:1c.0"], sysfs_root=str(sysfs_root), include_lnksta2=True
+    )
+    with monitor:
+        events = list(monitor.events(interval_s=0, count=2))
+        assert events == []
+        _set_lnksta(sysfs_root, "0000:00:1c.0", 0x0002, offset=0x82)
+        events = list(monitor.events(interval_s=0, count=1))
+        assert len(events) == 1
+        assert events[0].changes == {"lnksta2": (0, 2)}
+        assert monitor.run(interval_s=0, count=3) == 0
+
+
+def test_monitor_skips_lnksta2_on_v1_capability(sysfs_root, make_device):
+    _make_port(make_device, "0000:00:1c.0", version=1)
+    monitor = LinkMonitor(
+        ["0000:00:1c.0"], sysfs_root=str(sysfs_root), include_lnksta2=True
+    )
+    with monitor:
+        _set_lnksta(sysfs_root, "0000:00:1c.0", 0x0002, offset=0x82)
+        assert monitor.poll() == []
+        assert monitor.last("0000:00:1c.0").lnksta2 is None
+
+
+def test_monitor_keeps_polling_after_device_error(
+    sysfs_root, make_device, monkeypatch
+):
+    _make_port(make_device, "0000:00:1c.0", lnksta=0x2083)
+    _make_port(make_device, "0000:00:1d.0", lnksta=0x2083)
+    monitor = LinkMonitor(["0000:00:1c.0", "0000:00:1d.0"], sysfs_root=str(sysfs_root))
+    with monitor:
+        monitor.poll()
+        gone = monitor._by_address[PciAddress.parse("0000:00:1c.0")].fd
+        pread = os.pread
+
+        def failing_pread(fd, length, offset):
+            if fd == gone:
+                raise OSError(errno.ENODEV, "No such device")
+            return pread(fd, length, offset)
+
+        monkeypatch.setattr(os, "pread", failing_pread)
+        _set_lnksta(sysfs_root, "0000:00:1d.0", 0x0041)
+        events = monitor.poll()
+        assert [event.address.bdf for event in events] == ["0000:00:1d.0"]
+        assert list(monitor.errors) == [PciAddress.parse("0000:00:1c.0")]
+        error = monitor.errors[PciAddress.parse("0000:00:1c.0")]
+        assert isinstance(error, PciError)
+
+
+def test_monitor_requires_pcie_capability(sysfs_root, make_device):
+    make_device(bdf="0000:00:02.0")
+    monitor = LinkMonitor(["0000:00:02.0"], sysfs_root=str(sysfs_root))
+    with pytest.raises(ResourceNotFoundError):
+        monitor.open()
+    with pytest.raises(ValueRangeError):
+        LinkMonitor([], history=0)
+
+
+def test_monitor_sysfs_source(sysfs_root, make_device):
+    path = make_device(bdf="0000:00:03.0")
+    (path / "current_link_speed").write_text("8.0 GT/s PCIe\n")
+    (path / "current_link_width").write_text("16\n")
+    _make_port(make_device, "0000:00:1c.0")
+
+    monitor = LinkMonitor(
+        ["0000:00:03.0", "0000:00:1c.0"], sysfs_root=str(sysfs_root), source="auto"
+    )
+    with monitor:
+        assert monitor.sources() == {
+            PciAddress.parse("0000:00:03.0"): "sysfs",
+            PciAddress.parse("0000:00:1c.0"): "config",
+        }
+        assert monitor.poll() == []
+        (path / "current_link_width").write_text("4\n")
+        events = monitor.poll()
+        assert [event.address.bdf for event in events] == ["0000:00:03.0"]
+        assert events[0].changes == {"width": (16, 4)}
+        sample = monitor.last("0000:00:03.0")
+        assert sample.source == "sysfs"
+        assert sample.decode()["training"] is None
+
+    monitor = LinkMonitor(["0000:00:1c.0"], sysfs_root=str(sysfs_root), source="sysfs")
+    with pytest.raises(ResourceNotFoundError):
+        monitor.open()
+    with pytest.raises(ValueRangeError):
+        LinkMonitor([], source="lspci")
@@ -0,0 +1,62 @@
+import pytest
+
+from pypcie import config, link, mps
+from pypcie.errors import ValueRangeError
+from pypcie.sysfs import Sysfs
+from pypcie.synthetic import create_fabric
+
+
+def _fabric(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=2, switch_depth=1, switch_ports=2)
+    root = str(sysfs_root)
+    # Endpoint MPSS: 512 below the first downstream port, 128 below the second.
+    config.write_u32(fabric.endpoints[0], 0x74, 0x22, sysfs_root=root)
+    config.write_u32(fabric.endpoints[1], 0x74, 0x20, sysfs_root=root)
+    return fabric
+
+
+def _planned(settings):
+    return {s.address: (s.new_mps, s.new_mrrs) for s in settings}
+
+
+def test_plan_policies(sysfs_root):
+    fabric = _fabric(sysfs_root)
+    sysfs = Sysfs(str(sysfs_root))
+    first = [fabric.root_ports[0]] + fabric.bridges[1:4] + fabric.endpoints[:2]
+
+    settings = mps.plan("safe", sysfs=sysfs)
+    assert len(settings) == len(fabric.devices)
+    planned = _planned(settings)
+    assert all(planned[address] == (128, 512) for address in first)
+    assert planned[fabric.endpoints[2]] == (256, 512)
+
+    planned = _planned(mps.plan("performance", sysfs=sysfs))
+    assert planned[fabric.root_ports[0]] == (256, 512)
+    assert planned[fabric.endpoints[0]] == (256, 256)
+    assert planned[fabric.endpoints[1]] == (128, 128)
+
+    planned = _planned(mps.plan("peer-to-peer", sysfs=sysfs, workers=1))
+    assert set(value[0] for value in planned.values()) == {128}
+    assert planned[fabric.endpoints[3]] == (128, 4096)
+    assert planned[fabric.root_ports[1]] == (128, 512)
+
+    with pytest.raises(ValueRangeError):
+        mps.plan("fastest", sysfs=sysfs)
+
+
+def test_apply_plan(sysfs_root):
+    fabric = _fabric(sysfs_root)
+    sysfs = Sysfs(str(sysfs_root))
+    root = str(sysfs_root)
+    settings = mps.plan("performance", sysfs=sysfs)
+    changed = [s for s in settings if s.changed]
+    lines = mps.format_plan(settings)
+    assert len(lines) == 2 * len(changed) + 1
+    assert lines[-1] == "%d functions, %d to change" % (len(settings), len(changed))
+
+    assert mps.apply(settings, sysfs=sysfs) == len(changed)
+    status = link.read_device_control(fabric.endpoints[1], sysfs_root=root)
+    assert (status["max_payload"], status["max_read_request"]) == (128, 128)
+    status = link.read_device_control(fabric.root_ports[1], sysfs_root=root)
+    assert (status["max_payload"], status["max_read_request"]) == (256, 512)
+    assert not any(s.changed for s in mps.plan("performance", sysfs=sysfs))
@@ -0,0 +1,101 @@
+import pytest
+
+from pypcie import bar, config, instrument, msix
+from pypcie.errors import (
+    OutOfRangeError,
+    ResourceNotFoundError,
+    ValueRangeError,
+)
+from pypcie.handles import HandlePool
+from pypcie.sysfs import Sysfs
+from pypcie.synthetic import create_fabric
+
+MSIX = 0xB0
+TABLE = 0x100
+PBA = 0x800
+
+
+def _endpoint(sysfs_root, vectors=80):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    root = str(sysfs_root)
+    endpoint = fabric.endpoints[0]
+    # MSI-X after the PCIe capability: table at BAR 0+0x100, PBA at BAR 0+0x800.
+    config.write_u8(endpoint, 0x71, MSIX, sysfs_root=root)
+    config.write_u32(
+        endpoint, MSIX, 0x11 | (0x8000 | (vectors - 1)) << 16, sysfs_root=root
+    )
+    config.write_u32(endpoint, MSIX + 4, TABLE, sysfs_root=root)
+    config.write_u32(endpoint, MSIX + 8, PBA, sysfs_root=root)
+    for vector in range(vectors):
+        entry = TABLE + vector * 16
+        bar.write_u32(endpoint, 0, entry, 0xFEE00000 + (vector << 12), sysfs_root=root)
+        bar.write_u32(endpoint, 0, entry + 8, 0x40 + vector, sysfs_root=root)
+        bar.write_u32(endpoint, 0, entry + 12, vector % 2, sysfs_root=root)
+    bar.write_u32(endpoint, 0, PBA + 8, 0x1, sysfs_root=root)
+    return fabric, endpoint
+
+
+def test_read_table(sysfs_root):
+    fabric, endpoint = _endpoint(sysfs_root)
+    sysfs = Sysfs(str(sysfs_root))
+    capability = msix.find_msix(endpoint, sysfs=sysfs)
+    assert (capability.offset, capability.table_size, capability.enabled) == (
+        MSIX,
+        80,
+        True,
+    )
+
+    table = msix.read_table(endpoint, sysfs=sysfs)
+    assert len(table) == 80
+    assert table.masked_count == 40
+    assert table.vector(3) == {
+        "vector": 3,
+        "address": 0xFEE03000,
+        "data": 0x43,
+        "masked": True,
+        "pending": False,
+    }
+    assert table.is_pending(64) is True
+    lines = msix.format_table(table)
+    assert lines[0] == (
+        "MSI-X: 80 vectors (40 masked), enabled, table BAR 0+0x100, PBA BAR 0+0x800"
+    )
+    # Even vectors are unmasked; pending vector 64 is one of them.
+    assert len(lines) == 2 + 40
+    assert lines[2].split() == ["0", "0x00000000fee00000", "0x00000040", "no", "no"]
+    assert len(msix.format_table(table, show_all=True)) == 2 + 80
+
+    with HandlePool(sysfs_root=str(sysfs_root)) as pool:
+        assert msix.read_table(endpoint, pool=pool, pending=False).pending is None
+        assert len(pool) == 1
+
+
+def test_set_mask(sysfs_root):
+    fabric, endpoint = _endpoint(sysfs_root, vectors=16)
+    sysfs = Sysfs(str(sysfs_root))
+    writes = []
+
+    def hook(space, address, bar_index, offset, width, value, write):
+        if write:
+            writes.append((offset, value))
+
+    instrument.add_access_hook(hook)
+    try:
+        assert msix.set_mask(endpoint, range(0, 8), sysfs=sysfs) == 4
+    finally:
+        instrument.remove_access_hook(hook)
+    # Only the unmasked (even) vectors are written.
+    assert writes == [(TABLE + v * 16 + 12, 1) for v in (0, 2, 4, 6)]
+    assert msix.read_table(endpoint, sysfs=sysfs).masked_count == 12
+
+    vectors = msix.parse_vectors("0-3,15")
+    assert msix.set_mask(endpoint, vectors, masked=False, sysfs=sysfs) == 5
+    table = msix.read_table(endpoint, sysfs=sysfs)
+    assert [table.masked(v) for v in (0, 3, 4, 15)] == [False, False, True, False]
+
+    with pytest.raises(OutOfRangeError):
+        msix.set_mask(endpoint, [16], sysfs=sysfs)
+    with pytest.raises(ValueRangeError):
+        msix.parse_vectors("1-x")
+    with pytest.raises(ResourceNotFoundError):
+        msix.read_table(fabric.root_ports[0], sysfs=sysfs)
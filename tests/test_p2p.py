@@ -0,0 +1,132 @@
+import pytest
+
+from pypcie import config, p2p
+from pypcie.errors import ValueRangeError
+from pypcie.sysfs import Sysfs
+from pypcie.synthetic import create_fabric
+
+ACS = 0x140
+
+
+def _fabric(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=2, switch_depth=1, switch_ports=2)
+    root = str(sysfs_root)
+    # ACS behind AER on the downstream port above the first endpoint.
+    port = fabric.bridges[2]
+    header = config.read_u32(port, 0x100, sysfs_root=root)
+    config.write_u32(port, 0x100, header | (ACS << 20), sysfs_root=root)
+    config.write_u32(port, ACS, (1 << 16) | 0x000D, sysfs_root=root)
+    config.write_u32(port, ACS + 4, 0x005F, sysfs_root=root)
+    # The second endpoint trained at 16 GT/s x4.
+    config.write_u16(fabric.endpoints[1], 0x82, 4 | (4 << 4), sysfs_root=root)
+    return fabric
+
+
+def test_decode_acs():
+    decoded = p2p.decode_acs(0x005F, 0x000D)
+    assert decoded["supported"] == [
+        "source-validation",
+        "translation-blocking",
+        "request-redirect",
+        "completion-redirect",
+        "upstream-forwarding",
+        "direct-translated",
+    ]
+    assert decoded["enabled"] == [
+        "source-validation",
+        "request-redirect",
+        "completion-redirect",
+    ]
+
+
+def test_switch_local_path_and_acs_redirect(sysfs_root):
+    fabric = _fabric(sysfs_root)
+    root = str(sysfs_root)
+    sysfs = Sysfs(root)
+    rp, up, dp0, dp1 = fabric.bridges[:4]
+    e0, e1 = fabric.endpoints[:2]
+
+    path = p2p.p2p_path(e0, e1, sysfs=sysfs)
+    assert (path.route, path.common) == ("switch-local", up)
+    assert [node.address for node in path.ports] == [dp0, up, dp1]
+    assert [(l["port"], l["device"]) for l in path.links] == [
+        (dp0.bdf, e0.bdf),
+        (dp1.bdf, e1.bdf),
+    ]
+    assert path.weakest["width"] == 4
+    assert path.weakest["bandwidth_gbps"] == pytest.approx(7.877, abs=0.001)
+    assert path.redirected is False
+
+    config.write_u16(dp0, ACS + 6, 0x000D, sysfs_root=root)
+    path = p2p.p2p_path(e0, e1, sysfs=sysfs)
+    assert path.acs_redirect == [dp0]
+    assert path.redirected is True
+    lines = p2p.format_path(path)
+    assert lines[0] == "%s -> %s: switch-local (acs-redirect) via %s" % (
+        e0.bdf,
+        e1.bdf,
+        up.bdf,
+    )
+    assert lines[1].split() == [
+        dp0.bdf,
+        "downstream",
+        "ACS",
+        "source-validation,request-redirect,completion-redirect",
+        "(redirects)",
+    ]
+    assert lines[2].split() == [up.bdf, "upstream", "no", "ACS"]
+    assert lines[-1] == "  weakest link: %s -> %s 16GT/s x4 (7.88 GB/s)" % (
+        dp1.bdf,
+        e1.bdf,
+    )
+
+    with pytest.raises(ValueRangeError):
+        p2p.p2p_path(e0, e0, sysfs=sysfs)
+    with pytest.raises(ValueRangeError):
+        p2p.p2p_path(up, e0, sysfs=sysfs)
+
+
+def test_routes_through_root_and_across_complexes(sysfs_root):
+    fabric = _fabric(sysfs_root)
+    other = create_fabric(sysfs_root, root_ports=1, switch_depth=0, domain=1)
+    sysfs = Sysfs(str(sysfs_root))
+    e0, e2 = fabric.endpoints[0], fabric.endpoints[2]
+
+    path = p2p.p2p_path(e0, e2, sysfs=sysfs)
+    assert (path.route, path.common) == ("root-port", None)
+    assert [node.address for node in path.ports] == [
+        fabric.bridges[2],
+        fabric.bridges[1],
+        fabric.root_ports[0],
+        fabric.root_ports[1],
+        fabric.bridges[5],
+        fabric.bridges[6],
+    ]
+    assert len(path.links) == 4
+
+    path = p2p.p2p_path(e0, other.endpoints[0], sysfs=sysfs)
+    assert path.route == "cross-root-complex"
+    assert path.ports[-1].address == other.root_ports[0]
+
+
+def test_same_device_and_matrix(sysfs_root):
+    fabric = create_fabric(
+        sysfs_root, root_ports=1, switch_depth=1, switch_ports=2, functions=2
+    )
+    sysfs = Sysfs(str(sysfs_root))
+    fn0, fn1 = fabric.endpoints[:2]
+    path = p2p.p2p_path(fn0, fn1, sysfs=sysfs)
+    assert (path.route, path.ports, path.weakest) == ("same-device", [], None)
+
+    paths = p2p.p2p_matrix(sysfs=sysfs, workers=4)
+    assert len(paths) == 6
+    routes = sorted(path.route for path in paths)
+    assert routes == ["same-device"] * 2 + ["switch-local"] * 4
+    lines = p2p.format_matrix(paths)
+    assert len(lines) == 8
+    assert lines[-1] == "6 pairs: 2 same-device, 4 switch-local; 0 redirected by ACS"
+
+    subset = p2p.p2p_matrix([fabric.endpoints[2], fn0], sysfs=sysfs)
+    assert [(path.source, path.target) for path in subset] == [
+        (fn0, fabric.endpoints[2])
+    ]
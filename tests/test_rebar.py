@@ -0,0 +1,126 @@
+import os
+
+import pytest
+
+from pypcie import config, instrument, rebar
+from pypcie.bar import PciBar
+from pypcie.device import PciDevice
+from pypcie.errors import (
+    PermissionDeniedError,
+    ResourceNotFoundError,
+    ValueRangeError,
+)
+from pypcie.handles import HandlePool
+from pypcie.sysfs import Sysfs
+from pypcie.synthetic import create_fabric
+
+REBAR = 0x160
+
+
+def _endpoint(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    root = str(sysfs_root)
+    endpoint = fabric.endpoints[0]
+    # One resizable BAR 0 supporting 1M-256M, currently 1M.
+    header = config.read_u32(endpoint, 0x100, sysfs_root=root)
+    config.write_u32(endpoint, 0x100, header | (REBAR << 20), sysfs_root=root)
+    config.write_u32(endpoint, REBAR, (1 << 16) | 0x0015, sysfs_root=root)
+    config.write_u32(endpoint, REBAR + 0x04, 0x1FF0, sysfs_root=root)
+    config.write_u32(endpoint, REBAR + 0x08, 1 << 5, sysfs_root=root)
+    return endpoint
+
+
+def test_sizes():
+    assert rebar.parse_size("256M") == 256 << 20
+    assert rebar.parse_size("16GB") == 16 << 30
+    assert rebar.parse_size("0x100000") == 1 << 20
+    assert rebar.format_size(8 << 30) == "8G"
+    assert rebar.size_code(256 << 20) == 8
+    with pytest.raises(ValueRangeError):
+        rebar.size_code(3 << 20)
+    with pytest.raises(ValueRangeError):
+        rebar.parse_size("lots")
+
+
+def test_read_and_resize_config(sysfs_root):
+    endpoint = _endpoint(sysfs_root)
+    root = str(sysfs_root)
+    sysfs = Sysfs(root)
+    (entry,) = rebar.read_rebar(endpoint, sysfs=sysfs)
+    assert entry.bar == 0
+    assert entry.size == 1 << 20
+    assert entry.sizes == [(1 << 20) << code for code in range(9)]
+    assert rebar.format_rebar([entry]) == [
+        "%s BAR 0: 1M (supported: 1M 2M 4M 8M 16M 32M 64M 128M 256M)" % endpoint.bdf
+    ]
+
+    writes = []
+
+    def hook(space, address, bar, offset, width, value, write):
+        if write:
+            writes.append((offset, value))
+
+    instrument.add_access_hook(hook)
+    try:
+        assert rebar.resize_bar(endpoint, 0, 256 << 20, sysfs=sysfs) == "config"
+    finally:
+        instrument.remove_access_hook(hook)
+    # Memory decode is turned off and stays off until the BAR is reassigned.
+    assert writes == [
+        (0x04, 0x0004),
+        (REBAR + 0x08, (1 << 5) | (8 << 8)),
+    ]
+    assert config.read_u16(endpoint, 0x04, sysfs_root=root) == 0x0004
+    assert rebar.read_rebar(endpoint, sysfs=sysfs)[0].size == 256 << 20
+
+    with pytest.raises(ValueRangeError):
+        rebar.resize_bar(endpoint, 0, 1 << 30, sysfs=sysfs)
+    with pytest.raises(ResourceNotFoundError):
+        rebar.resize_bar(endpoint, 2, 1 << 20, sysfs=sysfs)
+
+
+def test_resize_sysfs_invalidates_caches(sysfs_root):
+    endpoint = _endpoint(sysfs_root)
+    root = str(sysfs_root)
+    sysfs = Sysfs(root)
+    device_dir = sysfs.device_dir(endpoint)
+    open(os.path.join(device_dir, "resource0_resize"), "w").close()
+
+    device = PciDevice(sysfs, endpoint)
+    pool = HandlePool(sysfs_root=root)
+    old_bar = device.bar(0).open()
+    pooled = pool.bar(endpoint, 0).open()
+    assert device.bars[0].size == 4096
+    assert pool.bar_table(endpoint)[0].size == 4096
+
+    # What the kernel leaves in ``resource`` once the resize write returns.
+    start = device.bars[0].start
+    with open(os.path.join(device_dir, "resource"), "w") as handle:
+        handle.write("0x%016x 0x%016x 0x%016x\n" % (start, start + (2 << 20) - 1, 0x200))
+        handle.write("0x%016x 0x%016x 0x%016x\n" % (0, 0, 0) * 5)
+
+    assert device.resize_bar(0, 2 << 20) == "sysfs"
+    with open(os.path.join(device_dir, "resource0_resize")) as handle:
+        assert handle.read() == "1\n"
+    assert old_bar._mmap is None
+    assert device.bars[0].size == 2 << 20
+    assert device.bar(0) is not old_bar
+
+    assert pooled._mmap is None
+    assert pool.bar_table(endpoint)[0].size == 2 << 20
+    assert pool.bar(endpoint, 0) is not pooled
+    device.close()
+    pool.close()
+
+
+def test_resize_refuses_open_bar(sysfs_root):
+    endpoint = _endpoint(sysfs_root)
+    sysfs = Sysfs(str(sysfs_root))
+    open(os.path.join(sysfs.device_dir(endpoint), "resource0_resize"), "w").close()
+
+    pci_bar = PciBar(sysfs, endpoint, 0).open()
+    with pytest.raises(PermissionDeniedError):
+        rebar.resize_bar(endpoint, 0, 2 << 20, sysfs=sysfs)
+    assert pci_bar._mmap is not None
+    pci_bar.close()
+    assert rebar.resize_bar(endpoint, 0, 2 << 20, sysfs=sysfs) == "sysfs"
@@ -0,0 +1,49 @@
+from pypcie import config, instrument, report
+from pypcie.synthetic import create_fabric
+from pypcie.sysfs import Sysfs
+
+
+def test_describe_endpoint(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0, speed=3, width=8)
+    sysfs = Sysfs(root=str(sysfs_root))
+    endpoint = fabric.endpoints[0]
+    config.write_u16(endpoint, 0x04, 0x0006, sysfs_root=str(sysfs_root))
+
+    instrument.reset()
+    instrument.enable()
+    try:
+        entry = report.describe_device(endpoint, sysfs=sysfs)
+        reads = instrument.snapshot()["syscalls"]["pread"]
+    finally:
+        instrument.disable()
+    assert reads == 1
+
+    header = entry["header"]
+    assert header["header_type"] == 0
+    assert header["command_bits"]["memory"] and header["command_bits"]["bus_master"]
+    assert not header["command_bits"]["io"]
+    names = [(cap["name"], cap["offset"]) for cap in entry["capabilities"]]
+    assert ("PCI Express", 0x70) in names
+    assert ("Advanced Error Reporting", 0x100) in names
+    pcie = [cap for cap in entry["capabilities"] if cap["id"] == 0x10][0]["decoded"]
+    assert pcie["port_type_name"] == "Endpoint"
+    assert pcie["speed_gtps"] == 8.0 and pcie["width"] == 8
+    assert pcie["max_payload"] == 128 and pcie["max_read_request"] == 512
+    assert entry["bars"][0]["index"] == 0
+    assert entry["bars"][0]["size"] == fabric.bar_size
+
+    lines = report.format_report(entry)
+    assert lines[0].startswith(endpoint.bdf)
+    assert any("LnkSta: Speed 8.0GT/s, Width x8" in line for line in lines)
+
+
+def test_describe_devices_parallel_keeps_order(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=2, switch_ports=2)
+    sysfs = Sysfs(root=str(sysfs_root))
+    serial = report.describe_devices(fabric.devices, sysfs=sysfs)
+    parallel = report.describe_devices(fabric.devices, sysfs=sysfs, workers=4)
+    assert serial == parallel
+    assert [entry["bdf"] for entry in parallel] == [a.bdf for a in fabric.devices]
+    bridges = [entry for entry in serial if entry["header"]["header_type"] == 1]
+    assert len(bridges) == len(fabric.bridges)
+    assert all("secondary_bus" in entry["header"] for entry in bridges)
@@ -0,0 +1,86 @@
+import pytest
+
+from pypcie import config, instrument, reset
+from pypcie.discover import iter_devices
+from pypcie.errors import ValueRangeError
+from pypcie.sysfs import Sysfs
+from pypcie.synthetic import create_fabric
+
+
+def _wipe(path):
+    # What a function looks like after reset: decode off, BARs and DEVCTL cleared.
+    with open(path, "r+b") as handle:
+        handle.seek(0x04)
+        handle.write(bytes(2))
+        handle.seek(0x10)
+        handle.write(bytes(24))
+        handle.seek(0x78)
+        handle.write(bytes(2))
+
+
+def test_save_and_restore_state(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    endpoint = fabric.endpoints[0]
+    root = str(sysfs_root)
+    config.write_u32(endpoint, 0x10, 0xF7E00000, sysfs_root=root)
+    before = config.read_space(endpoint, sysfs_root=root)
+
+    state = reset.save_state(endpoint, sysfs_root=root)
+    # Command is restored last, after BARs and MSI address/data.
+    assert state.enables[-1] == (0x04, b"\x06\x00")
+    assert (0x10, before[0x10:0x28]) in state.writes
+
+    _wipe(str(sysfs_root / endpoint.bdf / "config"))
+    assert reset.restore_state(state, sysfs_root=root) == len(state.writes) + 2
+    assert config.read_space(endpoint, sysfs_root=root) == before
+
+
+def test_reset_bridges_restores_downstream(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=2, switch_depth=1, switch_ports=2)
+    sysfs = Sysfs(str(sysfs_root))
+    root = str(sysfs_root)
+    before = {
+        address: config.read_space(address, sysfs_root=root)
+        for address in fabric.devices
+    }
+    wiped = []
+
+    def hook(space, address, bar, offset, width, value, write):
+        if write and offset == 0x3E and value & 0x0040:
+            for child in iter_devices(sysfs=sysfs, parent=address):
+                _wipe(str(sysfs_root / child.bdf / "config"))
+                wiped.append(child)
+
+    instrument.add_access_hook(hook)
+    try:
+        results = reset.reset_bridges(fabric.root_ports, sysfs=sysfs, settle_s=0)
+    finally:
+        instrument.remove_access_hook(hook)
+
+    assert [result.bridge for result in results] == fabric.root_ports
+    assert all(result.ok for result in results)
+    assert sorted(wiped) == sorted(set(fabric.devices) - set(fabric.root_ports))
+    # The switch upstream port comes before the ports and endpoints below it.
+    assert results[0].functions[0] == fabric.bridges[1]
+    assert set(results[0].stages) == set(reset.STAGES)
+    for address in fabric.devices:
+        assert config.read_space(address, sysfs_root=root) == before[address]
+
+    lines = reset.format_results(results)
+    assert lines[1].startswith("%s  ok          5" % fabric.root_ports[0].bdf)
+
+
+def test_reset_bridges_reports_unready_function(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=2, switch_depth=0)
+    sysfs = Sysfs(str(sysfs_root))
+    config.write_u32(fabric.endpoints[1], 0x00, 0xFFFFFFFF, sysfs_root=str(sysfs_root))
+
+    results = reset.reset_bridges(
+        fabric.root_ports, sysfs=sysfs, settle_s=0, timeout_s=0.02, poll_s=0.005
+    )
+    assert [result.ok for result in results] == [True, False]
+    assert results[1].error == "%s not ready after reset" % fabric.endpoints[1].bdf
+    assert results[1].stages["ready"] >= 0.02
+
+    with pytest.raises(ValueRangeError):
+        reset.reset_bridges([fabric.root_ports[0], fabric.endpoints[0]], sysfs=sysfs)
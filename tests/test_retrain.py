@@ -0,0 +1,52 @@
+from pypcie import config, retrain
+from pypcie.sysfs import Sysfs
+from pypcie.synthetic import create_fabric
+
+
+def test_downstream_ports(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=2, switch_depth=1, switch_ports=3)
+    sysfs = Sysfs(str(sysfs_root))
+    ports = retrain.downstream_ports(fabric.root_ports[0], sysfs=sysfs)
+    # The switch upstream port is skipped, its three downstream ports are not.
+    assert ports == fabric.bridges[2:5]
+
+
+def test_retrain_ports_concurrently(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=1, switch_ports=4)
+    sysfs = Sysfs(str(sysfs_root))
+    root = str(sysfs_root)
+    ports = retrain.downstream_ports(fabric.root_ports[0], sysfs=sysfs)
+    stuck = ports[1]
+    # Link Training stays set on one port.
+    status = config.read_u16(stuck, 0x82, sysfs_root=root)
+    config.write_u16(stuck, 0x82, status | 0x0800, sysfs_root=root)
+
+    results = retrain.retrain_ports(
+        ports, speed=16.0, sysfs=sysfs, concurrency=4, timeout_s=0.02, poll_s=0.005
+    )
+    assert [result.address for result in results] == ports
+    assert [result.ok for result in results] == [True, False, True, True]
+    assert results[1].retries == 2
+    assert results[1].error == "link training did not complete"
+    good = results[0]
+    assert (good.speed_gtps, good.width, good.retries) == (16.0, 16, 0)
+    # Training is only checked after one poll interval.
+    assert good.seconds >= 0.005
+    for port in ports:
+        assert config.read_u16(port, 0xA0, sysfs_root=root) & 0x000F == 0x4
+        assert config.read_u16(port, 0x80, sysfs_root=root) & 0x0020
+
+    results = retrain.retrain_ports(
+        [ports[0]], speed=32.0, sysfs=sysfs, timeout_s=0.02, retries=1
+    )
+    assert not results[0].ok
+    assert results[0].error == "trained below target speed"
+    assert results[0].retries == 1
+
+    # A link that stays faster than the target did not take the new speed.
+    results = retrain.retrain_ports([ports[0]], speed=8.0, sysfs=sysfs, retries=0)
+    assert not results[0].ok
+    assert results[0].error == "trained above target speed"
+
+    lines = retrain.format_results(results)
+    assert lines[1].startswith("%s  failed  16GT/s x16" % ports[0].bdf)
@@ -0,0 +1,80 @@
+import struct
+import zlib
+
+import pytest
+
+from pypcie import config, snapshot
+from pypcie.errors import SysfsFormatError
+from pypcie.synthetic import create_fabric
+from pypcie.sysfs import Sysfs
+from pypcie.types import PciAddress
+
+
+def test_capture_archive_round_trip(sysfs_root, tmp_path):
+    fabric = create_fabric(sysfs_root, root_ports=2, switch_ports=2)
+    sysfs = Sysfs(root=str(sysfs_root))
+
+    snap = snapshot.capture(sysfs=sysfs, workers=4)
+    assert len(snap) == len(fabric)
+    assert all(len(data) == 4096 for data in snap.devices.values())
+
+    path = str(tmp_path / "a.snap")
+    snapshot.write_archive(snap, path)
+    loaded = snapshot.read_archive(path)
+    assert loaded.devices == snap.devices
+    assert loaded.hostname == snap.hostname
+    assert not snapshot.diff(snap, loaded)
+
+    # Cutting the last entry short is reported, not loaded short.
+    with open(path, "rb") as handle:
+        raw = handle.read()
+    header = struct.calcsize("<8sdI")
+    body = zlib.decompress(raw[header:])[:-16]
+    with open(path, "wb") as handle:
+        handle.write(raw[:header] + zlib.compress(body))
+    with pytest.raises(SysfsFormatError, match="truncated snapshot archive"):
+        snapshot.read_archive(path)
+
+
+def test_diff_decodes_regions(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0)
+    sysfs = Sysfs(root=str(sysfs_root))
+    root_port, endpoint = fabric.root_ports[0], fabric.endpoints[0]
+    before = snapshot.capture(sysfs=sysfs)
+
+    config.write_u16(endpoint, 0x04, 0x0000, sysfs_root=str(sysfs_root))
+    config.write_u16(endpoint, 0x70 + 0x08, 0x5030, sysfs_root=str(sysfs_root))
+    config.write_u32(root_port, 0x100 + 0x10, 0x1, sysfs_root=str(sysfs_root))
+    config.write_u8(root_port, 0x19, 0x02, sysfs_root=str(sysfs_root))
+    after = snapshot.capture(sysfs=sysfs)
+
+    result = snapshot.diff(before, after)
+    assert result.added == [] and result.removed == []
+    regions = {
+        addr.bdf: [(c.offset, c.region) for c in changes]
+        for addr, changes in result.changed.items()
+    }
+    assert regions[endpoint.bdf] == [
+        (0x04, "header command/status"),
+        (0x78, "PCI Express+0x08"),
+    ]
+    assert regions[root_port.bdf] == [
+        (0x18, "header bus numbers"),
+        (0x110, "Advanced Error Reporting+0x10"),
+    ]
+    change = result.changed[endpoint][1]
+    assert struct.pack("<I", change.new)[:2] == b"\x30\x50"
+
+
+def test_diff_added_removed_and_truncated():
+    a = snapshot.Snapshot({}, hostname="h")
+    b = snapshot.Snapshot({}, hostname="h")
+    a.devices[PciAddress.parse("0000:00:01.0")] = bytes(64)
+    b.devices[PciAddress.parse("0000:00:02.0")] = bytes(64)
+    a.devices[PciAddress.parse("0000:00:03.0")] = bytes(68)
+    b.devices[PciAddress.parse("0000:00:03.0")] = bytes(64)
+    result = snapshot.diff(a, b)
+    assert [addr.bdf for addr in result.added] == ["0000:00:02.0"]
+    assert [addr.bdf for addr in result.removed] == ["0000:00:01.0"]
+    (change,) = result.changed[PciAddress.parse("0000:00:03.0")]
+    assert (change.offset, change.old, change.new) == (0x40, 0, None)
@@ -0,0 +1,33 @@
+import os
+
+from pypcie import capability, config
+from pypcie.discover import build_device_tree, find_root_port
+from pypcie.synthetic import create_fabric
+from pypcie.sysfs import Sysfs
+
+
+def test_create_fabric_topology(sysfs_root):
+    fabric = create_fabric(
+        sysfs_root, root_ports=2, switch_depth=1, switch_ports=2, functions=2
+    )
+    assert len(fabric.root_ports) == 2
+    assert len(fabric.bridges) == 2 * (1 + 1 + 2)
+    assert len(fabric.endpoints) == 2 * 2 * 2
+    assert os.path.islink(str(sysfs_root / fabric.endpoints[0].bdf))
+
+    sysfs = Sysfs(root=str(sysfs_root))
+    roots, children = build_device_tree(sysfs=sysfs)
+    assert roots == fabric.root_ports
+    endpoint = fabric.endpoints[-1]
+    assert find_root_port(endpoint, sysfs=sysfs) == fabric.root_ports[-1]
+    assert endpoint in children[fabric.bridges[-1]]
+
+
+def test_create_fabric_config_and_bars(sysfs_root):
+    fabric = create_fabric(sysfs_root, root_ports=1, switch_depth=0, bar_size=256)
+    endpoint = fabric.endpoints[0]
+    root = str(sysfs_root)
+    assert config.read_u16(endpoint, 0, sysfs_root=root) == 0x1234
+    assert capability.find_pcie_capability(endpoint, sysfs_root=root) == 0x70
+    assert capability.find_ext_capability(endpoint, 0x0001, sysfs_root=root) == 0x100
+    assert os.path.getsize(os.path.join(root, endpoint.bdf, "resource0")) == 256
@@ -3,7 +3,7 @@ import os
 import pytest
 
 from pypcie.errors import OutOfRangeError, ResourceNotFoundError, SysfsFormatError
-from pypcie.sysfs import Sysfs
+from pypcie.sysfs import Sysfs, list_device_bdfs
 
 
 def test_sysfs_paths(sysfs_root, make_device):
@@ -38,3 +38,29 @@ def test_sysfs_resource_path_validation(sysfs_root):
     sysfs = Sysfs(root=str(sysfs_root))
     with pytest.raises(OutOfRangeError):
         sysfs.resource_path("0000:00:00.0", -1)
+
+
+def test_device_dir_reads_attrs_relative_to_dir_fd(sysfs_root, make_device):
+    make_device(bdf="0000:00:0e.0", vendor=0x8086, device=0x1572, class_code=0x020000)
+    sysfs = Sysfs(root=str(sysfs_root))
+
+    with sysfs.open_device("0000:00:0e.0") as device:
+        assert device.read_attrs(("vendor", "device", "class", "subsystem_vendor")) == {
+            "vendor": 0x8086,
+            "device": 0x1572,
+            "class": 0x020000,
+        }
+        assert device.read_text("vendor") == "0x8086"
+        with pytest.raises(ResourceNotFoundError):
+            device.read_hex("missing")
+    assert sysfs.read_attrs("0000:00:0e.0", ["device"]) == {"device": 0x1572}
+    with pytest.raises(ResourceNotFoundError):
+        sysfs.read_attrs("0000:00:0f.0", ["vendor"])
+
+
+def test_list_device_bdfs_skips_non_device_entries(sysfs_root, make_device):
+    make_device(bdf="0000:00:02.0")
+    make_device(bdf="0000:00:01.0")
+    (sysfs_root / "not-a-device").mkdir()
+    addresses = sorted(list_device_bdfs(str(sysfs_root)))
+    assert [address.bdf for address in addresses] == ["0000:00:01.0", "0000:00:02.0"]
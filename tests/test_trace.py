@@ -0,0 +1,108 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from pypcie import bar, config, trace
+
+
+def _make(make_device, bdf):
+    resource_entries = [(0x1000, 0x10FF, 0x00000200)] + [(0, 0, 0)] * 5
+    make_device(
+        bdf=bdf,
+        config_bytes=bytes(range(64)),
+        resource_entries=resource_entries,
+        resource_files={0: bytes(256)},
+    )
+
+
+def test_record_and_read_trace(sysfs_root, make_device, tmp_path):
+    _make(make_device, "0000:00:05.0")
+    root = str(sysfs_root)
+    path = str(tmp_path / "t.bin")
+
+    with trace.TraceRecorder(path) as recorder:
+        config.read_u32("0000:00:05.0", 0, sysfs_root=root)
+        config.write_u16("0000:00:05.0", 4, 0x0007, sysfs_root=root)
+        bar.write_u32("0000:00:05.0", 0, 0x10, 0xDEADBEEF, sysfs_root=root)
+        bar.read_u32("0000:00:05.0", 0, 0x10, sysfs_root=root)
+    config.read_u8("0000:00:05.0", 0, sysfs_root=root)
+    assert recorder.count == 4
+
+    _, records = trace.read_trace(path)
+    assert [(r.space_name, r.offset, r.width, r.value, r.write) for r in records] == [
+        ("config", 0, 4, 0x03020100, False),
+        ("config", 4, 2, 0x0007, True),
+        ("bar0", 0x10, 4, 0xDEADBEEF, True),
+        ("bar0", 0x10, 4, 0xDEADBEEF, False),
+    ]
+    assert records[0].address.bdf == "0000:00:05.0"
+    assert records[0].timestamp <= records[-1].timestamp
+
+    stats = trace.trace_stats(records, top=1)
+    assert stats["ops"] == 4
+    assert stats["writes"] == 2
+    assert stats["hot_registers"][0]["space"] == "bar0"
+    assert stats["hot_registers"][0]["count"] == 2
+
+
+def test_replay_verifies_reads(sysfs_root, make_device, tmp_path):
+    _make(make_device, "0000:00:05.0")
+    root = str(sysfs_root)
+    path = str(tmp_path / "t.bin")
+    with trace.TraceRecorder(path):
+        bar.write_u32("0000:00:05.0", 0, 0x20, 0x11223344, sysfs_root=root)
+        bar.read_u32("0000:00:05.0", 0, 0x20, sysfs_root=root)
+        config.read_u16("0000:00:05.0", 8, sysfs_root=root)
+
+    bar.write_u32("0000:00:05.0", 0, 0x20, 0, sysfs_root=root)
+    config.write_u16("0000:00:05.0", 8, 0xFFFF, sysfs_root=root)
+    _, records = trace.read_trace(path)
+    result = trace.replay(records, sysfs_root=root, timing=True, verify=True)
+    assert result["reads"] == 2
+    assert result["writes"] == 1
+    assert len(result["mismatches"]) == 1
+    record, value = result["mismatches"][0]
+    assert (record.space_name, record.offset, value) == ("config", 8, 0xFFFF)
+
+
+def test_cli_trace_commands(sysfs_root, make_device, tmp_path):
+    _make(make_device, "0000:00:05.0")
+    script = tmp_path / "workload.py"
+    script.write_text(
+        "import sys\n"
+        "from pypcie import config\n"
+        "for _ in range(3):\n"
+        "    config.read_u32('0000:00:05.0', 0, sysfs_root=sys.argv[1])\n"
+    )
+    trace_path = str(tmp_path / "t.bin")
+    repo_root = Path(__file__).resolve().parents[1]
+    base = [sys.executable, "-m", "pypcie.cli", "--sysfs-root", str(sysfs_root)]
+
+    result = subprocess.run(
+        base
+        + ["trace", "record", "--output", trace_path, str(script), str(sysfs_root)],
+        cwd=str(repo_root),
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0
+    assert "recorded 3 accesses" in result.stderr
+
+    result = subprocess.run(
+        base + ["trace", "stats", trace_path],
+        cwd=str(repo_root),
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0
+    assert "3 accesses (3 reads, 0 writes)" in result.stdout
+    assert "0000:00:05.0 config+0x0: 3" in result.stdout
+
+    result = subprocess.run(
+        base + ["trace", "replay", "--verify", trace_path],
+        cwd=str(repo_root),
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0
+    assert result.stdout.startswith("replayed 3 accesses")
@@ -3,11 +3,13 @@ import pytest
 from pypcie.errors import SysfsFormatError, ValueRangeError
 from pypcie.types import (
     PciAddress,
+    PciAddressSet,
     validate_u16,
     validate_u32,
     validate_u64,
     validate_u8,
     validate_width,
+    validate_workers,
 )
 
 
@@ -45,6 +47,40 @@ def test_pci_address_range_validation():
         PciAddress(0, 0, 0, 0x8)
 
 
+def test_pci_address_interning_and_order():
+    addr = PciAddress.parse("0000:00:1f.6")
+    assert PciAddress.parse("00:1f.6") is addr
+    assert PciAddress.parse("0000:00:1F.6") is addr
+    assert addr.packed == (0x1F << 3) | 6
+    assert PciAddress.from_packed(addr.packed) == addr
+    assert addr == "0000:00:1f.6" and hash(addr) == hash(PciAddress(0, 0, 0x1F, 6))
+    with pytest.raises(AttributeError):
+        addr.bus = 1
+    with pytest.raises(ValueRangeError):
+        PciAddress.parse("0000:00:20.0")
+    with pytest.raises(SysfsFormatError):
+        PciAddress.parse("0000:00:1f.8")
+    ordered = sorted(
+        PciAddress.parse(text) for text in ("0001:00:00.0", "0000:10:00.0", "0000:02:00.1")
+    )
+    assert [a.bdf for a in ordered] == ["0000:02:00.1", "0000:10:00.0", "0001:00:00.0"]
+
+
+def test_pci_address_set():
+    addresses = ["0000:%02x:%02x.%d" % (b, d, f) for b in (3, 1) for d in (2, 0) for f in (1, 0)]
+    inventory = PciAddressSet(addresses)
+    assert len(inventory) == 8
+    assert [a.bdf for a in inventory] == sorted(addresses)
+    assert "0000:01:00.1" in inventory and "0000:02:00.0" not in inventory
+    inventory.add("0000:02:00.0")
+    inventory.add("0000:02:00.0")
+    inventory.discard("0000:01:00.1")
+    assert len(inventory) == 8
+    assert "0000:02:00.0" in inventory and "0000:01:00.1" not in inventory
+    assert inventory.packed().itemsize == 4
+    assert PciAddressSet.from_packed(inventory.packed()) == inventory
+
+
 def test_validate_width():
     for width in (1, 2, 4, 8):
         assert validate_width(width) == width
@@ -52,6 +88,15 @@ def test_validate_width():
         validate_width(3)
 
 
+def test_validate_workers():
+    assert validate_workers(4) == 4
+    for value in (0, -1, None, True, 2.0):
+        with pytest.raises(ValueRangeError, match="workers must be"):
+            validate_workers(value)
+    with pytest.raises(ValueRangeError, match="concurrency must be"):
+        validate_workers(0, "concurrency")
+
+
 def test_validate_value_ranges():
     assert validate_u8(0) == 0
     assert validate_u8(0xFF) == 0xFF